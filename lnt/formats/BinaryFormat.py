@@ -0,0 +1,400 @@
+"""
+A compact binary encoding of LNT reports, for large submissions.
+
+The tests of a report are stored by column: a table of the test names, then
+for each metric the index of the test of every sample and a typed array of the
+values. The payload may be compressed with zlib, or with zstd when a zstd
+module is available (the standard library one from Python 3.14, or the
+zstandard package).
+
+Layout, with all integers in little endian:
+
+  magic            b'LNTB'
+  version          uint8, 1
+  compression      uint8, one of COMPRESSION_NONE/ZLIB/ZSTD
+  payload          compressed as above:
+    header         string, a JSON object with the report minus its tests
+    num_tests      uint32, or NO_TESTS if the object has no tests member
+    test names     num_tests strings
+    num_columns    uint32
+    columns        num_columns times:
+      metric       string
+      kind         uint8, one of b'dqsj' (see _KINDS)
+      num_values   uint32
+      tests        num_values uint32, the (non-decreasing) test indices
+      values       num_values float64, int64, strings or JSON strings
+
+where a string is its uint32 length in bytes followed by its UTF-8 encoding.
+"""
+
+import array
+import json
+import struct
+import sys
+import zlib
+
+MAGIC = b'LNTB'
+VERSION = 1
+
+COMPRESSION_NONE = 0
+COMPRESSION_ZLIB = 1
+COMPRESSION_ZSTD = 2
+
+# The array type codes of the numeric columns and of the test indices.
+_FLOAT64 = 'd'
+_INT64 = 'q'
+_UINT32 = 'I' if array.array('I').itemsize == 4 else 'L'
+# Column kinds: numeric arrays, strings, and JSON encoded values for anything
+# else (booleans, nulls, mixed types, ...).
+_KINDS = (b'd', b'q', b's', b'j')
+# Integers in this range are exact in a float64 column.
+_MAX_EXACT_INT = 1 << 53
+_MAX_INT64 = (1 << 63) - 1
+
+# The number of tests of objects without a 'tests' member, which are not
+# reports but can still be stored.
+NO_TESTS = 0xFFFFFFFF
+
+# The default maximum size of a decompressed payload. The payload is
+# decompressed incrementally and rejected once it exceeds it, so a small
+# submission cannot expand to exhaust the memory of the server.
+MAX_DECOMPRESSED_SIZE = 1 << 30
+
+_uint8 = struct.Struct('<B')
+_uint32 = struct.Struct('<I')
+
+
+def _too_large(max_size):
+    return ValueError("binary report payload larger than %d bytes once "
+                      "decompressed" % max_size)
+
+
+def _zstd():
+    """Return the compress function of the available zstd module, and a
+    function decompressing a payload to at most a given size, or None."""
+    try:
+        from compression import zstd
+    except ImportError:
+        pass
+    else:
+        def decompress(payload, max_size):
+            decompressor = zstd.ZstdDecompressor()
+            data = decompressor.decompress(payload, max_size + 1)
+            if len(data) > max_size:
+                raise _too_large(max_size)
+            if not decompressor.eof:
+                raise ValueError("truncated binary report")
+            return data
+        return zstd.compress, decompress
+    try:
+        import zstandard
+    except ImportError:
+        return None
+
+    def decompress(payload, max_size):
+        reader = zstandard.ZstdDecompressor().stream_reader(payload)
+        chunks = []
+        size = 0
+        while size <= max_size:
+            chunk = reader.read(max_size + 1 - size)
+            if not chunk:
+                break
+            chunks.append(chunk)
+            size += len(chunk)
+        if size > max_size:
+            raise _too_large(max_size)
+        return b''.join(chunks)
+    return zstandard.ZstdCompressor().compress, decompress
+
+
+def default_compression():
+    """Return the compression used when writing reports: zstd if available,
+    zlib otherwise."""
+    return COMPRESSION_ZSTD if _zstd() is not None else COMPRESSION_ZLIB
+
+
+def _compress(payload, compression):
+    if compression == COMPRESSION_NONE:
+        return payload
+    if compression == COMPRESSION_ZLIB:
+        return zlib.compress(payload)
+    if compression == COMPRESSION_ZSTD:
+        zstd = _zstd()
+        if zstd is None:
+            raise ValueError("zstd compression needs the 'zstandard' package "
+                             "(or Python 3.14)")
+        return zstd[0](payload)
+    raise ValueError("unknown compression: %r" % (compression,))
+
+
+def _decompress(payload, compression, max_size):
+    if compression == COMPRESSION_NONE:
+        return payload
+    if compression == COMPRESSION_ZLIB:
+        decompressor = zlib.decompressobj()
+        try:
+            data = decompressor.decompress(payload, max_size + 1)
+        except zlib.error as e:
+            raise ValueError("invalid binary report payload: %s" % e)
+        if len(data) > max_size:
+            raise _too_large(max_size)
+        if not decompressor.eof:
+            raise ValueError("truncated binary report")
+        return data
+    if compression == COMPRESSION_ZSTD:
+        zstd = _zstd()
+        if zstd is None:
+            raise ValueError("reading zstd compressed reports needs the "
+                             "'zstandard' package (or Python 3.14)")
+        return zstd[1](payload, max_size)
+    raise ValueError("unknown compression: %r" % (compression,))
+
+
+def _to_bytes(values):
+    if sys.byteorder == 'big':
+        values = array.array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+
+def _column_kind(values):
+    types = set(type(v) for v in values)
+    if types == {float}:
+        return b'd'
+    if types == {int} and all(-_MAX_INT64 <= v <= _MAX_INT64 for v in values):
+        return b'q'
+    if types == {int, float} and \
+            all(-_MAX_EXACT_INT <= v <= _MAX_EXACT_INT for v in values):
+        return b'd'
+    if types == {str}:
+        return b's'
+    return b'j'
+
+
+class _Writer(object):
+    def __init__(self):
+        self.chunks = []
+
+    def uint8(self, value):
+        self.chunks.append(_uint8.pack(value))
+
+    def uint32(self, value):
+        self.chunks.append(_uint32.pack(value))
+
+    def string(self, value):
+        data = value.encode('utf-8')
+        self.uint32(len(data))
+        self.chunks.append(data)
+
+    def array(self, values):
+        self.chunks.append(_to_bytes(values))
+
+    def getvalue(self):
+        return b''.join(self.chunks)
+
+
+class _Reader(object):
+    def __init__(self, data):
+        self.data = data
+        self.pos = 0
+
+    def _take(self, size):
+        if self.pos + size > len(self.data):
+            raise ValueError("truncated binary report")
+        data = self.data[self.pos:self.pos + size]
+        self.pos += size
+        return data
+
+    def uint8(self):
+        return _uint8.unpack(self._take(_uint8.size))[0]
+
+    def uint32(self):
+        return _uint32.unpack(self._take(_uint32.size))[0]
+
+    def string(self):
+        return str(self._take(self.uint32()), 'utf-8')
+
+    def array(self, typecode, count):
+        values = array.array(typecode)
+        values.frombytes(self._take(count * values.itemsize))
+        if sys.byteorder == 'big':
+            values.byteswap()
+        return values
+
+
+def encode(report, compression=None):
+    """encode(report, [compression]) -> bytes
+
+    Encode a report (a dictionary in the version 2 format) in the binary
+    format. The compression defaults to default_compression().
+    """
+    if compression is None:
+        compression = default_compression()
+
+    header = dict((k, v) for k, v in report.items() if k != 'tests')
+    tests = report.get('tests')
+    names = []
+    columns = {}
+    for index, test in enumerate(tests or []):
+        names.append(test['name'])
+        for key, values in test.items():
+            if key == 'name':
+                continue
+            if not isinstance(values, list):
+                values = [values]
+            indices, column = columns.setdefault(key, ([], []))
+            indices.extend([index] * len(values))
+            column.extend(values)
+
+    out = _Writer()
+    out.string(json.dumps(header, sort_keys=True))
+    out.uint32(len(names) if tests is not None else NO_TESTS)
+    for name in names:
+        out.string(name)
+    out.uint32(len(columns))
+    for key, (indices, values) in columns.items():
+        kind = _column_kind(values)
+        out.string(key)
+        out.uint8(kind[0])
+        out.uint32(len(values))
+        out.array(array.array(_UINT32, indices))
+        if kind == b'd':
+            out.array(array.array(_FLOAT64, values))
+        elif kind == b'q':
+            out.array(array.array(_INT64, values))
+        elif kind == b's':
+            for value in values:
+                out.string(value)
+        else:
+            for value in values:
+                out.string(json.dumps(value))
+
+    return MAGIC + bytes([VERSION, compression]) + \
+        _compress(out.getvalue(), compression)
+
+
+class _Tests(object):
+    """The tests of a binary report, rebuilt from its columns one at a time
+    as they are iterated over."""
+
+    def __init__(self, names, columns):
+        self.names = names
+        self.columns = columns
+
+    def __len__(self):
+        return len(self.names)
+
+    def __iter__(self):
+        cursors = [0] * len(self.columns)
+        for index, name in enumerate(self.names):
+            test = {'name': name}
+            for i, (key, indices, values) in enumerate(self.columns):
+                start = end = cursors[i]
+                while end < len(indices) and indices[end] == index:
+                    end += 1
+                if end == start:
+                    continue
+                if end - start == 1:
+                    test[key] = values[start]
+                else:
+                    test[key] = list(values[start:end])
+                cursors[i] = end
+            yield test
+
+
+def decode(data, stream=False, max_size=MAX_DECOMPRESSED_SIZE):
+    """decode(data, [stream], [max_size]) -> report
+
+    Decode a report in the binary format. With stream, the tests of the
+    report are an iterable building them from the columns as needed, instead
+    of a list. A ValueError is raised if the payload is larger than max_size
+    bytes once decompressed.
+    """
+    if data[:len(MAGIC)] != MAGIC:
+        raise ValueError("not a binary LNT report")
+    if len(data) < len(MAGIC) + 2:
+        raise ValueError("truncated binary report")
+    version, compression = data[len(MAGIC)], data[len(MAGIC) + 1]
+    if version != VERSION:
+        raise ValueError("unsupported binary report version: %d" % version)
+    reader = _Reader(_decompress(data[len(MAGIC) + 2:], compression,
+                                 max_size))
+
+    report = json.loads(reader.string())
+    if not isinstance(report, dict):
+        raise ValueError("invalid binary report header")
+    num_tests = reader.uint32()
+    has_tests = num_tests != NO_TESTS
+    names = [reader.string() for _ in range(num_tests if has_tests else 0)]
+    columns = []
+    for _ in range(reader.uint32()):
+        key = reader.string()
+        kind = bytes([reader.uint8()])
+        count = reader.uint32()
+        indices = reader.array(_UINT32, count)
+        if any(a > b for a, b in zip(indices, indices[1:])) or \
+                (count and indices[-1] >= len(names)):
+            raise ValueError("invalid test indices for metric %r" % key)
+        if kind == b'd':
+            values = reader.array(_FLOAT64, count)
+        elif kind == b'q':
+            values = reader.array(_INT64, count)
+        elif kind == b's':
+            values = [reader.string() for _ in range(count)]
+        elif kind == b'j':
+            values = [json.loads(reader.string()) for _ in range(count)]
+        else:
+            raise ValueError("unknown kind %r for metric %r" % (kind, key))
+        columns.append((key, indices, values))
+    if reader.pos != len(reader.data):
+        raise ValueError("extra data after the binary report")
+
+    if has_tests:
+        tests = _Tests(names, columns)
+        report['tests'] = tests if stream else list(tests)
+    return report
+
+
+def _read(path_or_file):
+    if isinstance(path_or_file, str):
+        with open(path_or_file, 'rb') as fp:
+            return fp.read()
+    return path_or_file.read()
+
+
+def _matches_format(path_or_file):
+    if isinstance(path_or_file, str):
+        with open(path_or_file, 'rb') as fp:
+            head = fp.read(len(MAGIC))
+    else:
+        head = path_or_file.read(len(MAGIC))
+    return head == MAGIC
+
+
+def _load_format(path_or_file):
+    return decode(_read(path_or_file))
+
+
+def _load_stream_format(path_or_file):
+    return decode(_read(path_or_file), stream=True)
+
+
+def _dump_format(obj, fp):
+    if 'tests' not in obj and ('run' in obj or 'Run' in obj):
+        # Older report versions are stored in the current one, so that their
+        # tests are stored by column. Invalid ones are stored as they are.
+        import lnt.testing
+        try:
+            obj = lnt.testing.upgrade_and_normalize_report(dict(obj))
+        except (KeyError, ValueError):
+            pass
+    fp.write(encode(obj))
+
+
+format = {
+    'name': 'binary',
+    'predicate': _matches_format,
+    'read': _load_format,
+    'read_stream': _load_stream_format,
+    'write': _dump_format,
+}
@@ -1,24 +1,174 @@
 import json
+import re
+
+# The number of leading bytes looked at to guess the format of a file.
+_SNIFF_SIZE = 512
+
+# Reports are read in chunks of (at least) this many characters.
+_CHUNK_SIZE = 1 << 16
+
+# The members of a report holding its tests, which are not loaded by
+# _load_stream_format.
+_STREAMED_KEYS = ('tests', 'Tests')
+
+_decoder = json.JSONDecoder()
+_whitespace = re.compile(r'[ \t\n\r]*')
 
 
 def _matches_format(path_or_file):
     if isinstance(path_or_file, str):
-        path_or_file = open(path_or_file)
+        with open(path_or_file, 'rb') as fp:
+            head = fp.read(_SNIFF_SIZE)
+    else:
+        head = path_or_file.read(_SNIFF_SIZE)
+    if isinstance(head, str):
+        head = head.encode('utf-8')
 
-    try:
-        json.load(path_or_file)
-        return True
-    except Exception:
-        return False
+    # Reports are JSON objects.
+    return head.lstrip(b'\xef\xbb\xbf \t\n\r').startswith(b'{')
 
 
 def _load_format(path_or_file):
     if isinstance(path_or_file, str):
-        path_or_file = open(path_or_file)
+        with open(path_or_file) as fp:
+            return json.load(fp)
 
     return json.load(path_or_file)
 
 
+class _Scanner(object):
+    """Decodes a JSON document from a file one value at a time, so that only
+    a chunk of the file and the current value are held in memory."""
+
+    def __init__(self, fp):
+        self.fp = fp
+        self.buf = ''
+        self.pos = 0
+
+    def _fill(self):
+        """Append the next chunk of the file to the buffer, dropping what was
+        consumed already. Returns False at the end of the file."""
+        # Grow the chunks with the buffer, so that decoding a large value
+        # does not rescan it once per chunk.
+        chunk = self.fp.read(max(_CHUNK_SIZE, len(self.buf) - self.pos))
+        if not chunk:
+            return False
+        self.buf = self.buf[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self):
+        """Return the next non-whitespace character, without consuming it,
+        or '' at the end of the file."""
+        while True:
+            self.pos = _whitespace.match(self.buf, self.pos).end()
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self._fill():
+                return ''
+
+    def expect(self, chars):
+        """Consume the next non-whitespace character, which must be one of
+        chars, and return it."""
+        c = self.peek()
+        if not c or c not in chars:
+            raise ValueError("Expected one of %r at %r" %
+                             (chars, self.buf[self.pos:self.pos + 20]))
+        self.pos += 1
+        return c
+
+    def value(self):
+        """Decode and consume the next value."""
+        self.peek()
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self.buf, self.pos)
+            except ValueError:
+                # The value may continue in the next chunk.
+                if self._fill():
+                    continue
+                raise
+            # A value is always followed by one of these characters; if it is
+            # not in the buffer yet, a number or a literal may have been cut
+            # at the end of the chunk.
+            end_of_value = _whitespace.match(self.buf, end).end()
+            if (end_of_value == len(self.buf) or
+                    self.buf[end_of_value] not in ',:]}') and self._fill():
+                continue
+            self.pos = end
+            return value
+
+    def members(self):
+        """Consume the start of an object and yield its keys. The value of
+        each key must be consumed before resuming the generator."""
+        self.expect('{')
+        if self.peek() == '}':
+            self.pos += 1
+            return
+        while True:
+            key = self.value()
+            if not isinstance(key, str):
+                raise ValueError("Expected a string key, got %r" % (key,))
+            self.expect(':')
+            yield key
+            if self.expect(',}') == '}':
+                return
+
+    def elements(self):
+        """Consume an array, decoding its elements one at a time."""
+        self.expect('[')
+        if self.peek() == ']':
+            self.pos += 1
+            return
+        while True:
+            yield self.value()
+            if self.expect(',]') == ']':
+                return
+
+
+class _StreamedArray(object):
+    """An array member of the JSON object in a file, which is decoded again,
+    one element at a time, each time it is iterated over."""
+
+    def __init__(self, path, key):
+        self.path = path
+        self.key = key
+
+    def __iter__(self):
+        with open(self.path) as fp:
+            scanner = _Scanner(fp)
+            for key in scanner.members():
+                if key == self.key:
+                    yield from scanner.elements()
+                    return
+                scanner.value()
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+
+def _load_stream_format(path_or_file):
+    """Like _load_format, but the tests of the report are not kept in memory:
+    they are checked, then decoded again from the file while they are iterated
+    over."""
+    if not isinstance(path_or_file, str):
+        return _load_format(path_or_file)
+
+    data = {}
+    with open(path_or_file) as fp:
+        scanner = _Scanner(fp)
+        for key in scanner.members():
+            if key in _STREAMED_KEYS and scanner.peek() == '[':
+                for _ in scanner.elements():
+                    pass
+                data[key] = _StreamedArray(path_or_file, key)
+            else:
+                data[key] = scanner.value()
+        if scanner.peek():
+            raise ValueError("Extra data after the report")
+    return data
+
+
 def _dump_format(obj, fp):
     # The json module produces str objects but fp is opened in binary mode
     # (since Plistlib only dump to binary mode files) so we first dump into
@@ -31,5 +181,6 @@ format = {
     'name': 'json',
     'predicate': _matches_format,
     'read': _load_format,
+    'read_stream': _load_stream_format,
     'write': _dump_format,
 }
@@ -1,16 +1,22 @@
 import plistlib
 
+# The number of leading bytes looked at to guess the format of a file.
+_SNIFF_SIZE = 512
+
+# The possible starts of binary and XML property lists.
+_HEADERS = (b'bplist', b'<?xml', b'<!DOCTYPE plist', b'<plist')
+
 
 def _matches_format(path_or_file):
-    try:
-        if isinstance(path_or_file, str):
-            with open(path_or_file, 'rb') as fp:
-                plistlib.load(fp)
-        else:
-            plistlib.load(path_or_file)
-        return True
-    except Exception:
-        return False
+    if isinstance(path_or_file, str):
+        with open(path_or_file, 'rb') as fp:
+            head = fp.read(_SNIFF_SIZE)
+    else:
+        head = path_or_file.read(_SNIFF_SIZE)
+    if isinstance(head, str):
+        head = head.encode('utf-8')
+
+    return head.lstrip(b'\xef\xbb\xbf \t\n\r').startswith(_HEADERS)
 
 
 def _load_format(path_or_file):
@@ -5,13 +5,18 @@ LNT formats are described by dictionaries with 'name', 'read', and 'write'
 fields. Only the 'name' field is required. The 'read' field should be a
 callable taking a path_or_file object, the 'write' function should be a
 callable taking a Python object to write, and the path_or_file to write to.
+The optional 'read_stream' field is a variant of 'read' which may return the
+tests of a report as an iterable decoding them lazily, to bound the memory used
+by large reports. The 'predicate' field tells whether a file looks like it is
+in the format, from its first bytes.
 """
 
 from typing import List, Dict
 from .PlistFormat import format as plist
 from .JSONFormat import format as json
+from .BinaryFormat import format as binary
 
-formats: List[Dict] = [plist, json]
+formats: List[Dict] = [plist, json, binary]
 formats_by_name: Dict[str, Dict] = dict((f['name'], f) for f in formats)
 format_names: List[str] = list(formats_by_name.keys())
 
@@ -61,11 +66,13 @@ def guess_format(path_or_file):
     return matches
 
 
-def read_any(path_or_file, format_name):
-    """read_any(path_or_file, format_name) -> [format]
+def read_any(path_or_file, format_name, stream=False):
+    """read_any(path_or_file, format_name, [stream]) -> [format]
 
     Attempt to read any compatible LNT test format file. The format_name can be
-    an actual format name, or "<auto>".
+    an actual format name, or "<auto>". With stream, the tests of the report
+    may be returned as an iterable which decodes them from the file one at a
+    time, if the format supports it.
     """
     # Figure out the input format.
     if format_name == '<auto>':
@@ -81,6 +88,8 @@ def read_any(path_or_file, format_name):
         if f is None or not f.get('read'):
             raise ValueError("unknown input format: %r" % format_name)
 
+    if stream and f.get('read_stream'):
+        return f['read_stream'](path_or_file)
     return f['read'](path_or_file)
 
 
@@ -17,6 +17,7 @@ from .showtests import action_showtests
 from .submit import action_submit
 from .updatedb import action_updatedb
 from .viewcomparison import action_view_comparison
+from .worker import action_worker
 
 
 def show_version(ctx, param, value):
@@ -55,5 +56,6 @@ main.add_command(action_showtests)
 main.add_command(action_submit)
 main.add_command(action_updatedb)
 main.add_command(action_view_comparison)
+main.add_command(action_worker)
 main.add_command(group_admin)
 main.add_command(group_runtest)
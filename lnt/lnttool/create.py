@@ -36,7 +36,16 @@ secret_key = %(secret_key)r
 %(api_auth_token_line)s
 
 # The list of available databases, and their properties. At a minimum, there
-# should be a 'default' entry for the default database.
+# should be a 'default' entry for the default database. Setting 'bulk_import'
+# to True on a database inserts submitted samples with bulk statements (COPY on
+# PostgreSQL) instead of individual ORM objects, which makes large imports
+# faster.
+#
+# Each server process keeps a pool of connections to each database. It can be
+# configured with the 'pool_size', 'max_overflow', 'pool_recycle',
+# 'pool_timeout' and 'pool_pre_ping' settings of a database (see
+# sqlalchemy.create_engine). Setting 'null_pool' to True opens a connection for
+# each request instead, for databases behind a pooler such as pgbouncer.
 databases = {
     'default' : { 'path' : %(default_db)r },
     }
@@ -57,6 +66,31 @@ nt_emailer = {
     # reports to different email address.
     'to' : [(".*", None)],
     }
+
+# How the tasks following a submission (regenerating field changes and running
+# the rule hooks) are executed. 'sync' runs them within the submission, 'queue'
+# leaves them to 'lnt worker', 'thread' and 'process' run them in a background
+# thread or process of the server.
+post_submit_mode = 'sync'
+
+# The number of seconds after which a post submission job which is still
+# running is assumed to be lost (its worker crashed or was killed) and is
+# queued again. A job is given up once it was started 3 times.
+post_submit_timeout = 3600
+
+# The size in megabytes of the cache of decoded profiles kept by each server
+# process for the profile viewer, counting the decoded size of the profiles
+# rather than the size of their files. 0 disables it.
+profile_cache_size = 256
+
+# The number of worker processes the latest runs, daily and summary reports
+# split their machines between. 1 builds them in the server process.
+report_jobs = 1
+
+# Whether submissions are lean by default: they then only store the run,
+# without building its report or counting the rows of the tables. Submitters
+# can override this with the 'lean' parameter.
+lean_submissions = False
 """
 
 kWSGITemplate = """\
@@ -8,6 +8,7 @@ import click
 import lnt.formats
 from lnt.lnttool.common import submit_options, init_logger
 from lnt.server.db.rules_manager import register_hooks
+from lnt.util import logger
 
 
 @click.command("import")
@@ -27,10 +28,14 @@ from lnt.server.db.rules_manager import register_hooks
 @click.option("--quiet", "-q", is_flag=True, help="don't show test results")
 @click.option("--no-email", is_flag=True, help="don't send e-mail")
 @click.option("--no-report", is_flag=True, help="don't generate report")
+@click.option("-j", "--jobs", type=click.IntRange(min=1), default=1,
+              show_default=True,
+              help="number of processes parsing the files; with more than "
+                   "one, the files are imported in bulk, without reports")
 @submit_options
 def action_import(instance_path, files, database, output_format, show_sql,
                   show_sample_count, show_raw_result, testsuite, verbose,
-                  quiet, no_email, no_report, select_machine, merge):
+                  quiet, no_email, no_report, jobs, select_machine, merge):
     """import test data into a database"""
     import lnt.server.instance
     import lnt.util.ImportData
@@ -47,6 +52,29 @@ def action_import(instance_path, files, database, output_format, show_sql,
     # Get the database.
     with contextlib.closing(config.get_database(database)) as db:
         session = db.make_session()
+        if jobs > 1 and config.databases[database].shadow_import:
+            logger.warning(
+                "importing the files one at a time, to import them into the "
+                "shadow database too")
+            jobs = 1
+        if jobs > 1:
+            results, summary = lnt.util.ImportData.import_files(
+                config, database, db, session, list(files), output_format,
+                testsuite, jobs, select_machine=select_machine,
+                merge_run=merge)
+            for result in results:
+                if quiet:
+                    continue
+                if show_raw_result:
+                    pprint.pprint(result)
+                else:
+                    lnt.util.ImportData.print_report_result(
+                        result, sys.stdout, sys.stderr, verbose)
+            lnt.util.ImportData.print_import_summary(summary, sys.stdout)
+            if not all(result['success'] for result in results):
+                raise SystemExit(1)
+            return
+
         # Load the database.
         success = True
         for file_name in files:
@@ -1,4 +1,5 @@
 import click
+import os
 
 
 @click.group("profile")
@@ -10,10 +11,20 @@ def action_profile():
 @action_profile.command("upgrade")
 @click.argument("input", type=click.Path(exists=True))
 @click.argument("output", type=click.Path())
-def command_update(input, output):
+@click.option("--codec", type=click.Choice(['bz2', 'zlib', 'zstd', 'lz4']),
+              help="codec to compress the profile with (default: zstd if "
+                   "available, else zlib)")
+def command_update(input, output, codec):
     """upgrade a profile to the latest version"""
     import lnt.testing.profile.profile as profile
-    profile.Profile.fromFile(input).upgrade().save(filename=output)
+    from lnt.testing.profile.codec import getCodec
+    p = profile.Profile.fromFile(input).upgrade()
+    if codec is not None:
+        p.impl.codec = getCodec(codec)
+        if not p.impl.codec.isAvailable():
+            raise click.BadParameter("the module needed by %s is not "
+                                     "installed" % codec, param_hint="--codec")
+    p.save(filename=output)
 
 
 @action_profile.command("getVersion")
@@ -53,3 +64,26 @@ def command_code_for_function(input, fn):
     import lnt.testing.profile.profile as profile
     print(json.dumps(
         list(profile.Profile.fromFile(input).getCodeForFunction(fn))))
+
+
+@action_profile.command("repack")
+@click.argument("profile_dir", type=click.Path(exists=True, file_okay=False))
+def command_repack(profile_dir):
+    """share the text pools of the profiles in a directory
+
+    Moves the text pool of the version 2 and 3 profiles in PROFILE_DIR (the
+    'profile_dir' of an instance) to files shared by the profiles with the same
+    text, and deletes the shared files no profile uses anymore.
+    """
+    import lnt.testing.profile.pool as pool
+
+    def disk_usage():
+        return sum(os.path.getsize(os.path.join(root, name))
+                   for root, _, names in os.walk(profile_dir)
+                   for name in names)
+
+    before = disk_usage()
+    pooled, deleted = pool.repack(profile_dir)
+    after = disk_usage()
+    print("Pooled %d profiles, deleted %d unused pools: %d -> %d bytes" %
+          (pooled, deleted, before, after))
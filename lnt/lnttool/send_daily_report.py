@@ -22,9 +22,12 @@ from lnt.util import logger
               help="number of days to show in report")
 @click.option("--filter-machine-regex",
               help="only show machines that contain the regex")
+@click.option("-j", "--jobs", type=click.IntRange(min=1), default=1,
+              show_default=True,
+              help="number of processes the machines are split between")
 def action_send_daily_report(instance_path, address, database, testsuite, host,
                              from_address, today, subject_prefix, dry_run,
-                             days, filter_machine_regex):
+                             days, filter_machine_regex, jobs):
     """send a daily report email"""
     import contextlib
     import datetime
@@ -67,7 +70,8 @@ def action_send_daily_report(instance_path, address, database, testsuite, host,
             day_start_offset_hours=date.hour, for_mail=True,
             num_prior_days_to_include=days,
             filter_machine_regex=filter_machine_regex)
-        report.build(session)
+        report.build(session, jobs=jobs)
+        report.store_results(session)
 
         logger.info("generating HTML report...")
         ts_url = "%s/db_%s/v4/%s" \
@@ -26,8 +26,10 @@ def _print_result_url(results, verbose):
               help="testsuite to use in case the url is a file path")
 @click.option("--ignore-regressions", is_flag=True,
               help="disable regression tracking")
+@click.option("--lean", is_flag=True,
+              help="only store the run, without building its report")
 def action_submit(url, files, select_machine, merge, verbose, testsuite,
-                  ignore_regressions):
+                  ignore_regressions, lean):
     """submit a test report to the server"""
     from lnt.util import ServerUtil
     import lnt.util.ImportData
@@ -39,7 +41,8 @@ def action_submit(url, files, select_machine, merge, verbose, testsuite,
     results = ServerUtil.submitFiles(url, files, verbose,
                                      select_machine=select_machine,
                                      merge_run=merge, testsuite=testsuite,
-                                     ignore_regressions=ignore_regressions)
+                                     ignore_regressions=ignore_regressions,
+                                     lean=lean)
     for submitted_file in results:
         if verbose:
             lnt.util.ImportData.print_report_result(
@@ -17,11 +17,16 @@ import click
 @click.option("--delete-order", "delete_orders", default=[], multiple=True, type=int,
               help="Delete all runs associated to the given order(s) and their samples. "
                    "Orders are identified by their ID.")
+@click.option("--rebuild-geomeans", is_flag=True,
+              help="Recompute the geometric means of all the orders of all the machines, "
+                   "which are shown as the mean trend line of the graphs.")
 def action_updatedb(instance_path, database, testsuite, show_sql,
-                    delete_machines, delete_runs, delete_orders):
+                    delete_machines, delete_runs, delete_orders,
+                    rebuild_geomeans):
     """modify a database"""
     from .common import init_logger
 
+    import collections
     import contextlib
     import lnt.server.instance
     import logging
@@ -43,8 +48,12 @@ def action_updatedb(instance_path, database, testsuite, show_sql,
         else:
             runs = session.query(ts.Run) \
                 .filter(ts.Run.id.in_(delete_runs)).all()
+        orders_by_machine = collections.defaultdict(set)
         for run in runs:
+            orders_by_machine[run.machine_id].add(run.order_id)
             session.delete(run)
+        for machine_id, order_ids in orders_by_machine.items():
+            ts.update_geomeans(session, machine_id, order_ids)
 
         if delete_machines:
             machines = session.query(ts.Machine) \
@@ -52,4 +61,9 @@ def action_updatedb(instance_path, database, testsuite, show_sql,
             for machine in machines:
                 session.delete(machine)
 
+        if rebuild_geomeans:
+            session.flush()
+            count = ts.rebuild_geomeans(session)
+            print("Rebuilt the geometric means of %d orders" % count)
+
         session.commit()
@@ -0,0 +1,55 @@
+import click
+
+
+@click.command("worker")
+@click.argument("instance_path", type=click.UNPROCESSED)
+@click.option("--database", "databases", default=[], multiple=True,
+              help="database to process jobs for (default: all databases)")
+@click.option("--poll-interval", default=5.0, show_default=True, type=float,
+              help="seconds to wait before checking an empty queue again")
+@click.option("--once", is_flag=True,
+              help="exit once the queues are empty")
+@click.option("--verbose", "-v", is_flag=True, help="show debugging output")
+def action_worker(instance_path, databases, poll_interval, once, verbose):
+    """process queued post submission jobs
+
+Runs the tasks queued by submissions to a server with
+post_submit_mode = 'queue' (regenerating field changes and running the
+rule hooks). Several workers can run concurrently against a PostgreSQL
+database.
+    """
+    from .common import init_logger
+    from lnt.server.db import jobqueue
+    from lnt.util import logger
+    import contextlib
+    import lnt.server.instance
+    import logging
+    import time
+
+    init_logger(logging.DEBUG if verbose else logging.INFO)
+
+    instance = lnt.server.instance.Instance.frompath(instance_path)
+    config = instance.config
+    if not databases:
+        databases = sorted(config.databases.keys())
+    for name in databases:
+        if name not in config.databases:
+            raise click.BadParameter("unknown database '%s'" % name,
+                                     param_hint="--database")
+
+    with contextlib.ExitStack() as stack:
+        dbs = [(name, stack.enter_context(
+                    contextlib.closing(config.get_database(name))))
+               for name in databases]
+        while True:
+            processed = 0
+            for name, db in dbs:
+                count = jobqueue.run_pending_jobs(db)
+                if count:
+                    logger.info("Processed %d job(s) for database '%s'" %
+                                (count, name))
+                processed += count
+            if once:
+                break
+            if not processed:
+                time.sleep(poll_interval)
@@ -7,6 +7,7 @@ import re
 import tempfile
 
 import lnt.server.db.v4db
+from lnt.server.db.jobqueue import DEFAULT_TIMEOUT, POST_SUBMIT_MODES
 
 
 class EmailConfig:
@@ -67,22 +68,33 @@ class DBInfo:
             raise NotImplementedError("unable to load version %r database" % (
                                       db_version))
 
+        pool_options = {key: config_data[key]
+                        for key in lnt.server.db.v4db.POOL_OPTIONS
+                        if key in config_data}
+
         return DBInfo(dbPath,
                       config_data.get('shadow_import', None),
                       email_config,
-                      baseline_revision)
+                      baseline_revision,
+                      bool(config_data.get('bulk_import', False)),
+                      pool_options)
 
     @staticmethod
     def dummy_instance():
         return DBInfo("sqlite:///:memory:", None,
                       EmailConfig(False, '', '', []), 0)
 
-    def __init__(self, path, shadow_import, email_config, baseline_revision):
+    def __init__(self, path, shadow_import, email_config, baseline_revision,
+                 bulk_import=False, pool_options=None):
         self.config = None
         self.path = path
         self.shadow_import = shadow_import
         self.email_config = email_config
         self.baseline_revision = baseline_revision
+        # Insert submitted samples with bulk statements instead of ORM objects.
+        self.bulk_import = bulk_import
+        # The settings of the connection pool; see v4db.POOL_OPTIONS.
+        self.pool_options = pool_options or {}
 
     def __str__(self):
         return "DBInfo(" + self.path + ")"
@@ -119,6 +131,15 @@ class Config:
         secretKey = data.get('secret_key', None)
 
         ignore_regressions = data.get('ignore_regressions', False)
+        lean_submissions = data.get('lean_submissions', False)
+        post_submit_mode = data.get('post_submit_mode', 'sync')
+        post_submit_timeout = data.get('post_submit_timeout', DEFAULT_TIMEOUT)
+        profile_cache_size = data.get('profile_cache_size', 256)
+        report_jobs = data.get('report_jobs', 1)
+        if post_submit_mode not in POST_SUBMIT_MODES:
+            raise ValueError("invalid post_submit_mode %r (expected one of %s)"
+                             % (post_submit_mode,
+                                ', '.join(POST_SUBMIT_MODES)))
 
         return Config(data.get('name', 'LNT'), data['zorgURL'],
                       dbDir, os.path.join(baseDir, tempDir),
@@ -127,7 +148,9 @@ class Config:
                                                  default_email_config,
                                                  0))
                            for k, v in data['databases'].items()]),
-                      blacklist, schemasDir, api_auth_token, ignore_regressions)
+                      blacklist, schemasDir, api_auth_token, ignore_regressions,
+                      post_submit_mode, profile_cache_size * 1024 * 1024,
+                      report_jobs, lean_submissions, post_submit_timeout)
 
     @staticmethod
     def dummy_instance():
@@ -162,7 +185,12 @@ class Config:
                  blacklist,
                  schemasDir,
                  api_auth_token=None,
-                 ignore_regressions=False):
+                 ignore_regressions=False,
+                 post_submit_mode='sync',
+                 profile_cache_size=256 * 1024 * 1024,
+                 report_jobs=1,
+                 lean_submissions=False,
+                 post_submit_timeout=DEFAULT_TIMEOUT):
         self.name = name
         self.zorgURL = zorgURL
         self.dbDir = dbDir
@@ -178,6 +206,11 @@ class Config:
             db.config = self
         self.api_auth_token = api_auth_token
         self.ignore_regressions = ignore_regressions
+        self.post_submit_mode = post_submit_mode
+        self.profile_cache_size = profile_cache_size
+        self.report_jobs = report_jobs
+        self.lean_submissions = lean_submissions
+        self.post_submit_timeout = post_submit_timeout
 
     def get_database(self, name):
         """
@@ -192,7 +225,8 @@ class Config:
             return None
 
         return lnt.server.db.v4db.V4DB(db_entry.path, self,
-                                       db_entry.baseline_revision)
+                                       db_entry.baseline_revision,
+                                       db_entry.pool_options)
 
     def get_database_names(self):
         return list(self.databases.keys())
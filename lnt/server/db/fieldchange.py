@@ -1,13 +1,12 @@
 import difflib
 
-from sqlalchemy.orm import joinedload
+from sqlalchemy.orm import joinedload, selectinload
 from sqlalchemy.orm.session import Session
 from sqlalchemy.orm.exc import ObjectDeletedError
 from typing import Tuple, List
-import typing
 
 import lnt.server.reporting.analysis
-from lnt.testing.util.commands import timed
+from lnt.server.db.util import timed
 from lnt.util import logger
 from lnt.server.db.regression import new_regression, RegressionState
 from lnt.server.db.regression import rebuild_title
@@ -22,43 +21,74 @@ FIELD_CHANGE_LOOKBACK = 10
 
 
 def post_submit_tasks(session, ts, run_id):
-    """Run the field change related post submission tasks.
-
+    """Run the field change related post submission tasks, and store the
+    comparisons of the run pages of the runs of the machine and order of the
+    run, which a job may have been coalesced for, if the submissions did not
+    (see store_run_comparisons).
     """
+    # Imported here, as the reporting modules import the server ones.
+    import lnt.server.reporting.runs
+    run = ts.getRun(session, run_id)
+    runs = session.query(ts.Run) \
+        .filter(ts.Run.machine_id == run.machine_id) \
+        .filter(ts.Run.order_id == run.order_id) \
+        .order_by(ts.Run.id)
+    for order_run in runs:
+        lnt.server.reporting.runs.store_run_comparisons(session, ts,
+                                                        order_run)
     regenerate_fieldchanges_for_run(session, ts, run_id)
 
 
-def delete_fieldchange(session: Session, ts: TestSuiteDB, change) -> List[int]:
-    """Delete this field change.  Since it might be attahed to a regression
-    via regression indicators, fix those up too.  If this orphans a regression
-    delete it as well."""
-    # Find the indicators.
-    indicators = session.query(ts.RegressionIndicator). \
-        filter(ts.RegressionIndicator.field_change_id == change.id). \
-        all()
-    # And all the related regressions.
-    regression_ids: List[int] = [r.regression_id for r in indicators]
-
-    # Remove the idicators that point to this change.
-    for ind in indicators:
-        session.delete(ind)
-
-    # Now we can remove the change, itself.
-    session.delete(change)
-
-    # We might have just created a regression with no changes.
-    # If so, delete it as well.
+def delete_fieldchanges(session: Session, ts: TestSuiteDB,
+                        changes) -> List[int]:
+    """Delete these field changes, along with the regression indicators
+    attaching them to regressions. Regressions left without any change are
+    deleted as well. Returns the IDs of the deleted regressions.
+
+    The session is flushed, but not committed."""
+    change_ids = [c.id for c in changes]
+    if not change_ids:
+        return []
+    # Load the indicators of all the changes at once, the cascade would
+    # otherwise load them one change at a time.
+    changes = session.query(ts.FieldChange) \
+        .filter(ts.FieldChange.id.in_(change_ids)) \
+        .options(selectinload(ts.FieldChange.regression_indicators)) \
+        .all()
+    regression_ids = set()
+    for change in changes:
+        regression_ids.update(ind.regression_id
+                              for ind in change.regression_indicators)
+        # Deleting the change deletes its indicators too.
+        session.delete(change)
+    session.flush()
+
+    # We might have just left regressions with no changes.
+    # If so, delete them as well.
     deleted_ids: List[int] = []
-    for r in regression_ids:
-        remaining = session.query(ts.RegressionIndicator). \
-            filter(ts.RegressionIndicator.regression_id == r). \
-            all()
-        if len(remaining) == 0:
-            r = typing.cast(int, session.query(ts.Regression).get(r))
+    if not regression_ids:
+        return deleted_ids
+    remaining = set(r for r, in session.query(
+        ts.RegressionIndicator.regression_id)
+        .filter(ts.RegressionIndicator.regression_id.in_(regression_ids))
+        .distinct())
+    orphaned = regression_ids - remaining
+    if orphaned:
+        for r in session.query(ts.Regression) \
+                .filter(ts.Regression.id.in_(orphaned)):
             logger.info("Deleting regression because it has not changes:" +
                         repr(r))
             session.delete(r)
-            deleted_ids.append(r)
+            deleted_ids.append(r.id)
+        session.flush()
+    return deleted_ids
+
+
+def delete_fieldchange(session: Session, ts: TestSuiteDB, change) -> List[int]:
+    """Delete this field change.  Since it might be attahed to a regression
+    via regression indicators, fix those up too.  If this orphans a regression
+    delete it as well."""
+    deleted_ids = delete_fieldchanges(session, ts, [change])
     session.commit()
     return deleted_ids
 
@@ -66,6 +96,12 @@ def delete_fieldchange(session: Session, ts: TestSuiteDB, change) -> List[int]:
 @timed
 def regenerate_fieldchanges_for_run(session: Session, ts: TestSuiteDB, run_id: int) -> None:
     """Regenerate the set of FieldChange objects for the given run.
+
+    This is done set-wise: the existing field changes are loaded with a single
+    query, and the stale, updated and new field changes are each written in
+    one batch, no matter how many tests the run has. Each new field change is
+    then attached to a regression one at a time, which takes a few statements
+    per new change.
     """
     # Allow for potentially a few different runs, previous_runs, next_runs
     # all with the same order_id which we will aggregate together to make
@@ -106,23 +142,22 @@ def regenerate_fieldchanges_for_run(session: Session, ts: TestSuiteDB, run_id: i
 
     # Only store fieldchanges for "metric" samples like execution time;
     # not for fields with other data, e.g. hash of a binary
-    field_ids = [x.id for x in ts.Sample.get_metric_fields()]
-
-    # We need to make sure if a field change already exists we use it.
-    # Since querying on every possible test*field is expensive, get the
-    # interesting locations ahead of time, and keep them in memory to
-    # check if we should actually query.
-    changes_of_interest = set(session.query(ts.FieldChange.start_order_id,
-                                            ts.FieldChange.end_order_id,
-                                            ts.FieldChange.test_id,
-                                            ts.FieldChange.machine_id,
-                                            ts.FieldChange.field_id)
-                              .filter(ts.FieldChange.start_order == start_order)
-                              .filter(ts.FieldChange.end_order == end_order)
-                              .filter(ts.FieldChange.test_id.in_(runinfo.test_ids))
-                              .filter(ts.FieldChange.machine == run.machine)
-                              .filter(ts.FieldChange.field_id.in_(field_ids))
-                              .all())
+    metric_fields = list(ts.Sample.get_metric_fields())
+    field_ids = [x.id for x in metric_fields]
+    test_ids = runinfo.test_ids
+    hash_of_binary_field = ts.Sample.get_hash_of_binary_field()
+
+    # We need to make sure if a field change already exists we use it, so get
+    # all the ones this run could update ahead of time.
+    existing_changes = {}
+    if test_ids and field_ids:
+        for f in session.query(ts.FieldChange) \
+                .filter(ts.FieldChange.start_order == start_order) \
+                .filter(ts.FieldChange.end_order == end_order) \
+                .filter(ts.FieldChange.test_id.in_(test_ids)) \
+                .filter(ts.FieldChange.machine == run.machine) \
+                .filter(ts.FieldChange.field_id.in_(field_ids)):
+            existing_changes[(f.test_id, f.field_id)] = f
 
     active_changes = session.query(ts.FieldChange) \
         .join(ts.RegressionIndicator) \
@@ -135,61 +170,75 @@ def regenerate_fieldchanges_for_run(session: Session, ts: TestSuiteDB, run_id: i
                  joinedload(ts.FieldChange.machine)) \
         .all()
 
-    for field in list(ts.Sample.get_metric_fields()):
-        for test_id in runinfo.test_ids:
-            f = None
-            result = runinfo.get_comparison_result(
-                runs, previous_runs, test_id, field,
-                ts.Sample.get_hash_of_binary_field())
-            # Try and find a matching FC and update, else create one.
-            target = (start_order.id, run.order.id, run.machine.id, test_id, field.id)
-            should_search = target in changes_of_interest
-
-            if should_search:
-                f = session.query(ts.FieldChange) \
-                    .filter(ts.FieldChange.start_order == start_order) \
-                    .filter(ts.FieldChange.end_order == end_order) \
-                    .filter(ts.FieldChange.test_id == test_id) \
-                    .filter(ts.FieldChange.machine == run.machine) \
-                    .filter(ts.FieldChange.field_id == field.id) \
-                    .one_or_none()
-                if not f:
-                    logger.warning("Fell back to field lookup. Should not happen.")
-            if not result.is_result_performance_change() and f:
-                # With more data, its not a regression. Kill it!
-                logger.info("Removing field change: {}".format(f.id))
-                delete_fieldchange(session, ts, f)
-                continue
-
-            if result.is_result_performance_change() and not f:
-                test = session.query(ts.Test) \
-                    .filter(ts.Test.id == test_id) \
-                    .one()
-                f = ts.FieldChange(start_order=start_order,
-                                   end_order=run.order,
-                                   machine=run.machine,
-                                   test=test,
-                                   field_id=field.id)
-                session.add(f)
-                session.flush()
-                try:
-                    found, new_reg = identify_related_changes(session, ts,
-                                                              f, active_changes)
-                except ObjectDeletedError:
-                    # This can happen from time to time.
-                    # So, lets retry once.
-                    found, new_reg = identify_related_changes(session, ts,
-                                                              f, active_changes)
-
-                if found:
-                    logger.info("Found field change: {}".format(
-                                run.machine))
-
-            # Always update FCs with new values.
-            if f:
+    # Compare everything first, then sort the field changes into the ones to
+    # delete, update and create.
+    stale_changes = []
+    new_changes = {}
+    for field in metric_fields:
+        results = runinfo.get_comparison_results(
+            runs, previous_runs, test_ids, field, hash_of_binary_field)
+        for test_id, result in results.items():
+            f = existing_changes.get((test_id, field.id))
+            if not result.is_result_performance_change():
+                if f:
+                    # With more data, its not a regression. Kill it!
+                    stale_changes.append(f)
+            elif f:
+                # Always update FCs with new values.
                 f.old_value = result.previous
                 f.new_value = result.current
                 f.run = run
+            else:
+                new_changes[(test_id, field.id)] = result
+
+    if stale_changes:
+        stale_ids = set(f.id for f in stale_changes)
+        logger.info("Removing field changes: {}".format(sorted(stale_ids)))
+        delete_fieldchanges(session, ts, stale_changes)
+        active_changes = [c for c in active_changes if c.id not in stale_ids]
+
+    if new_changes:
+        session.flush()
+        new_test_ids = set(test_id for test_id, _ in new_changes)
+        session.execute(ts.FieldChange.__table__.insert(), [
+            {'StartOrderID': start_order.id,
+             'EndOrderID': run.order_id,
+             'TestID': test_id,
+             'MachineID': run.machine_id,
+             'FieldID': field_id,
+             'OldValue': result.previous,
+             'NewValue': result.current,
+             'RunID': run.id}
+            for (test_id, field_id), result in new_changes.items()])
+
+        # Load the new changes back, along with their tests, to attach them
+        # to regressions.
+        session.query(ts.Test).filter(ts.Test.id.in_(new_test_ids)).all()
+        created = {}
+        for f in session.query(ts.FieldChange) \
+                .filter(ts.FieldChange.start_order_id == start_order.id) \
+                .filter(ts.FieldChange.end_order_id == run.order_id) \
+                .filter(ts.FieldChange.machine_id == run.machine_id) \
+                .filter(ts.FieldChange.run_id == run.id) \
+                .filter(ts.FieldChange.test_id.in_(new_test_ids)) \
+                .filter(ts.FieldChange.field_id.in_(field_ids)) \
+                .order_by(ts.FieldChange.id):
+            created[(f.test_id, f.field_id)] = f
+
+        for key in new_changes:
+            f = created[key]
+            try:
+                found, new_reg = identify_related_changes(session, ts,
+                                                          f, active_changes)
+            except ObjectDeletedError:
+                # This can happen from time to time.
+                # So, lets retry once.
+                found, new_reg = identify_related_changes(session, ts,
+                                                          f, active_changes)
+
+            if found:
+                logger.info("Found field change: {}".format(
+                            run.machine))
 
     session.commit()
 
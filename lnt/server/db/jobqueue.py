@@ -0,0 +1,412 @@
+"""
+Database backed queue for the tasks which run after a run was submitted:
+regenerating the field changes of the run and running the post submission
+rule hooks.
+
+How these tasks are executed is selected with ``post_submit_mode`` in the
+instance configuration:
+
+  'sync'     Run them inside the submission itself (the default).
+  'queue'    Only enqueue a job; the jobs are processed by ``lnt worker``.
+  'thread'   Enqueue a job and process it in a background thread of the
+             submitting process.
+  'process'  Enqueue a job and process it in a worker process started by the
+             submitting process.
+
+Pending jobs for the same machine and order are coalesced into a single job,
+as regenerating the field changes of a run already considers all the runs
+submitted for that machine and order. A unique index on the pending jobs keeps
+concurrent submissions from queuing two of them.
+
+A job still running after ``post_submit_timeout`` seconds is assumed to belong
+to a worker which crashed or was killed: it is queued again, unless it was
+already started MAX_ATTEMPTS times, in which case it is marked as failed.
+"""
+
+import concurrent.futures
+import datetime
+import multiprocessing
+import threading
+
+import sqlalchemy
+import sqlalchemy.exc
+import sqlalchemy.ext.declarative
+from sqlalchemy import Column, DateTime, Integer, String
+from sqlalchemy.dialects import postgresql
+
+from lnt.server.db import fieldchange
+from lnt.server.db import rules_manager
+from lnt.util import logger
+
+Base = sqlalchemy.ext.declarative.declarative_base()
+
+POST_SUBMIT_MODES = ('sync', 'queue', 'thread', 'process')
+
+# The default number of seconds after which a running job is queued again.
+DEFAULT_TIMEOUT = 3600
+
+# The number of times a job is started before it is given up.
+MAX_ATTEMPTS = 3
+
+# Job states.
+PENDING = 0
+RUNNING = 1
+DONE = 2
+FAILED = 3
+
+STATE_NAMES = {
+    PENDING: 'pending',
+    RUNNING: 'running',
+    DONE: 'done',
+    FAILED: 'failed',
+}
+
+
+class PostSubmitJob(Base):
+    """The post submission tasks for the runs of a machine at an order."""
+    __tablename__ = 'PostSubmitJobs'
+
+    id = Column("ID", Integer, primary_key=True)
+    testsuite_name = Column("TestSuiteName", String(256), index=True)
+    machine_id = Column("MachineID", Integer)
+    order_id = Column("OrderID", Integer)
+    # The most recent run submitted for this machine and order.
+    run_id = Column("RunID", Integer)
+    state = Column("State", Integer, index=True)
+    # The number of submissions merged into this job after it was created.
+    coalesced = Column("Coalesced", Integer)
+    # The number of times the job was started.
+    attempts = Column("Attempts", Integer)
+    created_time = Column("CreatedTime", DateTime)
+    started_time = Column("StartedTime", DateTime)
+    finished_time = Column("FinishedTime", DateTime)
+    error = Column("Error", String(1024))
+
+    # At most one pending job per machine and order.
+    __table_args__ = (
+        sqlalchemy.Index('ix_PostSubmitJobs_Pending', testsuite_name,
+                         machine_id, order_id, unique=True,
+                         postgresql_where=state == PENDING,
+                         sqlite_where=state == PENDING),
+    )
+
+    def __init__(self, testsuite_name, machine_id, order_id, run_id):
+        self.testsuite_name = testsuite_name
+        self.machine_id = machine_id
+        self.order_id = order_id
+        self.run_id = run_id
+        self.state = PENDING
+        self.coalesced = 0
+        self.attempts = 0
+        self.created_time = datetime.datetime.utcnow()
+
+    def __repr__(self):
+        return '%s%r' % (self.__class__.__name__,
+                         (self.id, self.testsuite_name, self.run_id,
+                          STATE_NAMES.get(self.state)))
+
+    @property
+    def queue_latency(self):
+        """Seconds the job waited in the queue, or None if not started."""
+        if self.started_time is None:
+            return None
+        return (self.started_time - self.created_time).total_seconds()
+
+    @property
+    def run_time(self):
+        """Seconds the job took to run, or None if not finished."""
+        if self.started_time is None or self.finished_time is None:
+            return None
+        return (self.finished_time - self.started_time).total_seconds()
+
+    def __json__(self):
+        return {
+            'id': self.id,
+            'machine_id': self.machine_id,
+            'order_id': self.order_id,
+            'run_id': self.run_id,
+            'state': STATE_NAMES.get(self.state),
+            'coalesced': self.coalesced,
+            'attempts': self.attempts,
+            'created_time': self.created_time,
+            'started_time': self.started_time,
+            'finished_time': self.finished_time,
+            'queue_latency': self.queue_latency,
+            'run_time': self.run_time,
+            'error': self.error,
+        }
+
+
+def enqueue_post_submit(session, ts, run):
+    """
+    enqueue_post_submit(session, ts, run) -> PostSubmitJob
+
+    Queue the post submission tasks for the given run and commit. If a job for
+    the same machine and order is still pending, it is reused.
+    """
+    if session.bind.dialect.name == 'postgresql':
+        table = PostSubmitJob.__table__
+        new_job = PostSubmitJob(ts.name, run.machine_id, run.order_id, run.id)
+        insert = postgresql.insert(table).values(
+            TestSuiteName=new_job.testsuite_name,
+            MachineID=new_job.machine_id, OrderID=new_job.order_id,
+            RunID=new_job.run_id, State=new_job.state,
+            Coalesced=new_job.coalesced, Attempts=new_job.attempts,
+            CreatedTime=new_job.created_time)
+        insert = insert.on_conflict_do_update(
+            index_elements=[table.c.TestSuiteName, table.c.MachineID,
+                            table.c.OrderID],
+            index_where=table.c.State == PENDING,
+            set_={'RunID': insert.excluded.RunID,
+                  'Coalesced': table.c.Coalesced + 1}) \
+            .returning(table.c.ID)
+        job_id = session.execute(insert).scalar()
+        session.commit()
+        return session.query(PostSubmitJob).get(job_id)
+
+    # Without an upsert, update the pending job, or insert one if there is
+    # none; when a concurrent submission inserted it first, update it.
+    while True:
+        pending = session.query(PostSubmitJob) \
+            .filter(PostSubmitJob.state == PENDING) \
+            .filter(PostSubmitJob.testsuite_name == ts.name) \
+            .filter(PostSubmitJob.machine_id == run.machine_id) \
+            .filter(PostSubmitJob.order_id == run.order_id)
+        updated = pending.update(
+            {PostSubmitJob.run_id: run.id,
+             PostSubmitJob.coalesced: PostSubmitJob.coalesced + 1},
+            synchronize_session=False)
+        if updated:
+            job = pending.populate_existing().one()
+            break
+        job = PostSubmitJob(ts.name, run.machine_id, run.order_id, run.id)
+        try:
+            with session.begin_nested():
+                session.add(job)
+        except sqlalchemy.exc.IntegrityError:
+            continue
+        break
+    session.commit()
+    return job
+
+
+def requeue_stale_jobs(session, timeout=DEFAULT_TIMEOUT):
+    """
+    requeue_stale_jobs(session, [timeout]) -> int
+
+    Queue again the jobs which were started more than timeout seconds ago and
+    are still running, or mark them as failed once they were started
+    MAX_ATTEMPTS times, or when a job for the same machine and order is
+    already pending. Return the number of jobs queued again.
+    """
+    now = datetime.datetime.utcnow()
+    query = session.query(PostSubmitJob) \
+        .filter(PostSubmitJob.state == RUNNING) \
+        .filter(PostSubmitJob.started_time <
+                now - datetime.timedelta(seconds=timeout))
+    if session.bind.dialect.name == 'postgresql':
+        query = query.with_for_update(skip_locked=True)
+    count = 0
+    for job in query:
+        if (job.attempts or 0) >= MAX_ATTEMPTS:
+            logger.warning("Post submission job %d timed out %d times, "
+                           "giving up" % (job.id, job.attempts))
+            job.state = FAILED
+            job.finished_time = now
+            job.error = "timed out after %d attempts" % job.attempts
+            continue
+        try:
+            with session.begin_nested():
+                job.state = PENDING
+        except sqlalchemy.exc.IntegrityError:
+            # The pending job of its machine and order does the same work.
+            pending = session.query(PostSubmitJob.id) \
+                .filter(PostSubmitJob.state == PENDING) \
+                .filter(PostSubmitJob.testsuite_name == job.testsuite_name) \
+                .filter(PostSubmitJob.machine_id == job.machine_id) \
+                .filter(PostSubmitJob.order_id == job.order_id) \
+                .scalar()
+            logger.warning("Post submission job %d timed out, superseded by "
+                           "pending job %s" % (job.id, pending))
+            job.state = FAILED
+            job.finished_time = now
+            job.error = "timed out, superseded by job %s" % pending
+            continue
+        logger.warning("Post submission job %d timed out, queuing it "
+                       "again" % job.id)
+        count += 1
+    session.commit()
+    return count
+
+
+def claim_next_job(session, timeout=DEFAULT_TIMEOUT):
+    """
+    claim_next_job(session, [timeout]) -> PostSubmitJob or None
+
+    Mark the oldest pending job as running and return it. Jobs running for
+    more than timeout seconds are queued again first.
+    """
+    requeue_stale_jobs(session, timeout)
+    while True:
+        query = session.query(PostSubmitJob.id) \
+            .filter(PostSubmitJob.state == PENDING) \
+            .order_by(PostSubmitJob.id)
+        if session.bind.dialect.name == 'postgresql':
+            # Let concurrent workers pick different jobs.
+            query = query.with_for_update(skip_locked=True)
+        job_id = query.limit(1).scalar()
+        if job_id is None:
+            session.commit()
+            return None
+        # Only claim the job if no other worker claimed it since it was read,
+        # which backends without row locks do not prevent.
+        claimed = session.query(PostSubmitJob) \
+            .filter(PostSubmitJob.id == job_id) \
+            .filter(PostSubmitJob.state == PENDING) \
+            .update({PostSubmitJob.state: RUNNING,
+                     PostSubmitJob.started_time: datetime.datetime.utcnow(),
+                     PostSubmitJob.attempts:
+                         sqlalchemy.func.coalesce(PostSubmitJob.attempts,
+                                                  0) + 1},
+                    synchronize_session=False)
+        session.commit()
+        if claimed:
+            return session.query(PostSubmitJob).get(job_id)
+
+
+def run_job(db, job_id):
+    """Run the post submission tasks of a claimed job and record the
+    outcome."""
+    session = db.make_session()
+    try:
+        job = session.query(PostSubmitJob).get(job_id)
+        ts = db.testsuite.get(job.testsuite_name)
+        try:
+            if ts is None:
+                raise ValueError("unknown test suite '%s'" %
+                                 job.testsuite_name)
+            fieldchange.post_submit_tasks(session, ts, job.run_id)
+        except Exception as e:
+            session.rollback()
+            logger.exception("Post submission job %d failed" % job_id)
+            job = session.query(PostSubmitJob).get(job_id)
+            job.state = FAILED
+            job.error = str(e)[:1024]
+        else:
+            job = session.query(PostSubmitJob).get(job_id)
+            job.state = DONE
+        job.finished_time = datetime.datetime.utcnow()
+        session.commit()
+        logger.info("Post submission job %d for run %d %s: queued %.2fs, "
+                    "ran %.2fs" % (job.id, job.run_id, STATE_NAMES[job.state],
+                                   job.queue_latency, job.run_time))
+        return job.state
+    finally:
+        session.close()
+
+
+def run_pending_jobs(db, max_jobs=None):
+    """
+    run_pending_jobs(db, [max_jobs]) -> int
+
+    Process pending jobs until the queue is empty (or max_jobs were run) and
+    return the number of jobs processed.
+    """
+    if not rules_manager.HOOKS_LOADED:
+        rules_manager.register_hooks()
+    timeout = db.config.post_submit_timeout
+    count = 0
+    while max_jobs is None or count < max_jobs:
+        session = db.make_session()
+        try:
+            job = claim_next_job(session, timeout)
+            job_id = job.id if job is not None else None
+        finally:
+            session.close()
+        if job_id is None:
+            break
+        run_job(db, job_id)
+        count += 1
+    return count
+
+
+def get_statistics(session, testsuite_name, limit=100):
+    """
+    get_statistics(session, testsuite_name, [limit]) -> dict
+
+    Return the number of jobs in each state, and the queue latency and run
+    time of the most recently finished jobs.
+    """
+    counts = dict(session.query(PostSubmitJob.state,
+                                sqlalchemy.func.count(PostSubmitJob.id))
+                  .filter(PostSubmitJob.testsuite_name == testsuite_name)
+                  .group_by(PostSubmitJob.state))
+    finished = session.query(PostSubmitJob) \
+        .filter(PostSubmitJob.testsuite_name == testsuite_name) \
+        .filter(PostSubmitJob.finished_time.isnot(None)) \
+        .order_by(PostSubmitJob.finished_time.desc()) \
+        .limit(limit) \
+        .all()
+
+    def summarize(values):
+        if not values:
+            return None
+        return {
+            'mean': sum(values) / len(values),
+            'max': max(values),
+        }
+
+    return {
+        'counts': dict((name, counts.get(state, 0))
+                       for state, name in STATE_NAMES.items()),
+        'queue_latency': summarize([j.queue_latency for j in finished]),
+        'run_time': summarize([j.run_time for j in finished]),
+    }
+
+
+# Background processing for the 'thread' and 'process' modes. Each mode uses
+# a single worker, so jobs are processed one at a time.
+_executors = {}
+_scheduled = {}
+_executors_lock = threading.Lock()
+_worker_databases = {}
+
+
+def _run_pending_jobs_in_worker(config, db_name):
+    # The worker keeps its own database objects, independent of the lifetime
+    # of the requests which scheduled it.
+    db = _worker_databases.get(db_name)
+    if db is None:
+        db = _worker_databases[db_name] = config.get_database(db_name)
+    return run_pending_jobs(db)
+
+
+def _get_executor(mode):
+    executor = _executors.get(mode)
+    if executor is None:
+        if mode == 'thread':
+            executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        else:
+            executor = concurrent.futures.ProcessPoolExecutor(
+                max_workers=1, mp_context=multiprocessing.get_context('spawn'))
+        _executors[mode] = executor
+    return executor
+
+
+def schedule_jobs(config, db_name):
+    """Make the background worker of this process run the pending jobs of the
+    given database. This does nothing unless the post submission mode is
+    'thread' or 'process'."""
+    mode = config.post_submit_mode
+    if mode not in ('thread', 'process'):
+        return None
+    with _executors_lock:
+        # A scheduled run which has not started yet will see the new job.
+        future = _scheduled.get((mode, db_name))
+        if future is not None and not future.running() and \
+                not future.done():
+            return future
+        future = _get_executor(mode).submit(_run_pending_jobs_in_worker,
+                                            config, db_name)
+        _scheduled[(mode, db_name)] = future
+        return future
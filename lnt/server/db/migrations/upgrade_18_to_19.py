@@ -0,0 +1,68 @@
+"""Adds a SortKey column to the Order table of each test suite and backfills it
+for the existing orders. The key sorts the same way as the orders compare, so
+that new orders can be linked into the total ordering with an index lookup
+instead of sorting all the orders.
+"""
+
+import sqlalchemy
+from sqlalchemy import Column, Index, String, bindparam, select, update
+
+from lnt.server.db.migrations.util import introspect_table
+from lnt.server.db.util import add_column
+from lnt.server.ui.util import revision_sort_key
+from lnt.util import logger
+
+
+def _backfill_sort_keys(engine, db_key_name, order_field_names):
+    table_name = '{}_Order'.format(db_key_name)
+    add_column(engine, table_name, Column("SortKey", String))
+
+    order_table = introspect_table(engine, table_name)
+    fields = [order_table.c[name] for name in order_field_names]
+
+    cache = {}
+    with engine.begin() as trans:
+        rows = trans.execute(select([order_table.c.ID] + fields)).fetchall()
+    updates = []
+    for row in rows:
+        values = list(row[1:])
+        if any(value is None for value in values):
+            continue
+        updates.append({'order_id': row[0],
+                        'sort_key': revision_sort_key(values, cache=cache)})
+
+    if updates:
+        set_sort_key = update(order_table) \
+            .where(order_table.c.ID == bindparam('order_id')) \
+            .values(SortKey=bindparam('sort_key'))
+        with engine.begin() as trans:
+            trans.execute(set_sort_key, updates)
+
+    sort_key_index = Index('ix_{}_SortKey'.format(table_name),
+                           order_table.c.SortKey)
+    try:
+        sort_key_index.create(engine)
+    except (sqlalchemy.exc.OperationalError,
+            sqlalchemy.exc.ProgrammingError) as e:
+        logger.warning("Skipping index creation on {}, because of {}"
+                       .format(table_name, e))
+
+
+def upgrade(engine):
+    test_suite = introspect_table(engine, 'TestSuite')
+    order_fields = introspect_table(engine, 'TestSuiteOrderFields')
+
+    with engine.begin() as trans:
+        suites = list(trans.execute(select([test_suite.c.ID,
+                                            test_suite.c.DBKeyName])))
+
+    for suite_id, db_key_name in suites:
+        if not engine.has_table('{}_Order'.format(db_key_name)):
+            continue
+        with engine.begin() as trans:
+            order_field_names = [
+                name for name, in trans.execute(
+                    select([order_fields.c.Name])
+                    .where(order_fields.c.TestSuiteID == suite_id)
+                    .order_by(order_fields.c.Ordinal))]
+        _backfill_sort_keys(engine, db_key_name, order_field_names)
@@ -0,0 +1,32 @@
+# Adds the table holding the queue of post submission jobs.
+from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy import Column, DateTime, Index, Integer, String
+
+Base = declarative_base()
+
+
+class PostSubmitJob(Base):
+    __tablename__ = 'PostSubmitJobs'
+    id = Column("ID", Integer, primary_key=True)
+    testsuite_name = Column("TestSuiteName", String(256), index=True)
+    machine_id = Column("MachineID", Integer)
+    order_id = Column("OrderID", Integer)
+    run_id = Column("RunID", Integer)
+    state = Column("State", Integer, index=True)
+    coalesced = Column("Coalesced", Integer)
+    attempts = Column("Attempts", Integer)
+    created_time = Column("CreatedTime", DateTime)
+    started_time = Column("StartedTime", DateTime)
+    finished_time = Column("FinishedTime", DateTime)
+    error = Column("Error", String(1024))
+
+    # At most one pending (State 0) job per machine and order.
+    __table_args__ = (
+        Index('ix_PostSubmitJobs_Pending', testsuite_name, machine_id,
+              order_id, unique=True, postgresql_where=state == 0,
+              sqlite_where=state == 0),
+    )
+
+
+def upgrade(engine):
+    Base.metadata.create_all(engine)
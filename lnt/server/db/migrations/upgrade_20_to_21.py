@@ -0,0 +1,105 @@
+"""Adds the SeriesPoint table to each test suite, holding a copy of every value
+of a metric field along with the order and run it belongs to, and fills it from
+the existing samples.
+"""
+
+import sqlalchemy
+from sqlalchemy import Boolean, Column, DateTime, Float, ForeignKey, Index, \
+    Integer, MetaData, String, Table, select
+
+from lnt.server.db.migrations.util import introspect_table
+
+# lnt.testing.PASS
+PASS = 0
+
+
+def _create_series_table(engine, db_key_name):
+    meta = MetaData(bind=engine)
+    # Reflect the referenced tables, so the foreign keys can be resolved.
+    for suffix in ('Machine', 'Test', 'Order', 'Run'):
+        Table('{}_{}'.format(db_key_name, suffix), meta, autoload=True)
+    Table('TestSuiteSampleFields', meta, autoload=True)
+
+    name = '{}_SeriesPoint'.format(db_key_name)
+    points = Table(
+        name, meta,
+        Column("ID", Integer, primary_key=True),
+        Column("MachineID", Integer,
+               ForeignKey('{}_Machine.ID'.format(db_key_name))),
+        Column("TestID", Integer,
+               ForeignKey('{}_Test.ID'.format(db_key_name))),
+        Column("FieldID", Integer, ForeignKey('TestSuiteSampleFields.ID')),
+        Column("OrderID", Integer,
+               ForeignKey('{}_Order.ID'.format(db_key_name))),
+        Column("SortKey", String),
+        Column("RunID", Integer,
+               ForeignKey('{}_Run.ID'.format(db_key_name), ondelete='CASCADE'),
+               index=True),
+        Column("StartTime", DateTime),
+        Column("Value", Float),
+        Column("Passed", Boolean))
+    Index('ix_{}_SeriesPoint_Series'.format(db_key_name),
+          points.c.MachineID, points.c.TestID, points.c.FieldID,
+          points.c.SortKey)
+    points.create()
+    return points
+
+
+def _fill_series_table(engine, db_key_name, points, metric_fields):
+    sample = introspect_table(engine, '{}_Sample'.format(db_key_name))
+    run = introspect_table(engine, '{}_Run'.format(db_key_name))
+    order = introspect_table(engine, '{}_Order'.format(db_key_name))
+
+    for field_id, field_name, status_name in metric_fields:
+        value = sample.c[field_name]
+        if status_name is not None:
+            status = sample.c[status_name]
+            passed = sqlalchemy.or_(status == PASS, status.is_(None))
+        else:
+            passed = sqlalchemy.true()
+        values = select([run.c.MachineID,
+                         sample.c.TestID,
+                         sqlalchemy.literal(field_id, Integer),
+                         run.c.OrderID,
+                         order.c.SortKey,
+                         run.c.ID,
+                         run.c.StartTime,
+                         value,
+                         passed]) \
+            .select_from(sample.join(run, sample.c.RunID == run.c.ID)
+                         .join(order, run.c.OrderID == order.c.ID)) \
+            .where(value.isnot(None))
+        with engine.begin() as trans:
+            trans.execute(points.insert().from_select(
+                ['MachineID', 'TestID', 'FieldID', 'OrderID', 'SortKey',
+                 'RunID', 'StartTime', 'Value', 'Passed'], values))
+
+
+def upgrade(engine):
+    test_suite = introspect_table(engine, 'TestSuite')
+    sample_fields = introspect_table(engine, 'TestSuiteSampleFields')
+    sample_type = introspect_table(engine, 'SampleType')
+    status_fields = sample_fields.alias('status_fields')
+
+    with engine.begin() as trans:
+        suites = list(trans.execute(select([test_suite.c.ID,
+                                            test_suite.c.DBKeyName])))
+
+    for suite_id, db_key_name in suites:
+        if not engine.has_table('{}_Sample'.format(db_key_name)):
+            continue
+        with engine.begin() as trans:
+            metric_fields = list(trans.execute(
+                select([sample_fields.c.ID, sample_fields.c.Name,
+                        status_fields.c.Name])
+                .select_from(
+                    sample_fields
+                    .join(sample_type,
+                          sample_fields.c.Type == sample_type.c.ID)
+                    .outerjoin(status_fields,
+                               sample_fields.c.status_field ==
+                               status_fields.c.ID))
+                .where(sample_fields.c.TestSuiteID == suite_id)
+                .where(sample_type.c.Name.in_(['Real', 'Integer']))))
+        points = _create_series_table(engine, db_key_name)
+        _fill_series_table(engine, db_key_name, points, metric_fields)
@@ -0,0 +1,95 @@
+"""Adds the Geomean table to each test suite, holding the geometric mean of
+each metric field of each order of a machine, and fills it from the
+SeriesPoint table.
+"""
+
+import collections
+
+import sqlalchemy
+from sqlalchemy import Column, DateTime, Float, ForeignKey, Index, Integer, \
+    MetaData, String, Table, select
+
+from lnt.server.db.migrations.util import introspect_table
+from lnt.server.reporting.analysis import calc_geomean
+
+
+def _create_geomean_table(engine, db_key_name):
+    meta = MetaData(bind=engine)
+    # Reflect the referenced tables, so the foreign keys can be resolved.
+    for suffix in ('Machine', 'Order'):
+        Table('{}_{}'.format(db_key_name, suffix), meta, autoload=True)
+    Table('TestSuiteSampleFields', meta, autoload=True)
+
+    geomeans = Table(
+        '{}_Geomean'.format(db_key_name), meta,
+        Column("ID", Integer, primary_key=True),
+        Column("MachineID", Integer,
+               ForeignKey('{}_Machine.ID'.format(db_key_name))),
+        Column("OrderID", Integer,
+               ForeignKey('{}_Order.ID'.format(db_key_name))),
+        Column("FieldID", Integer, ForeignKey('TestSuiteSampleFields.ID')),
+        Column("SortKey", String),
+        Column("StartTime", DateTime),
+        Column("Value", Float))
+    Index('ix_{}_Geomean_Series'.format(db_key_name),
+          geomeans.c.MachineID, geomeans.c.FieldID, geomeans.c.SortKey)
+    geomeans.create()
+    return geomeans
+
+
+def _fill_geomean_table(engine, db_key_name, geomeans):
+    # See TestSuiteDB.update_geomeans: take the minimum of each test, then the
+    # mean over all the tests. This is done one machine at a time.
+    points = introspect_table(engine, '{}_SeriesPoint'.format(db_key_name))
+    order = introspect_table(engine, '{}_Order'.format(db_key_name))
+
+    with engine.begin() as trans:
+        machine_ids = [m for m, in trans.execute(
+            select([points.c.MachineID]).distinct())]
+
+    for machine_id in machine_ids:
+        values = collections.defaultdict(list)
+        start_times = {}
+        sort_keys = {}
+        with engine.begin() as trans:
+            q = select([points.c.OrderID, points.c.FieldID,
+                        order.c.SortKey,
+                        sqlalchemy.func.min(points.c.Value),
+                        sqlalchemy.func.min(points.c.StartTime)]) \
+                .select_from(points.join(order,
+                                         points.c.OrderID == order.c.ID)) \
+                .where(points.c.MachineID == machine_id) \
+                .group_by(points.c.OrderID, points.c.FieldID,
+                          order.c.SortKey, points.c.TestID)
+            for order_id, field_id, sort_key, value, start_time in \
+                    trans.execute(q):
+                values[(order_id, field_id)].append(value)
+                sort_keys[order_id] = sort_key
+                start_times[order_id] = min(start_time,
+                                            start_times.get(order_id,
+                                                            start_time))
+            if values:
+                trans.execute(geomeans.insert(), [
+                    {'MachineID': machine_id,
+                     'OrderID': order_id,
+                     'FieldID': field_id,
+                     'SortKey': sort_keys[order_id],
+                     'StartTime': start_times[order_id],
+                     'Value': calc_geomean(field_values)}
+                    for (order_id, field_id), field_values in
+                    sorted(values.items())])
+
+
+def upgrade(engine):
+    test_suite = introspect_table(engine, 'TestSuite')
+
+    with engine.begin() as trans:
+        db_key_names = [name for name, in trans.execute(
+            select([test_suite.c.DBKeyName]))]
+
+    for db_key_name in db_key_names:
+        if not engine.has_table('{}_Machine'.format(db_key_name)):
+            continue
+        geomeans = _create_geomean_table(engine, db_key_name)
+        if engine.has_table('{}_SeriesPoint'.format(db_key_name)):
+            _fill_geomean_table(engine, db_key_name, geomeans)
@@ -0,0 +1,47 @@
+"""Adds a SortKey column, copied from the order, to the Run table of each test
+suite, and indexes the runs by (machine, sort key), so the runs adjacent to a
+run on its machine can be found without sorting all the orders of the machine.
+"""
+
+import sqlalchemy
+from sqlalchemy import Column, Index, String, select, update
+
+from lnt.server.db.migrations.util import introspect_table
+from lnt.server.db.util import add_column
+from lnt.util import logger
+
+
+def _backfill_sort_keys(engine, db_key_name):
+    table_name = '{}_Run'.format(db_key_name)
+    add_column(engine, table_name, Column("SortKey", String))
+
+    run_table = introspect_table(engine, table_name)
+    order_table = introspect_table(engine, '{}_Order'.format(db_key_name))
+    order_sort_key = select([order_table.c.SortKey]) \
+        .where(order_table.c.ID == run_table.c.OrderID) \
+        .as_scalar()
+    with engine.begin() as trans:
+        trans.execute(update(run_table).values(SortKey=order_sort_key))
+
+    sort_key_index = Index('ix_{}_MachineID_SortKey'.format(table_name),
+                           run_table.c.MachineID, run_table.c.SortKey,
+                           run_table.c.OrderID)
+    try:
+        sort_key_index.create(engine)
+    except (sqlalchemy.exc.OperationalError,
+            sqlalchemy.exc.ProgrammingError) as e:
+        logger.warning("Skipping index creation on {}, because of {}"
+                       .format(table_name, e))
+
+
+def upgrade(engine):
+    test_suite = introspect_table(engine, 'TestSuite')
+
+    with engine.begin() as trans:
+        db_key_names = [name for name, in trans.execute(
+            select([test_suite.c.DBKeyName]))]
+
+    for db_key_name in db_key_names:
+        if not engine.has_table('{}_Run'.format(db_key_name)):
+            continue
+        _backfill_sort_keys(engine, db_key_name)
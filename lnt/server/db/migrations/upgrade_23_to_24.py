@@ -0,0 +1,43 @@
+"""Adds the DailyReportResult table to each test suite, holding the results of
+the machines in the daily reports of closed ranges of days.
+
+The table is left empty: it is filled as the daily reports are built.
+"""
+
+from sqlalchemy import Binary, Column, DateTime, ForeignKey, Index, Integer, \
+    MetaData, String, Table, select
+
+from lnt.server.db.migrations.util import introspect_table
+
+
+def _create_daily_report_result_table(engine, db_key_name):
+    meta = MetaData(bind=engine)
+    # Reflect the referenced table, so the foreign key can be resolved.
+    Table('{}_Machine'.format(db_key_name), meta, autoload=True)
+
+    results = Table(
+        '{}_DailyReportResult'.format(db_key_name), meta,
+        Column("ID", Integer, primary_key=True),
+        Column("MachineID", Integer,
+               ForeignKey('{}_Machine.ID'.format(db_key_name))),
+        Column("StartTime", DateTime),
+        Column("EndTime", DateTime),
+        Column("Fingerprint", String(64)),
+        Column("Data", Binary))
+    Index('ix_{}_DailyReportResult_Range'.format(db_key_name),
+          results.c.MachineID, results.c.StartTime, results.c.EndTime,
+          unique=True)
+    results.create()
+
+
+def upgrade(engine):
+    test_suite = introspect_table(engine, 'TestSuite')
+
+    with engine.begin() as trans:
+        db_key_names = [name for name, in trans.execute(
+            select([test_suite.c.DBKeyName]))]
+
+    for db_key_name in db_key_names:
+        if not engine.has_table('{}_Machine'.format(db_key_name)):
+            continue
+        _create_daily_report_result_table(engine, db_key_name)
@@ -0,0 +1,40 @@
+"""Adds the RunComparison table to each test suite, holding the results of
+comparing the runs to their previous run and their baseline.
+
+The table is left empty: the comparisons are stored as the runs are imported,
+and the runs imported before are compared when their pages are shown.
+"""
+
+from sqlalchemy import Binary, Column, ForeignKey, Index, Integer, MetaData, \
+    Table, select
+
+from lnt.server.db.migrations.util import introspect_table
+
+
+def _create_run_comparison_table(engine, db_key_name):
+    meta = MetaData(bind=engine)
+    # Reflect the referenced table, so the foreign key can be resolved.
+    Table('{}_Run'.format(db_key_name), meta, autoload=True)
+
+    comparisons = Table(
+        '{}_RunComparison'.format(db_key_name), meta,
+        Column("ID", Integer, primary_key=True),
+        Column("RunID", Integer, ForeignKey('{}_Run.ID'.format(db_key_name))),
+        Column("CompareToID", Integer, index=True),
+        Column("Data", Binary))
+    Index('ix_{}_RunComparison_Run'.format(db_key_name),
+          comparisons.c.RunID, comparisons.c.CompareToID)
+    comparisons.create()
+
+
+def upgrade(engine):
+    test_suite = introspect_table(engine, 'TestSuite')
+
+    with engine.begin() as trans:
+        db_key_names = [name for name, in trans.execute(
+            select([test_suite.c.DBKeyName]))]
+
+    for db_key_name in db_key_names:
+        if not engine.has_table('{}_Run'.format(db_key_name)):
+            continue
+        _create_run_comparison_table(engine, db_key_name)
@@ -4,7 +4,7 @@ import re
 from collections import namedtuple
 from lnt.server.reporting.analysis import RunInfo
 from lnt.server.ui.util import guess_test_short_name as shortname
-from lnt.testing.util.commands import timed
+from lnt.server.db.util import timed
 from lnt.util import logger
 
 
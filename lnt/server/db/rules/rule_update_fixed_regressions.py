@@ -8,7 +8,7 @@ from typing import Dict  # noqa: flake8 does not detect use in comments
 from lnt.server.db.regression import RegressionState
 from lnt.server.db.regression import get_cr_for_field_change, get_ris
 from lnt.server.db.testsuitedb import TestSuiteDB
-from lnt.testing.util.commands import timed
+from lnt.server.db.util import timed
 from lnt.util import logger
 from lnt.server.reporting.analysis import MIN_PERCENTAGE_CHANGE
 
@@ -5,7 +5,9 @@ These are a bit magical because the models themselves are driven by the test
 suite metadata, so we only create the classes at runtime.
 """
 
+import collections
 import datetime
+import io
 import json
 import os
 import itertools
@@ -14,6 +16,7 @@ import aniso8601
 import sqlalchemy
 import flask
 from sqlalchemy import Float, String, Integer, Column, ForeignKey, Binary, DateTime
+from sqlalchemy import Boolean
 from sqlalchemy.orm import relation
 from sqlalchemy.orm.exc import ObjectDeletedError
 from lnt.util import logger
@@ -21,7 +24,9 @@ from lnt.util import logger
 from . import testsuite
 import lnt.testing.profile.profile as profile
 import lnt
-from lnt.server.ui.util import convert_revision
+import lnt.testing
+from lnt.server.reporting.analysis import calc_geomean
+from lnt.server.ui.util import convert_revision, revision_sort_key
 
 
 def _dict_update_abort_on_duplicates(base_dict, to_merge):
@@ -32,6 +37,16 @@ def _dict_update_abort_on_duplicates(base_dict, to_merge):
         base_dict[key] = value
 
 
+def _copy_text(value):
+    '''Encode a value for PostgreSQL's COPY text format.'''
+    if value is None:
+        return '\\N'
+    if isinstance(value, float):
+        return repr(value)
+    return str(value).replace('\\', '\\\\').replace('\t', '\\t') \
+        .replace('\n', '\\n').replace('\r', '\\r')
+
+
 class MachineInfoChanged(ValueError):
     pass
 
@@ -47,6 +62,14 @@ class TestSuiteDB(object):
     through the model classes constructed by this wrapper object.
     """
 
+    # The maximum number of values in a single IN clause.
+    QUERY_CHUNK_SIZE = 500
+
+    # The number of tests of a submission imported at once. The samples of a
+    # batch are written out before the next one is read, which bounds the
+    # memory used by large submissions.
+    IMPORT_BATCH_SIZE = 1000
+
     def __init__(self, v4db, name, test_suite):
         self.v4db = v4db
         self.name = name
@@ -224,6 +247,12 @@ class TestSuiteDB(object):
             join = 'Order.previous_order_id==Order.id'
             next_order = relation("Order", backref=backref, primaryjoin=join,
                                   uselist=False)
+
+            # A string which sorts the same way as the orders compare (see
+            # lnt.server.ui.util.revision_sort_key). This allows finding the
+            # neighbours of a new order in the total ordering with an index
+            # lookup.
+            sort_key = Column("SortKey", String, index=True)
             order_name_cache = {}
 
             # Dynamically create fields for all of the test suite defined order
@@ -271,6 +300,14 @@ class TestSuiteDB(object):
             def name(self):
                 return self.as_ordered_string()
 
+            def compute_sort_key(self):
+                """Return the sort key for the current field values, or None
+                if some of the order fields are not set."""
+                values = [self.get_field(item) for item in self.fields]
+                if any(value is None for value in values):
+                    return None
+                return revision_sort_key(values, cache=Order.order_name_cache)
+
             def _get_comparison_discriminant(self, b):
                 """Return a representative pair of converted revision from self
                 and b. Order of the element on this pair is the same as the
@@ -353,6 +390,10 @@ class TestSuiteDB(object):
             start_time = Column("StartTime", DateTime)
             end_time = Column("EndTime", DateTime)
             simple_run_id = Column("SimpleRunID", Integer)
+            # The sort key of the order, see Order.sort_key. Together with the
+            # machine, this indexes the runs of a machine in order. It is
+            # updated along with the order's.
+            sort_key = Column("SortKey", String)
 
             # The parameters blob is used to store any additional information
             # reported by the run but not promoted into the machine record.
@@ -419,6 +460,17 @@ class TestSuiteDB(object):
                 _dict_update_abort_on_duplicates(result, self.parameters)
                 return result
 
+        # Keep the persisted sort key in sync with the order fields, no matter
+        # how the order was constructed.
+        def _update_order_sort_key(mapper, connection, order):
+            order.sort_key = order.compute_sort_key()
+        sqlalchemy.event.listen(Order, 'before_insert', _update_order_sort_key)
+        sqlalchemy.event.listen(Order, 'before_update', _update_order_sort_key)
+
+        def _update_run_sort_key(mapper, connection, run):
+            run.sort_key = run.order.sort_key
+        sqlalchemy.event.listen(Run, 'before_insert', _update_run_sort_key)
+
         Machine.runs = relation(Run, back_populates='machine',
                                 cascade="all, delete-orphan")
         Order.runs = relation(Run, back_populates='order',
@@ -596,6 +648,146 @@ class TestSuiteDB(object):
         Run.samples = relation(Sample, back_populates='run',
                                cascade="all, delete-orphan")
 
+        class SeriesPoint(self.base):
+            """A copy of one sample value of a metric field, along with the
+            order and run it belongs to. Points are added when a run is
+            imported, so the line of a graph (machine, test, field) can be
+            read in order with one indexed range scan instead of joining the
+            whole sample history."""
+
+            __tablename__ = db_key_name + '_SeriesPoint'
+            id = Column("ID", Integer, primary_key=True)
+            machine_id = Column("MachineID", Integer, ForeignKey(Machine.id))
+            test_id = Column("TestID", Integer, ForeignKey(Test.id))
+            field_id = Column("FieldID", Integer,
+                              ForeignKey(testsuite.SampleField.id))
+            order_id = Column("OrderID", Integer, ForeignKey(Order.id))
+            # The sort key of the order, see Order.sort_key. It is updated
+            # along with the order's.
+            sort_key = Column("SortKey", String)
+            # The points are deleted by the database along with their run.
+            run_id = Column("RunID", Integer,
+                            ForeignKey(Run.id, ondelete='CASCADE'), index=True)
+            start_time = Column("StartTime", DateTime)
+            value = Column("Value", Float)
+            # Whether the status field of the value (if any) is PASS or unset.
+            passed = Column("Passed", Boolean)
+
+            order = relation(Order)
+            run = relation(Run, back_populates='series_points')
+
+            def __repr__(self):
+                return '%s_%s%r' % (db_key_name, self.__class__.__name__,
+                                    (self.machine_id, self.test_id,
+                                     self.field_id, self.run_id, self.value))
+
+        Run.series_points = relation(SeriesPoint, back_populates='run',
+                                     cascade="all, delete-orphan",
+                                     passive_deletes=True)
+
+        def _delete_run_series_points(mapper, connection, run):
+            # SQLite only enforces the foreign keys (and their ON DELETE
+            # CASCADE) when asked to, so delete the points of the run here.
+            if connection.dialect.name == 'sqlite':
+                connection.execute(SeriesPoint.__table__.delete()
+                                   .where(SeriesPoint.run_id == run.id))
+        sqlalchemy.event.listen(Run, 'before_delete',
+                                _delete_run_series_points)
+
+        class Geomean(self.base):
+            """The geometric mean, over all the tests of a machine, of the
+            minimum value of a metric field for one order. These are updated
+            whenever the runs of the order change, for the mean trend line of
+            the graphs."""
+
+            __tablename__ = db_key_name + '_Geomean'
+            id = Column("ID", Integer, primary_key=True)
+            machine_id = Column("MachineID", Integer, ForeignKey(Machine.id))
+            order_id = Column("OrderID", Integer, ForeignKey(Order.id))
+            field_id = Column("FieldID", Integer,
+                              ForeignKey(testsuite.SampleField.id))
+            # The sort key of the order, see Order.sort_key. It is updated
+            # along with the order's.
+            sort_key = Column("SortKey", String)
+            # The earliest start time of the runs of the order.
+            start_time = Column("StartTime", DateTime)
+            value = Column("Value", Float)
+
+            machine = relation(Machine)
+            order = relation(Order)
+
+            def __repr__(self):
+                return '%s_%s%r' % (db_key_name, self.__class__.__name__,
+                                    (self.machine_id, self.order_id,
+                                     self.field_id, self.value))
+
+        Machine.geomeans = relation(Geomean, back_populates='machine',
+                                    cascade="all, delete-orphan")
+
+        # Update the copies of the sort key of an order when it changes.
+        def _update_copied_sort_keys(mapper, connection, order):
+            if sqlalchemy.inspect(order).attrs.sort_key.history.has_changes():
+                for table in (Run, SeriesPoint, Geomean):
+                    connection.execute(table.__table__.update()
+                                       .where(table.order_id == order.id)
+                                       .values(SortKey=order.sort_key))
+        sqlalchemy.event.listen(Order, 'after_update',
+                                _update_copied_sort_keys)
+
+        class DailyReportResult(self.base):
+            """The results of a machine in the daily report of a closed range
+            of days, see lnt.server.reporting.dailyreport. There is one per
+            machine and range. These are removed whenever a run is imported in
+            the range, and ignored when their fingerprint no longer matches
+            the runs and tests of the range."""
+
+            __tablename__ = db_key_name + '_DailyReportResult'
+            id = Column("ID", Integer, primary_key=True)
+            machine_id = Column("MachineID", Integer, ForeignKey(Machine.id))
+            # The range of the start times of the runs of the report.
+            start_time = Column("StartTime", DateTime)
+            end_time = Column("EndTime", DateTime)
+            fingerprint = Column("Fingerprint", String(64))
+            # The JSON encoded results.
+            data = Column("Data", Binary)
+
+            machine = relation(Machine)
+
+            def __repr__(self):
+                return '%s_%s%r' % (db_key_name, self.__class__.__name__,
+                                    (self.machine_id, self.start_time,
+                                     self.end_time))
+
+        Machine.daily_report_results = relation(
+            DailyReportResult, back_populates='machine',
+            cascade="all, delete-orphan")
+
+        class RunComparison(self.base):
+            """The results of comparing a run to another run (or to no run)
+            with the default aggregation function and confidence level, see
+            lnt.server.reporting.runs.store_run_comparisons. These are stored
+            when a run is imported, for its previous run and its baseline, so
+            the run pages do not have to compare all the samples again."""
+
+            __tablename__ = db_key_name + '_RunComparison'
+            id = Column("ID", Integer, primary_key=True)
+            run_id = Column("RunID", Integer, ForeignKey(Run.id))
+            # The run compared to. This is not a foreign key, so that runs can
+            # be deleted without looking for the comparisons to them, which
+            # are only used when the ID matches the run compared to.
+            compare_to_id = Column("CompareToID", Integer, index=True)
+            # The JSON encoded results.
+            data = Column("Data", Binary)
+
+            run = relation(Run)
+
+            def __repr__(self):
+                return '%s_%s%r' % (db_key_name, self.__class__.__name__,
+                                    (self.run_id, self.compare_to_id))
+
+        Run.comparisons = relation(RunComparison, back_populates='run',
+                                   cascade="all, delete-orphan")
+
         class FieldChange(self.base, ParameterizedMixin):
             """FieldChange represents a change in between the values
             of the same field belonging to two samples from consecutive runs.
@@ -761,6 +953,10 @@ class TestSuiteDB(object):
         self.Test = Test
         self.Profile = Profile
         self.Sample = Sample
+        self.SeriesPoint = SeriesPoint
+        self.Geomean = Geomean
+        self.DailyReportResult = DailyReportResult
+        self.RunComparison = RunComparison
         self.Order = Order
         self.FieldChange = FieldChange
         self.Regression = Regression
@@ -771,6 +967,21 @@ class TestSuiteDB(object):
         # Create the compound index we cannot declare inline.
         sqlalchemy.schema.Index("ix_%s_Sample_RunID_TestID" % db_key_name,
                                 Sample.run_id, Sample.test_id)
+        sqlalchemy.schema.Index("ix_%s_Run_MachineID_SortKey" % db_key_name,
+                                Run.machine_id, Run.sort_key, Run.order_id)
+        sqlalchemy.schema.Index("ix_%s_SeriesPoint_Series" % db_key_name,
+                                SeriesPoint.machine_id, SeriesPoint.test_id,
+                                SeriesPoint.field_id, SeriesPoint.sort_key)
+        sqlalchemy.schema.Index("ix_%s_Geomean_Series" % db_key_name,
+                                Geomean.machine_id, Geomean.field_id,
+                                Geomean.sort_key)
+        sqlalchemy.schema.Index("ix_%s_DailyReportResult_Range" % db_key_name,
+                                DailyReportResult.machine_id,
+                                DailyReportResult.start_time,
+                                DailyReportResult.end_time, unique=True)
+        sqlalchemy.schema.Index("ix_%s_RunComparison_Run" % db_key_name,
+                                RunComparison.run_id,
+                                RunComparison.compare_to_id)
 
     def create_tables(self, engine):
         self.base.metadata.create_all(engine)
@@ -919,34 +1130,37 @@ class TestSuiteDB(object):
             return existing
 
         # If not, then we need to insert this order into the total ordering
-        # linked list.
+        # linked list. The neighbours are found through the indexed sort key,
+        # which avoids loading and sorting all the existing orders.
+        order.sort_key = order.compute_sort_key()
+        previous_order = session.query(self.Order) \
+            .filter(self.Order.sort_key <= order.sort_key) \
+            .order_by(self.Order.sort_key.desc(), self.Order.id.desc()) \
+            .first()
+        next_order = session.query(self.Order) \
+            .filter(self.Order.sort_key > order.sort_key) \
+            .order_by(self.Order.sort_key.asc(), self.Order.id.asc()) \
+            .first()
 
         # Add the new order and commit, to assign an ID.
         session.add(order)
         session.commit()
 
-        # Load all the orders and sort them to form the total ordering.
-        orders = sorted(session.query(self.Order))
-
-        # Find the order we just added.
-        index = orders.index(order)
-
         # Insert this order into the linked list which forms the total
         # ordering.
-        if index > 0:
-            previous_order = orders[index - 1]
+        if previous_order is not None:
             previous_order.next_order_id = order.id
             order.previous_order_id = previous_order.id
-        if index + 1 < len(orders):
-            next_order = orders[index + 1]
+        if next_order is not None:
             next_order.previous_order_id = order.id
             order.next_order_id = next_order.id
 
         return order
 
-    def _getOrCreateRun(self, session, run_data, machine, merge):
+    def _getOrCreateRun(self, session, run_data, machine, merge,
+                        counts=None):
         """
-        _getOrCreateRun(session, run_data, machine, merge) -> Run, bool
+        _getOrCreateRun(session, run_data, machine, merge, [counts]) -> Run
 
         Add a new Run record from the given data (as recorded by the test
         interchange format).
@@ -957,8 +1171,8 @@ class TestSuiteDB(object):
         - 'replace': Remove the existing submission(s), then add the new one.
         - 'append': Add new submission.
 
-        The boolean result indicates whether the returned record was
-        constructed or not.
+        If a counts dictionary is given, its 'added_runs' entry is set to the
+        number of runs added, less the number of runs replaced.
         """
 
         # Extra the run parameters that define the order.
@@ -976,6 +1190,7 @@ class TestSuiteDB(object):
         # Find the order record.
         order = self._getOrCreateOrder(session, run_parameters)
         new_id = None
+        num_replaced = 0
 
         if merge != 'append':
             existing_runs = session.query(self.Run) \
@@ -994,7 +1209,10 @@ class TestSuiteDB(object):
 
                         # Keep the latest ID so the URL is still valid on replace
                         new_id = previous_run.id
+                        num_replaced += 1
 
+                        self.invalidate_daily_report_results(
+                            session, machine.id, previous_run.start_time)
                         session.delete(previous_run)
                 else:
                     raise ValueError('Invalid Run mergeStrategy %r' % merge)
@@ -1024,32 +1242,70 @@ class TestSuiteDB(object):
         # Any remaining parameters are saved as a JSON encoded array.
         run.parameters = run_parameters
         session.add(run)
+        if counts is not None:
+            counts['added_runs'] = 1 - num_replaced
         return run
 
-    def _importSampleValues(self, session, tests_data, run, config):
+    def _importSampleValues(self, session, tests_data, run, config,
+                            counts):
         # Load a map of all the tests, which we will extend when we find tests
         # that need to be added.
         test_cache = dict((test.name, test)
                           for test in session.query(self.Test))
 
-        field_dict = dict([(f.name, f) for f in self.sample_fields])
-        all_samples_to_add = []
-
-        def is_profile_only(td):
-            return len(td) == 2 and 'profile' in td
+        samples_to_add = []
+        profile_tests = []
+        num_tests = 0
 
-        for test_data in tests_data:
-            if is_profile_only(test_data):
-                # Ignore for now profile data without other metrics
-                continue
-
-            name = test_data['name']
+        for name, test_samples in self._parseTestSamples(tests_data, config,
+                                                         profile_tests):
             test = test_cache.get(name)
             if test is None:
-                test = self.Test(test_data['name'])
+                test = self.Test(name)
                 test_cache[name] = test
                 session.add(test)
+                counts['added_tests'] += 1
 
+            for values in test_samples:
+                sample = self.Sample(run, test)
+                for field, value in values.items():
+                    if field == 'profile':
+                        sample.profile = value
+                    else:
+                        sample.set_field(field, value)
+                samples_to_add.append(sample)
+                counts['added_samples'] += 1
+
+            num_tests += 1
+            if num_tests % self.IMPORT_BATCH_SIZE == 0:
+                # Write out this batch, and drop the run's references to its
+                # samples so they can be freed.
+                session.add_all(samples_to_add)
+                session.flush()
+                session.expire(run, ['samples'])
+                samples_to_add = []
+
+        session.add_all(samples_to_add)
+        self._addProfileOnlyTests(session, profile_tests, run, config)
+
+    def _parseTestSamples(self, tests_data, config, profile_tests):
+        """
+        _parseTestSamples(tests_data, config, profile_tests)
+            -> iter((name, [sample]))
+
+        Parse the tests of a submission into their name and samples, as
+        dictionaries mapping sample fields (or 'profile') to their values. The
+        tests submitted with only a profile are appended to profile_tests, to
+        be attached by _addProfileOnlyTests once all the samples are added.
+        """
+        field_dict = dict([(f.name, f) for f in self.sample_fields])
+
+        for test_data in tests_data:
+            if len(test_data) == 2 and 'profile' in test_data:
+                profile_tests.append(test_data)
+                continue
+
+            name = test_data['name']
             samples = []
             for key, values in test_data.items():
                 if key == 'name' or key == "id" or key.endswith("_id"):
@@ -1062,69 +1318,332 @@ class TestSuiteDB(object):
                 if not isinstance(values, list):
                     values = [values]
                 while len(samples) < len(values):
-                    sample = self.Sample(run, test)
-                    samples.append(sample)
-                    all_samples_to_add.append(sample)
+                    samples.append(dict())
                 for sample, value in zip(samples, values):
                     if key == 'profile':
-                        sample.profile = self.Profile(value, config, name)
+                        sample['profile'] = self.Profile(value, config, name)
                     else:
-                        sample.set_field(field, value)
+                        sample[field] = value
+            yield name, samples
 
-        for test_data in tests_data:
-            if not is_profile_only(test_data):
-                continue
+    def _addProfileOnlyTests(self, session, profile_tests, run, config):
+        """
+        _addProfileOnlyTests(session, profile_tests, run, config) -> None
+
+        Attach the profiles of the tests submitted with only a profile to the
+        samples of the run for that test, or for its '<name>.test:' subtests.
+        """
+        for test_data in profile_tests:
+            session.flush()
             name = test_data['name']
-            test = test_cache.get(name)
-            tests = [
-                test_cache[test_name]
-                for test_name in test_cache
-                if test_name.startswith(name + '.test:')
-            ]
-            if test is not None:
-                tests.append(test)
+            samples_by_test = collections.OrderedDict()
+            for sample, test_name in session.query(self.Sample,
+                                                   self.Test.name) \
+                    .join(self.Test) \
+                    .filter(self.Sample.run_id == run.id) \
+                    .filter(sqlalchemy.or_(
+                        self.Test.name == name,
+                        self.Test.name.startswith(name + '.test:',
+                                                  autoescape=True))) \
+                    .order_by(self.Sample.id):
+                samples_by_test.setdefault(test_name, []).append(sample)
 
             value = test_data['profile']
             new_profile = self.Profile(value, config, name)
             count = 0
-            for test in tests:
+            for test_name, test_samples in samples_by_test.items():
                 sample_exist = False
-                for sample in all_samples_to_add:
-                    if sample.test == test:
-                        if sample.profile is None:
-                            sample.profile = new_profile
-                            count += 1
-                            sample_exist = True
-                        else:
-                            logger.warning('Test %s already contains the profile data. '
-                                           'Profile %s was ignored.', test.name, name)
+                for sample in test_samples:
+                    if sample.profile_id is None:
+                        sample.profile = new_profile
+                        count += 1
+                        sample_exist = True
+                    else:
+                        logger.warning('Test %s already contains the profile data. '
+                                       'Profile %s was ignored.', test_name, name)
                 if not sample_exist:
                     logger.warning('The test %s is invalid. It contains the profile, '
-                                   'but no any samples. Consider removing it.', test.name)
+                                   'but no any samples. Consider removing it.', test_name)
             if count == 0:
                 logger.warning('Cannot find test(s) for the profile %s', name)
             else:
                 logger.info('The profile %s was added to %d test(s).', name, count)
 
-        session.add_all(all_samples_to_add)
+    def _getOrCreateTests(self, session, names, counts):
+        """
+        _getOrCreateTests(session, names, counts) -> {name: test_id}
+
+        Look up the IDs of the tests with the given names. Missing tests are
+        inserted with a single statement, and counted in the 'added_tests'
+        entry of counts.
+        """
+        test_ids = dict()
+
+        def lookup(names):
+            names = list(names)
+            for i in range(0, len(names), self.QUERY_CHUNK_SIZE):
+                chunk = names[i:i + self.QUERY_CHUNK_SIZE]
+                test_ids.update(session.query(self.Test.name, self.Test.id)
+                                .filter(self.Test.name.in_(chunk)))
+
+        names = set(names)
+        lookup(names)
+        missing = sorted(names.difference(test_ids))
+        if missing:
+            session.execute(self.Test.__table__.insert(),
+                            [{'Name': name} for name in missing])
+            counts['added_tests'] += len(missing)
+            lookup(missing)
+        return test_ids
+
+    def _bulkInsert(self, session, table, columns, rows):
+        """
+        Insert rows (tuples of values for the given column names) into the
+        table without going through the ORM. PostgreSQL uses COPY FROM STDIN,
+        other databases a single executemany INSERT.
+        """
+        if not rows:
+            return
+        connection = session.connection()
+        if connection.dialect.name == 'postgresql':
+            data = io.StringIO()
+            for row in rows:
+                data.write('\t'.join(_copy_text(value) for value in row))
+                data.write('\n')
+            data.seek(0)
+            quote = connection.dialect.identifier_preparer.quote
+            statement = 'COPY %s (%s) FROM STDIN' % (
+                quote(table.name), ', '.join(quote(c) for c in columns))
+            cursor = connection.connection.cursor()
+            try:
+                cursor.copy_expert(statement, data)
+            finally:
+                cursor.close()
+        else:
+            connection.execute(table.insert(),
+                               [dict(zip(columns, row)) for row in rows])
+
+    def _importSampleValuesBulk(self, session, tests_data, run, config,
+                                counts):
+        """
+        Variant of _importSampleValues which does not construct a Sample object
+        per sample. Only the tests mentioned in the submission are looked up,
+        and the samples are inserted with a bulk statement per batch of tests.
+        """
+        # The samples as dictionaries of field values, grouped by test name.
+        samples_by_test = collections.OrderedDict()
+        profile_tests = []
+        num_tests = 0
+
+        for name, test_samples in self._parseTestSamples(tests_data, config,
+                                                         profile_tests):
+            samples_by_test.setdefault(name, []).extend(test_samples)
+
+            num_tests += 1
+            if num_tests % self.IMPORT_BATCH_SIZE == 0:
+                self._insertSamplesBulk(session, samples_by_test, run,
+                                        counts)
+                samples_by_test = collections.OrderedDict()
+
+        self._insertSamplesBulk(session, samples_by_test, run, counts)
+        self._addProfileOnlyTests(session, profile_tests, run, config)
+
+    def _insertSamplesBulk(self, session, samples_by_test, run, counts):
+        """
+        Insert the samples (dictionaries of field values, grouped by test name)
+        of the run with a single bulk statement.
+        """
+        # Flush the run and the profiles, to assign their IDs.
+        session.add_all(sample['profile']
+                        for test_samples in samples_by_test.values()
+                        for sample in test_samples
+                        if sample.get('profile') is not None)
+        session.flush()
+
+        test_ids = self._getOrCreateTests(session, samples_by_test, counts)
+        columns = ['RunID', 'TestID', 'ProfileID'] + \
+            [field.column.name for field in self.sample_fields]
+        rows = []
+        for name, test_samples in samples_by_test.items():
+            test_id = test_ids[name]
+            for sample in test_samples:
+                profile = sample.get('profile')
+                row = [run.id, test_id,
+                       profile.id if profile is not None else None]
+                row.extend(sample.get(field) for field in self.sample_fields)
+                rows.append(row)
+        self._bulkInsert(session, self.Sample.__table__, columns, rows)
+        counts['added_samples'] += len(rows)
 
     def importDataFromDict(self, session, data, config, select_machine,
-                           merge_run):
+                           merge_run, counts=None):
         """
-        importDataFromDict(session, data, config, select_machine, merge_run)
+        importDataFromDict(session, data, config, select_machine, merge_run,
+                           [counts])
             -> Run  (or throws ValueError exception)
 
         Import a new run from the provided test interchange data, and return
         the constructed Run record. May throw ValueError exceptions in cases
         like mismatching machine data or duplicate run submission with
         merge_run == 'reject'.
+
+        If a counts dictionary is given, the numbers of machines, runs and
+        tests added by the import, and of samples of the new run, are stored
+        in its 'added_machines', 'added_runs', 'added_tests' and
+        'added_samples' entries. The runs replaced by the new one are counted
+        negatively.
         """
+        if counts is None:
+            counts = dict()
+        counts.update(added_machines=0, added_runs=0, added_tests=0,
+                      added_samples=0)
         machine = self._getOrCreateMachine(session, data['machine'],
                                            select_machine)
-        run = self._getOrCreateRun(session, data['run'], machine, merge_run)
-        self._importSampleValues(session, data['tests'], run, config)
+        if machine.id is None:
+            counts['added_machines'] = 1
+        run = self._getOrCreateRun(session, data['run'], machine, merge_run,
+                                   counts)
+        if config is not None and config.bulk_import:
+            self._importSampleValuesBulk(session, data['tests'], run, config,
+                                         counts)
+        else:
+            self._importSampleValues(session, data['tests'], run, config,
+                                     counts)
+        self._addSeriesPoints(session, run)
+        self.update_geomeans(session, run.machine_id, [run.order_id])
+        self.invalidate_daily_report_results(session, run.machine_id,
+                                             run.start_time)
+        self.invalidate_run_comparisons(session, run.id)
         return run
 
+    def _addSeriesPoints(self, session, run):
+        """Copy the metric values of the samples of a newly imported run to
+        the SeriesPoint table, with one INSERT ... SELECT per field."""
+        session.flush()
+        points = self.SeriesPoint.__table__
+
+        def literal(value, column):
+            return sqlalchemy.literal(value, points.c[column].type)
+
+        for field in self.Sample.get_metric_fields():
+            if field.status_field is not None:
+                status = field.status_field.column
+                passed = sqlalchemy.or_(status == lnt.testing.PASS,
+                                        status.is_(None))
+            else:
+                passed = sqlalchemy.true()
+            values = sqlalchemy.select([
+                literal(run.machine_id, 'MachineID'),
+                self.Sample.test_id,
+                literal(field.id, 'FieldID'),
+                literal(run.order_id, 'OrderID'),
+                literal(run.order.sort_key, 'SortKey'),
+                literal(run.id, 'RunID'),
+                literal(run.start_time, 'StartTime'),
+                field.column,
+                passed]) \
+                .where(self.Sample.run_id == run.id) \
+                .where(field.column.isnot(None))
+            session.execute(points.insert().from_select(
+                ['MachineID', 'TestID', 'FieldID', 'OrderID', 'SortKey',
+                 'RunID', 'StartTime', 'Value', 'Passed'], values))
+
+    def update_geomeans(self, session, machine_id, order_ids):
+        """
+        update_geomeans(session, machine_id, order_ids) -> None
+
+        Recompute the Geomean records of the given orders of a machine from
+        the SeriesPoint table. This must be called whenever runs of these
+        orders are added or removed.
+        """
+        order_ids = list(order_ids)
+        session.flush()
+        points = self.SeriesPoint
+        for i in range(0, len(order_ids), self.QUERY_CHUNK_SIZE):
+            chunk = order_ids[i:i + self.QUERY_CHUNK_SIZE]
+            session.query(self.Geomean) \
+                .filter(self.Geomean.machine_id == machine_id) \
+                .filter(self.Geomean.order_id.in_(chunk)) \
+                .delete(synchronize_session=False)
+
+            # Take the minimum of each test, then the mean over all the tests.
+            values = collections.defaultdict(list)
+            start_times = {}
+            q = session.query(points.order_id, points.field_id,
+                              sqlalchemy.func.min(points.value),
+                              sqlalchemy.func.min(points.start_time)) \
+                .filter(points.machine_id == machine_id) \
+                .filter(points.order_id.in_(chunk)) \
+                .group_by(points.order_id, points.field_id, points.test_id)
+            for order_id, field_id, value, start_time in q:
+                values[(order_id, field_id)].append(value)
+                start_times[order_id] = min(start_time,
+                                            start_times.get(order_id,
+                                                            start_time))
+            if not values:
+                continue
+            sort_keys = dict(session.query(self.Order.id, self.Order.sort_key)
+                             .filter(self.Order.id.in_(start_times)))
+            session.execute(self.Geomean.__table__.insert(), [
+                {'MachineID': machine_id,
+                 'OrderID': order_id,
+                 'FieldID': field_id,
+                 'SortKey': sort_keys[order_id],
+                 'StartTime': start_times[order_id],
+                 'Value': calc_geomean(field_values)}
+                for (order_id, field_id), field_values in
+                sorted(values.items())])
+
+    def invalidate_daily_report_results(self, session, machine_id,
+                                        start_time):
+        """
+        invalidate_daily_report_results(session, machine_id, start_time)
+            -> None
+
+        Remove the stored daily report results of a machine which cover runs
+        started at the given time. This must be called whenever a run is
+        added, or replaced by one with the same ID.
+        """
+        session.query(self.DailyReportResult) \
+            .filter(self.DailyReportResult.machine_id == machine_id) \
+            .filter(self.DailyReportResult.start_time < start_time) \
+            .filter(self.DailyReportResult.end_time >= start_time) \
+            .delete(synchronize_session=False)
+
+    def invalidate_run_comparisons(self, session, run_id):
+        """
+        invalidate_run_comparisons(session, run_id) -> None
+
+        Remove the stored comparisons of other runs to the given run. This
+        must be called whenever a run is added, as it may have the ID of a run
+        which was replaced or deleted.
+        """
+        session.query(self.RunComparison) \
+            .filter(self.RunComparison.compare_to_id == run_id) \
+            .delete(synchronize_session=False)
+
+    def rebuild_geomeans(self, session, machine_ids=None):
+        """
+        rebuild_geomeans(session, machine_ids=None) -> int
+
+        Recompute the Geomean records of all the orders of the given machines
+        (default: all machines), for instance to fill the table of an existing
+        database. Returns the number of orders processed.
+        """
+        if machine_ids is None:
+            machine_ids = [m for m, in session.query(self.Machine.id)]
+        count = 0
+        for machine_id in machine_ids:
+            session.query(self.Geomean) \
+                .filter(self.Geomean.machine_id == machine_id) \
+                .delete(synchronize_session=False)
+            order_ids = [o for o, in session.query(self.Run.order_id)
+                         .filter(self.Run.machine_id == machine_id)
+                         .distinct()]
+            self.update_geomeans(session, machine_id, order_ids)
+            count += len(order_ids)
+        return count
+
     # Simple query support (mostly used by templates)
 
     def machines(self, session, name=None):
@@ -1161,65 +1680,47 @@ class TestSuiteDB(object):
         if N == 0:
             return []
 
-        # The obvious algorithm here is to step through the run orders in the
-        # appropriate direction and yield any runs on the same machine which
-        # were reported at that order.
-        #
-        # However, this has one large problem. In some cases, the gap between
-        # orders reported on that machine may be quite high. This will be
-        # particularly true when a machine has stopped reporting for a while,
-        # for example, as there may be large gap between the largest reported
-        # order and the last order the machine reported at.
-        #
-        # In such cases, we could end up executing a large number of individual
-        # SA object materializations in traversing the order list, which is
-        # very bad.
-        #
-        # We currently solve this by instead finding all the orders reported on
-        # this machine, ordering those programatically, and then iterating over
-        # that. This performs worse (O(N) instead of O(1)) than the obvious
-        # algorithm in the common case but more uniform and significantly
-        # better in the worst cast, and I prefer that response times be
-        # uniform. In practice, this appears to perform fine even for quite
-        # large (~1GB, ~20k runs) databases.
-
-        # Find all the orders on this machine, then sort them.
-        #
-        # FIXME: Scalability! However, pretty fast in practice, see elaborate
-        # explanation above.
-        all_machine_orders = sorted(
-            session.query(self.Order)
-            .join(self.Run)
-            .filter(self.Run.machine == run.machine)
-            .distinct()
-            .all()
-        )
-
-        # Find the index of the current run.
-        index = all_machine_orders.index(run.order)
-
-        # Gather the next N orders.
+        # Walk the (machine, sort key) index of the runs from the given run,
+        # to find the adjacent orders reported on this machine. This only
+        # reads the index entries of the runs which are returned, no matter
+        # how many orders the machine has reported, or how far apart they are.
+        sort_key = run.order.sort_key
         if direction == -1:
-            orders_to_return = all_machine_orders[max(0, index - N):index]
+            count = N
+            adjacent = sqlalchemy.or_(
+                self.Run.sort_key < sort_key,
+                sqlalchemy.and_(self.Run.sort_key == sort_key,
+                                self.Run.order_id < run.order_id))
+            ordering = (self.Run.sort_key.desc(), self.Run.order_id.desc())
         else:
-            orders_to_return = all_machine_orders[index+1:index+N]
+            # As it always did, this returns at most N - 1 following orders.
+            count = N - 1
+            adjacent = sqlalchemy.or_(
+                self.Run.sort_key > sort_key,
+                sqlalchemy.and_(self.Run.sort_key == sort_key,
+                                self.Run.order_id > run.order_id))
+            ordering = (self.Run.sort_key.asc(), self.Run.order_id.asc())
+        if count == 0:
+            return []
 
-        # Get all the runs for those orders on this machine in a single query.
-        ids_to_fetch = [o.id
-                        for o in orders_to_return]
-        if not ids_to_fetch:
+        order_ids = [order_id for _, order_id in
+                     session.query(self.Run.sort_key, self.Run.order_id)
+                     .filter(self.Run.machine_id == run.machine_id)
+                     .filter(adjacent)
+                     .distinct()
+                     .order_by(*ordering)
+                     .limit(count)]
+        if not order_ids:
             return []
 
+        # Get all the runs for those orders on this machine in a single query.
         runs = session.query(self.Run).\
-            filter(self.Run.machine == run.machine).\
-            filter(self.Run.order_id.in_(ids_to_fetch)).all()
-
-        # Sort the result by order, accounting for direction to satisfy our
-        # requirement of returning the runs in adjacency order.
-        #
-        # Even though we already know the right order, this is faster than
-        # issueing separate queries.
-        runs.sort(key=lambda r: r.order, reverse=(direction == -1))
+            filter(self.Run.machine_id == run.machine_id).\
+            filter(self.Run.order_id.in_(order_ids)).all()
+
+        # Sort the result in adjacency order, as the orders were found.
+        position = dict((order_id, i) for i, order_id in enumerate(order_ids))
+        runs.sort(key=lambda r: position[r.order_id])
 
         return runs
 
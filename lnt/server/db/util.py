@@ -1,14 +1,62 @@
+import threading
+import time
+
 import sqlalchemy
+import sqlalchemy.event
 import sqlalchemy.ext.compiler
 from sqlalchemy.engine import Connection, Engine
 from sqlalchemy.schema import DDLElement
 from typing import Text, Union
 
+from lnt.util import logger
+from lnt.util import metrics
+
+# The number of SQL statements executed by each thread.
+_statement_counts = threading.local()
+
 
 def path_has_no_database_type(path):
     return '://' not in path
 
 
+def _count_statement(conn, cursor, statement, parameters, context,
+                     executemany):
+    _statement_counts.count = statement_count() + 1
+
+
+def count_statements(engine: Engine) -> None:
+    """Count the SQL statements executed on this engine in the
+    statement_count() of the executing thread."""
+    sqlalchemy.event.listen(engine, 'before_cursor_execute', _count_statement)
+
+
+def statement_count() -> int:
+    """Return the number of SQL statements the current thread executed so far
+    on the engines passed to count_statements()."""
+    return getattr(_statement_counts, 'count', 0)
+
+
+def timed(func):
+    """Log the time a database task took and the number of SQL statements it
+    executed, and record its duration in the task metrics."""
+    def timed(*args, **kw):
+        t_start = time.time()
+        statements = statement_count()
+        result = func(*args, **kw)
+        delta = time.time() - t_start
+        statements = statement_count() - statements
+        metrics.TASK_SECONDS.observe(delta, task=func.__name__)
+        msg = 'timer: %r %2.2f sec, %d queries' % (func.__name__, delta,
+                                                   statements)
+        if delta > 10:
+            logger.warning(msg)
+        else:
+            logger.info(msg)
+        return result
+
+    return timed
+
+
 class _AddColumn(DDLElement):
     def __init__(self, table_name, column):
         self.table_name = table_name
@@ -11,6 +11,24 @@ import lnt.server.db.migrate
 from lnt.server.db import testsuite
 import lnt.server.db.util
 
+# The settings of a database in lnt.cfg which configure its connection pool.
+# 'null_pool' opens a connection for each session instead of keeping a pool,
+# which suits databases behind a connection pooler such as pgbouncer. The
+# others are passed to sqlalchemy.create_engine, and are ignored for SQLite,
+# whose connections are cheap to open.
+POOL_OPTIONS = ('pool_size', 'max_overflow', 'pool_recycle', 'pool_timeout',
+                'pool_pre_ping', 'null_pool')
+
+
+def _engine_options(path, pool_options):
+    options = {}
+    if pool_options.get('null_pool'):
+        options['poolclass'] = sqlalchemy.pool.NullPool
+    elif not path.startswith('sqlite://'):
+        options.update((key, value) for key, value in pool_options.items()
+                       if key != 'null_pool')
+    return options
+
 
 class V4DB(object):
     """
@@ -52,7 +70,7 @@ class V4DB(object):
         # Order testuites alphabetically to get groupings
         self.testsuite = dict(sorted(self.testsuite.items()))
 
-    def __init__(self, path, config, baseline_revision=0):
+    def __init__(self, path, config, baseline_revision=0, pool_options=None):
         # If the path includes no database type, assume sqlite.
         if lnt.server.db.util.path_has_no_database_type(path):
             path = 'sqlite:///' + path
@@ -60,14 +78,17 @@ class V4DB(object):
         self.path = path
         self.config = config
         self.baseline_revision = baseline_revision
+        self.pool_options = pool_options or {}
         connect_args = {}
         if path.startswith("sqlite://"):
             # Some of the background tasks keep database transactions
             # open for a long time. Make it less likely to hit
             # "(OperationalError) database is locked" because of that.
             connect_args['timeout'] = 30
-        self.engine = sqlalchemy.create_engine(path,
-                                               connect_args=connect_args)
+        self.engine = sqlalchemy.create_engine(
+            path, connect_args=connect_args,
+            **_engine_options(path, self.pool_options))
+        lnt.server.db.util.count_statements(self.engine)
 
         # Update the database to the current version, if necessary. Only check
         # this once per path.
@@ -78,9 +99,29 @@ class V4DB(object):
         self.testsuite = dict()
         self._load_schemas()
 
+        # Do not keep the connections used to load the database: processes
+        # forked from this one (such as the workers of a pre-forking server)
+        # must not share them.
+        self.engine.dispose()
+
     def close(self):
         self.engine.dispose()
 
+    def get_pool_stats(self):
+        """Return a dictionary of the numbers of connections of the pool of
+        the database: open and idle ('checked_in'), in use ('checked_out'),
+        and opened beyond the size of the pool ('overflow'). Pools which do
+        not keep connections only report their size, 0."""
+        pool = self.engine.pool
+        if not isinstance(pool, sqlalchemy.pool.QueuePool):
+            return {'size': 0}
+        return {
+            'size': pool.size(),
+            'checked_in': pool.checkedin(),
+            'checked_out': pool.checkedout(),
+            'overflow': pool.overflow(),
+        }
+
     def make_session(self, expire_on_commit=True):
         return self.sessionmaker(expire_on_commit=expire_on_commit)
 
@@ -90,4 +131,5 @@ class V4DB(object):
             'path': self.path,
             'config': self.config,
             'baseline_revision': self.baseline_revision,
+            'pool_options': self.pool_options,
         }
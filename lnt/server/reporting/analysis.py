@@ -1,6 +1,8 @@
 """
 Utilities for helping with the analysis of data, for reporting purposes.
 """
+import json
+
 from lnt.testing import FAIL
 from lnt.util import logger
 from lnt.util import multidict
@@ -235,6 +237,65 @@ class ComparisonResult:
             return UNCHANGED_PASS
 
 
+def encode_comparison_result(cr):
+    """Return the inputs of a ComparisonResult made by a RunInfo with the
+    default aggregation function and confidence level, as a JSON encodable
+    list."""
+    return [cr.failed, cr.prev_failed, cr.samples, cr.prev_samples,
+            cr.cur_hash, cr.prev_hash, cr.cur_profile, cr.prev_profile]
+
+
+def decode_comparison_result(field, data):
+    """Make the ComparisonResult of a field from the output of
+    encode_comparison_result()."""
+    failed, prev_failed, samples, prev_samples, cur_hash, prev_hash, \
+        cur_profile, prev_profile = data
+    return ComparisonResult(stats.safe_min, failed, prev_failed, samples,
+                            prev_samples, cur_hash, prev_hash, cur_profile,
+                            prev_profile,
+                            bigger_is_better=field.bigger_is_better,
+                            ignore_same_hash=field.ignore_same_hash)
+
+
+class StoredComparisonResult(ComparisonResult):
+    """A ComparisonResult restored from the output of
+    encode_stored_comparison_result(). It has the aggregated values, deltas
+    and statuses of the comparison, but not the samples it was made from."""
+
+    def __init__(self, field, data):
+        self.failed, self.prev_failed, self.current, self.previous, \
+            self.delta, self.pct_delta, self.stddev, self.MAD, \
+            self.cur_hash, self.prev_hash, self.cur_profile, \
+            self.prev_profile, self.value_status, \
+            self.value_status_all = data
+        self.aggregation_fn = stats.safe_min
+        self.samples = self.prev_samples = None
+        self.confidence_lv = .05
+        self.bigger_is_better = field.bigger_is_better
+        self.ignore_same_hash = field.ignore_same_hash
+
+    def get_value_status(self, confidence_interval=2.576,
+                         value_precision=MIN_VALUE_PRECISION,
+                         ignore_small=True):
+        if confidence_interval != 2.576 or \
+                value_precision != MIN_VALUE_PRECISION:
+            raise ValueError("stored comparison results only have the value "
+                             "status for the default confidence interval "
+                             "and value precision")
+        return self.value_status if ignore_small else self.value_status_all
+
+
+def encode_stored_comparison_result(cr):
+    """Return the aggregated values, deltas and statuses of a
+    ComparisonResult made by a RunInfo with the default aggregation function
+    and confidence level, as a JSON encodable list for
+    StoredComparisonResult."""
+    return [cr.failed, cr.prev_failed, cr.current, cr.previous, cr.delta,
+            cr.pct_delta, cr.stddev, cr.MAD, cr.cur_hash, cr.prev_hash,
+            cr.cur_profile, cr.prev_profile, cr.get_value_status(),
+            cr.get_value_status(ignore_small=False)]
+
+
 class RunInfo(object):
     def __init__(self, session, testsuite, runs_to_load,
                  aggregation_fn=stats.safe_min, confidence_lv=.05,
@@ -250,6 +311,8 @@ class RunInfo(object):
         self.sample_map = multidict.multidict()
         self.profile_map = dict()
         self.loaded_run_ids = set()
+        # Column views of the samples, built on demand by get_comparison_results.
+        self._columns = dict()
 
         self._load_samples_for_runs(session, runs_to_load, only_tests)
 
@@ -365,6 +428,129 @@ class RunInfo(object):
                              ignore_same_hash=field.ignore_same_hash)
         return r
 
+    def get_run_comparison_results(self, run, compare_to, test_ids, field,
+                                   hash_of_binary_field):
+        if compare_to is not None:
+            compare_to = [compare_to]
+        else:
+            compare_to = []
+        return self.get_comparison_results([run], compare_to, test_ids, field,
+                                           hash_of_binary_field)
+
+    def get_comparison_results(self, runs, compare_runs, test_ids, field,
+                               hash_of_binary_field):
+        """Compare the given tests for one field at once.
+
+        Returns a dict mapping each test ID to the same ComparisonResult
+        get_comparison_result() gives for it. Instead of going through all the
+        samples of every test, the values are taken from column views of the
+        samples keyed by (run ID, test ID), which are built once per field and
+        reused by later calls."""
+        run_ids = [r.id for r in runs]
+        compare_run_ids = [r.id for r in compare_runs]
+
+        field_index = self.testsuite.get_field_index(field)
+        values = self._get_column(field_index)
+        if field.status_field:
+            failures = self._get_failures(
+                self.testsuite.get_field_index(field.status_field))
+        else:
+            failures = None
+        if hash_of_binary_field:
+            hash_index = self.testsuite.get_field_index(hash_of_binary_field)
+            hashes = self._get_column(hash_index)
+            # The previous hashes come from the samples which have a value.
+            prev_hashes = self._get_paired_column(field_index, hash_index)
+
+        def gather(column, run_ids, test_id):
+            gathered = []
+            for run_id in run_ids:
+                gathered.extend(column.get((run_id, test_id), ()))
+            return gathered
+
+        results = {}
+        for test_id in test_ids:
+            run_values = gather(values, run_ids, test_id)
+            prev_values = gather(values, compare_run_ids, test_id)
+
+            run_failed = prev_failed = False
+            if failures is not None:
+                run_failed = any((run_id, test_id) in failures
+                                 for run_id in run_ids)
+                prev_failed = any((run_id, test_id) in failures
+                                  for run_id in compare_run_ids)
+
+            if hash_of_binary_field:
+                hash_values = gather(hashes, run_ids, test_id)
+                if len(set(hash_values)) > 1:
+                    logger.warning("Found different hashes for multiple "
+                                   "samples in the same run {0}: {1}\n"
+                                   "TestID:{2}"
+                                   .format(runs, hash_values, test_id))
+                cur_hash = hash_values[0] if hash_values else None
+                prev_hash_values = gather(prev_hashes, compare_run_ids,
+                                          test_id)
+                prev_hash = prev_hash_values[0] if prev_hash_values else None
+            else:
+                cur_hash = None
+                prev_hash = None
+
+            cur_profile = prev_profile = None
+            if run_ids:
+                cur_profile = self.profile_map.get((run_ids[0], test_id))
+            if compare_run_ids:
+                prev_profile = self.profile_map.get((compare_run_ids[0],
+                                                     test_id))
+
+            results[test_id] = ComparisonResult(
+                self.aggregation_fn, run_failed, prev_failed, run_values,
+                prev_values, cur_hash, prev_hash, cur_profile, prev_profile,
+                self.confidence_lv,
+                bigger_is_better=field.bigger_is_better,
+                ignore_same_hash=field.ignore_same_hash)
+        return results
+
+    def _get_column(self, index):
+        """Map each (run ID, test ID) to the values at the given index of its
+        samples, leaving out the None values."""
+        key = ('values', index)
+        column = self._columns.get(key)
+        if column is None:
+            column = {}
+            for sample_key, samples in self.sample_map.items():
+                column_values = [s[index] for s in samples
+                                 if s[index] is not None]
+                if column_values:
+                    column[sample_key] = column_values
+            self._columns[key] = column
+        return column
+
+    def _get_paired_column(self, index, other_index):
+        """Map each (run ID, test ID) to the values at other_index of its
+        samples which have a value at index."""
+        key = ('paired', index, other_index)
+        column = self._columns.get(key)
+        if column is None:
+            column = {}
+            for sample_key, samples in self.sample_map.items():
+                column_values = [s[other_index] for s in samples
+                                 if s[index] is not None]
+                if column_values:
+                    column[sample_key] = column_values
+            self._columns[key] = column
+        return column
+
+    def _get_failures(self, status_index):
+        """Return the set of (run ID, test ID) with a failing sample."""
+        key = ('failures', status_index)
+        failures = self._columns.get(key)
+        if failures is None:
+            failures = set(sample_key
+                           for sample_key, samples in self.sample_map.items()
+                           if any(s[status_index] == FAIL for s in samples))
+            self._columns[key] = failures
+        return failures
+
     def get_geomean_comparison_result(self, run, compare_to, field, tests):
         unchanged_tests = [(cr.previous, cr.current, cr.prev_hash, cr.cur_hash)
                            for _, _, cr in tests
@@ -400,6 +586,7 @@ class RunInfo(object):
         to_load = set(run_ids) - self.loaded_run_ids
         if not to_load:
             return
+        self._columns.clear()
 
         # Batch load all of the samples for the needed runs.
         #
@@ -419,3 +606,168 @@ class RunInfo(object):
                 self.profile_map[(run_id, test_id)] = profile_id
 
         self.loaded_run_ids |= to_load
+
+
+# The stored ComparisonResult of a test without samples in either run.
+_EMPTY_STORED_RESULT = [False, False, None, None, 0, 0.0, None, None, None,
+                        None, None, None, None, None]
+
+
+class StoredRunInfo(RunInfo):
+    def __init__(self, session, testsuite, run, runs_to_load,
+                 aggregation_fn=stats.safe_min, confidence_lv=.05):
+        """A RunInfo for the comparisons of the given run, which gives the
+        stored results of the comparisons made when the run was imported (see
+        lnt.server.reporting.runs.store_run_comparisons), and only loads the
+        samples of runs_to_load for the other comparisons.
+        """
+        RunInfo.__init__(self, session, testsuite, [], aggregation_fn,
+                         confidence_lv)
+        self.run_id = run.id
+        self._session = session
+        self._runs_to_load = set(runs_to_load)
+        self._stored = {}
+        self._stored_results = {}
+
+        # The results are stored for the defaults only.
+        if aggregation_fn is not stats.safe_min or confidence_lv != .05:
+            return
+        comparisons = testsuite.RunComparison
+        q = session.query(comparisons.compare_to_id, comparisons.data) \
+            .filter(comparisons.run_id == run.id)
+        for compare_to_id, data in q:
+            if compare_to_id is None or compare_to_id in self._runs_to_load:
+                self._stored[compare_to_id] = json.loads(data.decode('utf-8'))
+
+    @property
+    def test_ids(self):
+        compare_to_ids = self._runs_to_load - {self.run_id}
+        if self.run_id in self._runs_to_load and self._stored and \
+                compare_to_ids <= set(self._stored):
+            if not compare_to_ids:
+                return set(next(iter(self._stored.values()))['run_test_ids'])
+            return set(test_id for compare_to_id in compare_to_ids
+                       for test_id in self._stored[compare_to_id]['test_ids'])
+        self._load_samples()
+        return RunInfo.test_ids.fget(self)
+
+    def get_samples(self, runs, test_id):
+        self._load_samples()
+        return RunInfo.get_samples(self, runs, test_id)
+
+    def get_comparison_result(self, runs, compare_runs, test_id, field,
+                              hash_of_binary_field):
+        results = self._get_stored_results(runs, compare_runs, field,
+                                           hash_of_binary_field)
+        if results is None:
+            self._load_samples()
+            return RunInfo.get_comparison_result(
+                self, runs, compare_runs, test_id, field, hash_of_binary_field)
+        return self._get_stored_result(results, test_id, field)
+
+    def get_comparison_results(self, runs, compare_runs, test_ids, field,
+                               hash_of_binary_field):
+        results = self._get_stored_results(runs, compare_runs, field,
+                                           hash_of_binary_field)
+        if results is None:
+            self._load_samples()
+            return RunInfo.get_comparison_results(
+                self, runs, compare_runs, test_ids, field,
+                hash_of_binary_field)
+        return dict((test_id,
+                     self._get_stored_result(results, test_id, field))
+                    for test_id in test_ids)
+
+    @staticmethod
+    def _get_stored_result(results, test_id, field):
+        result = results.get(test_id)
+        if result is None:
+            # The tests without samples in either run are not stored.
+            result = StoredComparisonResult(field, _EMPTY_STORED_RESULT)
+        return result
+
+    def _get_stored_results(self, runs, compare_runs, field,
+                            hash_of_binary_field):
+        """Return the stored results of a comparison of the run as a dict
+        mapping the test IDs with samples to their ComparisonResult, or None
+        if the comparison is not stored."""
+        if len(runs) != 1 or runs[0].id != self.run_id or \
+                self.run_id not in self._runs_to_load or \
+                len(compare_runs) > 1 or \
+                hash_of_binary_field != \
+                self.testsuite.Sample.get_hash_of_binary_field():
+            return None
+        compare_to_id = compare_runs[0].id if compare_runs else None
+        if compare_to_id in self._stored:
+            stored_id = compare_to_id
+        elif compare_to_id is None and self._stored:
+            # Any comparison gives the results of the run alone.
+            stored_id = next(iter(self._stored))
+        else:
+            return None
+
+        key = (compare_to_id, field.name)
+        results = self._stored_results.get(key)
+        if results is None:
+            stored = self._stored[stored_id]
+            encoded = stored['fields'].get(field.name)
+            strip = compare_to_id != stored_id
+            if encoded is None and compare_to_id is None:
+                encoded = stored['run_fields'].get(field.name)
+                strip = False
+            if encoded is None:
+                return None
+            results = {}
+            for test_id, data in encoded.items():
+                if strip:
+                    failed, _, current, _, _, _, stddev, mad, cur_hash, _, \
+                        cur_profile, _, _, _ = data
+                    data = [failed, False, current, None, 0, 0.0, stddev,
+                            mad, cur_hash, None, cur_profile, None, None,
+                            None]
+                results[int(test_id)] = StoredComparisonResult(field, data)
+            self._stored_results[key] = results
+        return results
+
+    def _load_samples(self):
+        self._load_samples_for_runs(self._session, self._runs_to_load, None)
+
+
+def make_run_comparison_data(sri, run, compare_to):
+    """Return the data of the RunComparison record of comparing run to
+    compare_to (which can be None), from a RunInfo with the default
+    aggregation function and confidence level which loaded both runs. The
+    metric fields are compared, the values of the other sample fields are
+    kept for the run alone. Only the aggregated values, deltas and statuses
+    are kept, not the samples."""
+    ts = sri.testsuite
+    hash_of_binary_field = ts.Sample.get_hash_of_binary_field()
+    run_ids = set([run.id])
+    if compare_to is not None:
+        run_ids.add(compare_to.id)
+    test_ids = sorted(set(test_id for run_id, test_id in sri.sample_map.keys()
+                          if run_id in run_ids))
+    run_test_ids = sorted(set(test_id
+                              for run_id, test_id in sri.sample_map.keys()
+                              if run_id == run.id))
+
+    def encode(field, compare_to):
+        results = sri.get_run_comparison_results(run, compare_to, test_ids,
+                                                 field, hash_of_binary_field)
+        encoded = {}
+        for test_id in test_ids:
+            data = encode_stored_comparison_result(results[test_id])
+            if data != _EMPTY_STORED_RESULT:
+                encoded[test_id] = data
+        return encoded
+
+    metric_fields = list(ts.Sample.get_metric_fields())
+    return {
+        'test_ids': test_ids,
+        'run_test_ids': run_test_ids,
+        'fields': dict((field.name, encode(field, compare_to))
+                       for field in metric_fields),
+        'run_fields': dict((field.name, encode(field, None))
+                           for field in ts.sample_fields
+                           if field not in metric_fields),
+    }
@@ -1,14 +1,127 @@
 from lnt.server.reporting.analysis import REGRESSED, UNCHANGED_FAIL
+from lnt.server.reporting.analysis import StoredComparisonResult, \
+    encode_stored_comparison_result
 from lnt.server.reporting.report import RunResult, RunResults, report_css_styles, pairs, OrderAndHistory
 from lnt.util import multidict
 import datetime
+import hashlib
+import json
 import lnt.server.reporting.analysis
+import lnt.server.reporting.parallel
 import lnt.server.ui.app
 import re
+import sqlalchemy.exc
 import sqlalchemy.sql
 import urllib.parse
 
 
+def _encode_day_result(cr):
+    # Only keep the samples of the day itself, which the spark lines show: the
+    # previous samples are the ones of the previous day.
+    return [encode_stored_comparison_result(cr), cr.samples]
+
+
+def _decode_day_result(field, data):
+    stored, samples = data
+    cr = StoredComparisonResult(field, stored)
+    cr.samples = samples
+    return cr
+
+
+def compute_machine_results(session, db, ts_name, day_run_ids, past_run_ids,
+                            test_ids):
+    """
+    compute_machine_results(session, db, ts_name, day_run_ids, past_run_ids,
+                            test_ids) -> dict
+
+    Compute the results of one machine in a daily report for the given tests,
+    from the IDs of the runs of each day with the largest order, and of the
+    recent runs of each day. They only depend on the runs of the machine, so
+    that the machines can be processed independently of each other (see
+    lnt.server.reporting.parallel).
+
+    The results are a JSON encodable dictionary with:
+      * 'fields': for each metric field, the (test ID, day results) pairs of
+        the tests with an interesting result on the most recent day. The day
+        results are the ComparisonResult of each day encoded by
+        _encode_day_result(), or None for the days without runs.
+      * 'nr_tests': for each day, the number of tests with samples.
+    """
+    ts = db.testsuite[ts_name]
+    fields = list(ts.Sample.get_metric_fields())
+    hash_of_binary_field = ts.Sample.get_hash_of_binary_field()
+    num_days = len(day_run_ids)
+
+    run_ids = [run_id for ids in past_run_ids for run_id in ids]
+    runs = dict((r.id, r) for r in
+                session.query(ts.Run).filter(ts.Run.id.in_(run_ids)))
+    day_runs = [[runs[run_id] for run_id in ids] for ids in day_run_ids]
+    past_runs = [[runs[run_id] for run_id in ids] for ids in past_run_ids]
+    # The runs to compare the oldest day against, of which there are none.
+    past_runs.append([])
+
+    sri = lnt.server.reporting.analysis.RunInfo(session, ts, run_ids,
+                                                only_tests=test_ids)
+
+    # Record which days have samples, so that we'll compare also consecutive
+    # runs that are further than a day apart if no runs happened in between.
+    # prev_day_indices[test_id][i] is the index of the day to compare day i
+    # against.
+    prev_day_indices = {}
+    for test_id in test_ids:
+        day_has_samples = [len(sri.get_samples(runs, test_id)) > 0
+                           for runs in past_runs]
+        indices = []
+        for day_nr in range(num_days):
+            prev_index = day_nr + 1
+            for i in range(day_nr + 1, num_days):
+                if day_has_samples[i]:
+                    prev_index = i
+                    break
+            indices.append(prev_index)
+        prev_day_indices[test_id] = indices
+
+    def compare(field, day_nr, test_ids):
+        # Compare the tests with the same previous day at once.
+        by_prev_index = multidict.multidict()
+        for test_id in test_ids:
+            by_prev_index[prev_day_indices[test_id][day_nr]] = test_id
+        crs = {}
+        for prev_index, group in by_prev_index.items():
+            crs.update(sri.get_comparison_results(
+                day_runs[day_nr], past_runs[prev_index], group, field,
+                hash_of_binary_field))
+        return crs
+
+    field_rows = []
+    for field in fields:
+        # Compute if there is anything to display for the most recent day, and
+        # only compute the results of the other days if so.
+        day0_crs = compare(field, 0, test_ids)
+        visible_test_ids = [test_id for test_id in test_ids
+                            if day0_crs[test_id].is_result_interesting()]
+        rows = dict((test_id,
+                     [_encode_day_result(day0_crs[test_id])])
+                    for test_id in visible_test_ids)
+        for i in range(1, num_days):
+            if len(day_runs[i]) == 0:
+                for days in rows.values():
+                    days.append(None)
+                continue
+            crs = compare(field, i, visible_test_ids)
+            for test_id, days in rows.items():
+                days.append(_encode_day_result(crs[test_id]))
+        field_rows.append([[test_id, rows[test_id]]
+                           for test_id in visible_test_ids])
+
+    # Count the tests seen on each day, in the runs with the largest order.
+    nr_tests = [sum(1 for test_id in test_ids
+                    if sri.get_samples(runs, test_id))
+                for runs in day_runs]
+
+    return {'fields': field_rows, 'nr_tests': nr_tests}
+
+
 class DailyReport(object):
     def __init__(self, ts, year, month, day, num_prior_days_to_include=3,
                  day_start_offset_hours=16, for_mail=False,
@@ -40,6 +153,9 @@ class DailyReport(object):
         self.reporting_tests = None
         self.result_table = None
         self.nr_tests_table = None
+        # The computed (machine, fingerprint, results) to store, see
+        # store_results.
+        self.results_to_store = []
 
     def get_query_parameters_string(self):
         query_params = [
@@ -78,7 +194,9 @@ class DailyReport(object):
         # Select a key run arbitrarily.
         return runs[0]
 
-    def build(self, session):
+    def build(self, session, jobs=1):
+        """Build the report. The machines are split between 'jobs' worker
+        processes, see lnt.server.reporting.parallel."""
         ts = self.ts
 
         # Construct datetime instances for the report range.
@@ -201,13 +319,50 @@ class DailyReport(object):
                     ts.Sample.run_id.in_(relevant_run_ids),
                     ts.Sample.test_id == ts.Test.id))).all()
         self.reporting_tests.sort(key=lambda t: t.name)
-
-        run_ids_to_load = list(relevant_run_ids) + \
-            [r.id for r in less_relevant_runs]
-
-        # Create a run info object.
-        sri = lnt.server.reporting.analysis.RunInfo(session, ts,
-                                                    run_ids_to_load)
+        tests_by_id = dict((t.id, t) for t in self.reporting_tests)
+
+        # Find the reporting tests each machine has samples for, the others
+        # have nothing to display for it.
+        past_run_ids = [r.id for r in less_relevant_runs]
+        machine_test_ids = multidict.multidict()
+        q = session.query(ts.Run.machine_id, ts.Sample.test_id) \
+            .filter(ts.Sample.run_id == ts.Run.id) \
+            .filter(ts.Sample.run_id.in_(past_run_ids)) \
+            .distinct()
+        for machine_id, test_id in q:
+            if test_id in tests_by_id:
+                machine_test_ids[machine_id] = test_id
+
+        # Compute the results of each machine, or take them from the database
+        # if they were stored for an earlier build of the report (see
+        # store_results). They are only stored once the last day of the report
+        # is over, as the results of the current day change with each
+        # submission.
+        is_closed = self.prior_days[0] <= datetime.datetime.utcnow()
+        self.results_to_store = []
+        machine_results = {}
+        to_compute = []
+        for machine in self.reporting_machines:
+            test_ids = sorted(machine_test_ids.get(machine.id, ()))
+            fingerprint = self._get_fingerprint(machine, test_ids)
+            results = None
+            if is_closed:
+                results = self._load_machine_results(session, machine,
+                                                     fingerprint)
+            if results is None:
+                to_compute.append((machine, test_ids, fingerprint))
+            else:
+                machine_results[machine] = results
+
+        computed = lnt.server.reporting.parallel.map_jobs(
+            session, ts.v4db, compute_machine_results,
+            [(ts.name, self._get_run_ids(self.machine_runs, machine),
+              self._get_run_ids(self.machine_past_runs, machine), test_ids)
+             for machine, test_ids, _ in to_compute], jobs)
+        for (machine, _, fingerprint), results in zip(to_compute, computed):
+            if is_closed:
+                self.results_to_store.append((machine, fingerprint, results))
+            machine_results[machine] = results
 
         # Build the result table of tests with interesting results.
         def compute_visible_results_priority(visible_results):
@@ -230,86 +385,88 @@ class DailyReport(object):
             return (-int(had_failures), -sum_abs_day0_deltas, test.name)
 
         self.result_table = []
-        self.nr_tests_table = []
-        for field in self.fields:
-            field_results = []
-            for test in self.reporting_tests:
-                # For each machine, compute if there is anything to display for
-                # the most recent day, and if so add it to the view.
-                visible_results = []
-                for machine in self.reporting_machines:
-                    # Get the most recent comparison result.
-                    # Record which days have samples, so that we'll compare
-                    # also consecutive runs that are further than a day
-                    # apart if no runs happened in between.
-                    day_has_samples = []
-                    for i in range(0, self.num_prior_days_to_include):
-                        runs = self.machine_past_runs.get((machine.id, i), ())
-                        samples = sri.get_samples(runs, test.id)
-                        day_has_samples.append(len(samples) > 0)
-
-                    def find_most_recent_run_with_samples(day_nr):
-                        for i in range(day_nr+1,
-                                       self.num_prior_days_to_include):
-                            if day_has_samples[i]:
-                                return i
-                        return day_nr+1
-
-                    prev_day_index = find_most_recent_run_with_samples(0)
-                    day_runs = machine_runs.get((machine.id, 0), ())
-                    prev_runs = self.machine_past_runs.get(
-                        (machine.id, prev_day_index), ())
-                    cr = sri.get_comparison_result(
-                        day_runs, prev_runs, test.id, field,
-                        self.hash_of_binary_field)
-
-                    # If the result is not "interesting", ignore this machine.
-                    if not cr.is_result_interesting():
-                        continue
-
-                    # Otherwise, compute the results for all the days.
+        for field_index, field in enumerate(self.fields):
+            # Gather the visible results of each test, in the order of the
+            # machines.
+            test_results = multidict.multidict()
+            for machine in self.reporting_machines:
+                field_rows = machine_results[machine]['fields'][field_index]
+                for test_id, days in field_rows:
                     day_results = RunResults()
-                    day_results.append(RunResult(cr))
-                    for i in range(1, self.num_prior_days_to_include):
-                        day_runs = machine_runs.get((machine.id, i), ())
-                        if len(day_runs) == 0:
+                    for day in days:
+                        if day is None:
                             day_results.append(None)
-                            continue
-
-                        prev_day_index = find_most_recent_run_with_samples(i)
-                        prev_runs = self.machine_past_runs.get(
-                                       (machine.id, prev_day_index), ())
-                        cr = sri.get_comparison_result(
-                            day_runs, prev_runs, test.id, field,
-                            self.hash_of_binary_field)
-                        day_results.append(RunResult(cr))
-
+                        else:
+                            cr = _decode_day_result(field, day)
+                            day_results.append(RunResult(cr))
                     day_results.complete()
+                    test_results[test_id] = (machine, day_results)
 
-                    # Append the result for the machine.
-                    visible_results.append((machine, day_results))
-
-                # If there are visible results for this test, append it to the
-                # view.
-                if visible_results:
-                    field_results.append((test, visible_results))
+            field_results = [(tests_by_id[test_id], visible_results)
+                             for test_id, visible_results
+                             in test_results.items()]
 
             # Order the field results by "priority".
             field_results.sort(key=compute_visible_results_priority)
             self.result_table.append((field, field_results))
 
-        for machine in self.reporting_machines:
-            nr_tests_for_machine = []
-            for i in range(0, self.num_prior_days_to_include):
-                # get all runs with the same largest "order" on a given day
-                day_runs = machine_runs.get((machine.id, i), ())
-                nr_tests_seen = 0
-                for test in self.reporting_tests:
-                    samples = sri.get_samples(day_runs, test.id)
-                    if len(samples) > 0:
-                        nr_tests_seen += 1
-                nr_tests_for_machine.append(nr_tests_seen)
-            self.nr_tests_table.append((machine, nr_tests_for_machine))
+        self.nr_tests_table = [
+            (machine, machine_results[machine]['nr_tests'])
+            for machine in self.reporting_machines]
+
+    def store_results(self, session):
+        """Store the results of the machines the build of a report of closed
+        days computed, for the next builds of the report, and commit."""
+        for machine, fingerprint, results in self.results_to_store:
+            self._store_machine_results(session, machine, fingerprint,
+                                        results)
+        session.commit()
+        self.results_to_store = []
+
+    def _get_run_ids(self, runs, machine):
+        return [[r.id for r in runs.get((machine.id, i), ())]
+                for i in range(self.num_prior_days_to_include)]
+
+    def _get_fingerprint(self, machine, test_ids):
+        """Hash what the results of a machine depend on: the fields, the tests
+        and the runs of each day."""
+        key = [[field.name for field in self.fields], test_ids,
+               [sorted(ids) for ids in
+                self._get_run_ids(self.machine_runs, machine)],
+               [sorted(ids) for ids in
+                self._get_run_ids(self.machine_past_runs, machine)]]
+        return hashlib.sha1(json.dumps(key).encode('utf-8')).hexdigest()
+
+    def _query_machine_results(self, session, machine):
+        results = self.ts.DailyReportResult
+        return session.query(results) \
+            .filter(results.machine_id == machine.id) \
+            .filter(results.start_time == self.prior_days[-1]) \
+            .filter(results.end_time == self.prior_days[0])
+
+    def _load_machine_results(self, session, machine, fingerprint):
+        stored = self._query_machine_results(session, machine).first()
+        if stored is None or stored.fingerprint != fingerprint:
+            return None
+        return json.loads(stored.data.decode('utf-8'))
+
+    def _store_machine_results(self, session, machine, fingerprint, results):
+        data = json.dumps(results).encode('utf-8')
+        # Several requests may build the same report at once. Update the
+        # stored results in place, and keep the ones of the request which
+        # inserted them first: they were computed from the same runs.
+        if self._query_machine_results(session, machine).update(
+                {'fingerprint': fingerprint, 'data': data},
+                synchronize_session=False):
+            return
+        try:
+            with session.begin_nested():
+                session.add(self.ts.DailyReportResult(
+                    machine_id=machine.id, start_time=self.prior_days[-1],
+                    end_time=self.prior_days[0], fingerprint=fingerprint,
+                    data=data))
+        except sqlalchemy.exc.IntegrityError:
+            pass
 
     def render(self, ts_url, only_html_body=True):
         # Strip any trailing slash on the testsuite URL.
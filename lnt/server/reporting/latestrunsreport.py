@@ -1,9 +1,78 @@
 from lnt.server.reporting.analysis import REGRESSED, UNCHANGED_FAIL
+from lnt.server.reporting.analysis import decode_comparison_result, \
+    encode_comparison_result
 from lnt.server.reporting.report import RunResult, RunResults, report_css_styles
 import lnt.server.reporting.analysis
+import lnt.server.reporting.parallel
 import lnt.server.ui.app
 
 
+def compute_machine_results(session, db, ts_name, machine_id, run_count):
+    """
+    compute_machine_results(session, db, ts_name, machine_id, run_count)
+        -> (int, list) or None
+
+    Compare the latest runs of a machine to the oldest of them. Return the
+    number of runs and, for each metric field, the (test ID, results) pairs of
+    the tests with an interesting result in the latest run, where the results
+    are the encoded ComparisonResult of each run from the latest one. Return
+    None if the machine has fewer than 2 runs.
+    """
+    ts = db.testsuite[ts_name]
+    fields = list(ts.Sample.get_metric_fields())
+    hash_of_binary_field = ts.Sample.get_hash_of_binary_field()
+
+    machine_runs = list(reversed(
+        session.query(ts.Run)
+        .filter(ts.Run.machine_id == machine_id)
+        .order_by(ts.Run.start_time.desc())
+        .limit(run_count)
+        .all()))
+
+    if len(machine_runs) < 2:
+        return None
+
+    machine_runs_ids = [r.id for r in machine_runs]
+
+    # take all tests from latest run and do a comparison
+    oldest_run = machine_runs[0]
+
+    run_tests = (session.query(ts.Test)
+                 .join(ts.Sample)
+                 .join(ts.Run)
+                 .filter(ts.Sample.run_id == oldest_run.id)
+                 .filter(ts.Sample.test_id == ts.Test.id)
+                 .all())
+    test_ids = [test.id for test in run_tests]
+
+    # Create a run info object.
+    sri = lnt.server.reporting.analysis.RunInfo(session, ts, machine_runs_ids)
+
+    field_rows = []
+    for field in fields:
+        latest_crs = sri.get_comparison_results(
+            [machine_runs[-1]], [oldest_run], test_ids, field,
+            hash_of_binary_field)
+
+        # Ignore the tests whose result is not "interesting".
+        visible_test_ids = [test_id for test_id in test_ids
+                            if latest_crs[test_id].is_result_interesting()]
+
+        # For all previous runs, analyze comparison results
+        rows = dict((test_id, []) for test_id in visible_test_ids)
+        for run in reversed(machine_runs):
+            crs = sri.get_comparison_results(
+                [run], [oldest_run], visible_test_ids, field,
+                hash_of_binary_field)
+            for test_id, results in rows.items():
+                results.append(encode_comparison_result(crs[test_id]))
+
+        field_rows.append([[test_id, rows[test_id]]
+                           for test_id in visible_test_ids])
+
+    return len(machine_runs), field_rows
+
+
 class LatestRunsReport(object):
     def __init__(self, ts, run_count):
         self.ts = ts
@@ -14,87 +83,67 @@ class LatestRunsReport(object):
         # Computed values.
         self.result_table = None
 
-    def build(self, session):
+    def build(self, session, jobs=1):
+        """Build the report. The machines are split between 'jobs' worker
+        processes, see lnt.server.reporting.parallel."""
         ts = self.ts
 
         machines = session.query(ts.Machine).all()
+        computed = lnt.server.reporting.parallel.map_jobs(
+            session, ts.v4db, compute_machine_results,
+            [(ts.name, machine.id, self.run_count) for machine in machines],
+            jobs)
+
+        test_ids = set(test_id for results in computed if results is not None
+                       for field_rows in results[1]
+                       for test_id, _ in field_rows)
+        tests = {}
+        if test_ids:
+            tests = dict((test.id, test) for test in session.query(ts.Test)
+                         .filter(ts.Test.id.in_(list(test_ids))))
 
         self.result_table = []
-        for field in self.fields:
+        for field_index, field in enumerate(self.fields):
+            # Build the result table of tests with interesting results.
+            def compute_visible_results_priority(visible_results):
+                # We just use an ad hoc priority that favors showing tests with
+                # failures and large changes. We do this by computing the priority
+                # as tuple of whether or not there are any failures, and then sum
+                # of the mean percentage changes.
+                test, results = visible_results
+                had_failures = False
+                sum_abs_deltas = 0.
+                for result in results:
+                    test_status = result.cr.get_test_status()
+
+                    if (test_status == REGRESSED or test_status == UNCHANGED_FAIL):
+                        had_failures = True
+                    elif result.cr.pct_delta is not None:
+                        sum_abs_deltas += abs(result.cr.pct_delta)
+                return (field.name, -int(had_failures), -sum_abs_deltas, test.name)
+
             field_results = []
-            for machine in machines:
-                machine_results = []
-                machine_runs = list(reversed(
-                    session.query(ts.Run)
-                    .filter(ts.Run.machine_id == machine.id)
-                    .order_by(ts.Run.start_time.desc())
-                    .limit(self.run_count)
-                    .all()))
-
-                if len(machine_runs) < 2:
+            for machine, results in zip(machines, computed):
+                if results is None:
                     continue
+                num_runs, field_rows = results
 
-                machine_runs_ids = [r.id for r in machine_runs]
-
-                # take all tests from latest run and do a comparison
-                oldest_run = machine_runs[0]
-
-                run_tests = (session.query(ts.Test)
-                             .join(ts.Sample)
-                             .join(ts.Run)
-                             .filter(ts.Sample.run_id == oldest_run.id)
-                             .filter(ts.Sample.test_id == ts.Test.id)
-                             .all())
-
-                # Create a run info object.
-                sri = lnt.server.reporting.analysis.RunInfo(session, ts, machine_runs_ids)
-
-                # Build the result table of tests with interesting results.
-                def compute_visible_results_priority(visible_results):
-                    # We just use an ad hoc priority that favors showing tests with
-                    # failures and large changes. We do this by computing the priority
-                    # as tuple of whether or not there are any failures, and then sum
-                    # of the mean percentage changes.
-                    test, results = visible_results
-                    had_failures = False
-                    sum_abs_deltas = 0.
-                    for result in results:
-                        test_status = result.cr.get_test_status()
-
-                        if (test_status == REGRESSED or test_status == UNCHANGED_FAIL):
-                            had_failures = True
-                        elif result.cr.pct_delta is not None:
-                            sum_abs_deltas += abs(result.cr.pct_delta)
-                    return (field.name, -int(had_failures), -sum_abs_deltas, test.name)
-
-                for test in run_tests:
-                    cr = sri.get_comparison_result(
-                            [machine_runs[-1]], [oldest_run], test.id, field,
-                            self.hash_of_binary_field)
-
-                    # If the result is not "interesting", ignore it.
-                    if not cr.is_result_interesting():
-                        continue
-
-                    # For all previous runs, analyze comparison results
+                machine_results = []
+                for test_id, run_results in field_rows[field_index]:
                     test_results = RunResults()
-
-                    for run in reversed(machine_runs):
-                        cr = sri.get_comparison_result(
-                                [run], [oldest_run], test.id, field,
-                                self.hash_of_binary_field)
+                    for data in run_results:
+                        cr = decode_comparison_result(field, data)
                         test_results.append(RunResult(cr))
-
                     test_results.complete()
 
-                    machine_results.append((test, test_results))
+                    machine_results.append((tests[test_id], test_results))
 
                 machine_results.sort(key=compute_visible_results_priority)
 
                 # If there are visible results for this test, append it to the
                 # view.
                 if machine_results:
-                    field_results.append((machine, len(machine_runs), machine_results))
+                    field_results.append((machine, num_runs, machine_results))
 
             field_results.sort(key=lambda x: x[0].name)
             self.result_table.append((field, field_results))
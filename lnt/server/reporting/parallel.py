@@ -0,0 +1,70 @@
+"""
+Running the work of the reports on each machine in worker processes.
+
+The reports split their work in calls of a module level function, usually one
+per machine, which take a session and the database and return a result which
+can be pickled. With more than one job, the calls are spread over a pool of
+worker processes, each with its own connection to the database, and their
+results are returned in the order of the calls, so that the reports are the
+same whatever the number of jobs.
+"""
+
+import concurrent.futures
+import multiprocessing
+import threading
+
+import lnt.server.db.v4db
+
+_executors = {}
+_executors_lock = threading.Lock()
+_worker_databases = {}
+
+
+def _get_executor(jobs):
+    with _executors_lock:
+        executor = _executors.get(jobs)
+        if executor is None:
+            executor = concurrent.futures.ProcessPoolExecutor(
+                max_workers=jobs,
+                mp_context=multiprocessing.get_context('spawn'))
+            _executors[jobs] = executor
+        return executor
+
+
+def _get_worker_database(path, config, baseline_revision, pool_options):
+    # The workers keep their database objects between the calls.
+    db = _worker_databases.get(path)
+    if db is None:
+        db = lnt.server.db.v4db.V4DB(path, config, baseline_revision,
+                                     pool_options)
+        _worker_databases[path] = db
+    return db
+
+
+def _call_in_worker(database, function, args):
+    db = _get_worker_database(*database)
+    session = db.make_session()
+    try:
+        return function(session, db, *args)
+    finally:
+        session.close()
+
+
+def map_jobs(session, db, function, args_list, jobs=1):
+    """
+    map_jobs(session, db, function, args_list, jobs=1) -> list
+
+    Return the list of the results of function(session, db, *args) for each
+    args of args_list. With jobs > 1, the calls are made in that many worker
+    processes, so the function and its arguments and results must be
+    picklable, and the function must only read the database.
+    """
+    args_list = list(args_list)
+    if jobs <= 1 or len(args_list) <= 1:
+        return [function(session, db, *args) for args in args_list]
+
+    database = (db.path, db.config, db.baseline_revision, db.pool_options)
+    executor = _get_executor(jobs)
+    futures = [executor.submit(_call_in_worker, database, function, args)
+               for args in args_list]
+    return [future.result() for future in futures]
@@ -3,6 +3,7 @@ Report functionality centered around individual runs.
 """
 
 from collections import namedtuple
+import json
 import time
 import lnt.server.reporting.analysis
 import lnt.server.ui.app
@@ -12,11 +13,15 @@ import lnt.util.stats
 def generate_run_data(session, run, baseurl, num_comparison_runs=0,
                       result=None, compare_to=None, baseline=None,
                       aggregation_fn=lnt.util.stats.safe_min,
-                      confidence_lv=.05, styles=dict(), classes=dict()):
+                      confidence_lv=.05, styles=dict(), classes=dict(),
+                      use_stored=True):
     """
     Generate raw data for a report on the results of the given individual
     run. They are meant as inputs to jinja templates which could create
     email reports or presentations on a web page.
+
+    The comparisons stored by store_run_comparisons are used unless
+    use_stored is False, which is needed to show the samples of the tests.
     """
     assert num_comparison_runs >= 0
 
@@ -63,8 +68,12 @@ def generate_run_data(session, run, baseurl, num_comparison_runs=0,
         runs_to_load.add(compare_to.id)
     if baseline:
         runs_to_load.add(baseline.id)
-    sri = lnt.server.reporting.analysis.RunInfo(
-        session, ts, runs_to_load, aggregation_fn, confidence_lv)
+    if use_stored:
+        sri = lnt.server.reporting.analysis.StoredRunInfo(
+            session, ts, run, runs_to_load, aggregation_fn, confidence_lv)
+    else:
+        sri = lnt.server.reporting.analysis.RunInfo(
+            session, ts, runs_to_load, aggregation_fn, confidence_lv)
 
     # Get the test names, metric fields and total test counts.
     test_names = session.query(ts.Test.name, ts.Test.id).\
@@ -215,6 +224,47 @@ def generate_run_data(session, run, baseurl, num_comparison_runs=0,
     return data
 
 
+def store_run_comparisons(session, ts, run):
+    """
+    store_run_comparisons(session, ts, run) -> None
+
+    Compare the given run to its previous run and to its baseline, which the
+    run pages show by default, and store the results for generate_run_data.
+    The runs of the next order of the machine are compared to their previous
+    run too, as it may now be the given run.
+    """
+    _store_default_comparisons(session, ts, run)
+    for next_run in ts.get_next_runs_on_machine(session, run, 2):
+        _store_default_comparisons(session, ts, next_run)
+
+
+def _store_default_comparisons(session, ts, run):
+    previous_runs = ts.get_previous_runs_on_machine(session, run, 1)
+    compare_runs = [previous_runs[0] if previous_runs else None]
+    baseline = run.machine.get_baseline_run(session)
+    if baseline is not None and baseline is not compare_runs[0]:
+        compare_runs.append(baseline)
+
+    stored_ids = set(compare_to_id for compare_to_id, in
+                     session.query(ts.RunComparison.compare_to_id)
+                     .filter(ts.RunComparison.run_id == run.id))
+    compare_runs = [r for r in compare_runs
+                    if (r.id if r is not None else None) not in stored_ids]
+    if not compare_runs:
+        return
+
+    sri = lnt.server.reporting.analysis.RunInfo(
+        session, ts, [run.id] + [r.id for r in compare_runs if r is not None])
+    for compare_to in compare_runs:
+        data = lnt.server.reporting.analysis.make_run_comparison_data(
+            sri, run, compare_to)
+        session.add(ts.RunComparison(
+            run_id=run.id,
+            compare_to_id=compare_to.id if compare_to is not None else None,
+            data=json.dumps(data).encode('utf-8')))
+    session.flush()
+
+
 BucketEntry = namedtuple('BucketEntry', ['name', 'cr', 'test_id'])
 
 
@@ -231,10 +281,11 @@ def _get_changes_by_type(ts, run_a, run_b, metric_fields, test_names,
         added_tests = []
         existing_failures = []
         unchanged_tests = []
+        field_results = sri.get_run_comparison_results(
+            run_a, run_b, [test_id for _, test_id in test_names], field,
+            ts.Sample.get_hash_of_binary_field())
         for name, test_id in test_names:
-            cr = sri.get_run_comparison_result(
-                run_a, run_b, test_id, field,
-                ts.Sample.get_hash_of_binary_field())
+            cr = field_results[test_id]
             comparison_results[(name, field)] = cr
             test_status = cr.get_test_status()
             perf_status = cr.get_value_status()
@@ -1,7 +1,9 @@
 import re
 
+import lnt.server.reporting.parallel
 import lnt.testing
 import lnt.util.stats
+from lnt.util import multidict
 
 ###
 # Aggregation Function
@@ -83,6 +85,161 @@ class NormalizedMean(Mean):
                             for v in values])
 
 ###
+# Datapoints
+
+
+def get_datapoints(session, db, ts_name, run_ids):
+    """
+    get_datapoints(session, db, ts_name, run_ids) -> list
+
+    Return the (key, value) datapoints of the samples of the given runs, see
+    SummaryReport.build() for their keys. The runs of each machine can be
+    processed independently of each other (see
+    lnt.server.reporting.parallel).
+    """
+    def get_nts_datapoints_for_sample(ts, sample):
+        # Get the basic sample info.
+        run_id = sample[0]
+        machine_id = run_machine_id_map[run_id]
+        run_parameters = run_parameters_map[run_id]
+
+        # The test name for a sample in the NTS suite is just the name of
+        # the sample test.
+        test_name = sample[1]
+
+        # The arch and build mode are derived from the run flags.
+        arch = run_parameters['cc_target'].split('-')[0]
+        if '86' in arch:
+            arch = 'x86'
+
+        if run_parameters['OPTFLAGS'] == '-O0':
+            build_mode = 'Debug'
+        else:
+            build_mode = 'Release'
+
+        # Return a datapoint for each passing field.
+        for field_name, field, status_field in ts_sample_metric_fields:
+            # Ignore failing samples.
+            if status_field:
+                status_field_index = ts.get_field_index(status_field)
+                if sample[2 + status_field_index] == lnt.testing.FAIL:
+                    continue
+
+            # Ignore missing samples.
+            field_index = ts.get_field_index(field)
+            value = sample[2 + field_index]
+            if value is None:
+                continue
+
+            # Otherwise, return a datapoint.
+            if field_name == 'compile_time':
+                metric = 'Compile Time'
+            else:
+                assert field_name == 'execution_time'
+                metric = 'Execution Time'
+            yield ((test_name, metric, arch, build_mode, machine_id),
+                   value)
+
+    def get_compile_datapoints_for_sample(ts, sample):
+        # Get the basic sample info.
+        run_id = sample[0]
+        machine_id = run_machine_id_map[run_id]
+        run_parameters = run_parameters_map[run_id]
+
+        # Extract the compile flags from the test name.
+        base_name, flags = sample[1].split('(')
+        assert flags[-1] == ')'
+        other_flags = []
+        build_mode = None
+        for flag in flags[:-1].split(','):
+            # If this is an optimization flag, derive the build mode from
+            # it.
+            if flag.startswith('-O'):
+                if '-O0' in flag:
+                    build_mode = 'Debug'
+                else:
+                    build_mode = 'Release'
+                continue
+
+            # If this is a 'config' flag, derive the build mode from it.
+            if flag.startswith('config='):
+                if flag == "config='Debug'":
+                    build_mode = 'Debug'
+                else:
+                    assert flag == "config='Release'"
+                    build_mode = 'Release'
+                continue
+
+            # Otherwise, treat the flag as part of the test name.
+            other_flags.append(flag)
+
+        # Form the test name prefix from the remaining flags.
+        test_name_prefix = '%s(%s)' % (base_name, ','.join(other_flags))
+
+        # Extract the arch from the run info (and normalize).
+        arch = run_parameters['cc_target'].split('-')[0]
+        if arch.startswith('arm'):
+            arch = 'ARM'
+        elif '86' in arch:
+            arch = 'x86'
+
+        # The metric is fixed.
+        metric = 'Compile Time'
+
+        # Report the user and wall time.
+        for field_name, field, status_field in ts_sample_metric_fields:
+            if field_name not in ('user_time', 'wall_time'):
+                continue
+
+            # Ignore failing samples.
+            if status_field:
+                status_field_index = ts.get_field_index(status_field)
+                if sample[2 + status_field_index] == lnt.testing.FAIL:
+                    continue
+
+            # Ignore missing samples.
+            field_index = ts.get_field_index(field)
+            value = sample[2 + field_index]
+            if value is None:
+                continue
+
+            # Otherwise, return a datapoint.
+            yield (('%s.%s' % (test_name_prefix, field_name), metric, arch,
+                    build_mode, machine_id), value)
+
+    def get_datapoints_for_sample(ts, sample):
+        # The exact datapoints in each sample depend on the testsuite
+        if ts.name == 'nts':
+            return get_nts_datapoints_for_sample(ts, sample)
+        else:
+            assert ts.name == 'compile'
+            return get_compile_datapoints_for_sample(ts, sample)
+
+    ts = db.testsuite[ts_name]
+    runs = session.query(ts.Run).filter(ts.Run.id.in_(run_ids)).all()
+
+    # Compute the metric fields.
+    ts_sample_metric_fields = [
+        (f.name, f, f.status_field)
+        for f in ts.Sample.get_metric_fields()]
+
+    # Compute a mapping from run id to machine id.
+    run_machine_id_map = dict((r.id, r.machine.name)
+                              for r in runs)
+
+    # Preload the run parameters.
+    run_parameters_map = dict((r.id, r.parameters)
+                              for r in runs)
+
+    # Load all the samples for all runs we are interested in, with the names
+    # of their tests.
+    columns = [ts.Sample.run_id, ts.Test.name]
+    columns.extend(f.column for f in ts.sample_fields)
+    samples = session.query(*columns) \
+        .filter(ts.Sample.test_id == ts.Test.id) \
+        .filter(ts.Sample.run_id.in_(run_ids))
+    return [datapoint for sample in samples
+            for datapoint in get_datapoints_for_sample(ts, sample)]
 
 
 class SummaryReport(object):
@@ -106,7 +263,10 @@ class SummaryReport(object):
 
         self.warnings = []
 
-    def build(self, session):
+    def build(self, session, jobs=1):
+        """Build the report. The samples of the runs of each machine are read
+        by one of 'jobs' worker processes, see lnt.server.reporting.parallel.
+        """
         # Build a per-testsuite list of the machines that match the specified
         # patterns.
         def should_be_in_report(machine):
@@ -153,11 +313,6 @@ class SummaryReport(object):
                 runs.append((ts_runs, ts_order_ids))
             self.runs_at_index.append(runs)
 
-        # Load the tests for each testsuite.
-        self.tests = dict((ts, dict((test.id, test)
-                                    for test in session.query(ts.Test)))
-                          for ts in self.testsuites)
-
         # Compute the base table for aggregation.
         #
         # The table is indexed by a test name and test features, which are
@@ -176,7 +331,7 @@ class SummaryReport(object):
         #   <machine id>)
 
         self.data_table = {}
-        self._build_data_table(session)
+        self._build_data_table(session, jobs)
 
         # Compute indexed data table by applying the indexing functions.
         self._build_indexed_data_table()
@@ -187,167 +342,29 @@ class SummaryReport(object):
         # Build final organized data tables.
         self._build_final_data_tables()
 
-    def _build_data_table(self, session):
-        def get_nts_datapoints_for_sample(ts, sample):
-            # Get the basic sample info.
-            run_id = sample[0]
-            machine_id = run_machine_id_map[run_id]
-            run_parameters = run_parameters_map[run_id]
-
-            # Get the test.
-            test = ts_tests[sample[1]]
-
-            # The test name for a sample in the NTS suite is just the name of
-            # the sample test.
-            test_name = test.name
-
-            # The arch and build mode are derived from the run flags.
-            arch = run_parameters['cc_target'].split('-')[0]
-            if '86' in arch:
-                arch = 'x86'
-
-            if run_parameters['OPTFLAGS'] == '-O0':
-                build_mode = 'Debug'
-            else:
-                build_mode = 'Release'
-
-            # Return a datapoint for each passing field.
-            for field_name, field, status_field in ts_sample_metric_fields:
-                # Ignore failing samples.
-                if status_field:
-                    status_field_index = ts.get_field_index(status_field)
-                    if sample[2 + status_field_index] == lnt.testing.FAIL:
-                        continue
-
-                # Ignore missing samples.
-                field_index = ts.get_field_index(field)
-                value = sample[2 + field_index]
-                if value is None:
-                    continue
-
-                # Otherwise, return a datapoint.
-                if field_name == 'compile_time':
-                    metric = 'Compile Time'
-                else:
-                    assert field_name == 'execution_time'
-                    metric = 'Execution Time'
-                yield ((test_name, metric, arch, build_mode, machine_id),
-                       value)
-
-        def get_compile_datapoints_for_sample(ts, sample):
-            # Get the basic sample info.
-            run_id = sample[0]
-            machine_id = run_machine_id_map[run_id]
-            run_parameters = run_parameters_map[run_id]
-
-            # Get the test.
-            test = ts_tests[sample[1]]
-
-            # Extract the compile flags from the test name.
-            base_name, flags = test.name.split('(')
-            assert flags[-1] == ')'
-            other_flags = []
-            build_mode = None
-            for flag in flags[:-1].split(','):
-                # If this is an optimization flag, derive the build mode from
-                # it.
-                if flag.startswith('-O'):
-                    if '-O0' in flag:
-                        build_mode = 'Debug'
-                    else:
-                        build_mode = 'Release'
-                    continue
-
-                # If this is a 'config' flag, derive the build mode from it.
-                if flag.startswith('config='):
-                    if flag == "config='Debug'":
-                        build_mode = 'Debug'
-                    else:
-                        assert flag == "config='Release'"
-                        build_mode = 'Release'
-                    continue
-
-                # Otherwise, treat the flag as part of the test name.
-                other_flags.append(flag)
-
-            # Form the test name prefix from the remaining flags.
-            test_name_prefix = '%s(%s)' % (base_name, ','.join(other_flags))
-
-            # Extract the arch from the run info (and normalize).
-            arch = run_parameters['cc_target'].split('-')[0]
-            if arch.startswith('arm'):
-                arch = 'ARM'
-            elif '86' in arch:
-                arch = 'x86'
-
-            # The metric is fixed.
-            metric = 'Compile Time'
-
-            # Report the user and wall time.
-            for field_name, field, status_field in ts_sample_metric_fields:
-                if field_name not in ('user_time', 'wall_time'):
-                    continue
-
-                # Ignore failing samples.
-                if status_field:
-                    status_field_index = ts.get_field_index(status_field)
-                    if sample[2 + status_field_index] == lnt.testing.FAIL:
-                        continue
-
-                # Ignore missing samples.
-                field_index = ts.get_field_index(field)
-                value = sample[2 + field_index]
-                if value is None:
-                    continue
-
-                # Otherwise, return a datapoint.
-                yield (('%s.%s' % (test_name_prefix, field_name), metric, arch,
-                        build_mode, machine_id), value)
-
-        def get_datapoints_for_sample(ts, sample):
-            # The exact datapoints in each sample depend on the testsuite
-            if ts.name == 'nts':
-                return get_nts_datapoints_for_sample(ts, sample)
-            else:
-                assert ts.name == 'compile'
-                return get_compile_datapoints_for_sample(ts, sample)
-
-        # For each column...
+    def _build_data_table(self, session, jobs):
+        # Get the datapoints of the runs of each machine, for each column and
+        # test suite.
+        tasks = []
         for index, runs in enumerate(self.runs_at_index):
-            # For each test suite and run list...
             for ts, (ts_runs, _) in zip(self.testsuites, runs):
-                ts_tests = self.tests[ts]
-
-                # Compute the metric fields.
-                ts_sample_metric_fields = [
-                    (f.name, f, f.status_field)
-                    for f in ts.Sample.get_metric_fields()]
-
-                # Compute a mapping from run id to run.
-                run_id_map = dict((r.id, r)
-                                  for r in ts_runs)
-
-                # Compute a mapping from run id to machine id.
-                run_machine_id_map = dict((r.id, r.machine.name)
-                                          for r in ts_runs)
-
-                # Preload the run parameters.
-                run_parameters_map = dict((r.id, r.parameters)
-                                          for r in ts_runs)
-
-                # Load all the samples for all runs we are interested in.
-                columns = [ts.Sample.run_id, ts.Sample.test_id]
-                columns.extend(f.column for f in ts.sample_fields)
-                samples = session.query(*columns).filter(
-                    ts.Sample.run_id.in_(list(run_id_map.keys())))
-                for sample in samples:
-                    for key, value in get_datapoints_for_sample(ts, sample):
-                        items = self.data_table.get(key)
-                        if items is None:
-                            items = [[]
-                                     for _ in self.report_orders]
-                            self.data_table[key] = items
-                        items[index].append(value)
+                machine_run_ids = multidict.multidict()
+                for r in ts_runs:
+                    machine_run_ids[r.machine_id] = r.id
+                for machine_id, run_ids in sorted(machine_run_ids.items()):
+                    tasks.append((index, ts, run_ids))
+        datapoints = lnt.server.reporting.parallel.map_jobs(
+            session, self.db, get_datapoints,
+            [(ts.name, run_ids) for _, ts, run_ids in tasks], jobs)
+
+        for (index, _, _), task_datapoints in zip(tasks, datapoints):
+            for key, value in task_datapoints:
+                items = self.data_table.get(key)
+                if items is None:
+                    items = [[]
+                             for _ in self.report_orders]
+                    self.data_table[key] = items
+                items[index].append(value)
 
     def _build_indexed_data_table(self):
         def is_in_execution_time_filter(name):
@@ -1,3 +1,4 @@
+import collections
 import lnt.util.ImportData
 import re
 import yaml
@@ -9,10 +10,11 @@ from flask_restful import Resource, abort
 from sqlalchemy.orm import joinedload
 from sqlalchemy.orm.exc import NoResultFound
 
+from lnt.server.ui.downsample import change_order_ids, lttb_indices
 from lnt.server.ui.util import convert_revision
 from lnt.server.ui.decorators import in_db
-from lnt.testing import PASS
 from lnt.util import logger
+from lnt.server.db import jobqueue
 from lnt.server.db import testsuite
 from lnt.server.db import testsuitedb
 from functools import wraps
@@ -66,6 +68,81 @@ def add_common_fields(to_update):
     to_update.update(common_fields_factory())
 
 
+NDJSON_MIMETYPE = 'application/x-ndjson'
+
+
+def paginate(query, id_column):
+    """Restrict a query to the page of rows selected by the 'after_id' and
+    'limit' arguments of the request: the rows with an ID above 'after_id',
+    in order of ID, at most 'limit' of them. Returns the query and the limit,
+    or None if the request does not set one."""
+    after_id = request.args.get('after_id', type=int)
+    if after_id is not None:
+        query = query.filter(id_column > after_id)
+    query = query.order_by(id_column)
+    limit = request.args.get('limit', type=int)
+    if limit is not None and limit <= 0:
+        limit = None
+    if limit is not None:
+        query = query.limit(limit)
+    return query, limit
+
+
+def filter_prefix(query, name_column):
+    """Restrict a query to the rows whose name starts with the 'prefix'
+    argument of the request, if any."""
+    prefix = request.args.get('prefix')
+    if prefix:
+        query = query.filter(name_column.startswith(prefix, autoescape=True))
+    return query
+
+
+def list_response(result, key, query, to_json, limit):
+    """
+    Return the objects of a query, converted to dicts by to_json, in the list
+    key of the result. The 'fields' argument of the request selects the keys
+    to keep in each object. If the request is paginated, the result gives the
+    'next_after_id' to request the next page with, which is None on the last
+    page.
+
+    When the request has a 'format=ndjson' argument or only accepts NDJSON,
+    the objects are instead streamed as newline delimited JSON, one per line,
+    without the rest of the result.
+    """
+    fields = request.args.get('fields')
+    if fields:
+        fields = set(fields.split(',')) | {'id'}
+
+    def project(obj):
+        if fields:
+            obj = {k: v for k, v in obj.items() if k in fields}
+        return obj
+
+    if request.args.get('format') == 'ndjson' or \
+            request.accept_mimetypes.best == NDJSON_MIMETYPE:
+        db = request.db
+
+        def generate():
+            # The request session is closed once the view returns, before the
+            # response is streamed, so the rows are read in a session of their
+            # own.
+            session = db.make_session()
+            try:
+                for row in query.with_session(session).yield_per(1000):
+                    yield json.dumps(project(to_json(row))) + '\n'
+            finally:
+                session.close()
+        return Response(stream_with_context(generate()),
+                        mimetype=NDJSON_MIMETYPE)
+
+    objs = [project(to_json(row)) for row in query]
+    result[key] = objs
+    if limit is not None:
+        result['next_after_id'] = objs[-1]['id'] if len(objs) == limit \
+            else None
+    return result
+
+
 class Fields(Resource):
     """List all the fields in the test suite."""
     method_decorators = [in_db]
@@ -90,10 +167,10 @@ class Tests(Resource):
         ts = request.get_testsuite()
 
         result = common_fields_factory()
-        tests = request.session.query(ts.Test).all()
-        result['tests'] = [t.__json__() for t in tests]
-
-        return result
+        tests = filter_prefix(request.session.query(ts.Test), ts.Test.name)
+        tests, limit = paginate(tests, ts.Test.id)
+        return list_response(result, 'tests', tests,
+                             lambda t: t.__json__(), limit)
 
 
 class Machines(Resource):
@@ -104,11 +181,12 @@ class Machines(Resource):
     def get():
         ts = request.get_testsuite()
         session = request.session
-        machines = session.query(ts.Machine).order_by(ts.Machine.id).all()
+        machines = filter_prefix(session.query(ts.Machine), ts.Machine.name)
+        machines, limit = paginate(machines, ts.Machine.id)
 
         result = common_fields_factory()
-        result['machines'] = machines
-        return result
+        return list_response(result, 'machines', machines,
+                             lambda m: m.__json__(), limit)
 
 
 class Machine(Resource):
@@ -144,15 +222,13 @@ class Machine(Resource):
         machine = Machine._get_machine(machine_spec)
         machine_runs = session.query(ts.Run) \
             .filter(ts.Run.machine_id == machine.id) \
-            .options(joinedload(ts.Run.order)) \
-            .all()
-
-        runs = [run.__json__(flatten_order=True) for run in machine_runs]
+            .options(joinedload(ts.Run.order))
+        machine_runs, limit = paginate(machine_runs, ts.Run.id)
 
         result = common_fields_factory()
         result['machine'] = machine
-        result['runs'] = runs
-        return result
+        return list_response(result, 'runs', machine_runs,
+                             lambda r: r.__json__(flatten_order=True), limit)
 
     @staticmethod
     @requires_auth_token
@@ -234,14 +310,22 @@ class Machine(Resource):
                 abort(400, msg="Expected 'into' for merge request")
             into = Machine._get_machine(into_id)
             into_name = "%s:%s" % (into.name, into.id)
+            order_ids = [o for o, in session.query(ts.Run.order_id)
+                         .filter(ts.Run.machine_id == machine.id)
+                         .distinct()]
             session.query(ts.Run) \
                 .filter(ts.Run.machine_id == machine.id) \
                 .update({ts.Run.machine_id: into.id},
                         synchronize_session=False)
+            session.query(ts.SeriesPoint) \
+                .filter(ts.SeriesPoint.machine_id == machine.id) \
+                .update({ts.SeriesPoint.machine_id: into.id},
+                        synchronize_session=False)
             session.expire_all()  # be safe after synchronize_session==False
             # re-query Machine so we can delete it.
             machine = Machine._get_machine(machine_spec)
             session.delete(machine)
+            ts.update_geomeans(session, into.id, order_ids)
             session.commit()
             logger.info("Merged machine %s into %s" %
                         (machine_name, into_name))
@@ -294,6 +378,7 @@ class Run(Resource):
         if run is None:
             abort(404, msg="Did not find run " + str(run_id))
         session.delete(run)
+        ts.update_geomeans(session, run.machine_id, [run.order_id])
         session.commit()
         logger.info("Deleted run %s" % (run_id,))
 
@@ -308,15 +393,20 @@ class Runs(Resource):
         """Add a new run into the lnt database"""
         session = request.session
         db = request.get_db()
-        data = request.get_data(as_text=True)
+        data = request.get_data()
         select_machine = request.values.get('select_machine', 'match')
         merge = request.values.get('merge', None)
         ignore_regressions = request.values.get('ignore_regressions', False) \
             or getattr(current_app.old_config, 'ignore_regressions', False)
+        lean = request.values.get('lean')
+        if lean is None:
+            lean = getattr(current_app.old_config, 'lean_submissions', False)
+        else:
+            lean = lean.lower() not in ('', '0', 'false')
         result = lnt.util.ImportData.import_from_string(
             current_app.old_config, g.db_name, db, session, g.testsuite_name,
             data, select_machine=select_machine, merge_run=merge,
-            ignore_regressions=ignore_regressions)
+            ignore_regressions=ignore_regressions, lean=lean)
 
         error = result['error']
         if error is not None:
@@ -477,13 +567,15 @@ class SamplesData(Resource):
             .join(ts.Run) \
             .join(ts.Order) \
             .filter(ts.Sample.run_id.in_(run_ids))
+        q = filter_prefix(q, ts.Test.name)
+        q, limit = paginate(q, ts.Sample.id)
         result = common_fields_factory()
         # noinspection PyProtectedMember
-        result['samples'] = [{k: v for k, v in sample.items() if v is not None}
-                             for sample in [sample._asdict()
-                                            for sample in q.all()]]
-
-        return result
+        return list_response(
+            result, 'samples', q,
+            lambda sample: {k: v for k, v in sample._asdict().items()
+                            if v is not None},
+            limit)
 
 
 class Graph(Resource):
@@ -507,19 +599,17 @@ class Graph(Resource):
         except NoResultFound:
             abort(404)
 
-        q = session.query(field.column, ts.Order.llvm_project_revision,
-                          ts.Run.start_time, ts.Run.id) \
-            .select_from(ts.Sample) \
-            .join(ts.Run) \
-            .join(ts.Order) \
-            .filter(ts.Run.machine_id == machine.id) \
-            .filter(ts.Sample.test == test) \
-            .filter(field.column.isnot(None)) \
-            .order_by(ts.Order.llvm_project_revision.desc())
+        points = ts.SeriesPoint
+        q = session.query(points.value, ts.Order.llvm_project_revision,
+                          points.start_time, points.run_id, points.order_id) \
+            .join(ts.Order, points.order_id == ts.Order.id) \
+            .filter(points.machine_id == machine.id) \
+            .filter(points.test_id == test.id) \
+            .filter(points.field_id == field.id) \
+            .order_by(points.sort_key.desc(), points.id.desc())
 
         if field.status_field:
-            q = q.filter((field.status_field.column == PASS) |
-                         (field.status_field.column.is_(None)))
+            q = q.filter(points.passed == True)
 
         limit = request.values.get('limit', None)
         if limit:
@@ -527,10 +617,166 @@ class Graph(Resource):
             if limit:
                 q = q.limit(limit)
 
+        rows = q.all()[::-1]
+        rows.sort(key=lambda row: convert_revision(row[1]))
+
+        # Downsample the line, keeping the points of its regressions.
+        max_points = request.values.get('max_points', type=int)
+        if max_points and len(rows) > max_points:
+            keep_order_ids = change_order_ids(
+                session, ts, [(machine.id, test.id, field.id)])[
+                    (machine.id, test.id, field.id)]
+            keep = [i for i, row in enumerate(rows)
+                    if row[4] in keep_order_ids]
+            indices = lttb_indices([row[0] for row in rows], max_points,
+                                   keep=keep)
+            rows = [rows[i] for i in indices]
+
         samples = [
             [rev, val,
              {'label': rev, 'date': str(time), 'runID': str(rid)}]
-            for val, rev, time, rid in q.all()[::-1]
+            for val, rev, time, rid, _ in rows
+        ]
+        return samples
+
+
+class GraphSeries(Resource):
+    """The data of several lines of a graph, fetched with a single query."""
+    method_decorators = [in_db]
+
+    @staticmethod
+    def get():
+        """Get the points of each requested line, as columns of orders,
+        values, dates and run IDs."""
+        session = request.session
+        ts = request.get_testsuite()
+
+        # Lines are passed as series=<machine id>.<test id>.<field index>.
+        series = []
+        for value in request.args.getlist('series'):
+            try:
+                machine_id, test_id, field_index = map(int, value.split('.'))
+                field = ts.sample_fields[field_index]
+            except (ValueError, IndexError):
+                abort(400, msg="Invalid series '%s', expected "
+                               "<machine id>.<test id>.<field index>" % value)
+            series.append((machine_id, test_id, field_index, field.id))
+        if not series:
+            abort(400, msg='No series found in args. Should be '
+                           '"graphs?series=1.2.0&series=1.3.0" etc.')
+        limit = request.args.get('limit', type=int)
+        max_points = request.args.get('max_points', type=int)
+
+        # Select the points of the tests of each machine and field at once.
+        points = ts.SeriesPoint
+        tests = collections.defaultdict(set)
+        for machine_id, test_id, _, field_id in series:
+            tests[(machine_id, field_id)].add(test_id)
+        q = session.query(points.machine_id, points.test_id, points.field_id,
+                          ts.Order.fields[0].column, points.value,
+                          points.start_time, points.run_id, points.order_id,
+                          points.sort_key, points.id) \
+            .join(ts.Order, points.order_id == ts.Order.id) \
+            .filter(sqlalchemy.or_(*[
+                sqlalchemy.and_(points.machine_id == machine_id,
+                                points.field_id == field_id,
+                                points.test_id.in_(test_ids))
+                for (machine_id, field_id), test_ids in tests.items()])) \
+            .filter(points.passed == True)
+
+        if limit:
+            # Keep the latest points of each line.
+            rank = sqlalchemy.func.row_number().over(
+                partition_by=(points.machine_id, points.test_id,
+                              points.field_id),
+                order_by=(points.sort_key.desc(), points.id.desc()))
+            subquery = q.add_columns(rank.label('rank')).subquery()
+            columns = list(subquery.c)
+            q = session.query(*columns[:-1]) \
+                .filter(columns[-1] <= limit) \
+                .order_by(columns[-3], columns[-2])
+        else:
+            q = q.order_by(points.sort_key, points.id)
+
+        lines = collections.defaultdict(lambda: ([], [], [], [], []))
+        for machine_id, test_id, field_id, order, value, start_time, \
+                run_id, order_id, _, _ in q:
+            orders, values, dates, run_ids, order_ids = \
+                lines[(machine_id, test_id, field_id)]
+            orders.append(order)
+            values.append(value)
+            dates.append(str(start_time))
+            run_ids.append(run_id)
+            order_ids.append(order_id)
+
+        # Downsample the lines like the graph page, keeping the points of
+        # their regressions.
+        if max_points:
+            keep_order_ids = change_order_ids(
+                session, ts, [(machine_id, test_id, field_id)
+                              for machine_id, test_id, _, field_id
+                              in series])
+
+        result = common_fields_factory()
+        result['series'] = []
+        for machine_id, test_id, field_index, field_id in series:
+            orders, values, dates, run_ids, order_ids = \
+                lines[(machine_id, test_id, field_id)]
+            if max_points:
+                line_keep_order_ids = \
+                    keep_order_ids[(machine_id, test_id, field_id)]
+                keep = [i for i, order_id in enumerate(order_ids)
+                        if order_id in line_keep_order_ids]
+                indices = lttb_indices(values, max_points, keep=keep)
+                orders, values, dates, run_ids = (
+                    [column[i] for i in indices]
+                    for column in (orders, values, dates, run_ids))
+            result['series'].append({
+                'machine_id': machine_id,
+                'test_id': test_id,
+                'field_index': field_index,
+                'orders': orders,
+                'values': values,
+                'dates': dates,
+                'run_ids': run_ids,
+            })
+        return result
+
+
+class Geomean(Resource):
+    """The geometric mean of all the tests of a machine, for each order."""
+    method_decorators = [in_db]
+
+    @staticmethod
+    def get(machine_id, field_index):
+        """Get the data for the mean trend line of a graph."""
+        session = request.session
+        ts = request.get_testsuite()
+        try:
+            machine = session.query(ts.Machine) \
+                .filter(ts.Machine.id == machine_id) \
+                .one()
+            field = ts.sample_fields[field_index]
+        except (NoResultFound, IndexError):
+            abort(404)
+
+        geomeans = ts.Geomean
+        q = session.query(geomeans.value, ts.Order.llvm_project_revision,
+                          geomeans.start_time) \
+            .join(ts.Order, geomeans.order_id == ts.Order.id) \
+            .filter(geomeans.machine_id == machine.id) \
+            .filter(geomeans.field_id == field.id) \
+            .order_by(geomeans.sort_key.desc())
+
+        limit = request.values.get('limit', None)
+        if limit:
+            limit = int(limit)
+            if limit:
+                q = q.limit(limit)
+
+        samples = [
+            [rev, val, {'label': rev, 'date': str(time)}]
+            for val, rev, time in q.all()[::-1]
         ]
         samples.sort(key=lambda x: convert_revision(x[0]))
         return samples
@@ -589,6 +835,27 @@ class Regression(Resource):
         return results
 
 
+class Jobs(Resource):
+    """Statistics about the post submission job queue, and the most recent
+    jobs."""
+    method_decorators = [in_db]
+
+    @staticmethod
+    def get():
+        ts = request.get_testsuite()
+        session = request.session
+        limit = request.args.get('limit', 100, type=int)
+
+        result = common_fields_factory()
+        result.update(jobqueue.get_statistics(session, ts.name, limit))
+        result['jobs'] = session.query(jobqueue.PostSubmitJob) \
+            .filter(jobqueue.PostSubmitJob.testsuite_name == ts.name) \
+            .order_by(jobqueue.PostSubmitJob.id.desc()) \
+            .limit(limit) \
+            .all()
+        return result
+
+
 def ts_path(path):
     """Make a URL path with a database and test suite embedded in them."""
     return "/api/db_<string:db>/v4/<string:ts>/" + path
@@ -616,6 +883,10 @@ def load_api_resources(api):
     api.add_resource(Order, ts_path("orders/<int:order_id>"))
     graph_url = "graph/<int:machine_id>/<int:test_id>/<int:field_index>"
     api.add_resource(Graph, ts_path(graph_url))
+    api.add_resource(GraphSeries, ts_path("graphs"), ts_path("graphs/"))
+    geomean_url = "geomean/<int:machine_id>/<int:field_index>"
+    api.add_resource(Geomean, ts_path(geomean_url))
     regression_url = \
         "regression/<int:machine_id>/<int:test_id>/<int:field_index>"
     api.add_resource(Regression, ts_path(regression_url))
+    api.add_resource(Jobs, ts_path("jobs"), ts_path("jobs/"))
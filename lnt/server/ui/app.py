@@ -15,6 +15,8 @@ from flask import request
 from flask import jsonify
 from flask import render_template
 from flask_restful import Api
+import sqlalchemy.engine
+import sqlalchemy.event
 from sqlalchemy.ext.declarative import DeclarativeMeta
 
 import lnt
@@ -23,11 +25,13 @@ import lnt.server.db.v4db
 import lnt.server.instance
 import lnt.server.ui.filters
 import lnt.server.ui.globals
+import lnt.server.ui.profile_cache
 import lnt.server.ui.profile_views
 import lnt.server.ui.regression_views
 import lnt.server.ui.views
 from lnt.server.ui.api import load_api_resources
 from lnt.util import logger
+from lnt.util import metrics
 
 
 class RootSlashPatchMiddleware(object):
@@ -79,6 +83,10 @@ class Request(flask.Request):
         self.request_time = time.time()
         self.db = None
         self.testsuite = None
+        # The number of SQL statements executed for this request, and the
+        # time spent executing them.
+        self.sql_queries = 0
+        self.sql_time = 0.0
 
     def elapsed_time(self):
         return time.time() - self.request_time
@@ -116,12 +124,37 @@ class Request(flask.Request):
         t = self.elapsed_time()
         if t > 10:
             logger.warning("Request {} took {}s".format(self.url, t))
-        db = getattr(self, 'db', None)
-        if db is not None:
-            db.close()
+        # The database is shared by the requests of the instance, and its
+        # connections return to its pool when the session of the request is
+        # closed.
         return super(Request, self).close()
 
 
+def _before_cursor_execute(conn, cursor, statement, parameters, context,
+                           executemany):
+    if context is not None and flask.has_request_context():
+        context.lnt_start_time = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context,
+                          executemany):
+    start_time = getattr(context, 'lnt_start_time', None)
+    if start_time is not None and flask.has_request_context():
+        request.sql_queries += 1
+        request.sql_time += time.perf_counter() - start_time
+
+
+def _record_request_metrics(response):
+    endpoint = request.endpoint or 'none'
+    metrics.REQUEST_SECONDS.observe(request.elapsed_time(), endpoint=endpoint,
+                                    method=request.method,
+                                    status=response.status_code)
+    metrics.REQUEST_SQL_QUERIES.observe(request.sql_queries,
+                                        endpoint=endpoint)
+    metrics.REQUEST_SQL_SECONDS.observe(request.sql_time, endpoint=endpoint)
+    return response
+
+
 class LNTExceptionLoggerFlask(flask.Flask):
     def log_exception(self, exc_info):
         # We need to stringify the traceback, since logs are sent via
@@ -152,6 +185,17 @@ class App(LNTExceptionLoggerFlask):
         app.api = Api(app)
         load_api_resources(app.api)
 
+        # Time the SQL statements of the requests, for /metrics.
+        for name, listener in (('before_cursor_execute',
+                                _before_cursor_execute),
+                               ('after_cursor_execute',
+                                _after_cursor_execute)):
+            if not sqlalchemy.event.contains(sqlalchemy.engine.Engine, name,
+                                             listener):
+                sqlalchemy.event.listen(sqlalchemy.engine.Engine, name,
+                                        listener)
+        app.after_request(_record_request_metrics)
+
         @app.before_request
         def set_session():
             """Make our session cookies last."""
@@ -233,6 +277,9 @@ class App(LNTExceptionLoggerFlask):
         # Set the application secret key.
         self.secret_key = self.old_config.secretKey
 
+        self.profile_cache = lnt.server.ui.profile_cache.ProfileCache(
+            self.old_config.profile_cache_size)
+
         lnt.server.db.rules_manager.register_hooks()
 
 
@@ -0,0 +1,93 @@
+"""
+Reducing the number of points of the lines of a graph, for graphs with more
+points than can be told apart on screen.
+
+lttb_indices returns the indices of the points to keep, in increasing order,
+so that the other data of the points (orders, dates, run IDs) can be picked
+along with their values. The points of the regressions of the lines, given by
+change_order_ids, are kept by all the graphs.
+"""
+
+import collections
+
+
+def lttb_indices(values, max_points, xs=None, keep=()):
+    """
+    lttb_indices(values, max_points, [xs], [keep]) -> [index]
+
+    Return the indices of at most max_points of the values, chosen with the
+    Largest-Triangle-Three-Buckets algorithm: the first and last values are
+    kept, and from each bucket of the values between them, the one forming
+    the largest triangle with the value kept from the previous bucket and the
+    mean of the next bucket. The X coordinates of the values are xs, or their
+    indices if not given.
+
+    The indices in keep, such as the points of regressions, are kept as well
+    and take their share of max_points, which is only exceeded when there are
+    too many of them.
+    """
+    num_values = len(values)
+    keep = set(i for i in keep if 0 <= i < num_values)
+    if max_points is None or num_values <= max_points:
+        return list(range(num_values))
+    if max_points < 3:
+        return sorted(keep.union([0, num_values - 1][:max_points]))
+    if xs is None:
+        xs = range(num_values)
+
+    budget = max(max_points - len(keep), 2)
+    indices = [0]
+    if budget > 2:
+        bucket_size = (num_values - 2) / (budget - 2)
+        previous = 0
+        for bucket in range(budget - 2):
+            start = int(bucket * bucket_size) + 1
+            end = int((bucket + 1) * bucket_size) + 1
+            next_end = min(int((bucket + 2) * bucket_size) + 1, num_values)
+            next_x = sum(xs[i] for i in range(end, next_end)) / \
+                (next_end - end)
+            next_y = sum(values[i] for i in range(end, next_end)) / \
+                (next_end - end)
+
+            prev_x = xs[previous]
+            prev_y = values[previous]
+            best_area = -1
+            for i in range(start, end):
+                area = abs((prev_x - next_x) * (values[i] - prev_y) -
+                           (prev_x - xs[i]) * (next_y - prev_y))
+                if area > best_area:
+                    best_area = area
+                    previous = i
+            indices.append(previous)
+    indices.append(num_values - 1)
+    return sorted(keep.union(indices))
+
+
+def change_order_ids(session, ts, series):
+    """
+    change_order_ids(session, ts, series) -> {series: set(order ID)}
+
+    Return the start and end orders of the field changes of each line in
+    series, given as (machine ID, test ID, field ID), whose points are kept
+    when the lines are downsampled.
+    """
+    series = set(series)
+    order_ids = collections.defaultdict(set)
+    if not series:
+        return order_ids
+    changes = session.query(ts.FieldChange.machine_id,
+                            ts.FieldChange.test_id,
+                            ts.FieldChange.field_id,
+                            ts.FieldChange.start_order_id,
+                            ts.FieldChange.end_order_id) \
+        .filter(ts.FieldChange.machine_id.in_(
+            set(machine_id for machine_id, _, _ in series))) \
+        .filter(ts.FieldChange.test_id.in_(
+            set(test_id for _, test_id, _ in series))) \
+        .filter(ts.FieldChange.field_id.in_(
+            set(field_id for _, _, field_id in series)))
+    for machine_id, test_id, field_id, start_order_id, end_order_id \
+            in changes:
+        order_ids[(machine_id, test_id, field_id)].update(
+            (start_order_id, end_order_id))
+    return order_ids
@@ -0,0 +1,168 @@
+"""
+A cache of the profiles decoded by the profile viewer.
+
+Browsing a profile queries its functions, its counters and then the code of
+each function the user clicks on, and each of these requests would otherwise
+decode the profile file again. The cache is shared by the threads of a server
+process, and is bounded by the (approximate) size of what it holds in memory.
+"""
+
+import collections
+import os
+import threading
+
+from lnt.testing.profile.profile import Profile
+
+# The size accounted for each instruction of a code listing, on top of the size
+# of its text.
+_INSTRUCTION_SIZE = 200
+
+
+class _CachedProfile(object):
+    def __init__(self, profile):
+        self.profile = profile
+        # Decoding the code of a function is not thread safe.
+        self.lock = threading.Lock()
+        self.closed = False
+
+    def close(self):
+        """Release the file of the profile once it was evicted."""
+        with self.lock:
+            self.profile.close()
+            self.closed = True
+
+
+class ProfileCache(object):
+    """A least recently used cache of profiles and of the code listings of
+    their functions, keyed by the name and modification time of the profile
+    files. The size of a profile is the size of its sections decoded so far,
+    which grows as the code of its functions is read, or the size of its file
+    for the formats which do not report it."""
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        self.entries = collections.OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+
+    def _get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return entry[0]
+
+    def _evict(self):
+        """Remove the least recently used entries until the cache fits in its
+        maximum size, and return their values. The cache lock must be
+        held."""
+        evicted = []
+        while self.size > self.max_size:
+            _, (value, size) = self.entries.popitem(last=False)
+            self.size -= size
+            evicted.append(value)
+        return evicted
+
+    @staticmethod
+    def _close(evicted):
+        # This is done outside of the cache lock, as closing a profile waits
+        # for the code listings being read from it.
+        for value in evicted:
+            if isinstance(value, _CachedProfile):
+                value.close()
+
+    def _put(self, key, value, size):
+        with self.lock:
+            if size > self.max_size:
+                return value
+            evicted = []
+            old = self.entries.pop(key, None)
+            if old is not None:
+                # Another thread loaded the same entry meanwhile.
+                self.size -= old[1]
+                evicted.append(old[0])
+            self.entries[key] = (value, size)
+            self.size += size
+            evicted.extend(self._evict())
+        self._close(evicted)
+        return value
+
+    def _resize(self, key, size):
+        """Update the size of an entry whose value grew."""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return
+            self.entries[key] = (entry[0], size)
+            self.size += size - entry[1]
+            evicted = self._evict()
+        self._close(evicted)
+
+    @staticmethod
+    def _profile_size(profile, stat):
+        size = profile.getDecodedSize()
+        return stat.st_size if size is None else size
+
+    def _get_profile(self, path, stat):
+        key = (path, stat.st_mtime_ns)
+        cached = self._get(key)
+        if cached is None:
+            profile = Profile.fromFile(path)
+            cached = self._put(key, _CachedProfile(profile),
+                               self._profile_size(profile, stat))
+        return cached
+
+    def get_profile(self, path):
+        """Return the profile in the file at path."""
+        return self._get_profile(path, os.stat(path)).profile
+
+    def get_code_for_function(self, path, fname):
+        """Return the list of the instructions of the function fname in the
+        profile at path, as given by Profile.getCodeForFunction."""
+        stat = os.stat(path)
+        key = (path, stat.st_mtime_ns, fname)
+        code = self._get(key)
+        if code is None:
+            cached = self._get_profile(path, stat)
+            with cached.lock:
+                if cached.closed:
+                    # The profile was evicted meanwhile, read it again.
+                    profile = Profile.fromFile(path)
+                    code = list(profile.getCodeForFunction(fname))
+                    profile.close()
+                    profile_size = None
+                else:
+                    code = list(cached.profile.getCodeForFunction(fname))
+                    profile_size = self._profile_size(cached.profile, stat)
+            if profile_size is not None:
+                # The sections holding the code are decoded now.
+                self._resize((path, stat.st_mtime_ns), profile_size)
+            size = sum(_INSTRUCTION_SIZE + len(text) for _, _, text in code)
+            self._put(key, code, size)
+        return code
+
+    def clear(self):
+        with self.lock:
+            entries = list(self.entries.values())
+            self.entries.clear()
+            self.size = 0
+        for value, _ in entries:
+            if isinstance(value, _CachedProfile):
+                value.close()
+
+    def get_stats(self):
+        """Return a dictionary of the hit and miss counts, and of the number
+        and size of the cached entries."""
+        with self.lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'entries': len(self.entries),
+                'size': self.size,
+                'max_size': self.max_size,
+            }
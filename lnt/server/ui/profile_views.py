@@ -18,6 +18,11 @@ def _get_sample(session, ts, run_id, test_id):
                     .filter(ts.Sample.profile_id.isnot(None)).first()
 
 
+def _get_profile_path(sample):
+    return os.path.join(current_app.old_config.profileDir,
+                        sample.profile.filename)
+
+
 @frontend.route('/profile/admin')
 def profile_admin():
     profileDir = current_app.old_config.profileDir
@@ -37,6 +42,7 @@ def profile_admin():
     # Convert from UNIX timestamps to Javascript timestamps.
     history = [[x * 1000, y] for x, y in history]
     age = [[x * 1000, y] for x, y in age]
+    cache_stats = current_app.profile_cache.get_stats()
 
     # Calculate a histogram bucket size that shows ~20 bars on the screen
     num_buckets = 20
@@ -56,7 +62,8 @@ def profile_admin():
     age = [[k * bucket_size, hist[k]] for k in sorted(hist.keys())]
 
     return render_template("profile_admin.html",
-                           history=history, age=age, bucket_size=bucket_size)
+                           history=history, age=age, bucket_size=bucket_size,
+                           cache_stats=cache_stats)
 
 
 @v4_route("/profile/ajax/getFunctions")
@@ -66,12 +73,10 @@ def v4_profile_ajax_getFunctions():
     runid = request.args.get('runid')
     testid = request.args.get('testid')
 
-    profileDir = current_app.old_config.profileDir
-
     sample = _get_sample(session, ts, runid, testid)
 
     if sample and sample.profile:
-        p = sample.profile.load(profileDir)
+        p = current_app.profile_cache.get_profile(_get_profile_path(sample))
         return json.dumps([[n, f] for n, f in p.getFunctions().items()])
     else:
         abort(404)
@@ -84,14 +89,13 @@ def v4_profile_ajax_getTopLevelCounters():
     runids = request.args.get('runids').split(',')
     testid = request.args.get('testid')
 
-    profileDir = current_app.old_config.profileDir
-
     idx = 0
     tlc = {}
     for rid in runids:
         sample = _get_sample(session, ts, rid, testid)
         if sample and sample.profile:
-            p = sample.profile.load(profileDir)
+            p = current_app.profile_cache.get_profile(
+                _get_profile_path(sample))
             for k, v in p.getTopLevelCounters().items():
                 tlc.setdefault(k, [None]*len(runids))[idx] = v
         idx += 1
@@ -111,14 +115,13 @@ def v4_profile_ajax_getCodeForFunction():
     testid = request.args.get('testid')
     f = urllib.parse.unquote(request.args.get('f'))
 
-    profileDir = current_app.old_config.profileDir
-
     sample = _get_sample(session, ts, runid, testid)
     if not sample or not sample.profile:
         abort(404)
 
-    p = sample.profile.load(profileDir)
-    return json.dumps([x for x in p.getCodeForFunction(f)])
+    code = current_app.profile_cache.get_code_for_function(
+        _get_profile_path(sample), f)
+    return json.dumps(code)
 
 
 @v4_route("/profile/<int:testid>/<int:run1_id>")
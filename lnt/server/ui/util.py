@@ -286,6 +286,30 @@ def convert_revision(dotted, cache=None):
     return val
 
 
+def revision_sort_key(revisions, cache=None):
+    """Turn a sequence of revision strings into a single string which sorts
+    (as a plain string) the same way the tuple of their convert_revision()
+    values does. This allows ordering revisions within the database.
+
+    Every number is encoded as its decimal length (two digits) followed by its
+    digits, and each revision is terminated by "00". The result only contains
+    digits, so it compares the same way under any collation.
+    ["1.2"] -> "01101200"
+    ["10", "3"] -> "02100001300"
+
+    :param revisions: the string revisions to convert, in comparison order.
+    :param cache: a dict to use as a cache for convert_revision or None.
+    :return: the sort key string.
+    """
+    parts = []
+    for dotted in revisions:
+        for number in convert_revision(dotted, cache=cache):
+            digits = str(number)
+            parts.append('%02d%s' % (len(digits), digits))
+        parts.append('00')
+    return ''.join(parts)
+
+
 class PrecomputedCR():
     """Make a thing that looks like a comprison result, that is derived
     from a field change."""
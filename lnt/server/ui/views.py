@@ -10,6 +10,7 @@ from io import BytesIO
 
 import flask
 import flask_wtf
+import sqlalchemy.exc
 import sqlalchemy.sql
 from flask import abort
 from flask import current_app
@@ -35,9 +36,11 @@ import lnt.server.ui.util
 import lnt.util
 import lnt.util.ImportData
 import lnt.util.stats
+from lnt.util import metrics as metrics_registry
 from lnt.external.stats import stats as ext_stats
 from lnt.server.db import testsuitedb  # noqa: F401
 from lnt.server.reporting.analysis import ComparisonResult, calc_geomean
+from lnt.server.ui import downsample
 from lnt.server.ui import util
 from lnt.server.ui.decorators import frontend, db_route, v4_route
 from lnt.server.ui.globals import db_url_for, v4_url_for, v4_redirect
@@ -45,7 +48,6 @@ from lnt.server.ui.util import FLASH_DANGER, FLASH_SUCCESS, FLASH_INFO
 from lnt.server.ui.util import PrecomputedCR
 from lnt.server.ui.util import baseline_key, convert_revision
 from lnt.server.ui.util import mean
-from lnt.testing import PASS
 from lnt.util import logger
 from lnt.util import multidict
 from lnt.util import stats
@@ -118,9 +120,15 @@ def _do_submit():
     merge_run = request.form.get('merge', None)
     ignore_regressions = request.form.get('ignore_regressions', False) \
         or getattr(current_app.old_config, 'ignore_regressions', False)
+    lean = request.form.get('lean')
+    if lean is None:
+        lean = getattr(current_app.old_config, 'lean_submissions', False)
+    else:
+        lean = lean.lower() not in ('', '0', 'false')
 
-    if input_file and not input_file.content_length:
-        input_file = None
+    # Uploads rarely come with a content length, so read the file to tell
+    # whether one was given. Binary reports can only be submitted as files.
+    input_file = input_file.read() if input_file else None
 
     if not input_file and not input_data:
         return render_template(
@@ -130,7 +138,7 @@ def _do_submit():
             "submit_run.html", error="cannot provide input file *and* data")
 
     if input_file:
-        data_value = input_file.read()
+        data_value = input_file
     else:
         data_value = input_data
 
@@ -159,7 +167,7 @@ def _do_submit():
     result = lnt.util.ImportData.import_from_string(
         current_app.old_config, g.db_name, db, session, g.testsuite_name,
         data_value, select_machine=select_machine, merge_run=merge_run,
-        ignore_regressions=ignore_regressions)
+        ignore_regressions=ignore_regressions, lean=lean)
 
     # It is nice to have a full URL to the run, so fixup the request URL
     # here were we know more about the flask instance.
@@ -448,7 +456,10 @@ class V4RequestInfo(object):
             result=None, compare_to=compare_to, baseline=baseline,
             num_comparison_runs=self.num_comparison_runs,
             aggregation_fn=aggregation_fn, confidence_lv=confidence_lv,
-            styles=styles, classes=classes)
+            styles=styles, classes=classes,
+            # The stored comparisons do not keep the samples.
+            use_stored=not (request.args.get('show_all_samples') or
+                            request.args.get('show_sample_counts')))
         self.sri = self.data['sri']
         note = self.data['visible_note']
         if note:
@@ -550,7 +561,8 @@ def v4_run(id):
     if request.args.get('json'):
         json_obj = dict()
 
-        sri = lnt.server.reporting.analysis.RunInfo(session, ts, [id])
+        sri = lnt.server.reporting.analysis.StoredRunInfo(session, ts, run,
+                                                          [id])
         reported_tests = session.query(ts.Test.name, ts.Test.id).\
             filter(ts.Run.id == id).\
             filter(ts.Test.id.in_(sri.test_ids)).all()
@@ -894,22 +906,21 @@ def load_graph_data(plot_parameter, show_failures, limit, xaxis_date, revision_c
     session = request.session
     ts = request.get_testsuite()
 
-    # Load all the field values for this test on the same machine.
-    #
-    # FIXME: Don't join to Order here, aggregate this across all the tests
-    # we want to load. Actually, we should just make this a single query.
-    values = session.query(plot_parameter.field.column, ts.Order,
-                           ts.Run.start_time, ts.Run.id, ts.Run.parameters_data) \
-                    .select_from(ts.Sample) \
-                    .join(ts.Run).join(ts.Order) \
-                    .filter(ts.Run.machine_id == plot_parameter.machine.id) \
-                    .filter(ts.Sample.test == plot_parameter.test) \
-                    .filter(plot_parameter.field.column.isnot(None))
+    # Load all the field values for this test on the same machine, newest
+    # first so that the limit keeps the most recent points.
+    points = ts.SeriesPoint
+    values = session.query(points.value, ts.Order,
+                           points.start_time, points.run_id, ts.Run.parameters_data) \
+                    .join(ts.Order, points.order_id == ts.Order.id) \
+                    .join(ts.Run, points.run_id == ts.Run.id) \
+                    .filter(points.machine_id == plot_parameter.machine.id) \
+                    .filter(points.test_id == plot_parameter.test.id) \
+                    .filter(points.field_id == plot_parameter.field.id) \
+                    .order_by(points.sort_key.desc(), points.id.desc())
     # Unless all samples requested, filter out failing tests.
     if not show_failures:
         if plot_parameter.field.status_field:
-            values = values.filter((plot_parameter.field.status_field.column == PASS) |
-                                   (plot_parameter.field.status_field.column.is_(None)))
+            values = values.filter(points.passed == True)
     if limit:
         values = values.limit(limit)
 
@@ -936,42 +947,51 @@ def load_geomean_data(field, machine, limit, xaxis_date, revision_cache=None):
     Load geomean for specified field on the same machine.
     :param field: Field.
     :param machine: Machine.
-    :param limit: Limit points if specified.
+    :param limit: Limit to the latest orders if specified.
     :param xaxis_date: X axis is Date, otherwise Order.
     """
     session = request.session
     ts = request.get_testsuite()
-    values = session.query(sqlalchemy.sql.func.min(field.column),
-                           ts.Order,
-                           sqlalchemy.sql.func.min(ts.Run.start_time)) \
-                    .select_from(ts.Sample) \
-                    .join(ts.Run).join(ts.Order).join(ts.Test) \
-                    .filter(ts.Run.machine_id == machine.id) \
-                    .filter(field.column.isnot(None)) \
-                    .group_by(ts.Order, ts.Test)
+    geomeans = ts.Geomean
+    values = session.query(geomeans.value, ts.Order, geomeans.start_time) \
+                    .join(ts.Order, geomeans.order_id == ts.Order.id) \
+                    .filter(geomeans.machine_id == machine.id) \
+                    .filter(geomeans.field_id == field.id) \
+                    .order_by(geomeans.sort_key.desc())
 
     if limit:
         values = values.limit(limit)
 
-    data = multidict.multidict(
-        ((order, date), val)
-        for val, order, date in values).items()
-
-    # Calculate geomean of each revision.
     if xaxis_date:
-        data = [(date, [(calc_geomean(vals), order, date)])
-                for ((order, date), vals) in data]
+        data = [(date, [(val, order, date)])
+                for val, order, date in values]
         # Sort data points according to date.
         data.sort(key=lambda sample: sample[0])
     else:
-        data = [(order.llvm_project_revision, [(calc_geomean(vals), order, date)])
-                for ((order, date), vals) in data]
+        data = [(order.llvm_project_revision, [(val, order, date)])
+                for val, order, date in values]
         # Sort data points according to order (revision).
         data.sort(key=lambda sample: convert_revision(sample[0], cache=revision_cache))
 
     return data
 
 
+def downsample_trace(trace, kept_x):
+    """Keep the points of a graph trace whose X value is in kept_x, along with
+    their Y values, metadata and error bars. Does nothing if kept_x is
+    None."""
+    if kept_x is None:
+        return trace
+    indices = [i for i, x in enumerate(trace['x']) if x in kept_x]
+    for key in ('x', 'y', 'meta'):
+        if key in trace:
+            trace[key] = [trace[key][i] for i in indices]
+    if 'error_y' in trace:
+        array = trace['error_y']['array']
+        trace['error_y']['array'] = [array[i] for i in indices]
+    return trace
+
+
 @v4_route("/graph")
 def v4_graph():
     session = request.session
@@ -1006,6 +1026,8 @@ def v4_graph():
         request.args.get('show_moving_median'))
     options['moving_window_size'] = moving_window_size = int(
         request.args.get('moving_window_size', 10))
+    options['max_points'] = max_points = int(
+        request.args.get('max_points', 0))
     options['hide_highlight'] = bool(
         request.args.get('hide_highlight'))
     options['logarithmic_scale'] = bool(
@@ -1056,6 +1078,7 @@ def v4_graph():
     # Create region of interest for run data region if we are performing a
     # comparison.
     revision_range = None
+    highlight_order_ids = set()
     highlight_run_id = request.args.get('highlight_run')
     if show_highlight and highlight_run_id and highlight_run_id.isdigit():
         highlight_run = session.query(ts.Run).filter_by(
@@ -1073,6 +1096,8 @@ def v4_graph():
                 "start": start_rev,
                 "end": end_rev,
             }
+            highlight_order_ids = {prev_runs[0].order_id,
+                                   highlight_run.order_id}
 
     # Build the graph data.
     legend = []
@@ -1084,6 +1109,14 @@ def v4_graph():
 
     metrics = list(set(req.field.name for req in plot_parameters))
 
+    # The orders of the regressions of the lines, whose points are kept when
+    # the lines are downsampled.
+    change_order_ids = defaultdict(set)
+    if max_points:
+        change_order_ids = downsample.change_order_ids(
+            session, ts, [(req.machine.id, req.test.id, req.field.id)
+                          for req in plot_parameters])
+
     for i, req in enumerate(plot_parameters):
         # Determine the base plot color.
         col = list(util.makeDarkColor(float(i) / num_plots))
@@ -1094,7 +1127,10 @@ def v4_graph():
         # Load all the field values for this test on the same machine.
         data = load_graph_data(req, show_failures, limit, xaxis_date, revision_cache)
 
-        graph_datum.append((req.test.name, data, col, req.field, url, req.machine))
+        keep_order_ids = highlight_order_ids.union(
+            change_order_ids[(req.machine.id, req.test.id, req.field.id)])
+        graph_datum.append((req.test.name, data, col, req.field, url,
+                            req.machine, keep_order_ids))
 
         # Get baselines for this line
         num_baselines = len(baseline_parameters)
@@ -1147,12 +1183,14 @@ def v4_graph():
         col = (0, 0, 0)
         legend.append(LegendItem(machine, test_name, field.name, col, None))
         data = load_geomean_data(field, machine, limit, xaxis_date, revision_cache)
-        graph_datum.append((test_name, data, col, field, None, machine))
+        graph_datum.append((test_name, data, col, field, None, machine,
+                            highlight_order_ids))
 
     def trace_name(name, test_name, field_name):
         return "%s: %s (%s)" % (name, test_name, field_name)
 
-    for test_name, data, col, field, url, machine in graph_datum:
+    for test_name, data, col, field, url, machine, keep_order_ids \
+            in graph_datum:
         # Generate trace metadata.
         trace_meta = {}
         trace_meta["machine"] = machine.name
@@ -1272,38 +1310,32 @@ def v4_graph():
 
         # Compute the moving average and or moving median of our data if
         # requested.
-        if moving_average or moving_median:
-
-            def compute_moving_average(x, window, average_list, _):
-                average_list["x"].append(x)
-                average_list["y"].append(lnt.util.stats.mean(window))
-
-            def compute_moving_median(x, window, _, median_list):
-                median_list["x"].append(x)
-                median_list["y"].append(lnt.util.stats.median(window))
-
-            def compute_moving_average_and_median(x, window, average_list,
-                                                  median_list):
-                average_list["x"].append(x)
-                average_list["y"].append(lnt.util.stats.mean(window))
-                median_list["x"].append(x)
-                median_list["y"].append(lnt.util.stats.median(window))
-
-            if moving_average and moving_median:
-                fun = compute_moving_average_and_median
-            elif moving_average:
-                fun = compute_moving_average
-            else:
-                fun = compute_moving_median
-
-            len_pts = len(pts_x)
-            for i in range(len_pts):
-                start_index = max(0, i - moving_window_size)
-                end_index = min(len_pts, i + moving_window_size)
-
-                window_pts = pts_y[start_index:end_index]
-                fun(pts_x[i], window_pts, moving_average_data,
-                    moving_median_data)
+        # The windows slide over the points, rather than being sliced out of
+        # them for each point.
+        if moving_average:
+            moving_average_data["x"] = list(pts_x)
+            moving_average_data["y"] = lnt.util.stats.moving_means(
+                pts_y, moving_window_size)
+        if moving_median:
+            moving_median_data["x"] = list(pts_x)
+            moving_median_data["y"] = lnt.util.stats.moving_medians(
+                pts_y, moving_window_size)
+
+        # Downsample the line to max_points if requested, keeping the points
+        # of its regressions and of the highlighted run. The other traces
+        # keep the points of the same X values.
+        kept_x = None
+        if max_points and len(pts_x) > max_points:
+            keep = [i for i, point_metadata in enumerate(meta)
+                    if point_metadata["orderID"] in keep_order_ids]
+            xs = None
+            if xaxis_date:
+                xs = [(x - pts_x[0]).total_seconds() for x in pts_x]
+            indices = downsample.lttb_indices(pts_y, max_points, xs, keep)
+            kept_x = set(pts_x[i] for i in indices)
+            for trace in (errorbar, cumulative_minimum, moving_median_data,
+                          moving_average_data, multisample_points_data):
+                downsample_trace(trace, kept_x)
 
         yaxis_index = metrics.index(field.name)
         yaxis = "y" if yaxis_index == 0 else "y%d" % (yaxis_index + 1)
@@ -1321,6 +1353,7 @@ def v4_graph():
                 "y": pts_y,
                 "meta": meta
             }
+            downsample_trace(plot, kept_x)
             plot.update(trace_meta)
             if url:
                 plot["url"] = url
@@ -1379,6 +1412,7 @@ def v4_graph():
                         "x": unique_x,
                         "y": reglin_y
                     }
+                    downsample_trace(plot, kept_x)
                     plot.update(trace_meta)
                     graph_plots.insert(0, plot)
 
@@ -1671,10 +1705,23 @@ def v4_daily_report(year, month, day):
 
     # Build the report.
     try:
-        report.build(request.session)
+        report.build(request.session,
+                     jobs=current_app.old_config.report_jobs)
     except ValueError:
         return abort(400)
 
+    # Try to keep the results of a report of closed days for the next
+    # requests, in a session of its own so that the request only reads.
+    if report.results_to_store:
+        session = request.db.make_session()
+        try:
+            report.store_results(session)
+        except sqlalchemy.exc.SQLAlchemyError:
+            logger.warning("Could not store the daily report results",
+                           exc_info=True)
+        finally:
+            session.close()
+
     return render_template("v4_daily_report.html", report=report,
                            analysis=lnt.server.reporting.analysis,
                            **ts_data(ts))
@@ -1750,7 +1797,7 @@ def v4_latest_runs_report():
         num_runs = 10
 
     report = lnt.server.reporting.latestrunsreport.LatestRunsReport(ts, num_runs)
-    report.build(request.session)
+    report.build(request.session, jobs=current_app.old_config.report_jobs)
 
     return render_template("v4_latest_runs_report.html", report=report,
                            analysis=lnt.server.reporting.analysis,
@@ -1774,7 +1821,7 @@ You must define a summary report configuration first.""")
         request.get_db(), config['orders'], config['machine_names'],
         config['machine_patterns'])
     # Build the report.
-    report.build(session)
+    report.build(session, jobs=current_app.old_config.report_jobs)
 
     if bool(request.args.get('json')):
         json_obj = dict()
@@ -1820,6 +1867,31 @@ def health():
     return msg, 200
 
 
+_POOL_METRICS = {
+    key: metrics_registry.REGISTRY.gauge('lnt_db_pool_' + key, description,
+                                         ['database'])
+    for key, description in [
+        ('size', "The number of connections the pool keeps."),
+        ('checked_in', "The number of idle connections of the pool."),
+        ('checked_out', "The number of connections of the pool in use."),
+        ('overflow',
+         "The number of connections opened beyond the pool size."),
+    ]
+}
+
+
+@frontend.route('/metrics')
+def metrics():
+    """The metrics of this server process (see lnt.util.metrics), in the text
+    format of Prometheus."""
+    for name, db in current_app.instance.databases.items():
+        for key, value in db.get_pool_stats().items():
+            _POOL_METRICS[key].set(value, database=name)
+    response = make_response(metrics_registry.REGISTRY.render())
+    response.mimetype = 'text/plain'
+    return response
+
+
 @v4_route("/search")
 def v4_search():
     session = request.session
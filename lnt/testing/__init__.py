@@ -664,13 +664,15 @@ def upgrade_and_normalize_report(data):
     return data
 
 
-def validate_report(file, format):
+def validate_report(file, format, stream=False):
     """
-    validate_report(file, format) -> result dict
+    validate_report(file, format, [stream]) -> result dict
 
     Validate the format of an LNT test report file without importing it into
     a database. This performs format-level validation: parsing the file and
-    upgrading/normalizing the report format.
+    upgrading/normalizing the report format. With stream, the tests of the
+    returned report may be an iterable decoding them from the file one at a
+    time (see lnt.formats.read_any).
 
     Returns a result dict with:
     - 'success': True/False
@@ -686,7 +688,7 @@ def validate_report(file, format):
     }
 
     try:
-        data = lnt.formats.read_any(file, format)
+        data = lnt.formats.read_any(file, format, stream=stream)
     except Exception:
         import traceback
         result['error'] = "could not parse input format"
@@ -0,0 +1,114 @@
+"""
+The codecs the sections of profiles can be compressed with.
+
+ProfileV2 compresses its sections with bz2, which compresses well but is slow
+to decompress, and decompressing dominates the time taken to show the code of
+a function. ProfileV3 records the codec of its sections, which is one of
+CODECS. zlib is always available; zstd needs Python 3.14 or the zstandard
+module, and lz4 needs the lz4 module.
+"""
+
+import bz2
+import zlib
+
+
+class Codec(object):
+    """
+    A compression codec, identified in profiles by its 'id'. 'load' returns
+    its compress and decompress functions, raising ImportError when the
+    module it needs is missing.
+    """
+    def __init__(self, id, name, load):
+        self.id = id
+        self.name = name
+        self._load = load
+        self._functions = None
+
+    def _getFunctions(self):
+        if self._functions is None:
+            try:
+                self._functions = self._load()
+            except ImportError as e:
+                raise RuntimeError("the %s codec is not available: %s" %
+                                   (self.name, e))
+        return self._functions
+
+    def isAvailable(self):
+        try:
+            self._getFunctions()
+        except RuntimeError:
+            return False
+        return True
+
+    def compress(self, data):
+        return self._getFunctions()[0](data)
+
+    def decompress(self, data):
+        return self._getFunctions()[1](data)
+
+    # Codecs are shared by all the sections using them.
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def __repr__(self):
+        return 'Codec(%r)' % self.name
+
+
+def _loadBz2():
+    return bz2.compress, bz2.decompress
+
+
+def _loadZlib():
+    return zlib.compress, zlib.decompress
+
+
+def _loadZstd():
+    try:
+        from compression import zstd
+        return zstd.compress, zstd.decompress
+    except ImportError:
+        # Unlike its ZstdCompressor and ZstdDecompressor objects, the
+        # functions of zstandard can be used by several threads.
+        import zstandard
+        return zstandard.compress, zstandard.decompress
+
+
+def _loadLz4():
+    import lz4.frame
+    return lz4.frame.compress, lz4.frame.decompress
+
+
+BZ2 = Codec(0, 'bz2', _loadBz2)
+ZLIB = Codec(1, 'zlib', _loadZlib)
+ZSTD = Codec(2, 'zstd', _loadZstd)
+LZ4 = Codec(3, 'lz4', _loadLz4)
+
+CODECS = [BZ2, ZLIB, ZSTD, LZ4]
+
+
+def getCodec(key):
+    """
+    Return the codec with the id or name 'key'.
+    """
+    for codec in CODECS:
+        if key in (codec.id, codec.name):
+            return codec
+    raise ValueError("unknown profile codec %r" % (key,))
+
+
+def availableCodecs():
+    """
+    Return the codecs whose modules are available.
+    """
+    return [codec for codec in CODECS if codec.isAvailable()]
+
+
+def defaultCodec():
+    """
+    Return the codec new profiles are written with: zstd if it is available,
+    else zlib.
+    """
+    return ZSTD if ZSTD.isAvailable() else ZLIB
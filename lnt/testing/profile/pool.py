@@ -0,0 +1,208 @@
+"""
+Shared text pools of version 2 and 3 profiles.
+
+The text pool of a profile (the disassembly of its instructions) is usually
+the same in the profiles of many runs of a binary. A pooled profile stores it
+in a separate file of the _pools directory next to it, named after the hash of
+its contents, so that identical text pools are only stored once. Each pool
+file has a count of the profiles referring to it. LNT never deletes the
+profiles themselves, so the counts only grow when profiles are stored: repack()
+is what recounts the references and removes the pools without any, for example
+after profiles were deleted by hand.
+"""
+
+import collections
+import contextlib
+import hashlib
+import os
+import tempfile
+import time
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from lnt.testing.profile import profilev2impl
+
+POOL_DIR = '_pools'
+POOL_SUFFIX = '.lntpool'
+REFS_SUFFIX = '.refs'
+
+# An upper bound of the size of the section headers of a profile.
+_HEADER_SIZE = 4096
+
+
+def _write_atomically(path, data):
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path),
+                                    prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+def isPoolable(data):
+    """
+    Return whether the serialized profile 'data' has a text pool which can be
+    moved to a shared pool.
+    """
+    if data[:1] not in (b'\x02', b'\x03'):
+        return False
+    index, _ = profilev2impl.readIndex(data)
+    return not index[profilev2impl.TEXT_POOL_SECTION][2]
+
+
+def getPoolReference(data):
+    """
+    Return the pool file the serialized profile 'data' refers to, relative to
+    its directory, or None.
+    """
+    if data[:1] not in (b'\x02', b'\x03'):
+        return None
+    index, _ = profilev2impl.readIndex(data)
+    return index[profilev2impl.TEXT_POOL_SECTION][2] or None
+
+
+class PoolStore(object):
+    """
+    The text pools of the profiles in a directory.
+
+    Changes to the pools are serialized with a lock file, so that they can be
+    made by several processes (where fcntl is available).
+    """
+
+    def __init__(self, profile_dir):
+        self.profile_dir = profile_dir
+        self.pool_dir = os.path.join(profile_dir, POOL_DIR)
+
+    @contextlib.contextmanager
+    def _locked(self):
+        os.makedirs(self.pool_dir, exist_ok=True)
+        with open(os.path.join(self.pool_dir, '.lock'), 'a') as lock:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            yield
+
+    def _paths(self, pool_fname):
+        path = os.path.join(self.profile_dir, pool_fname)
+        return path, path[:-len(POOL_SUFFIX)] + REFS_SUFFIX
+
+    def _read_refcount(self, refs_path):
+        try:
+            with open(refs_path) as f:
+                return int(f.read())
+        except FileNotFoundError:
+            return 0
+
+    def _write_refcount(self, refs_path, count):
+        _write_atomically(refs_path, str(count).encode())
+
+    def acquire(self, text_pool):
+        """
+        Add a reference to the pool with the contents 'text_pool', creating
+        it if needed, and return its file name relative to the profile
+        directory.
+        """
+        digest = hashlib.sha256(text_pool).hexdigest()
+        pool_fname = POOL_DIR + '/' + digest + POOL_SUFFIX
+        path, refs_path = self._paths(pool_fname)
+        with self._locked():
+            if not os.path.exists(path):
+                _write_atomically(path, text_pool)
+            self._write_refcount(refs_path,
+                                 self._read_refcount(refs_path) + 1)
+        return pool_fname
+
+    def getRefcount(self, pool_fname):
+        return self._read_refcount(self._paths(pool_fname)[1])
+
+    def recount(self, references, since):
+        """
+        Set the reference counts of the pools from 'references', a mapping of
+        pool file names to the number of profiles using them, and delete the
+        pools without any. The pools referenced since the time 'since', when
+        'references' started being collected, are left alone. Returns the
+        number of pools deleted.
+        """
+        deleted = 0
+        with self._locked():
+            for name in os.listdir(self.pool_dir):
+                if not name.endswith(POOL_SUFFIX):
+                    continue
+                pool_fname = POOL_DIR + '/' + name
+                path, refs_path = self._paths(pool_fname)
+                try:
+                    if os.stat(refs_path).st_mtime >= since:
+                        continue
+                except FileNotFoundError:
+                    pass
+                count = references.get(pool_fname, 0)
+                if count:
+                    self._write_refcount(refs_path, count)
+                else:
+                    os.remove(path)
+                    if os.path.exists(refs_path):
+                        os.remove(refs_path)
+                    deleted += 1
+        return deleted
+
+
+def poolProfile(data, store):
+    """
+    Return the serialized profile 'data' with its text pool moved to 'store',
+    if it is a version 2 or 3 profile which holds it, or 'data' unchanged.
+    """
+    if not isPoolable(data):
+        return data
+    index, start = profilev2impl.readIndex(data)
+    offset, size, _ = index[profilev2impl.TEXT_POOL_SECTION]
+    pool_fname = store.acquire(data[start + offset:start + offset + size])
+    return profilev2impl.replaceTextPool(data, pool_fname)
+
+
+def repack(profile_dir):
+    """
+    Move the text pools of the profiles in 'profile_dir' to shared pools, then
+    recompute the reference counts of the pools, deleting the unused ones.
+    Returns the number of profiles pooled and the number of pools deleted.
+    """
+    store = PoolStore(profile_dir)
+    names = sorted(name for name in os.listdir(profile_dir)
+                   if name.endswith('.lntprof'))
+
+    pooled = 0
+    for name in names:
+        path = os.path.join(profile_dir, name)
+        with open(path, 'rb') as f:
+            data = f.read()
+        try:
+            new_data = poolProfile(data, store)
+        except (IndexError, ValueError):
+            # Not a valid profile.
+            continue
+        if new_data is not data:
+            # Keep the modification time, which tells the age of profiles.
+            stat = os.stat(path)
+            _write_atomically(path, new_data)
+            os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+            pooled += 1
+
+    since = time.time()
+    references = collections.Counter()
+    for name in os.listdir(profile_dir):
+        if not name.endswith('.lntprof'):
+            continue
+        with open(os.path.join(profile_dir, name), 'rb') as f:
+            header = f.read(_HEADER_SIZE)
+        try:
+            pool_fname = getPoolReference(header)
+        except (IndexError, ValueError):
+            continue
+        if pool_fname:
+            references[pool_fname] += 1
+    deleted = store.recount(references, since)
+    return pooled, deleted
@@ -74,7 +74,8 @@ class Profile(object):
         with Profile.render(), and save it immediately in filename.
 
         This is equivalent to Profile.fromRendered(s).save(filename=filename)
-        but it avoids the intermediate deserialize/serialize steps.
+        but it avoids the intermediate deserialize/serialize steps. Like with
+        save(), profiles saved in 'profileDir' share their text pool.
         """
         s = base64.b64decode(s)
 
@@ -82,11 +83,13 @@ class Profile(object):
             assert profileDir is not None
             if not os.path.exists(profileDir):
                 os.makedirs(profileDir)
-            tf = tempfile.NamedTemporaryFile(prefix=prefix,
+            from lnt.testing.profile import pool
+            s = pool.poolProfile(s, pool.PoolStore(profileDir))
+            with tempfile.NamedTemporaryFile(prefix=prefix,
                                              suffix='.lntprof',
                                              dir=profileDir,
-                                             delete=False)
-            tf.write(s)
+                                             delete=False) as tf:
+                tf.write(s)
             return tf.name
 
         else:
@@ -99,7 +102,9 @@ class Profile(object):
         Save a profile. One of 'filename' or 'profileDir' must be given.
           - If 'filename' is given, that is where the profile is saved.
           - If 'profileDir' is given, a new unique filename is created
-            inside 'profileDir', optionally with 'prefix'.
+            inside 'profileDir', optionally with 'prefix'. The text pool of
+            the profile is shared with the other profiles there (see
+            lnt.testing.profile.pool).
 
         The filename written to is returned.
         """
@@ -110,11 +115,14 @@ class Profile(object):
         assert profileDir is not None
         if not os.path.exists(profileDir):
             os.makedirs(profileDir)
-        tf = tempfile.NamedTemporaryFile(prefix=prefix,
+        from lnt.testing.profile import pool
+        data = pool.poolProfile(self.impl.serialize(),
+                                pool.PoolStore(profileDir))
+        with tempfile.NamedTemporaryFile(prefix=prefix,
                                          suffix='.lntprof',
                                          dir=profileDir,
-                                         delete=False)
-        self.impl.serialize(tf.name)
+                                         delete=False) as tf:
+            tf.write(data)
 
         # FIXME: make the returned filepath relative to baseDir?
         return os.path.relpath(tf.name, profileDir)
@@ -161,6 +169,12 @@ class Profile(object):
     def getCodeForFunction(self, fname):
         return self.impl.getCodeForFunction(fname)
 
+    def getDecodedSize(self):
+        return self.impl.getDecodedSize()
+
+    def close(self):
+        return self.impl.close()
+
 
 class ProfileImpl(object):
     @staticmethod
@@ -196,6 +210,20 @@ class ProfileImpl(object):
         """
         raise NotImplementedError("Abstract class")
 
+    def getDecodedSize(self):
+        """
+        Return the approximate number of bytes of the profile decoded in
+        memory so far, or None if unknown.
+        """
+        return None
+
+    def close(self):
+        """
+        Release the resources (such as open files) a lazily read profile
+        holds. The profile may not be fully usable afterwards.
+        """
+        pass
+
     def getVersion(self):
         """
         Return the profile version.
@@ -1,7 +1,8 @@
 from .profile import ProfileImpl
-import bz2
+from . import codec
 import copy
 import io
+import mmap
 import os
 import struct
 
@@ -16,7 +17,8 @@ The format:
   * Consists of only two datatypes:
     * Strings (newline terminated)
     * Positive integers (ULEB encoded)
-  * Some sections are expected to be BZ2 compressed.
+  * Some sections are expected to be BZ2 compressed (or compressed with the
+    codec of the profile in version 3, see ProfileV3).
 
 The sections are:
   Header
@@ -67,15 +69,18 @@ The sections are:
 
   The TextPool section has the ability to be shared across multiple profiles
   to take advantage of inter-run redundancy (the image very rarely changes
-  substantially). This pooling ability is not yet implemented but the
-  appropriate scaffolding is in place.
+  substantially). A pooled TextPool section is empty, and its header names
+  the file holding its (compressed) contents, relative to the directory of
+  the profile; see lnt.testing.profile.pool.
 
   The ProfileV2 format gives a ~3x size improvement over the ProfileV1 (which
   is also compressed) - meaning a ProfileV2 is roughly 1/3 the size of
   ProfileV1. With text pooling, ProfileV2s can be even smaller.
 
   Not only this, but for the simple task of enumerating the functions in a
-  profile we do not need to do any decompression at all.
+  profile we do not need to do any decompression at all: profiles are read
+  from a memory mapping of the file, and the compressed sections are only
+  decompressed by the first call to getCodeForFunction.
 """
 
 ##############################################################################
@@ -136,6 +141,52 @@ def readFloat(fobj):
     return f
 
 
+_float = struct.Struct('>f')
+_float_bits = struct.Struct('>l')
+
+
+class BufferReader(object):
+    """
+    Reads the datatypes of the format from a bytes-like object (such as a
+    memory mapped file), without the overhead of a stream.
+    """
+    def __init__(self, data, pos=0):
+        self.data = data
+        self.pos = pos
+
+    def readNum(self):
+        data = self.data
+        pos = self.pos
+        b = data[pos]
+        pos += 1
+        n = b & 0x7F
+        shift = 7
+        while b & 0x80:
+            b = data[pos]
+            pos += 1
+            n |= (b & 0x7F) << shift
+            shift += 7
+        self.pos = pos
+        return n
+
+    def readString(self):
+        end = self.data.find(b'\n', self.pos)
+        if end < 0:
+            raise ValueError("unterminated string")
+        s = self.data[self.pos:end].decode()
+        self.pos = end + 1
+        return s
+
+    def readFloat(self):
+        return _float.unpack(_float_bits.pack(self.readNum()))[0]
+
+    def read(self, size=-1):
+        end = len(self.data) if size < 0 else self.pos + size
+        data = self.data[self.pos:end]
+        self.pos = end
+        return data
+
+
 def writeFloat(fobj, f):
     """
     Write a floating point number to a stream.
@@ -147,25 +198,100 @@ def writeFloat(fobj, f):
     bits = struct.unpack('>l', packed)[0]
     writeNum(fobj, bits)
 
+
+# The number of sections of a profile, and the index of the TextPool section
+# (see ProfileV2.deserialize).
+NUM_SECTIONS = 8
+TEXT_POOL_SECTION = 6
+
+
+def readPreamble(reader):
+    """
+    Read what precedes the section headers of a serialized profile: its
+    version, and for version 3 the id of its codec. Returns the version.
+    """
+    version = reader.readNum()
+    if version == 3:
+        reader.readNum()
+    elif version != 2:
+        raise ValueError("not a version 2 or 3 profile")
+    return version
+
+
+def readIndex(data):
+    """
+    Read the section headers of the serialized profile 'data', returning a
+    list of (offset, size, pool_fname) tuples, pool_fname being None for the
+    sections which cannot be pooled, and the offset of the first section.
+    """
+    reader = BufferReader(data)
+    readPreamble(reader)
+    index = []
+    for i in range(NUM_SECTIONS):
+        offset = reader.readNum()
+        size = reader.readNum()
+        pool_fname = reader.readString() if i == TEXT_POOL_SECTION else None
+        index.append((offset, size, pool_fname))
+    return index, reader.pos
+
+
+def replaceTextPool(data, pool_fname):
+    """
+    Return a copy of the serialized profile 'data', which must hold its text
+    pool, referring to pool_fname for it instead.
+    """
+    index, start = readIndex(data)
+    if index[TEXT_POOL_SECTION][2]:
+        raise ValueError("profile text pool is already pooled")
+
+    reader = BufferReader(data)
+    readPreamble(reader)
+    header = io.BytesIO()
+    body = io.BytesIO()
+    header.write(data[:reader.pos])
+    for i, (offset, size, _) in enumerate(index):
+        if i == TEXT_POOL_SECTION:
+            writeNum(header, body.tell())
+            writeNum(header, 0)
+            writeString(header, pool_fname)
+        else:
+            writeNum(header, body.tell())
+            writeNum(header, size)
+            body.write(data[start + offset:start + offset + size])
+    return header.getvalue() + body.getvalue()
+
 ##############################################################################
 # Abstract section types
 
 
 class Section(object):
+    # The number of bytes of the section decoded so far.
+    decoded_size = 0
+
     def writeHeader(self, fobj, offset, size):
         writeNum(fobj, offset)
         writeNum(fobj, size)
 
-    def readHeader(self, fobj):
-        self.offset = readNum(fobj)
-        self.size = readNum(fobj)
+    def readHeader(self, reader):
+        self.offset = reader.readNum()
+        self.size = reader.readNum()
 
     def write(self, fobj):
         return self.serialize(fobj)
 
-    def read(self, fobj):
-        fobj.seek(self.offset + self.start)
-        return self.deserialize(fobj)
+    def read(self, buf):
+        """
+        Read the section from 'buf', which holds the whole profile.
+        """
+        start = self.start + self.offset
+        self.decoded_size = self.size
+        return self.deserialize(BufferReader(buf[start:start + self.size]))
+
+    def load(self):
+        """
+        Finish reading the section if it was read lazily.
+        """
+        pass
 
     def setStart(self, start):
         """
@@ -178,15 +304,28 @@ class Section(object):
 
 
 class CompressedSection(Section):
-    def read(self, fobj):
-        fobj.seek(self.offset + self.start)
-        _io = io.BytesIO(bz2.decompress(fobj.read(self.size)))
-        return self.deserialize(_io)
+    # The profile this section is read from, until it is decompressed.
+    buf = None
+    codec = codec.BZ2
+
+    def read(self, buf):
+        # Decompressing is deferred to the first use of the section.
+        self.buf = buf
+
+    def load(self):
+        if self.buf is None:
+            return
+        start = self.start + self.offset
+        data = self.codec.decompress(self.buf[start:start + self.size])
+        self.decoded_size = len(data)
+        self.deserialize(BufferReader(data))
+        # Only mark the section as read once it is, for concurrent readers.
+        self.buf = None
 
     def write(self, fobj):
         _io = io.BytesIO()
         self.serialize(_io)
-        fobj.write(bz2.compress(_io.getvalue()))
+        fobj.write(self.codec.compress(_io.getvalue()))
 
 
 class MaybePooledSection(Section):
@@ -195,25 +334,44 @@ class MaybePooledSection(Section):
     inside an external file (where this section from multiple
     files are pooled together)
     """
+    buf = None
+    codec = codec.BZ2
+    # The directory pool_fname is relative to, which is the one of the
+    # profile.
+    base_dir = None
+
     def __init__(self):
         self.pool_fname = ''
 
-    def readHeader(self, fobj):
-        Section.readHeader(self, fobj)
-        self.pool_fname = readString(fobj)
+    def readHeader(self, reader):
+        Section.readHeader(self, reader)
+        self.pool_fname = reader.readString()
 
     def writeHeader(self, fobj, offset, size):
         Section.writeHeader(self, fobj, offset, size)
         writeString(fobj, self.pool_fname)
 
-    def read(self, fobj):
-        if self.pool_fname:
-            raise NotImplementedError()
+    def read(self, buf):
+        # Like compressed sections, read on first use.
+        self.buf = buf
 
+    def load(self):
+        if self.buf is None:
+            return
+        if self.pool_fname:
+            if self.base_dir is None:
+                raise ValueError("cannot locate the pool %r of a profile "
+                                 "not read from a file" % self.pool_fname)
+            with open(os.path.join(self.base_dir, self.pool_fname),
+                      'rb') as f:
+                data = f.read()
         else:
-            _io = io.BytesIO(bz2.decompress(fobj.read(self.size)))
-            self.size = len(_io.getvalue())
-            return self.deserialize(_io)
+            start = self.start + self.offset
+            data = self.buf[start:start + self.size]
+        data = self.codec.decompress(data)
+        self.decoded_size = len(data)
+        self.deserialize(BufferReader(data))
+        self.buf = None
 
     def write(self, fobj):
         _io = io.BytesIO()
@@ -222,7 +380,7 @@ class MaybePooledSection(Section):
 
         else:
             Section.write(self, _io)
-            fobj.write(bz2.compress(_io.getvalue()))
+            fobj.write(self.codec.compress(_io.getvalue()))
 
 ##############################################################################
 # Concrete section types
@@ -232,8 +390,8 @@ class Header(Section):
     def serialize(self, fobj):
         writeString(fobj, self.disassembly_format)
 
-    def deserialize(self, fobj):
-        self.disassembly_format = readString(fobj)
+    def deserialize(self, reader):
+        self.disassembly_format = reader.readString()
 
     def upgrade(self, impl):
         self.disassembly_format = impl.getDisassemblyFormat()
@@ -253,10 +411,10 @@ class CounterNamePool(Section):
         for i in range(n_names):
             writeString(fobj, self.idx_to_name[i])
 
-    def deserialize(self, fobj):
+    def deserialize(self, reader):
         self.idx_to_name = {}
-        for i in range(readNum(fobj)):
-            self.idx_to_name[i] = readString(fobj)
+        for i in range(reader.readNum()):
+            self.idx_to_name[i] = reader.readString()
         self.name_to_idx = {v: k
                             for k, v
                             in self.idx_to_name.items()}
@@ -283,15 +441,15 @@ class TopLevelCounters(Section):
             writeNum(fobj, self.counter_name_pool.name_to_idx[k])
             writeNum(fobj, int(v))
 
-    def deserialize(self, fobj):
+    def deserialize(self, reader):
         self.counters = {}
-        for i in range(readNum(fobj)):
-            k = readNum(fobj)
-            v = readNum(fobj)
+        for i in range(reader.readNum()):
+            k = reader.readNum()
+            v = reader.readNum()
             self.counters[self.counter_name_pool.idx_to_name[k]] = v
 
     def upgrade(self, impl):
-        self.counters = impl.data['counters'].copy()
+        self.counters = impl.getTopLevelCounters().copy()
 
     def copy(self, cnp):
         new = copy.copy(self)
@@ -316,8 +474,8 @@ class LineCounters(CompressedSection):
                 for k in all_counters:
                     writeFloat(fobj, counters.get(k, 0))
 
-    def deserialize(self, fobj):
-        self.data = fobj.read()
+    def deserialize(self, reader):
+        self.data = reader.read()
 
     def upgrade(self, impl):
         self.impl = impl
@@ -329,15 +487,14 @@ class LineCounters(CompressedSection):
     def setOffsetFor(self, fname, value):
         self.function_offsets[fname] = value
 
-    def extractForFunction(self, fname, counters):
-        offset = self.function_offsets[fname]
-        _io = io.BytesIO(self.data)
-        _io.seek(offset)
+    def extractForFunction(self, fname, counters, length):
+        self.load()
+        reader = BufferReader(self.data, self.function_offsets[fname])
         counters.sort()
-        while True:
+        for _ in range(length):
             c = {}
             for k in counters:
-                c[k] = readFloat(_io)
+                c[k] = reader.readFloat()
             yield c
 
 
@@ -366,8 +523,8 @@ class LineAddresses(CompressedSection):
                 writeNum(fobj, max(0, address - prev_address))
                 prev_address = address
 
-    def deserialize(self, fobj):
-        self.data = fobj.read()
+    def deserialize(self, reader):
+        self.data = reader.read()
 
     def upgrade(self, impl):
         self.impl = impl
@@ -379,13 +536,12 @@ class LineAddresses(CompressedSection):
     def setOffsetFor(self, fname, value):
         self.function_offsets[fname] = value
 
-    def extractForFunction(self, fname):
-        offset = self.function_offsets[fname]
-        _io = io.BytesIO(self.data)
-        _io.seek(offset)
+    def extractForFunction(self, fname, length):
+        self.load()
+        reader = BufferReader(self.data, self.function_offsets[fname])
         last_address = 0
-        while True:
-            address = readNum(_io) + last_address
+        for _ in range(length):
+            address = reader.readNum() + last_address
             last_address = address
             yield address
 
@@ -416,9 +572,8 @@ class LineText(CompressedSection):
                 writeNum(fobj, self.text_pool.getOrCreate(text))
             writeNum(fobj, 0)  # Write sequence terminator
 
-    def deserialize(self, fobj):
-        # FIXME: Make this lazy.
-        self.data = fobj.read()
+    def deserialize(self, reader):
+        self.data = reader.read()
 
     def upgrade(self, impl):
         self.impl = impl
@@ -430,13 +585,11 @@ class LineText(CompressedSection):
     def setOffsetFor(self, fname, value):
         self.function_offsets[fname] = value
 
-    def extractForFunction(self, fname):
-        offset = self.function_offsets[fname]
-
-        _io = io.BytesIO(self.data)
-        _io.seek(offset)
-        while True:
-            n = readNum(_io)
+    def extractForFunction(self, fname, length):
+        self.load()
+        reader = BufferReader(self.data, self.function_offsets[fname])
+        for _ in range(length):
+            n = reader.readNum()
             yield self.text_pool.getAt(n)
 
     def copy(self, tp):
@@ -459,9 +612,8 @@ class TextPool(MaybePooledSection):
         self.data.seek(0)
         fobj.write(self.data.read())
 
-    def deserialize(self, fobj):
-        # FIXME: Make this lazy!
-        self.data = io.BytesIO(fobj.read(self.size))
+    def deserialize(self, reader):
+        self.data = io.BytesIO(reader.read())
 
     def upgrade(self, impl):
         pass
@@ -478,10 +630,12 @@ class TextPool(MaybePooledSection):
         return self.offsets[text]
 
     def getAt(self, offset):
+        self.load()
         self.data.seek(offset, os.SEEK_SET)
         return readString(self.data)
 
     def copy(self):
+        self.load()
         return copy.deepcopy(self)
 
 
@@ -510,20 +664,20 @@ class Functions(Section):
                 writeNum(fobj, self.counter_name_pool.name_to_idx[k])
                 writeFloat(fobj, v)
 
-    def deserialize(self, fobj):
+    def deserialize(self, reader):
         self.functions = {}
-        for i in range(readNum(fobj)):
+        for i in range(reader.readNum()):
             f = {}
-            name = readString(fobj)
-            f['length'] = readNum(fobj)
-            self.line_counters.setOffsetFor(name, readNum(fobj))
-            self.line_addresses.setOffsetFor(name, readNum(fobj))
-            self.line_text.setOffsetFor(name, readNum(fobj))
+            name = reader.readString()
+            f['length'] = reader.readNum()
+            self.line_counters.setOffsetFor(name, reader.readNum())
+            self.line_addresses.setOffsetFor(name, reader.readNum())
+            self.line_text.setOffsetFor(name, reader.readNum())
             f['counters'] = {}
 
-            for j in range(readNum(fobj)):
-                k = self.counter_name_pool.idx_to_name[readNum(fobj)]
-                v = readFloat(fobj)
+            for j in range(reader.readNum()):
+                k = self.counter_name_pool.idx_to_name[reader.readNum()]
+                v = reader.readFloat()
                 f['counters'][k] = v
 
             self.functions[name] = f
@@ -534,12 +688,12 @@ class Functions(Section):
 
     def getCodeForFunction(self, fname):
         f = self.functions[fname]
+        length = f['length']
         counter_gen = self.line_counters \
-            .extractForFunction(fname, list(f['counters'].keys()))
-        address_gen = self.line_addresses.extractForFunction(fname)
-        text_gen = self.line_text.extractForFunction(fname)
-        for n in range(f['length']):
-            yield (next(counter_gen), next(address_gen), next(text_gen))
+            .extractForFunction(fname, list(f['counters'].keys()), length)
+        address_gen = self.line_addresses.extractForFunction(fname, length)
+        text_gen = self.line_text.extractForFunction(fname, length)
+        yield from zip(counter_gen, address_gen, text_gen)
 
     def copy(self, counter_name_pool, line_counters,
              line_addresses, line_text):
@@ -552,6 +706,19 @@ class Functions(Section):
 
 
 class ProfileV2(ProfileImpl):
+    # The types of the sections which later versions encode differently.
+    LineCounters = LineCounters
+    LineAddresses = LineAddresses
+
+    # The profile this one was upgraded from. The sections of an upgraded
+    # profile only hold the code of its functions once serialized, and until
+    # then it is read from there.
+    upgraded_from = None
+
+    # The mapping of the profile file, kept until all the sections which are
+    # read lazily are loaded.
+    mapping = None
+
     @staticmethod
     def checkFile(fn):
         # The first number is the version (2); ULEB encoded this is simply
@@ -559,56 +726,86 @@ class ProfileV2(ProfileImpl):
         with open(fn, 'rb') as f:
             return f.read(1) == b'\x02'
 
-    @staticmethod
-    def deserialize(fobj):
-        p = ProfileV2()
+    def _createSections(self, impl):
+        self.h = Header()
+        self.cnp = CounterNamePool()
+        self.tlc = TopLevelCounters(self.cnp)
+        self.lc = self.LineCounters(impl)
+        self.la = self.LineAddresses(impl)
+        self.tp = TextPool()
+        self.lt = LineText(self.tp, impl)
+        self.f = Functions(self.cnp, self.lc, self.la, self.lt, impl)
+
+        self.sections = [self.h, self.cnp, self.tlc, self.lc, self.la,
+                         self.lt, self.tp, self.f]
+
+    def _readPreamble(self, reader):
+        version = reader.readNum()
+        assert version == 2
 
-        p.h = Header()
-        p.cnp = CounterNamePool()
-        p.tlc = TopLevelCounters(p.cnp)
-        p.lc = LineCounters(p)
-        p.la = LineAddresses(p)
-        p.tp = TextPool()
-        p.lt = LineText(p.tp, p)
-        p.f = Functions(p.cnp, p.lc, p.la, p.lt, p)
+    def _read(self, fobj):
+        self._createSections(self)
 
-        p.sections = [p.h, p.cnp, p.tlc, p.lc, p.la, p.lt, p.tp, p.f]
+        # Map the file rather than reading it: only the index and the
+        # sections which are actually used get paged in.
+        try:
+            buf = self.mapping = mmap.mmap(fobj.fileno(), 0,
+                                           access=mmap.ACCESS_READ)
+        except (AttributeError, OSError, ValueError):
+            buf = fobj.read()
 
-        version = readNum(fobj)
-        assert version == 2
+        if isinstance(getattr(fobj, 'name', None), str):
+            self.tp.base_dir = os.path.dirname(os.path.abspath(fobj.name))
 
-        for section in p.sections:
-            section.readHeader(fobj)
-        for section in p.sections:
-            section.setStart(fobj.tell())
-        for section in p.sections:
-            section.read(fobj)
+        reader = BufferReader(buf)
+        self._readPreamble(reader)
 
-        return p
+        for section in self.sections:
+            section.readHeader(reader)
+        for section in self.sections:
+            section.setStart(reader.pos)
+        for section in self.sections:
+            section.read(buf)
 
-    def serialize(self, fname=None):
-        # If we're not writing to a file, emulate a file object instead.
-        if fname is None:
-            fobj = io.BytesIO()
-        else:
-            fobj = open(fname, 'wb')
+        return self
+
+    @staticmethod
+    def deserialize(fobj):
+        return ProfileV2()._read(fobj)
 
-        # Take a copy of all sections. While writing we may change
-        # offsets / indices, and we need to ensure we can modify our
-        # sections' states without affecting the original object (we may
-        # need to read from it while writing! (getCodeForFunction))
+    def _copySections(self):
+        """
+        Take a copy of all sections. While writing we may change offsets /
+        indices, and we need to ensure we can modify our sections' states
+        without affecting the original object (we may need to read from it
+        while writing! (getCodeForFunction))
+        """
         h = self.h.copy()
         cnp = self.cnp.copy()
         tlc = self.tlc.copy(cnp)
         lc = self.lc.copy()
         la = self.la.copy()
         tp = self.tp.copy()
+        # The serialized profile holds its text pool; see pool.poolProfile.
+        tp.pool_fname = ''
         lt = self.lt.copy(tp)
         f = self.f.copy(cnp, lc, la, lt)
-        sections = [h, cnp, tlc, lc, la, lt, tp, f]
+        return [h, cnp, tlc, lc, la, lt, tp, f]
 
+    def _writePreamble(self, fobj):
         writeNum(fobj, 2)  # Version
 
+    def serialize(self, fname=None):
+        # If we're not writing to a file, emulate a file object instead.
+        if fname is None:
+            fobj = io.BytesIO()
+        else:
+            fobj = open(fname, 'wb')
+
+        sections = self._copySections()
+
+        self._writePreamble(fobj)
+
         # We need to write all sections first, so we know their offset
         # before we write the header.
         tmpio = io.BytesIO()
@@ -625,32 +822,27 @@ class ProfileV2(ProfileImpl):
 
         if fname is None:
             return fobj.getvalue()
+        fobj.close()
 
     @staticmethod
     def upgrade(v1impl):
         assert v1impl.getVersion() == 1
 
         p = ProfileV2()
-
-        p.h = Header()
-        p.cnp = CounterNamePool()
-        p.tlc = TopLevelCounters(p.cnp)
-        p.lc = LineCounters(p)
-        p.la = LineAddresses(p)
-        p.tp = TextPool()
-        p.lt = LineText(p.tp, p)
-        p.f = Functions(p.cnp, p.lc, p.la, p.lt, p)
-
-        p.sections = [p.h, p.cnp, p.tlc, p.lc, p.la, p.lt, p.tp, p.f]
+        p._createSections(p)
 
         for section in p.sections:
             section.upgrade(v1impl)
+        p.upgraded_from = v1impl
 
         return p
 
     def getVersion(self):
         return 2
 
+    def getDisassemblyFormat(self):
+        return self.h.disassembly_format
+
     def getFunctions(self):
         return self.f.functions
 
@@ -658,4 +850,26 @@ class ProfileV2(ProfileImpl):
         return self.tlc.counters
 
     def getCodeForFunction(self, fname):
-        return self.f.getCodeForFunction(fname)
+        if self.upgraded_from is not None:
+            yield from self.upgraded_from.getCodeForFunction(fname)
+            return
+        yield from self.f.getCodeForFunction(fname)
+        # The mapping (and its file descriptor) is no longer needed once the
+        # lazily read sections are loaded.
+        if all(getattr(section, 'buf', None) is None
+               for section in self.sections):
+            self.close()
+
+    def getDecodedSize(self):
+        if self.upgraded_from is not None:
+            return None
+        return sum(section.decoded_size for section in self.sections)
+
+    def close(self):
+        """
+        Release the mapping of the profile file. The code of the functions
+        can no longer be read afterwards, unless it was read before.
+        """
+        if self.mapping is not None:
+            self.mapping.close()
+            self.mapping = None
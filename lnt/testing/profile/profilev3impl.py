@@ -0,0 +1,152 @@
+from .codec import defaultCodec, getCodec
+from .profilev2impl import ProfileV2, CompressedSection, MaybePooledSection
+from .profilev2impl import writeNum
+from . import profilev2impl
+import array
+import itertools
+import sys
+
+"""
+ProfileV3 is ProfileV2 with a choice of the codec its sections are compressed
+with, rather than always BZ2, which is slow to decompress, and with the
+counters and addresses of instructions stored in fixed width arrays, so that
+they are encoded and decoded a function at a time rather than a number at a
+time.
+
+The format is the one of ProfileV2 (see lnt.testing.profile.profilev2impl),
+except for:
+  * Its version (3) and the id of the codec of its compressed sections, both
+    ULEB encoded, which precede the section headers. The codecs are listed in
+    lnt.testing.profile.codec. Profiles are written with zstd when it is
+    available, and zlib otherwise.
+  * The LineCounters section, which is an array of little endian 32 bit
+    floats, with the value of each counter of the function for each
+    instruction.
+  * The LineAddresses section, which is an array of little endian 64 bit
+    signed integers, with the offset of the address of each instruction from
+    the previous one (or from zero for the first instruction of a function).
+"""
+
+
+def writeArray(fobj, values):
+    """
+    Write the array 'values' in little endian order to a stream.
+    """
+    if sys.byteorder == 'big':
+        values = array.array(values.typecode, values)
+        values.byteswap()
+    fobj.write(values.tobytes())
+
+
+def readArray(typecode, data, offset, count):
+    """
+    Read an array of 'count' little endian numbers of type 'typecode' from
+    'data', starting at 'offset'.
+    """
+    values = array.array(typecode)
+    values.frombytes(data[offset:offset + values.itemsize * count])
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values
+
+
+class LineCounters(profilev2impl.LineCounters):
+    def serialize(self, fobj):
+        assert self.impl
+
+        self.function_offsets = {}
+        start = fobj.tell()
+        for fname, f in sorted(self.impl.getFunctions().items()):
+            self.function_offsets[fname] = fobj.tell() - start
+            all_counters = sorted(f['counters'].keys())
+            values = array.array('f', [
+                counters.get(k, 0)
+                for counters, _, _ in self.impl.getCodeForFunction(fname)
+                for k in all_counters])
+            writeArray(fobj, values)
+
+    def extractForFunction(self, fname, counters, length):
+        self.load()
+        counters.sort()
+        if not counters:
+            return ({} for _ in range(length))
+        values = readArray('f', self.data, self.function_offsets[fname],
+                           length * len(counters))
+        rows = zip(*[iter(values)] * len(counters))
+        return (dict(zip(counters, row)) for row in rows)
+
+
+class LineAddresses(profilev2impl.LineAddresses):
+    def serialize(self, fobj):
+        assert self.impl
+
+        self.function_offsets = {}
+        start = fobj.tell()
+        for fname in sorted(self.impl.getFunctions()):
+            self.function_offsets[fname] = fobj.tell() - start
+            addresses = [address for _, address, _
+                         in self.impl.getCodeForFunction(fname)]
+            values = array.array('q', [
+                address - prev_address for address, prev_address
+                in zip(addresses, [0] + addresses)])
+            writeArray(fobj, values)
+
+    def extractForFunction(self, fname, length):
+        self.load()
+        values = readArray('q', self.data, self.function_offsets[fname],
+                           length)
+        return itertools.accumulate(values)
+
+
+class ProfileV3(ProfileV2):
+    LineCounters = LineCounters
+    LineAddresses = LineAddresses
+
+    def __init__(self, codec=None):
+        self.codec = codec or defaultCodec()
+
+    @staticmethod
+    def checkFile(fn):
+        # The version (3) ULEB encoded is simply 0x03.
+        with open(fn, 'rb') as f:
+            return f.read(1) == b'\x03'
+
+    def _setCodec(self, sections):
+        for section in sections:
+            if isinstance(section, (CompressedSection, MaybePooledSection)):
+                section.codec = self.codec
+
+    def _readPreamble(self, reader):
+        version = reader.readNum()
+        assert version == 3
+        self.codec = getCodec(reader.readNum())
+        self._setCodec(self.sections)
+
+    @staticmethod
+    def deserialize(fobj):
+        return ProfileV3()._read(fobj)
+
+    def _copySections(self):
+        sections = ProfileV2._copySections(self)
+        self._setCodec(sections)
+        return sections
+
+    def _writePreamble(self, fobj):
+        writeNum(fobj, 3)  # Version
+        writeNum(fobj, self.codec.id)
+
+    @staticmethod
+    def upgrade(v2impl, codec=None):
+        assert v2impl.getVersion() == 2
+
+        p = ProfileV3(codec)
+        p._createSections(p)
+
+        for section in p.sections:
+            section.upgrade(v2impl)
+        p.upgraded_from = v2impl
+
+        return p
+
+    def getVersion(self):
+        return 3
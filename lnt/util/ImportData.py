@@ -1,26 +1,37 @@
 from lnt.util import NTEmailReport
 from contextlib import closing
 from lnt.util import logger
+from lnt.util import metrics
 import collections
+import concurrent.futures
 import datetime
+import io
+import lnt.formats
 import lnt.server.reporting.analysis
+import lnt.server.reporting.runs
 import lnt.testing
+import lnt.server.ui.util
+import multiprocessing
 import os
+import sqlalchemy
 
 import tempfile
 import time
 
 from lnt.server.db import fieldchange
+from lnt.server.db import jobqueue
 
 
 def import_and_report(config, db_name, db, session, file, format, ts_name,
                       show_sample_count=False, disable_email=False,
                       disable_report=False, select_machine=None,
-                      merge_run=None, ignore_regressions=False):
+                      merge_run=None, ignore_regressions=False,
+                      lean=False):
     """
     import_and_report(config, db_name, db, session, file, format, ts_name,
                       [show_sample_count], [disable_email],
-                      [disable_report], [select_machine], [merge_run])
+                      [disable_report], [select_machine], [merge_run],
+                      [ignore_regressions], [lean])
                      -> ... object ...
 
     Import a test data file into an LNT server and generate a test report. On
@@ -28,6 +39,14 @@ def import_and_report(config, db_name, db, session, file, format, ts_name,
 
     The result object is a dictionary containing information on the imported
     run and its comparison to the previous run.
+
+    A lean import only does the work needed to store the run: the added
+    machines, runs and tests are counted by the import rather than by
+    querying the tables, and the report is only generated when it is emailed.
+
+    The comparisons shown by the run pages are stored by the post submission
+    tasks, in the background unless the post submission mode is 'sync', or
+    by the import when the tasks are skipped with ignore_regressions.
     """
     result = {
         'success': False,
@@ -47,18 +66,20 @@ def import_and_report(config, db_name, db, session, file, format, ts_name,
     if ts is None:
         result['error'] = "Unknown test suite '%s'!" % ts_name
         return result
-    numMachines = ts.getNumMachines(session)
-    numRuns = ts.getNumRuns(session)
-    numTests = ts.getNumTests(session)
+    if not lean:
+        numMachines = ts.getNumMachines(session)
+        numRuns = ts.getNumRuns(session)
+        numTests = ts.getNumTests(session)
 
-    # If the database gets fragmented, count(*) in SQLite can get really
-    # slow!?!
-    if show_sample_count:
-        numSamples = ts.getNumSamples(session)
+        # If the database gets fragmented, count(*) in SQLite can get really
+        # slow!?!
+        if show_sample_count:
+            numSamples = ts.getNumSamples(session)
 
     startTime = time.time()
-    validation = lnt.testing.validate_report(file, format)
+    validation = lnt.testing.validate_report(file, format, stream=True)
     result['load_time'] = time.time() - startTime
+    metrics.IMPORT_SECONDS.observe(result['load_time'], phase='load')
 
     if not validation['success']:
         result['error'] = validation['error']
@@ -94,10 +115,11 @@ def import_and_report(config, db_name, db, session, file, format, ts_name,
                 return result
 
     importStartTime = time.time()
+    counts = dict()
     try:
         run = ts.importDataFromDict(session, data, config=db_config,
                                     select_machine=select_machine,
-                                    merge_run=merge_run)
+                                    merge_run=merge_run, counts=counts)
     except KeyboardInterrupt:
         raise
     except Exception as e:
@@ -113,7 +135,13 @@ def import_and_report(config, db_name, db, session, file, format, ts_name,
     # If the import succeeded, save the import path.
     run.imported_from = file
 
+    # The post submission tasks store the comparisons which the run pages show
+    # by default, unless they are skipped.
+    if ignore_regressions:
+        lnt.server.reporting.runs.store_run_comparisons(session, ts, run)
+
     result['import_time'] = time.time() - importStartTime
+    metrics.IMPORT_SECONDS.observe(result['import_time'], phase='import')
 
     result['report_to_address'] = toAddress
     if config:
@@ -121,17 +149,25 @@ def import_and_report(config, db_name, db, session, file, format, ts_name,
     else:
         report_url = "localhost"
 
-    if not disable_report:
+    if not disable_report and (not lean or toAddress is not None):
         #  This has the side effect of building the run report for
         #  this result.
         NTEmailReport.emailReport(result, session, run, report_url,
                                   email_config, toAddress, True)
 
-    result['added_machines'] = ts.getNumMachines(session) - numMachines
-    result['added_runs'] = ts.getNumRuns(session) - numRuns
-    result['added_tests'] = ts.getNumTests(session) - numTests
-    if show_sample_count:
-        result['added_samples'] = ts.getNumSamples(session) - numSamples
+    if lean:
+        result['added_machines'] = counts['added_machines']
+        result['added_runs'] = counts['added_runs']
+        result['added_tests'] = counts['added_tests']
+        if show_sample_count:
+            result['added_samples'] = counts['added_samples']
+    else:
+        result['added_machines'] = ts.getNumMachines(session) - numMachines
+        result['added_runs'] = ts.getNumRuns(session) - numRuns
+        result['added_tests'] = ts.getNumTests(session) - numTests
+        if show_sample_count:
+            result['added_samples'] = \
+                ts.getNumSamples(session) - numSamples
 
     result['committed'] = True
     result['run_id'] = run.id
@@ -139,12 +175,17 @@ def import_and_report(config, db_name, db, session, file, format, ts_name,
 
     if ignore_regressions:
         logger.info("Regenerating regressions skipped")
+    elif config and config.post_submit_mode != 'sync':
+        job = jobqueue.enqueue_post_submit(session, ts, run)
+        result['post_submit_job_id'] = job.id
+        jobqueue.schedule_jobs(config, db_name)
     else:
         fieldchange.post_submit_tasks(session, ts, run.id)
 
     # Add a handy relative link to the submitted run.
     result['result_url'] = "db_{}/v4/{}/{}".format(db_name, ts_name, run.id)
     result['report_time'] = time.time() - importStartTime
+    metrics.IMPORT_SECONDS.observe(result['report_time'], phase='report')
     result['total_time'] = time.time() - startTime
     logger.info("Successfully created {}".format(result['result_url']))
     # If this database has a shadow import configured, import the run into that
@@ -167,7 +208,8 @@ def import_and_report(config, db_name, db, session, file, format, ts_name,
                                               disable_report,
                                               select_machine=select_machine,
                                               merge_run=merge_run,
-                                              ignore_regressions=ignore_regressions)
+                                              ignore_regressions=ignore_regressions,
+                                              lean=lean)
 
             # Append the shadow result to the result.
             result['shadow_result'] = shadow_result
@@ -176,6 +218,169 @@ def import_and_report(config, db_name, db, session, file, format, ts_name,
     return result
 
 
+# The number of reports parsed ahead by the processes of import_files, and
+# imported in one transaction.
+IMPORT_BATCH_SIZE = 50
+
+
+def _validate_report_file(file, format):
+    # Called in the worker processes of import_files: the whole report is
+    # read, so that it can be sent back.
+    return lnt.testing.validate_report(file, format)
+
+
+def import_files(config, db_name, db, session, files, format, ts_name,
+                 jobs, select_machine=None, merge_run=None,
+                 batch_size=IMPORT_BATCH_SIZE):
+    """
+    import_files(config, db_name, db, session, files, format, ts_name, jobs,
+                 [select_machine], [merge_run], [batch_size])
+                -> (results, summary)
+
+    Import many test data files into an LNT server at once. The files are
+    parsed and validated in jobs worker processes, a batch at a time, and the
+    runs of each batch are imported in the order of their run orders. Each
+    file is committed on its own, as importing a run commits the orders it
+    creates: a file which fails to import is rolled back without affecting
+    the others. The post submission tasks are then run (or queued) once for
+    each order a run was imported for, machine by machine, which also stores
+    the comparisons shown by the run pages. Unlike import_and_report, no
+    report is generated or emailed.
+
+    Returns the list of the results of the files, in the order of the files,
+    and a dictionary with the number of imported runs and samples and the
+    total time.
+    """
+    if select_machine is None:
+        select_machine = 'match'
+    if merge_run is None:
+        merge_run = 'reject'
+
+    start_time = time.time()
+    ts = db.testsuite[ts_name]
+    db_config = config.databases[db_name] if config else None
+
+    results = [{'success': False, 'error': None, 'import_file': file}
+               for file in files]
+    imported_runs = []
+    num_samples = 0
+
+    def order_sort_key(data):
+        values = [data['run'].get(field.name) for field in ts.order_fields]
+        if any(value is None for value in values):
+            # This fails to import anyway.
+            return ''
+        return lnt.server.ui.util.revision_sort_key(values)
+
+    def import_file(index, data):
+        try:
+            run = ts.importDataFromDict(session, data, config=db_config,
+                                        select_machine=select_machine,
+                                        merge_run=merge_run)
+            run.imported_from = files[index]
+            session.commit()
+        except Exception as e:
+            session.rollback()
+            import traceback
+            results[index]['error'] = "import failure: %s" % e
+            results[index]['message'] = traceback.format_exc()
+            return None
+        return run
+
+    def import_batch(batch):
+        nonlocal num_samples
+        runs = []
+        for index, data in batch:
+            run = import_file(index, data)
+            if run is not None:
+                runs.append((index, run))
+        for index, run in runs:
+            results[index].update({
+                'success': True,
+                'run_id': run.id,
+                'result_url': "db_{}/v4/{}/{}".format(db_name, ts_name,
+                                                      run.id),
+            })
+            imported_runs.append((run.machine_id, run.order.sort_key,
+                                  run.order_id, run.id))
+        if not runs:
+            return
+        num_samples += session.query(sqlalchemy.func.count(ts.Sample.id)) \
+            .filter(ts.Sample.run_id.in_([run.id for _, run in runs])) \
+            .scalar()
+
+    executor = concurrent.futures.ProcessPoolExecutor(
+        max_workers=jobs, mp_context=multiprocessing.get_context('spawn'))
+
+    def parse(indexes):
+        return [(index, executor.submit(_validate_report_file, files[index],
+                                        format))
+                for index in indexes]
+    with executor:
+        # Parse the next batch while the current one is imported.
+        batches = [range(i, min(i + batch_size, len(files)))
+                   for i in range(0, len(files), batch_size)]
+        futures = parse(batches[0]) if batches else []
+        for i in range(len(batches)):
+            next_futures = parse(batches[i + 1]) \
+                if i + 1 < len(batches) else []
+
+            batch = []
+            for index, future in futures:
+                validation = future.result()
+                result = results[index]
+                if not validation['success']:
+                    result['error'] = validation['error']
+                    if 'message' in validation:
+                        result['message'] = validation['message']
+                    continue
+                data = validation['data']
+                data_schema = data.get('schema')
+                if data_schema is not None and data_schema != ts_name:
+                    result['error'] = ("Importing '%s' data into test suite "
+                                       "'%s'" % (data_schema, ts_name))
+                    continue
+                batch.append((index, data))
+            batch.sort(key=lambda entry: order_sort_key(entry[1]))
+            import_batch(batch)
+            futures = next_futures
+
+    # Run the post submission tasks once per order, machine by machine.
+    orders = collections.OrderedDict()
+    for machine_id, _, order_id, run_id in sorted(imported_runs):
+        orders[(machine_id, order_id)] = run_id
+    if config and config.post_submit_mode != 'sync':
+        for run_id in orders.values():
+            run = session.query(ts.Run).get(run_id)
+            if run is not None:
+                jobqueue.enqueue_post_submit(session, ts, run)
+        jobqueue.schedule_jobs(config, db_name)
+    else:
+        for run_id in orders.values():
+            fieldchange.post_submit_tasks(session, ts, run_id)
+
+    summary = {
+        'runs': len(imported_runs),
+        'samples': num_samples,
+        'total_time': time.time() - start_time,
+    }
+    return results, summary
+
+
+def print_import_summary(summary, out):
+    """
+    print_import_summary(summary, out) -> None
+
+    Print the throughput of an import_files call to the given output stream.
+    """
+    total_time = max(summary['total_time'], 1e-6)
+    print("Imported %d runs (%d samples) in %.2fs: %.2f runs/s, "
+          "%.2f samples/s" % (summary['runs'], summary['samples'],
+                              summary['total_time'],
+                              summary['runs'] / total_time,
+                              summary['samples'] / total_time), file=out)
+
+
 def no_submit():
     """Do not submit but create dummy submission report."""
     return {
@@ -211,8 +416,9 @@ def print_report_result(result, out, err, verbose=True):
         return
 
     # Print the test results.
-    test_results = result.get('test_results')
-    if not test_results:
+    # Lean imports have no test results, but still report the imported data.
+    test_results = result.get('test_results') or []
+    if not test_results and 'added_runs' not in result:
         return
 
     # List the parameter sets, if interesting.
@@ -226,7 +432,8 @@ def print_report_result(result, out, err, verbose=True):
 
     total_num_tests = sum([len(item['results'])
                            for item in test_results])
-    print("--- Tested: %d tests --" % total_num_tests, file=out)
+    if test_results:
+        print("--- Tested: %d tests --" % total_num_tests, file=out)
     test_index = 0
     result_kinds = collections.Counter()
     for i, item in enumerate(test_results):
@@ -306,15 +513,23 @@ def print_report_result(result, out, err, verbose=True):
         if result.get('added_samples', 0):
             print("Added Samples : %d" % result['added_samples'], file=out)
         print(file=out)
-    print("Results", file=out)
-    print("----------------", file=out)
-    for kind, count in result_kinds.items():
-        print(kind, ":", count, file=out)
+    if test_results:
+        print("Results", file=out)
+        print("----------------", file=out)
+        for kind, count in result_kinds.items():
+            print(kind, ":", count, file=out)
+
+
+# The suffixes of the stashed copies of submissions, by format.
+_SUBMISSION_SUFFIXES = {
+    'binary': '.lntb',
+    'plist': '.plist',
+}
 
 
 def import_from_string(config, db_name, db, session, ts_name, data,
                        select_machine=None, merge_run=None,
-                       ignore_regressions=False):
+                       ignore_regressions=False, lean=False):
     # Stash a copy of the raw submission.
     #
     # To keep the temporary directory organized, we keep files in
@@ -331,9 +546,14 @@ def import_from_string(config, db_name, db, session, ts_name, data,
     # to use these files in cases we might need them for debugging or data
     # recovery.
     prefix = utcnow.strftime("data-%Y-%m-%d_%H-%M-%S")
-    fd, path = tempfile.mkstemp(prefix=prefix, suffix='.json',
-                                dir=str(tmpdir), text=True)
-    with os.fdopen(fd, "w") as fp:
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+    data_format = lnt.formats.guess_format(io.BytesIO(data))
+    suffix = _SUBMISSION_SUFFIXES.get(data_format and data_format['name'],
+                                      '.json')
+    fd, path = tempfile.mkstemp(prefix=prefix, suffix=suffix,
+                                dir=str(tmpdir))
+    with os.fdopen(fd, "wb") as fp:
         fp.write(data)
 
     # Import the data.
@@ -344,5 +564,5 @@ def import_from_string(config, db_name, db, session, ts_name, data,
     result = lnt.util.ImportData.import_and_report(
         config, db_name, db, session, path, '<auto>', ts_name,
         select_machine=select_machine, merge_run=merge_run,
-        ignore_regressions=ignore_regressions)
+        ignore_regressions=ignore_regressions, lean=lean)
     return result
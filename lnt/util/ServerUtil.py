@@ -8,7 +8,9 @@ import urllib.error
 import contextlib
 import json
 import ssl
+import uuid
 import certifi
+import lnt.formats.BinaryFormat
 import lnt.server.instance
 
 # FIXME: I used to maintain this file in such a way that it could be used
@@ -29,21 +31,47 @@ def _show_json_error(reply):
         sys.stderr.write(message + '\n')
 
 
+def _encode_multipart(values, file_data):
+    """Encode the form values and the file as multipart/form-data, returning
+    the body and its content type."""
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, value in values.items():
+        parts.append(('--%s\r\n'
+                      'Content-Disposition: form-data; name="%s"\r\n\r\n'
+                      '%s\r\n' % (boundary, name, value)).encode('utf-8'))
+    parts.append(('--%s\r\n'
+                  'Content-Disposition: form-data; name="file"; '
+                  'filename="report"\r\n'
+                  'Content-Type: application/octet-stream\r\n\r\n' %
+                  boundary).encode('utf-8'))
+    parts.append(file_data)
+    parts.append(('\r\n--%s--\r\n' % boundary).encode('utf-8'))
+    return b''.join(parts), 'multipart/form-data; boundary=%s' % boundary
+
+
 def submitFileToServer(url, file, select_machine=None, merge_run=None,
-                       ignore_regressions=False):
+                       ignore_regressions=False, lean=False):
     with open(file, 'rb') as f:
-        values = {
-            'input_data': f.read(),
-            'commit': "1",  # compatibility with old servers.
-        }
-        if select_machine is not None:
-            values['select_machine'] = select_machine
-        if merge_run is not None:
-            values['merge'] = merge_run
-        if ignore_regressions:
-            values['ignore_regressions'] = True
+        file_data = f.read()
+    values = {
+        'commit': "1",  # compatibility with old servers.
+    }
+    if select_machine is not None:
+        values['select_machine'] = select_machine
+    if merge_run is not None:
+        values['merge'] = merge_run
+    if ignore_regressions:
+        values['ignore_regressions'] = True
+    if lean:
+        values['lean'] = True
     headers = {'Accept': 'application/json'}
-    data = urllib.parse.urlencode(values).encode(encoding='ascii')
+    if file_data.startswith(lnt.formats.BinaryFormat.MAGIC):
+        # Binary reports are uploaded as is, instead of URL encoded.
+        data, headers['Content-Type'] = _encode_multipart(values, file_data)
+    else:
+        values['input_data'] = file_data
+        data = urllib.parse.urlencode(values).encode(encoding='ascii')
     try:
         context = ssl.create_default_context(cafile=certifi.where())
         response = urllib.request.urlopen(urllib.request.Request(url, data, headers=headers), context=context)
@@ -72,7 +100,8 @@ def submitFileToServer(url, file, select_machine=None, merge_run=None,
 
 
 def submitFileToInstance(path, file, select_machine=None, merge_run=None,
-                         testsuite=None, ignore_regressions=False):
+                         testsuite=None, ignore_regressions=False,
+                         lean=False):
     # Otherwise, assume it is a local url and submit to the default database
     # in the instance.
     instance = lnt.server.instance.Instance.frompath(path)
@@ -85,28 +114,30 @@ def submitFileToInstance(path, file, select_machine=None, merge_run=None,
         return lnt.util.ImportData.import_and_report(
             config, db_name, db, session, file, format='<auto>',
             ts_name=testsuite or 'nts', select_machine=select_machine,
-            merge_run=merge_run, ignore_regressions=ignore_regressions)
+            merge_run=merge_run, ignore_regressions=ignore_regressions,
+            lean=lean)
 
 
 def submitFile(url, file, verbose, select_machine=None, merge_run=None,
-               testsuite=None, ignore_regressions=False):
+               testsuite=None, ignore_regressions=False, lean=False):
     # If this is a real url, submit it using urllib.
     if '://' in url:
         result = submitFileToServer(url, file, select_machine, merge_run,
-                                    ignore_regressions)
+                                    ignore_regressions, lean)
     else:
         result = submitFileToInstance(url, file, select_machine, merge_run,
-                                      testsuite, ignore_regressions)
+                                      testsuite, ignore_regressions, lean)
     return result
 
 
 def submitFiles(url, files, verbose, select_machine=None, merge_run=None,
-                testsuite=None, ignore_regressions=False):
+                testsuite=None, ignore_regressions=False, lean=False):
     results = []
     for file in files:
         result = submitFile(url, file, verbose, select_machine=select_machine,
                             merge_run=merge_run, testsuite=testsuite,
-                            ignore_regressions=ignore_regressions)
+                            ignore_regressions=ignore_regressions,
+                            lean=lean)
         if result:
             results.append(result)
     return results
@@ -0,0 +1,180 @@
+"""
+A registry of the metrics of a server process, which the /metrics page shows
+in the text format of Prometheus.
+
+The metrics are kept by each process: a server running several worker
+processes reports the metrics of the one serving the /metrics request, and
+Prometheus must be configured to scrape each of them (or to aggregate them).
+"""
+
+import bisect
+import threading
+
+# The upper bounds, in seconds, of the buckets of the histograms of durations.
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+                    10.0, 30.0, 60.0, 300.0)
+# The upper bounds of the buckets of the histograms of query counts.
+COUNT_BUCKETS = (0, 1, 5, 10, 25, 50, 100, 250, 500, 1000, 5000)
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"') \
+        .replace('\n', '\\n')
+
+
+def _format_value(value):
+    if isinstance(value, float):
+        if value == float('inf'):
+            return '+Inf'
+        return repr(value)
+    return str(value)
+
+
+class _Metric(object):
+    type = None
+
+    def __init__(self, name, description, labels=()):
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+        self.lock = threading.Lock()
+        # The values of the metric, by the tuple of the values of its labels.
+        self.values = {}
+
+    def _key(self, labels):
+        if set(labels) != set(self.labels):
+            raise ValueError("metric %s has the labels (%s), not (%s)" %
+                             (self.name, ', '.join(self.labels),
+                              ', '.join(labels)))
+        return tuple(str(labels[label]) for label in self.labels)
+
+    def _format_labels(self, key, extra=()):
+        pairs = list(zip(self.labels, key)) + list(extra)
+        if not pairs:
+            return ''
+        return '{%s}' % ','.join('%s="%s"' % (label, _escape(value))
+                                 for label, value in pairs)
+
+    def _samples(self, key, value):
+        """Return the (suffix, extra labels, value) samples of one value."""
+        return [('', (), value)]
+
+    def render(self):
+        lines = ['# HELP %s %s' % (self.name, self.description),
+                 '# TYPE %s %s' % (self.name, self.type)]
+        with self.lock:
+            values = sorted(self.values.items())
+            for key, value in values:
+                for suffix, extra, sample in self._samples(key, value):
+                    lines.append('%s%s%s %s' %
+                                 (self.name, suffix,
+                                  self._format_labels(key, extra),
+                                  _format_value(sample)))
+        return lines
+
+
+class Counter(_Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    type = 'gauge'
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = value
+
+
+class Histogram(_Metric):
+    type = 'histogram'
+
+    def __init__(self, name, description, labels=(),
+                 buckets=DURATION_BUCKETS):
+        _Metric.__init__(self, name, description, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self.lock:
+            counts, total, count = self.values.get(
+                key, ([0] * len(self.buckets), 0, 0))
+            i = bisect.bisect_left(self.buckets, value)
+            if i < len(counts):
+                counts[i] += 1
+            self.values[key] = (counts, total + value, count + 1)
+
+    def _samples(self, key, value):
+        counts, total, count = value
+        samples = []
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets, counts):
+            cumulative += bucket_count
+            samples.append(('_bucket', [('le', _format_value(bound))],
+                            cumulative))
+        samples.append(('_bucket', [('le', '+Inf')], count))
+        samples.append(('_sum', (), total))
+        samples.append(('_count', (), count))
+        return samples
+
+
+class Registry(object):
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.metrics = {}
+
+    def _get(self, cls, name, *args, **kwargs):
+        with self.lock:
+            metric = self.metrics.get(name)
+            if metric is None:
+                metric = self.metrics[name] = cls(name, *args, **kwargs)
+            elif type(metric) is not cls:
+                raise ValueError("metric %s is already a %s" %
+                                 (name, metric.type))
+            return metric
+
+    def counter(self, name, description, labels=()):
+        return self._get(Counter, name, description, labels)
+
+    def gauge(self, name, description, labels=()):
+        return self._get(Gauge, name, description, labels)
+
+    def histogram(self, name, description, labels=(),
+                  buckets=DURATION_BUCKETS):
+        return self._get(Histogram, name, description, labels, buckets)
+
+    def render(self):
+        """Return the metrics in the text format of Prometheus."""
+        with self.lock:
+            metrics = sorted(self.metrics.items())
+        lines = []
+        for _, metric in metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+REQUEST_SECONDS = REGISTRY.histogram(
+    'lnt_http_request_duration_seconds',
+    "The time taken to handle requests.", ['endpoint', 'method', 'status'])
+REQUEST_SQL_QUERIES = REGISTRY.histogram(
+    'lnt_http_request_sql_queries',
+    "The number of SQL statements executed by requests.", ['endpoint'],
+    buckets=COUNT_BUCKETS)
+REQUEST_SQL_SECONDS = REGISTRY.histogram(
+    'lnt_http_request_sql_duration_seconds',
+    "The time requests spent executing SQL statements.", ['endpoint'])
+IMPORT_SECONDS = REGISTRY.histogram(
+    'lnt_import_duration_seconds',
+    "The time taken by the phases of imports: loading the report, importing "
+    "it, and importing and reporting on it.", ['phase'])
+TASK_SECONDS = REGISTRY.histogram(
+    'lnt_task_duration_seconds',
+    "The time taken by timed tasks, such as the post submission tasks.",
+    ['task'])
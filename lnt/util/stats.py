@@ -1,3 +1,5 @@
+import collections
+import heapq
 import math
 from lnt.external.stats.stats import mannwhitneyu as mannwhitneyu_large
 from functools import reduce
@@ -41,6 +43,97 @@ def median(values):
     return (values[(N - 1) // 2] + values[N // 2]) * .5
 
 
+def moving_means(values, window):
+    """Return the mean of values[i - window:i + window] (clamped to the
+    values) for each index i, updating the sum of the window as it slides."""
+    result = []
+    total = 0.
+    start = end = 0
+    for i in range(len(values)):
+        while end < min(len(values), i + window):
+            total += values[end]
+            end += 1
+        while start < max(0, i - window):
+            total -= values[start]
+            start += 1
+        result.append(total / (end - start) if end > start else None)
+    return result
+
+
+class _SlidingMedian(object):
+    """The median of a multiset of values which are added and removed one at
+    a time, in O(log n) each. The lower half of the values is kept in a max
+    heap and the upper half in a min heap; removed values are only dropped
+    from a heap once they reach its top."""
+
+    def __init__(self):
+        self.low = []  # The negated values of the lower half.
+        self.high = []
+        self.low_size = self.high_size = 0
+        self.removed = collections.Counter()
+
+    def _prune(self, heap, sign):
+        while heap and self.removed[sign * heap[0]]:
+            self.removed[sign * heapq.heappop(heap)] -= 1
+
+    def _rebalance(self):
+        # Keep the lower half as large as the upper one, or one larger.
+        if self.low_size > self.high_size + 1:
+            heapq.heappush(self.high, -heapq.heappop(self.low))
+            self.low_size -= 1
+            self.high_size += 1
+            self._prune(self.low, -1)
+        elif self.low_size < self.high_size:
+            heapq.heappush(self.low, -heapq.heappop(self.high))
+            self.low_size += 1
+            self.high_size -= 1
+            self._prune(self.high, 1)
+
+    def add(self, value):
+        if not self.low or value <= -self.low[0]:
+            heapq.heappush(self.low, -value)
+            self.low_size += 1
+        else:
+            heapq.heappush(self.high, value)
+            self.high_size += 1
+        self._rebalance()
+
+    def remove(self, value):
+        self.removed[value] += 1
+        if value <= -self.low[0]:
+            self.low_size -= 1
+            self._prune(self.low, -1)
+        else:
+            self.high_size -= 1
+            self._prune(self.high, 1)
+        self._rebalance()
+
+    def median(self):
+        if self.low_size == 0:
+            return None
+        lower = -self.low[0]
+        upper = lower if self.low_size > self.high_size else self.high[0]
+        return (lower + upper) * .5
+
+
+def moving_medians(values, window):
+    """Return the median of values[i - window:i + window] (clamped to the
+    values) for each index i, updating the median of the window as it slides
+    in O(log window) per value."""
+    result = []
+    medians = _SlidingMedian()
+    start = end = 0
+    for i in range(len(values)):
+        while end < min(len(values), i + window):
+            medians.add(values[end])
+            end += 1
+        while start < max(0, i - window):
+            medians.remove(values[start])
+            start += 1
+        result.append(medians.median())
+    return result
+
+
 def median_absolute_deviation(values, med=None):
     if med is None:
         med = median(values)
@@ -85,13 +178,22 @@ def mannwhitneyu_small(a, b, sigLevel):
     x = a if not flip else b
     y = b if not flip else a
 
-    Ux = 0.
-    for xe in x:
-        for ye in y:
-            if xe < ye:
-                Ux += 1
-            elif xe == ye:
-                Ux += .5
+    # Ux counts the pairs (xe, ye) with xe < ye, ties counting as one half.
+    # Compute it from the rank sum of x, giving tied values their average
+    # rank, instead of comparing every pair.
+    combined = sorted([(v, 0) for v in x] + [(v, 1) for v in y],
+                      key=lambda e: e[0])
+    x_rank_sum = 0.
+    i = 0
+    while i < len(combined):
+        j = i
+        while j + 1 < len(combined) and combined[j + 1][0] == combined[i][0]:
+            j += 1
+        # Elements i..j are tied, their ranks are i + 1 to j + 1.
+        rank = (i + j) / 2. + 1
+        x_rank_sum += rank * sum(1 for e in combined[i:j + 1] if e[1] == 0)
+        i = j + 1
+    Ux = len(x) * len(y) - (x_rank_sum - len(x) * (len(x) + 1) / 2.)
     Uy = len(a) * len(b) - Ux
     Ua = Ux if not flip else Uy
     Ub = Uy if not flip else Ux
@@ -0,0 +1,5 @@
+# RUN: lnt convert --to=binary %S/Inputs/test.json %t.lntb
+# RUN: lnt convert --to=json %t.lntb | filecheck %s
+# RUN: lnt convert --to=json < %t.lntb | filecheck %s
+
+# CHECK: {"a": 1}
@@ -14,4 +14,14 @@
 # RUN: rm -rf %t/non_existing_output.lnt
 # RUN: lnt profile upgrade %S/Inputs/test.lntprof %t/non_existing_output.lnt
 # RUN: lnt profile getVersion %t/non_existing_output.lnt | filecheck --check-prefix=CHECK-UPGRADE %s
-# CHECK-UPGRADE: 2
+# CHECK-UPGRADE: 3
+# RUN: lnt profile upgrade --codec bz2 %t/non_existing_output.lnt %t/bz2.lntprof
+# RUN: lnt profile getCodeForFunction %t/bz2.lntprof fn1 | filecheck --check-prefix=CHECK-REPACKFN1 %s
+
+# RUN: rm -rf %t/repack && mkdir -p %t/repack
+# RUN: lnt profile upgrade %S/Inputs/test.lntprof %t/repack/a.lntprof
+# RUN: lnt profile upgrade %S/Inputs/test.lntprof %t/repack/b.lntprof
+# RUN: lnt profile repack %t/repack | filecheck --check-prefix=CHECK-REPACK %s
+# CHECK-REPACK: Pooled 2 profiles, deleted 0 unused pools
+# RUN: lnt profile getCodeForFunction %t/repack/b.lntprof fn1 | filecheck --check-prefix=CHECK-REPACKFN1 %s
+# CHECK-REPACKFN1: 1048576, "add r0, r0, r0"], [{"branch-misses": 0.0, "cycles": 100.0}, 1048580, "sub r1, r0, r0"]]
@@ -20,7 +20,7 @@
 
 import sys
 import glob
-from lnt.testing.profile.profilev2impl import ProfileV2
+from lnt.testing.profile.profilev3impl import ProfileV3
 
 profile = glob.glob('%s/data/profiles/*.lntprof' % sys.argv[1])[0]
-assert ProfileV2.checkFile(profile)
+assert ProfileV3.checkFile(profile)
@@ -17,6 +17,8 @@ sys.path.insert(0, UI_DIR)
 from V4Pages import check_json
 import lnt.server.db.migrate
 import lnt.server.ui.app
+import gc
+import json
 import logging
 import sys
 import unittest
@@ -103,6 +105,7 @@ class JSONAPITester(unittest.TestCase):
         self.instance_path = instance_path
         app = lnt.server.ui.app.App.create_standalone(instance_path)
         app.testing = True
+        self.app = app
         self.client = app.test_client()
 
         # Build ID maps for dynamic lookups.
@@ -132,7 +135,8 @@ class JSONAPITester(unittest.TestCase):
         self.assertEqual(type(response), dict)
 
         # There should be no unexpected top level keys.
-        all_top_level_keys = {'generated_by', 'machine', 'machines', 'runs', 'run', 'orders', 'tests', 'samples'}
+        all_top_level_keys = {'generated_by', 'machine', 'machines', 'runs', 'run', 'orders', 'tests', 'samples',
+                              'series'}
         keys = set(response.keys())
         self.assertTrue(keys.issubset(all_top_level_keys),
                         "{} not subset of {}".format(keys, all_top_level_keys))
@@ -239,6 +243,85 @@ class JSONAPITester(unittest.TestCase):
         self.assertEqual(j2[0][0], u'152293')
         self.assertEqual(j2[0][1], 10.0)
 
+        # And that max_points downsamples the line, but keeps the points of
+        # its regressions.
+        j3 = check_json(
+            client,
+            f'api/db_default/v4/nts/graph/{m2_id}/{test1_id}/0?max_points=1')
+        self.assertEqual(len(j3), 1)
+        j3 = check_json(
+            client,
+            f'api/db_default/v4/nts/graph/{m2_id}/{test1_id}/2?max_points=1')
+        self.assertEqual(j3, j)
+
+    def test_graphs_api(self):
+        """Check that /graphs returns the same lines as /graph."""
+        client = self.client
+        m1_id = self.machine1['id']
+        m2_id = self.machine2['id']
+        test_ids = [t['id'] for t in self.tests_by_name.values()]
+
+        series = ['%d.%d.%d' % (m, t, f) for m in (m1_id, m2_id)
+                  for t in test_ids for f in (0, 2)]
+        j = check_json(client, 'api/db_default/v4/nts/graphs?' +
+                       '&'.join('series=' + s for s in series))
+        self._check_response_is_well_formed(j)
+        self.assertEqual(len(j['series']), len(series))
+        for line in j['series']:
+            graph = check_json(
+                client, 'api/db_default/v4/nts/graph/%d/%d/%d' %
+                (line['machine_id'], line['test_id'], line['field_index']))
+            self.assertEqual(line['orders'], [p[0] for p in graph])
+            self.assertEqual(line['values'], [p[1] for p in graph])
+            self.assertEqual(line['dates'], [p[2]['date'] for p in graph])
+            self.assertEqual([str(r) for r in line['run_ids']],
+                             [p[2]['runID'] for p in graph])
+
+        # The limit keeps the latest points of each line.
+        test1_id = self.tests_by_name['test1']['id']
+        j = check_json(client, 'api/db_default/v4/nts/graphs?series=%d.%d.2'
+                       '&limit=1' % (m2_id, test1_id))
+        self.assertEqual(j['series'][0]['orders'], [u'152293'])
+        self.assertEqual(j['series'][0]['values'], [10.0])
+        # max_points downsamples the lines like /graph, keeping the points
+        # of their regressions.
+        for field_index in (0, 2):
+            j = check_json(client, 'api/db_default/v4/nts/graphs?series='
+                           '%d.%d.%d&max_points=1' %
+                           (m2_id, test1_id, field_index))
+            graph = check_json(client, 'api/db_default/v4/nts/graph/%d/%d/%d'
+                               '?max_points=1' %
+                               (m2_id, test1_id, field_index))
+            self.assertEqual(j['series'][0]['orders'],
+                             [p[0] for p in graph])
+            self.assertEqual(j['series'][0]['values'],
+                             [p[1] for p in graph])
+
+        check_json(client, 'api/db_default/v4/nts/graphs', expected_code=400)
+        check_json(client, 'api/db_default/v4/nts/graphs?series=1.2',
+                   expected_code=400)
+        check_json(client, 'api/db_default/v4/nts/graphs?series=1.2.99',
+                   expected_code=400)
+
+    def test_geomean_api(self):
+        """Check that /geomean/x/y returns what we expect."""
+        client = self.client
+
+        # Mean of machine2, field 2 (score).
+        m2_id = self.machine2['id']
+        j = check_json(client, f'api/db_default/v4/nts/geomean/{m2_id}/2')
+        self.assertEqual([p[0] for p in j],
+                         [u'152290', u'152292', u'152293', u'152294',
+                          u'152295', u'152296'])
+
+        # Now check that limit keeps the latest orders.
+        j2 = check_json(
+            client, f'api/db_default/v4/nts/geomean/{m2_id}/2?limit=1')
+        self.assertEqual(j2, j[-1:])
+
+        check_json(client, 'api/db_default/v4/nts/geomean/9999/2',
+                   expected_code=404)
+
     def test_samples_api(self):
         """Samples API."""
         client = self.client
@@ -307,6 +390,78 @@ class JSONAPITester(unittest.TestCase):
         self.assertEqual('SingleSource/UnitTests/2006-12-01-float_varg',
                          float_varg['name'])
 
+    def test_list_pagination(self):
+        """The lists of tests, machines, runs and samples can be paginated,
+        filtered, projected and streamed as NDJSON."""
+        client = self.client
+        all_tests = check_json(client, 'api/db_default/v4/nts/tests')['tests']
+        all_ids = sorted(t['id'] for t in all_tests)
+
+        # Walk the pages of tests.
+        ids = []
+        url = 'api/db_default/v4/nts/tests?limit=4'
+        while True:
+            j = check_json(client, url)
+            self.assertLessEqual(len(j['tests']), 4)
+            ids.extend(t['id'] for t in j['tests'])
+            if j['next_after_id'] is None:
+                break
+            self.assertEqual(j['next_after_id'], ids[-1])
+            url = 'api/db_default/v4/nts/tests?limit=4&after_id=%d' % \
+                j['next_after_id']
+        self.assertEqual(ids, all_ids)
+
+        # Name prefix filter and field projection.
+        j = check_json(client, 'api/db_default/v4/nts/tests?prefix=Single'
+                               'Source/UnitTests/2006-12-0&fields=name')
+        self.assertEqual(sorted(t['name'] for t in j['tests']), [
+            u'SingleSource/UnitTests/2006-12-01-float_varg',
+            u'SingleSource/UnitTests/2006-12-04-DynAllocAndRestore'])
+        for t in j['tests']:
+            self.assertEqual(set(t), {'id', 'name'})
+        j = check_json(client, 'api/db_default/v4/nts/machines?prefix=machine')
+        self.assertEqual([m['name'] for m in j['machines']],
+                         [u'machine2', u'machine3'])
+
+        # The runs of a machine.
+        j = check_json(client, 'api/db_default/v4/nts/machines/%d?limit=1'
+                       '&fields=start_time' % self.machine1['id'])
+        self.assertEqual(j['machine']['name'], self.machine1['name'])
+        self.assertEqual(j['runs'], [{'id': self.m1_runs[0]['id'],
+                                      'start_time':
+                                      self.m1_runs[0]['start_time']}])
+        self.assertEqual(j['next_after_id'], self.m1_runs[0]['id'])
+
+        # Samples, and NDJSON streaming.
+        run_id = self.m1_run1_id
+        samples = check_json(
+            client, 'api/db_default/v4/nts/samples?runid=%d' % run_id)
+        response = client.get('api/db_default/v4/nts/samples?runid=%d'
+                              '&format=ndjson' % run_id)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'application/x-ndjson')
+        lines = response.get_data(as_text=True).splitlines()
+        self.assertEqual([json.loads(line) for line in lines],
+                         samples['samples'])
+        response = client.get('api/db_default/v4/nts/machines',
+                              headers={'Accept': 'application/x-ndjson'})
+        self.assertEqual(len(response.get_data(as_text=True).splitlines()),
+                         len(machines_expected_properties))
+
+        # The streamed responses give their connections back to the pool,
+        # without waiting for the garbage collector to free their sessions.
+        db = self.app.instance.get_database('default')
+        gc.disable()
+        try:
+            for _ in range(20):
+                response = client.get('api/db_default/v4/nts/samples?runid=%d'
+                                      '&format=ndjson' % run_id)
+                self.assertEqual(len(response.get_data(as_text=True)
+                                     .splitlines()), len(samples['samples']))
+            self.assertEqual(db.engine.pool.checkedout(), 0)
+        finally:
+            gc.enable()
+
     def test_schema(self):
         client = self.client
         rest_schema = check_json(client, 'api/db_default/v4/nts/schema')
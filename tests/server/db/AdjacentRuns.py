@@ -0,0 +1,90 @@
+# Check the lookup of the runs adjacent to a run on its machine.
+#
+# RUN: rm -rf %t.instance
+# RUN: %{utils}/with_postgres.sh %t.pg.log \
+# RUN:     %{utils}/with_temporary_instance.py %t.instance \
+# RUN:         -- python %s %t.instance
+
+import sys
+import unittest
+
+import lnt.server.instance
+
+
+class AdjacentRunsTest(unittest.TestCase):
+    def setUp(self):
+        instance_path = sys.argv[1]
+        instance = lnt.server.instance.Instance.frompath(instance_path)
+        self.db = instance.get_database('default')
+        self.session = self.db.make_session()
+        self.ts = self.db.testsuite['nts']
+
+    def tearDown(self):
+        self.session.close()
+
+    def _import(self, machine, order):
+        data = {
+            'format_version': '2',
+            'machine': {'name': machine},
+            'run': {
+                'start_time': '2024-01-01 10:00:00',
+                'end_time': '2024-01-01 11:00:00',
+                'llvm_project_revision': order,
+            },
+            'tests': [{'name': 't/a', 'execution_time': 1.0}],
+        }
+        run = self.ts.importDataFromDict(self.session, data, config=None,
+                                         select_machine='match',
+                                         merge_run='append')
+        self.session.commit()
+        return run
+
+    def _orders(self, runs):
+        return [r.order.llvm_project_revision for r in runs]
+
+    def test_adjacent_runs(self):
+        # Orders are submitted out of order, with gaps filled by another
+        # machine, and some orders have several runs.
+        runs = {}
+        for order in ['5', '1', '30', '7', '12', '3', '100', '9']:
+            runs[order] = self._import('adjacent', order)
+        for order in ['2', '8', '10', '40']:
+            self._import('other', order)
+        self._import('adjacent', '7')
+
+        previous = self.ts.get_previous_runs_on_machine(
+            self.session, runs['9'], 3)
+        self.assertEqual(self._orders(previous), ['7', '7', '5', '3'])
+        previous = self.ts.get_previous_runs_on_machine(
+            self.session, runs['3'], 5)
+        self.assertEqual(self._orders(previous), ['1'])
+        previous = self.ts.get_previous_runs_on_machine(
+            self.session, runs['1'], 5)
+        self.assertEqual(previous, [])
+
+        next_runs = self.ts.get_next_runs_on_machine(
+            self.session, runs['5'], 4)
+        self.assertEqual(self._orders(next_runs), ['7', '7', '9', '12'])
+        next_runs = self.ts.get_next_runs_on_machine(
+            self.session, runs['30'], 5)
+        self.assertEqual(self._orders(next_runs), ['100'])
+        next_runs = self.ts.get_next_runs_on_machine(
+            self.session, runs['100'], 5)
+        self.assertEqual(next_runs, [])
+
+    def test_order_sort_key_change(self):
+        first = self._import('adjacent-sort', '5')
+        second = self._import('adjacent-sort', '7')
+        # The runs follow their order when its sort key changes.
+        first.order.llvm_project_revision = '9'
+        self.session.commit()
+        previous = self.ts.get_previous_runs_on_machine(
+            self.session, first, 5)
+        self.assertEqual(previous, [second])
+        next_runs = self.ts.get_next_runs_on_machine(
+            self.session, second, 5)
+        self.assertEqual(next_runs, [first])
+
+
+if __name__ == '__main__':
+    unittest.main(argv=[sys.argv[0], ])
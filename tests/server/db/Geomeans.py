@@ -0,0 +1,88 @@
+# Check that the geometric means of the orders of a machine are maintained.
+#
+# RUN: rm -rf %t.instance
+# RUN: %{utils}/with_postgres.sh %t.pg.log \
+# RUN:     %{utils}/with_temporary_instance.py %t.instance \
+# RUN:         -- python %s %t.instance
+
+import sys
+import unittest
+
+import lnt.server.instance
+
+
+class GeomeansTest(unittest.TestCase):
+    def setUp(self):
+        instance_path = sys.argv[1]
+        instance = lnt.server.instance.Instance.frompath(instance_path)
+        self.db = instance.get_database('default')
+        self.session = self.db.make_session()
+        self.ts = self.db.testsuite['nts']
+        self.field = [f for f in self.ts.Sample.fields
+                      if f.name == 'execution_time'][0]
+
+    def tearDown(self):
+        self.session.close()
+
+    def _import(self, machine, order, tests, merge_run='reject'):
+        data = {
+            'format_version': '2',
+            'machine': {'name': machine},
+            'run': {
+                'start_time': '2024-01-01 10:00:00',
+                'end_time': '2024-01-01 11:00:00',
+                'llvm_project_revision': order,
+            },
+            'tests': [{'name': name, 'execution_time': value}
+                      for name, value in sorted(tests.items())],
+        }
+        run = self.ts.importDataFromDict(self.session, data, config=None,
+                                         select_machine='match',
+                                         merge_run=merge_run)
+        self.session.commit()
+        return run
+
+    def _geomeans(self, machine):
+        geomeans = self.ts.Geomean
+        return [(g.order.llvm_project_revision, round(g.value, 3))
+                for g in self.session.query(geomeans)
+                .join(self.ts.Machine)
+                .filter(self.ts.Machine.name == machine)
+                .filter(geomeans.field_id == self.field.id)
+                .order_by(geomeans.sort_key)]
+
+    def test_geomeans(self):
+        self._import('geo', '10', {'t/a': [2.0, 4.0], 't/b': 8.0})
+        run = self._import('geo', '9', {'t/a': 1.0, 't/b': 1.0})
+        # The minimum of each test is used.
+        self.assertEqual(self._geomeans('geo'), [('9', 1.0), ('10', 4.0)])
+
+        # A second run of an order updates the mean.
+        self._import('geo', '10', {'t/a': 0.5, 't/b': 8.0},
+                     merge_run='append')
+        self.assertEqual(self._geomeans('geo'), [('9', 1.0), ('10', 2.0)])
+
+        # Deleting a run removes its order.
+        self.session.delete(run)
+        self.ts.update_geomeans(self.session, run.machine_id,
+                                [run.order_id])
+        self.session.commit()
+        self.assertEqual(self._geomeans('geo'), [('10', 2.0)])
+
+        # Rebuilding from scratch gives the same result.
+        self.session.query(self.ts.Geomean).delete()
+        self.assertEqual(self.ts.rebuild_geomeans(self.session), 1)
+        self.session.commit()
+        self.assertEqual(self._geomeans('geo'), [('10', 2.0)])
+
+    def test_order_sort_key_change(self):
+        run = self._import('geo-sort', '5', {'t/a': 5.0})
+        self._import('geo-sort', '7', {'t/a': 7.0})
+        # The means follow their order when its sort key changes.
+        run.order.llvm_project_revision = '9'
+        self.session.commit()
+        self.assertEqual(self._geomeans('geo-sort'), [('7', 7.0), ('9', 5.0)])
+
+
+if __name__ == '__main__':
+    unittest.main(argv=[sys.argv[0], ])
@@ -0,0 +1,111 @@
+# Check that the bulk sample import produces the same samples as the ORM one.
+#
+# RUN: rm -rf %t.instance
+# RUN: %{utils}/with_postgres.sh %t.pg.log \
+# RUN:     %{utils}/with_temporary_instance.py %t.instance \
+# RUN:         -- python %s %t.instance %{shared_inputs}
+
+import copy
+import json
+import os
+import sys
+import unittest
+
+import lnt.server.instance
+from lnt.testing import PASS, FAIL
+
+
+class ImportBulkTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        instance_path = sys.argv[1]
+        shared_inputs = sys.argv[2]
+        instance = lnt.server.instance.Instance.frompath(instance_path)
+        cls.db_config = instance.config.databases['default']
+        cls.db = instance.get_database('default')
+        cls.ts = cls.db.testsuite['nts']
+
+        with open(os.path.join(shared_inputs, 'profile-report.json')) as f:
+            profile_tests = json.load(f)['Tests']
+        cls.profile = [t['Data'][0] for t in profile_tests
+                       if t['Name'].endswith('.profile')][0]
+
+    def _make_report(self, machine_name):
+        return {
+            'format_version': '2',
+            'machine': {'name': machine_name},
+            'run': {
+                'start_time': '2024-01-01 10:00:00',
+                'end_time': '2024-01-01 11:00:00',
+                'llvm_project_revision': '4242',
+            },
+            'tests': [
+                {'name': 'suite/existing', 'execution_time': [1.5, 1.25],
+                 'execution_status': FAIL},
+                {'name': 'suite/new-%s' % machine_name,
+                 'compile_time': 0.1, 'code_size': 1024,
+                 'hash': 'tab\there\\back\nslash'},
+                {'name': 'suite/multi', 'execution_time': [1.0, 2.0, 3.0],
+                 'compile_time': [4.0], 'hash_status': PASS},
+                {'name': 'suite/profiled', 'execution_time': 0.5,
+                 'profile': self.profile},
+                {'name': 'suite/separate.test:1', 'score': 10.0},
+                {'name': 'suite/separate', 'profile': self.profile},
+            ],
+        }
+
+    def _import(self, machine_name, bulk_import):
+        session = self.db.make_session()
+        self.db_config.bulk_import = bulk_import
+        try:
+            run = self.ts.importDataFromDict(
+                session, copy.deepcopy(self._make_report(machine_name)),
+                config=self.db_config, select_machine='match',
+                merge_run='reject')
+            session.commit()
+            return self._samples(session, run.id)
+        finally:
+            self.db_config.bulk_import = False
+            session.close()
+
+    def _samples(self, session, run_id):
+        result = []
+        for sample in session.query(self.ts.Sample) \
+                .filter(self.ts.Sample.run_id == run_id) \
+                .order_by(self.ts.Sample.id):
+            result.append((sample.test.name.split('-')[0],
+                           sample.get_fields(),
+                           sample.profile is not None))
+        return sorted(result, key=repr)
+
+    def test_bulk_matches_orm(self):
+        # Make sure one of the tests already exists.
+        session = self.db.make_session()
+        session.add(self.ts.Test('suite/existing'))
+        session.commit()
+        session.close()
+
+        orm_samples = self._import('orm', False)
+        bulk_samples = self._import('bulk', True)
+        self.assertEqual(len(orm_samples), 8)
+        self.assertEqual(orm_samples, bulk_samples)
+
+        # Tests are shared between the two imports.
+        session = self.db.make_session()
+        names = [t.name for t in session.query(self.ts.Test)]
+        self.assertEqual(len(names), len(set(names)))
+        self.assertEqual(len(names), 6)
+        session.close()
+
+    def test_in_batches(self):
+        samples = self._import('whole', False)
+        self.ts.IMPORT_BATCH_SIZE = 2
+        try:
+            self.assertEqual(self._import('batchedorm', False), samples)
+            self.assertEqual(self._import('batchedbulk', True), samples)
+        finally:
+            del self.ts.IMPORT_BATCH_SIZE
+
+
+if __name__ == '__main__':
+    unittest.main(argv=[sys.argv[0], ])
@@ -0,0 +1,88 @@
+# Check that the numbers of added machines, runs, tests and samples counted by
+# the import match the numbers of rows added to the tables.
+#
+# RUN: rm -rf %t.instance
+# RUN: %{utils}/with_postgres.sh %t.pg.log \
+# RUN:     %{utils}/with_temporary_instance.py %t.instance \
+# RUN:         -- python %s %t.instance
+
+import sys
+import unittest
+
+import lnt.server.instance
+
+
+class ImportCountsTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        instance_path = sys.argv[1]
+        instance = lnt.server.instance.Instance.frompath(instance_path)
+        cls.db_config = instance.config.databases['default']
+        cls.db = instance.get_database('default')
+        cls.ts = cls.db.testsuite['nts']
+
+    def _import(self, machine_name, order, tests, bulk_import,
+                merge_run='reject'):
+        data = {
+            'format_version': '2',
+            'machine': {'name': machine_name},
+            'run': {
+                'start_time': '2024-01-01 10:00:00',
+                'end_time': '2024-01-01 11:00:00',
+                'llvm_project_revision': order,
+            },
+            'tests': [{'name': name, 'execution_time': values}
+                      for name, values in tests],
+        }
+        session = self.db.make_session()
+        self.db_config.bulk_import = bulk_import
+        try:
+            before = self._num_rows(session)
+            counts = {}
+            self.ts.importDataFromDict(session, data, config=self.db_config,
+                                       select_machine='match',
+                                       merge_run=merge_run, counts=counts)
+            session.commit()
+            added = [n - b for n, b in zip(self._num_rows(session), before)]
+            return counts, added
+        finally:
+            self.db_config.bulk_import = False
+            session.close()
+
+    def _num_rows(self, session):
+        return [self.ts.getNumMachines(session), self.ts.getNumRuns(session),
+                self.ts.getNumTests(session)]
+
+    def _check(self, bulk_import):
+        prefix = 'bulk' if bulk_import else 'orm'
+        counts, added = self._import(
+            prefix, '1', [('%s/a' % prefix, [1.0, 2.0]),
+                          ('%s/b' % prefix, 3.0)], bulk_import)
+        self.assertEqual(counts, {'added_machines': 1, 'added_runs': 1,
+                                  'added_tests': 2, 'added_samples': 3})
+        self.assertEqual(added, [1, 1, 2])
+
+        counts, added = self._import(
+            prefix, '2', [('%s/a' % prefix, 1.0),
+                          ('%s/c' % prefix, 2.0)], bulk_import)
+        self.assertEqual(counts, {'added_machines': 0, 'added_runs': 1,
+                                  'added_tests': 1, 'added_samples': 2})
+        self.assertEqual(added, [0, 1, 1])
+
+        # A replaced run is counted negatively.
+        counts, added = self._import(
+            prefix, '2', [('%s/a' % prefix, 1.0)], bulk_import,
+            merge_run='replace')
+        self.assertEqual(counts, {'added_machines': 0, 'added_runs': 0,
+                                  'added_tests': 0, 'added_samples': 1})
+        self.assertEqual(added, [0, 0, 0])
+
+    def test_orm_counts(self):
+        self._check(False)
+
+    def test_bulk_counts(self):
+        self._check(True)
+
+
+if __name__ == '__main__':
+    unittest.main(argv=[sys.argv[0], ])
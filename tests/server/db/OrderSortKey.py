@@ -0,0 +1,80 @@
+# Check that orders are linked into the total ordering through the persisted
+# sort key.
+#
+# RUN: rm -rf %t.instance
+# RUN: %{utils}/with_postgres.sh %t.pg.log \
+# RUN:     %{utils}/with_temporary_instance.py %t.instance \
+# RUN:         -- python %s %t.instance
+
+import sys
+import unittest
+
+import lnt.server.instance
+from lnt.server.ui.util import revision_sort_key
+
+
+class OrderSortKeyTest(unittest.TestCase):
+    def setUp(self):
+        instance_path = sys.argv[1]
+        instance = lnt.server.instance.Instance.frompath(instance_path)
+        self.db = instance.get_database('default')
+        self.session = self.db.make_session()
+        self.ts = self.db.testsuite['nts']
+
+    def tearDown(self):
+        self.session.rollback()
+        self.session.close()
+
+    def test_revision_sort_key(self):
+        revisions = ['1', '1.2', '1.2.3', '1.10', '1.9', '2', '10', '9', 'abc']
+        by_tuple = sorted(revisions, key=lambda r: revision_sort_key([r]))
+        self.assertEqual(by_tuple, ['1', '1.2', '1.2.3', '1.9', '1.10', '2',
+                                    '9', '10', 'abc'])
+        self.assertLess(revision_sort_key(['1', '5']),
+                        revision_sort_key(['1.2', '3']))
+        self.assertLess(revision_sort_key(['1', '3']),
+                        revision_sort_key(['1', '3.0']))
+
+    def test_insert_orders(self):
+        revisions = ['500', '100', '300', '1000', '200', '50', '400', '90']
+        for revision in revisions:
+            self.ts._getOrCreateOrder(
+                self.session, {'llvm_project_revision': revision})
+        self.session.commit()
+
+        orders = self.session.query(self.ts.Order).all()
+        for order in orders:
+            self.assertEqual(order.sort_key, order.compute_sort_key())
+
+        # Walk the linked list and check it visits the orders in sorted order.
+        expected = sorted(orders)
+        order = expected[0]
+        self.assertIsNone(order.previous_order_id)
+        walked = [order]
+        while order.next_order_id is not None:
+            next_order = self.session.query(self.ts.Order) \
+                .get(order.next_order_id)
+            self.assertEqual(next_order.previous_order_id, order.id)
+            walked.append(next_order)
+            order = next_order
+        self.assertEqual([o.id for o in walked], [o.id for o in expected])
+
+        # Getting an existing order must not create a new one.
+        existing = self.ts._getOrCreateOrder(
+            self.session, {'llvm_project_revision': '300'})
+        self.assertEqual(existing.llvm_project_revision, '300')
+        self.assertEqual(self.session.query(self.ts.Order).count(),
+                         len(orders))
+
+    def test_sort_key_on_flush(self):
+        order = self.ts.Order(llvm_project_revision='12345')
+        self.session.add(order)
+        self.session.flush()
+        self.assertEqual(order.sort_key, revision_sort_key(['12345']))
+        order.llvm_project_revision = '12346'
+        self.session.flush()
+        self.assertEqual(order.sort_key, revision_sort_key(['12346']))
+
+
+if __name__ == '__main__':
+    unittest.main(argv=[sys.argv[0], ])
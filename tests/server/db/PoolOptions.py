@@ -0,0 +1,49 @@
+# Check the connection pool settings of databases.
+#
+# RUN: rm -rf %t.dir && mkdir -p %t.dir
+# RUN: python %s %t.dir
+
+import os
+import sys
+import unittest
+
+import sqlalchemy.pool
+
+from lnt.server.config import Config, DBInfo, EmailConfig
+from lnt.server.db import v4db
+
+
+class PoolOptionsTest(unittest.TestCase):
+    def test_config(self):
+        info = DBInfo.from_data(sys.argv[1],
+                                {'path': 'lnt.db', 'pool_size': 3,
+                                 'pool_recycle': 600, 'bulk_import': True},
+                                EmailConfig(False, '', '', []), 0)
+        self.assertEqual(info.pool_options,
+                         {'pool_size': 3, 'pool_recycle': 600})
+
+    def test_engine_options(self):
+        options = {'pool_size': 3, 'max_overflow': 0, 'null_pool': False}
+        self.assertEqual(
+            v4db._engine_options('postgresql://lnt@localhost/lnt', options),
+            {'pool_size': 3, 'max_overflow': 0})
+        # SQLite connections are not pooled.
+        self.assertEqual(
+            v4db._engine_options('sqlite:///lnt.db', options), {})
+        self.assertEqual(
+            v4db._engine_options('postgresql://lnt@localhost/lnt',
+                                 {'pool_size': 3, 'null_pool': True}),
+            {'poolclass': sqlalchemy.pool.NullPool})
+
+    def test_null_pool(self):
+        path = 'sqlite:///' + os.path.join(sys.argv[1], 'null_pool.db')
+        db = v4db.V4DB(path, Config.dummy_instance(),
+                       pool_options={'null_pool': True})
+        self.assertIsInstance(db.engine.pool, sqlalchemy.pool.NullPool)
+        self.assertEqual(db.get_pool_stats(), {'size': 0})
+        self.assertEqual(db.settings()['pool_options'], {'null_pool': True})
+        db.close()
+
+
+if __name__ == '__main__':
+    unittest.main(argv=sys.argv[:1])
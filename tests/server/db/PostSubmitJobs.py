@@ -0,0 +1,263 @@
+# Check the queue of post submission jobs.
+#
+# RUN: rm -rf %t.instance
+# RUN: %{utils}/with_postgres.sh %t.pg.log \
+# RUN:     %{utils}/with_temporary_instance.py %t.instance \
+# RUN:         -- python %s %t.instance %S
+
+import collections
+import datetime
+import os
+import sys
+import tempfile
+import threading
+import unittest
+
+import sqlalchemy.exc
+
+import lnt.server.instance
+import lnt.util.ImportData
+from lnt.server.db import jobqueue
+
+
+class PostSubmitJobsTest(unittest.TestCase):
+    def setUp(self):
+        instance_path = sys.argv[1]
+        self.inputs_path = sys.argv[2]
+        instance = lnt.server.instance.Instance.frompath(instance_path)
+        self.config = instance.config
+        self.config.post_submit_mode = 'queue'
+        self.db = self.config.get_database('default')
+        self.session = self.db.make_session()
+        self.ts = self.db.testsuite['nts']
+
+    def tearDown(self):
+        self.session.close()
+        self.db.close()
+
+    def _submit(self, machine, order):
+        with tempfile.NamedTemporaryFile(mode='w', suffix='.json') as f:
+            data = open(os.path.join(self.inputs_path,
+                                     'Inputs/report.json.in')) \
+                .read() \
+                .replace('@@MACHINE@@', machine) \
+                .replace('@@ORDER@@', order)
+            f.write(data)
+            f.flush()
+
+            result = lnt.util.ImportData.import_and_report(
+                self.config, 'default', self.db, self.session, f.name,
+                format='<auto>', ts_name='nts', disable_email=True,
+                disable_report=True, merge_run='append')
+        self.assertTrue(result['success'], result.get('error'))
+        return result
+
+    def _jobs(self):
+        return self.session.query(jobqueue.PostSubmitJob) \
+            .filter(jobqueue.PostSubmitJob.testsuite_name == 'nts') \
+            .order_by(jobqueue.PostSubmitJob.id).all()
+
+    def _compared(self, run_ids):
+        return set(run_id for run_id, in
+                   self.session.query(self.ts.RunComparison.run_id)
+                   .filter(self.ts.RunComparison.run_id.in_(run_ids)))
+
+    def test_queue(self):
+        first = self._submit('queue-machine', '100')
+        second = self._submit('queue-machine', '100')
+        third = self._submit('queue-machine', '101')
+
+        # The two submissions for the same machine and order share a job,
+        # which regenerates the field changes for the latest run.
+        self.assertEqual(first['post_submit_job_id'],
+                         second['post_submit_job_id'])
+        self.assertNotEqual(first['post_submit_job_id'],
+                            third['post_submit_job_id'])
+        jobs = self._jobs()
+        self.assertEqual(len(jobs), 2)
+        self.assertEqual([j.state for j in jobs],
+                         [jobqueue.PENDING, jobqueue.PENDING])
+        self.assertEqual(jobs[0].coalesced, 1)
+        self.assertEqual(jobs[0].run_id, second['run_id'])
+
+        stats = jobqueue.get_statistics(self.session, 'nts')
+        self.assertEqual(stats['counts']['pending'], 2)
+        self.assertIsNone(stats['queue_latency'])
+
+        # The comparisons of the run pages are left to the jobs, which store
+        # them for all the runs of their order.
+        run_ids = [first['run_id'], second['run_id'], third['run_id']]
+        self.assertEqual(self._compared(run_ids), set())
+        self.session.rollback()
+
+        self.assertEqual(jobqueue.run_pending_jobs(self.db), 2)
+        self.assertEqual(jobqueue.run_pending_jobs(self.db), 0)
+        self.assertEqual(self._compared(run_ids), set(run_ids))
+
+        for job in self._jobs():
+            self.assertEqual(job.state, jobqueue.DONE, job.error)
+            self.assertGreaterEqual(job.queue_latency, 0)
+            self.assertGreaterEqual(job.run_time, 0)
+
+        stats = jobqueue.get_statistics(self.session, 'nts')
+        self.assertEqual(stats['counts'], {'pending': 0, 'running': 0,
+                                           'done': 2, 'failed': 0})
+        self.assertGreaterEqual(stats['run_time']['max'],
+                                stats['run_time']['mean'])
+
+        # Running jobs are not coalesced with new submissions.
+        self.session.rollback()
+        fourth = self._submit('queue-machine', '101')
+        self.assertNotEqual(fourth['post_submit_job_id'],
+                            third['post_submit_job_id'])
+
+    def test_failed_job(self):
+        job = jobqueue.PostSubmitJob('no-such-suite', 1, 1, 1)
+        self.session.add(job)
+        self.session.commit()
+        self.assertEqual(jobqueue.run_pending_jobs(self.db, max_jobs=1), 1)
+        self.session.refresh(job)
+        self.assertEqual(job.state, jobqueue.FAILED)
+        self.assertIn('no-such-suite', job.error)
+
+    def test_stale_job(self):
+        # A job left running by a worker which crashed is queued again once
+        # it timed out, and given up after MAX_ATTEMPTS starts.
+        jobqueue.run_pending_jobs(self.db)
+        job = jobqueue.PostSubmitJob('no-such-suite', 1, 1, 1)
+        self.session.add(job)
+        self.session.commit()
+        for attempt in range(1, jobqueue.MAX_ATTEMPTS + 1):
+            claimed = jobqueue.claim_next_job(self.session)
+            self.assertEqual(claimed.id, job.id)
+            self.assertEqual(claimed.attempts, attempt)
+            # Not timed out yet.
+            self.assertIsNone(jobqueue.claim_next_job(self.session))
+            claimed.started_time -= datetime.timedelta(hours=2)
+            self.session.commit()
+        self.assertIsNone(jobqueue.claim_next_job(self.session))
+        self.session.refresh(job)
+        self.assertEqual(job.state, jobqueue.FAILED)
+        self.assertIn('timed out', job.error)
+
+    def _concurrently(self, count, func):
+        # Call func(session) in count threads at once, each with its own
+        # session, and return the results.
+        barrier = threading.Barrier(count)
+        results = [None] * count
+
+        def call(index):
+            session = self.db.make_session()
+            try:
+                barrier.wait()
+                results[index] = func(session)
+            finally:
+                session.close()
+        threads = [threading.Thread(target=call, args=(i,))
+                   for i in range(count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def _delete_jobs(self, testsuite_name):
+        self.session.rollback()
+        self.session.query(jobqueue.PostSubmitJob) \
+            .filter(jobqueue.PostSubmitJob.testsuite_name == testsuite_name) \
+            .delete()
+        self.session.commit()
+
+    def test_pending_index(self):
+        self.session.add(jobqueue.PostSubmitJob('index-suite', 1, 1, 1))
+        self.session.add(jobqueue.PostSubmitJob('index-suite', 1, 1, 2))
+        with self.assertRaises(sqlalchemy.exc.IntegrityError):
+            self.session.commit()
+        self.session.rollback()
+
+        # Only the pending jobs are unique.
+        done = jobqueue.PostSubmitJob('index-suite', 1, 1, 1)
+        done.state = jobqueue.DONE
+        self.session.add(done)
+        self.session.add(jobqueue.PostSubmitJob('index-suite', 1, 1, 2))
+        self.session.commit()
+        self._delete_jobs('index-suite')
+
+    def test_concurrent_enqueue(self):
+        # Concurrent submissions for the same machine and order share a
+        # single pending job.
+        Suite = collections.namedtuple('Suite', 'name')
+        Run = collections.namedtuple('Run', 'id machine_id order_id')
+        ts = Suite('concurrent-suite')
+        count = 8
+        job_ids = self._concurrently(count, lambda session: jobqueue
+                                     .enqueue_post_submit(session, ts,
+                                                          Run(1, 1, 1)).id)
+        self.assertEqual(len(set(job_ids)), 1)
+        jobs = self.session.query(jobqueue.PostSubmitJob) \
+            .filter(jobqueue.PostSubmitJob.testsuite_name == ts.name).all()
+        self.assertEqual(len(jobs), 1)
+        self.assertEqual(jobs[0].state, jobqueue.PENDING)
+        self.assertEqual(jobs[0].coalesced, count - 1)
+        self._delete_jobs(ts.name)
+
+    def test_concurrent_claim(self):
+        # Concurrent workers never claim the same job.
+        jobqueue.run_pending_jobs(self.db)
+        count = 4
+        for run_id in range(count):
+            self.session.add(jobqueue.PostSubmitJob('claim-suite', run_id, 1,
+                                                    run_id))
+        self.session.commit()
+        job_ids = self._concurrently(
+            count, lambda session: [job.id for job in
+                                    iter(lambda: jobqueue.claim_next_job(
+                                        session), None)])
+        claimed = sum(job_ids, [])
+        self.assertEqual(len(claimed), count)
+        self.assertEqual(len(set(claimed)), count)
+        self._delete_jobs('claim-suite')
+
+    def test_superseded_stale_job(self):
+        # A timed out job is not queued again next to a pending job for the
+        # same machine and order.
+        jobqueue.run_pending_jobs(self.db)
+        stale = jobqueue.PostSubmitJob('stale-suite', 1, 1, 1)
+        stale.state = jobqueue.RUNNING
+        stale.attempts = 1
+        stale.started_time = datetime.datetime.utcnow() - \
+            datetime.timedelta(hours=2)
+        pending = jobqueue.PostSubmitJob('stale-suite', 1, 1, 2)
+        self.session.add(stale)
+        self.session.add(pending)
+        self.session.commit()
+        self.assertEqual(jobqueue.requeue_stale_jobs(self.session), 0)
+        self.session.refresh(stale)
+        self.assertEqual(stale.state, jobqueue.FAILED)
+        self.assertIn('superseded by job %d' % pending.id, stale.error)
+        self._delete_jobs('stale-suite')
+
+    def _check_background_mode(self, mode, machine):
+        self.config.post_submit_mode = mode
+        result = self._submit(machine, '100')
+        # The worker runs the scheduled runs one at a time, so the job is
+        # done once a new run completes.
+        jobqueue.schedule_jobs(self.config, 'default').result(timeout=120)
+        self.session.rollback()
+        job = self.session.query(jobqueue.PostSubmitJob) \
+            .get(result['post_submit_job_id'])
+        self.assertEqual(job.state, jobqueue.DONE, job.error)
+        self.assertEqual(job.attempts, 1)
+        # Keep the queue of the other tests as they expect it.
+        self.session.delete(job)
+        self.session.commit()
+
+    def test_thread_mode(self):
+        self._check_background_mode('thread', 'thread-machine')
+
+    def test_process_mode(self):
+        self._check_background_mode('process', 'process-machine')
+
+
+if __name__ == '__main__':
+    unittest.main(argv=[sys.argv[0], ])
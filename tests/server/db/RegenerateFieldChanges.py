@@ -0,0 +1,120 @@
+# Check the regeneration of the field changes of a run.
+#
+# RUN: rm -rf %t.instance
+# RUN: %{utils}/with_postgres.sh %t.pg.log \
+# RUN:     %{utils}/with_temporary_instance.py %t.instance \
+# RUN:         -- python %s %t.instance
+
+import sys
+import threading
+import unittest
+
+import lnt.server.instance
+from lnt.server.db import fieldchange
+from lnt.server.db.util import statement_count
+
+
+class RegenerateFieldChangesTest(unittest.TestCase):
+    def setUp(self):
+        instance_path = sys.argv[1]
+        instance = lnt.server.instance.Instance.frompath(instance_path)
+        self.db = instance.get_database('default')
+        self.session = self.db.make_session()
+        self.ts = self.db.testsuite['nts']
+
+    def tearDown(self):
+        self.session.close()
+
+    def _import(self, machine, order, values, merge_run='reject'):
+        data = {
+            'format_version': '2',
+            'machine': {'name': machine},
+            'run': {
+                'start_time': '2024-01-01 10:00:00',
+                'end_time': '2024-01-01 11:00:00',
+                'llvm_project_revision': order,
+            },
+            'tests': [{'name': name, 'execution_time': value}
+                      for name, value in sorted(values.items())],
+        }
+        run = self.ts.importDataFromDict(self.session, data, config=None,
+                                         select_machine='match',
+                                         merge_run=merge_run)
+        self.session.commit()
+        return run.id
+
+    def _regenerate(self, run_id):
+        """Regenerate the field changes of the run and return the number of
+        statements it took."""
+        statements = statement_count()
+        fieldchange.regenerate_fieldchanges_for_run(self.session, self.ts,
+                                                    run_id)
+        return statement_count() - statements
+
+    def _changes(self, machine):
+        return sorted(
+            (fc.test.name, fc.old_value, fc.new_value)
+            for fc in self.session.query(self.ts.FieldChange)
+            .join(self.ts.Machine)
+            .filter(self.ts.Machine.name == machine))
+
+    def _regressions(self):
+        return self.session.query(self.ts.Regression).count()
+
+    def test_regenerate(self):
+        self._import('m1', '1', {'t/a': 1.0, 't/b': 1.0, 't/c': 1.0})
+        run_id = self._import('m1', '2', {'t/a': 2.0, 't/b': 1.0,
+                                          't/c': 3.0})
+        regressions = self._regressions()
+        self._regenerate(run_id)
+        self.assertEqual(self._changes('m1'), [('t/a', 1.0, 2.0),
+                                               ('t/c', 1.0, 3.0)])
+        self.assertGreater(self._regressions(), regressions)
+
+        # Regenerating again updates the existing changes.
+        self._regenerate(run_id)
+        self.assertEqual(self._changes('m1'), [('t/a', 1.0, 2.0),
+                                               ('t/c', 1.0, 3.0)])
+
+        # A new run for the same order shows t/a did not regress after all.
+        run_id = self._import('m1', '2', {'t/a': 1.0, 't/b': 1.0,
+                                          't/c': 3.0}, merge_run='append')
+        self._regenerate(run_id)
+        self.assertEqual(self._changes('m1'), [('t/c', 1.0, 3.0)])
+
+    def test_query_count(self):
+        # Updating the field changes of a run takes the same number of
+        # statements, whatever the number of tests and changes.
+        def regenerate(machine, num_tests, num_changes):
+            before = dict(('t/%d' % i, 1.0) for i in range(num_tests))
+            after = dict(before)
+            for i in range(num_changes):
+                after['t/%d' % i] = 3.0
+            self._import(machine, '1', before)
+            run_id = self._import(machine, '2', after)
+            self._regenerate(run_id)
+            self.assertEqual(len(self._changes(machine)), num_changes)
+            return self._regenerate(run_id)
+
+        self.assertEqual(regenerate('small', 10, 2),
+                         regenerate('large', 200, 50))
+
+    def test_statement_count(self):
+        # The statements of other threads are not counted.
+        def query():
+            session = self.db.make_session()
+            try:
+                session.query(self.ts.Run).all()
+            finally:
+                session.close()
+        statements = statement_count()
+        thread = threading.Thread(target=query)
+        thread.start()
+        thread.join()
+        self.assertEqual(statement_count(), statements)
+        self.session.query(self.ts.Run).all()
+        self.assertGreater(statement_count(), statements)
+
+
+if __name__ == '__main__':
+    unittest.main(argv=[sys.argv[0], ])
@@ -0,0 +1,96 @@
+# Check that the series points of the graph endpoints follow the samples.
+#
+# RUN: rm -rf %t.instance
+# RUN: %{utils}/with_postgres.sh %t.pg.log \
+# RUN:     %{utils}/with_temporary_instance.py %t.instance \
+# RUN:         -- python %s %t.instance
+
+import sys
+import unittest
+
+import lnt.server.instance
+import lnt.testing
+
+
+class SeriesPointsTest(unittest.TestCase):
+    def setUp(self):
+        instance_path = sys.argv[1]
+        instance = lnt.server.instance.Instance.frompath(instance_path)
+        self.db = instance.get_database('default')
+        self.session = self.db.make_session()
+        self.ts = self.db.testsuite['nts']
+
+    def tearDown(self):
+        self.session.close()
+
+    def _import(self, machine, order, tests):
+        data = {
+            'format_version': '2',
+            'machine': {'name': machine},
+            'run': {
+                'start_time': '2024-01-01 10:00:00',
+                'end_time': '2024-01-01 11:00:00',
+                'llvm_project_revision': order,
+            },
+            'tests': tests,
+        }
+        run = self.ts.importDataFromDict(self.session, data, config=None,
+                                         select_machine='match',
+                                         merge_run='reject')
+        self.session.commit()
+        return run
+
+    def _points(self, machine, test, field_name):
+        field = [f for f in self.ts.Sample.fields if f.name == field_name][0]
+        points = self.ts.SeriesPoint
+        return [(p.order.llvm_project_revision, p.value, p.passed)
+                for p in self.session.query(points)
+                .join(self.ts.Machine, points.machine_id == self.ts.Machine.id)
+                .join(self.ts.Test, points.test_id == self.ts.Test.id)
+                .filter(self.ts.Machine.name == machine)
+                .filter(self.ts.Test.name == test)
+                .filter(points.field_id == field.id)
+                .order_by(points.sort_key, points.id)]
+
+    def test_series_points(self):
+        self._import('series', '20', [
+            {'name': 't/a', 'execution_time': [2.0, 2.5],
+             'compile_time': 1.0}])
+        run = self._import('series', '3', [
+            {'name': 't/a', 'execution_time': 3.0,
+             'execution_status': lnt.testing.FAIL},
+            {'name': 't/b', 'execution_time': 4.0}])
+
+        # Points are ordered by the order sort key, not by submission.
+        self.assertEqual(self._points('series', 't/a', 'execution_time'),
+                         [('3', 3.0, False), ('20', 2.0, True),
+                          ('20', 2.5, True)])
+        self.assertEqual(self._points('series', 't/a', 'compile_time'),
+                         [('20', 1.0, True)])
+        self.assertEqual(self._points('series', 't/b', 'execution_time'),
+                         [('3', 4.0, True)])
+
+        # Deleting the run deletes its points.
+        self.session.delete(run)
+        self.session.commit()
+        self.assertEqual(self._points('series', 't/a', 'execution_time'),
+                         [('20', 2.0, True), ('20', 2.5, True)])
+        self.assertEqual(self._points('series', 't/b', 'execution_time'), [])
+
+    def test_order_sort_key_change(self):
+        run = self._import('sort-key', '5', [
+            {'name': 't/c', 'execution_time': 5.0}])
+        self._import('sort-key', '7', [
+            {'name': 't/c', 'execution_time': 7.0}])
+        point = run.series_points[0]
+        self.assertIs(point.run, run)
+
+        # The points follow their order when its sort key changes.
+        run.order.llvm_project_revision = '9'
+        self.session.commit()
+        self.assertEqual(self._points('sort-key', 't/c', 'execution_time'),
+                         [('7', 7.0, True), ('9', 5.0, True)])
+
+
+if __name__ == '__main__':
+    unittest.main(argv=[sys.argv[0], ])
@@ -0,0 +1,118 @@
+# Check that comparing many tests at once gives the same results as comparing
+# them one at a time.
+#
+# RUN: rm -rf %t.instance
+# RUN: %{utils}/with_postgres.sh %t.pg.log \
+# RUN:     %{utils}/with_temporary_instance.py %t.instance \
+# RUN:         -- python %s %t.instance
+
+import random
+import sys
+import unittest
+
+import lnt.server.instance
+from lnt.server.reporting.analysis import RunInfo, REGRESSED, IMPROVED
+from lnt.server.reporting.analysis import UNCHANGED_PASS, UNCHANGED_FAIL
+from lnt.testing import PASS, FAIL
+
+
+class ComparisonResultsTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        instance_path = sys.argv[1]
+        instance = lnt.server.instance.Instance.frompath(instance_path)
+        cls.db = instance.get_database('default')
+        cls.session = cls.db.make_session()
+        cls.ts = cls.db.testsuite['nts']
+
+        rng = random.Random(1234)
+        cls.runs = []
+        for order in range(1, 7):
+            tests = []
+            for i in range(30):
+                if rng.random() < .1:
+                    # The test is missing from this run.
+                    continue
+                test = {'name': 'suite/test%d' % i}
+                base = 1.0 + i % 5
+                test['execution_time'] = [
+                    base * rng.choice([1.0, 1.001, 1.2, 1.5, 2.0])
+                    for _ in range(rng.choice([1, 1, 2, 4, 6]))]
+                if rng.random() < .5:
+                    test['compile_time'] = base + rng.random()
+                if rng.random() < .1:
+                    test['execution_status'] = FAIL
+                if rng.random() < .1:
+                    test['compile_status'] = FAIL
+                if rng.random() < .8:
+                    test['hash'] = rng.choice(['h1', 'h2'])
+                    test['hash_status'] = PASS
+                tests.append(test)
+            data = {
+                'format_version': '2',
+                'machine': {'name': 'm'},
+                'run': {
+                    'start_time': '2024-01-01 10:00:00',
+                    'end_time': '2024-01-01 11:00:00',
+                    'llvm_project_revision': str(order),
+                },
+                'tests': tests,
+            }
+            cls.runs.append(cls.ts.importDataFromDict(
+                cls.session, data, config=None, select_machine='match',
+                merge_run='reject'))
+        cls.session.commit()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.session.close()
+
+    def _check(self, runinfo, runs, compare_runs, test_ids):
+        statuses = set()
+        hash_field = self.ts.Sample.get_hash_of_binary_field()
+        for field in self.ts.Sample.get_metric_fields():
+            results = runinfo.get_comparison_results(
+                runs, compare_runs, test_ids, field, hash_field)
+            self.assertEqual(sorted(results.keys()), sorted(test_ids))
+            for test_id in test_ids:
+                expected = runinfo.get_comparison_result(
+                    runs, compare_runs, test_id, field, hash_field)
+                result = results[test_id]
+                self.assertEqual(vars(result), vars(expected))
+                self.assertEqual(result.get_test_status(),
+                                 expected.get_test_status())
+                self.assertEqual(result.get_value_status(),
+                                 expected.get_value_status())
+                statuses.add(result.get_value_status())
+        return statuses
+
+    def test_parity(self):
+        runs = self.runs
+        runinfo = RunInfo(self.session, self.ts, [r.id for r in runs])
+        test_ids = [t.id for t in self.session.query(self.ts.Test)]
+        # Include a test without any samples.
+        test_ids.append(max(test_ids) + 1)
+
+        statuses = self._check(runinfo, runs[5:], runs[4:5], test_ids)
+        statuses |= self._check(runinfo, runs[4:6], runs[:4], test_ids)
+        statuses |= self._check(runinfo, runs[:1], [], test_ids)
+        statuses |= self._check(runinfo, [], runs[1:2], test_ids)
+        # Make sure the data covers all the classifications.
+        self.assertTrue(statuses.issuperset([REGRESSED, IMPROVED,
+                                             UNCHANGED_PASS, UNCHANGED_FAIL]),
+                        statuses)
+
+        for run in runs[1:]:
+            compare_to = runs[0]
+            hash_field = self.ts.Sample.get_hash_of_binary_field()
+            for field in self.ts.Sample.get_metric_fields():
+                results = runinfo.get_run_comparison_results(
+                    run, compare_to, test_ids, field, hash_field)
+                for test_id in test_ids:
+                    expected = runinfo.get_run_comparison_result(
+                        run, compare_to, test_id, field, hash_field)
+                    self.assertEqual(vars(results[test_id]), vars(expected))
+
+
+if __name__ == '__main__':
+    unittest.main(argv=[sys.argv[0], ])
@@ -0,0 +1,175 @@
+# Check that the results of the daily reports of closed ranges of days are
+# stored, and recomputed when the runs of the range change.
+#
+# RUN: rm -rf %t.instance
+# RUN: %{utils}/with_postgres.sh %t.pg.log \
+# RUN:     %{utils}/with_temporary_instance.py %t.instance \
+# RUN:         -- python %s %t.instance
+
+import datetime
+import json
+import sys
+import unittest
+
+import lnt.server.instance
+import lnt.server.ui.app
+from lnt.server.reporting.dailyreport import DailyReport
+
+
+class DailyReportTest(unittest.TestCase):
+    def setUp(self):
+        instance_path = sys.argv[1]
+        instance = lnt.server.instance.Instance.frompath(instance_path)
+        self.db = instance.get_database('default')
+        self.session = self.db.make_session()
+        self.ts = self.db.testsuite['nts']
+
+    def tearDown(self):
+        self.session.close()
+
+    def _import(self, machine, order, day, tests, merge_run='reject'):
+        start_time = datetime.datetime(2024, 5, day, 10)
+        data = {
+            'format_version': '2',
+            'machine': {'name': machine},
+            'run': {
+                'start_time': str(start_time),
+                'end_time': str(start_time + datetime.timedelta(hours=1)),
+                'llvm_project_revision': order,
+            },
+            'tests': [{'name': name, 'execution_time': value}
+                      for name, value in sorted(tests.items())],
+        }
+        run = self.ts.importDataFromDict(self.session, data, config=None,
+                                         select_machine='match',
+                                         merge_run=merge_run)
+        self.session.commit()
+        return run
+
+    def _build(self, year=2024, month=5, day=3, store=True):
+        report = DailyReport(self.ts, year, month, day,
+                             num_prior_days_to_include=2,
+                             day_start_offset_hours=16)
+        report.build(self.session)
+        if store:
+            report.store_results(self.session)
+        return report
+
+    def _results(self, report):
+        return [(test.name, machine.name,
+                 [day_result.cr.current if day_result else None
+                  for day_result in day_results])
+                for field, field_results in report.result_table
+                if field.name == 'execution_time'
+                for test, visible_results in field_results
+                for machine, day_results in visible_results]
+
+    def _stored(self):
+        return sorted(name for name, in
+                      self.session.query(self.ts.Machine.name)
+                      .join(self.ts.DailyReportResult))
+
+    def test_daily_report(self):
+        self._import('dr-a', '1', 2, {'dr/t1': 1.0, 'dr/t2': 1.0})
+        self._import('dr-a', '2', 3, {'dr/t1': 2.0, 'dr/t2': 1.0})
+        self._import('dr-b', '1', 2, {'dr/t1': 1.0})
+        run_b = self._import('dr-b', '2', 3, {'dr/t1': 1.0})
+
+        # Building the report does not store its results by itself.
+        report = self._build(store=False)
+        self.assertEqual(len(report.results_to_store), 2)
+        self.session.commit()
+        self.assertEqual(self._stored(), [])
+
+        report = self._build()
+        expected = [('dr/t1', 'dr-a', [2.0, 1.0])]
+        self.assertEqual(self._results(report), expected)
+        self.assertEqual([(machine.name, nr_tests) for machine, nr_tests
+                          in report.nr_tests_table],
+                         [('dr-a', [2, 2]), ('dr-b', [1, 1])])
+        self.assertEqual(self._stored(), ['dr-a', 'dr-b'])
+
+        # The results are stored without the samples of the previous day, and
+        # give the same report.
+        data = json.loads(self.session.query(self.ts.DailyReportResult.data)
+                          .join(self.ts.Machine)
+                          .filter(self.ts.Machine.name == 'dr-a')
+                          .scalar().decode('utf-8'))
+        field_index = [field.name for field in
+                       self.ts.Sample.get_metric_fields()] \
+            .index('execution_time')
+        test_id, days = data['fields'][field_index][0]
+        stored, samples = days[0]
+        self.assertEqual(stored[2:4], [2.0, 1.0])
+        self.assertEqual(samples, [2.0])
+        report = self._build()
+        self.assertEqual(report.results_to_store, [])
+        self.assertEqual(self._results(report), expected)
+        self.assertEqual(self._stored(), ['dr-a', 'dr-b'])
+
+        # Replacing a run, which keeps its ID, removes the stored results of
+        # its machine.
+        self._import('dr-b', '2', 3, {'dr/t1': 3.0}, merge_run='replace')
+        self.assertEqual(self._stored(), ['dr-a'])
+        self.assertEqual(self._results(self._build()),
+                         [('dr/t1', 'dr-a', [2.0, 1.0]),
+                          ('dr/t1', 'dr-b', [3.0, 1.0])])
+        self.assertEqual(self._stored(), ['dr-a', 'dr-b'])
+
+        # Deleting a run changes the fingerprint of the results.
+        run_b = self.session.query(self.ts.Run).get(run_b.id)
+        self.session.delete(run_b)
+        self.session.commit()
+        self.assertEqual(self._results(self._build()), expected)
+
+    def test_concurrent_builds(self):
+        self._import('dr-c', '1', 12, {'dr/t1': 1.0})
+        self._import('dr-c', '2', 13, {'dr/t1': 2.0})
+        report = self._build(day=13)
+        machine = self.session.query(self.ts.Machine) \
+            .filter_by(name='dr-c').one()
+
+        def count():
+            return self.session.query(self.ts.DailyReportResult) \
+                .filter_by(machine_id=machine.id).count()
+        self.assertEqual(count(), 1)
+
+        # Storing the results again updates them.
+        report._store_machine_results(self.session, machine, 'again', {})
+        self.session.commit()
+        self.assertEqual(count(), 1)
+
+        # So does a request which did not see the results stored by another
+        # one yet.
+        query = report._query_machine_results
+        report._query_machine_results = \
+            lambda session, machine: query(session, machine).filter(False)
+        report._store_machine_results(self.session, machine, 'other', {})
+        self.session.commit()
+        self.assertEqual(count(), 1)
+        self.assertEqual(query(self.session, machine).one().fingerprint,
+                         'again')
+
+        self.session.query(self.ts.DailyReportResult) \
+            .filter_by(machine_id=machine.id).delete()
+        self.session.commit()
+
+    def test_view(self):
+        # The page of a report of closed days stores its results.
+        self._import('dr-v', '1', 21, {'dr/t1': 1.0})
+        self._import('dr-v', '2', 22, {'dr/t1': 2.0})
+        app = lnt.server.ui.app.App.create_standalone(sys.argv[1])
+        app.testing = True
+        response = app.test_client().get(
+            'db_default/v4/nts/daily_report/2024/5/22?num_days=2')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'dr-v', response.data)
+        self.session.rollback()
+        self.assertIn('dr-v', self._stored())
+
+        self.session.query(self.ts.DailyReportResult).delete()
+        self.session.commit()
+
+
+if __name__ == '__main__':
+    unittest.main(argv=[sys.argv[0], ])
@@ -0,0 +1,95 @@
+# Check that the reports built in worker processes are the same as the ones
+# built in the current process.
+#
+# RUN: rm -rf %t.instance
+# RUN: %{utils}/with_postgres.sh %t.pg.log \
+# RUN:     %{utils}/with_temporary_instance.py %t.instance \
+# RUN:         -- python %s %t.instance
+
+import datetime
+import sys
+import unittest
+
+import lnt.server.instance
+from lnt.server.reporting.dailyreport import DailyReport
+from lnt.server.reporting.latestrunsreport import LatestRunsReport
+
+
+class ParallelReportsTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        instance_path = sys.argv[1]
+        instance = lnt.server.instance.Instance.frompath(instance_path)
+        cls.db = instance.get_database('default')
+        cls.session = cls.db.make_session()
+        cls.ts = cls.db.testsuite['nts']
+
+        order = 0
+        for day in range(1, 4):
+            for machine in ('par-a', 'par-b', 'par-c'):
+                order += 1
+                start_time = datetime.datetime(2024, 6, day, 10)
+                tests = [{'name': 'par/t%d' % i,
+                          'execution_time': (i + 1) * (1 + (order + i) % 5)}
+                         for i in range(5)]
+                data = {
+                    'format_version': '2',
+                    'machine': {'name': machine},
+                    'run': {
+                        'start_time': str(start_time),
+                        'end_time': str(start_time),
+                        'llvm_project_revision': str(order),
+                    },
+                    'tests': tests,
+                }
+                cls.ts.importDataFromDict(cls.session, data, config=None,
+                                          select_machine='match',
+                                          merge_run='reject')
+        cls.session.commit()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.session.close()
+
+    @staticmethod
+    def _results(result_table):
+        return [(field.name, row[0].name,
+                 [(test.name, [(r.cr.current, r.cr.previous) if r else None
+                               for r in results])
+                  for test, results in row[-1]])
+                for field, field_results in result_table
+                for row in field_results]
+
+    def test_latest_runs_report(self):
+        tables = []
+        for jobs in (1, 2):
+            report = LatestRunsReport(self.ts, 3)
+            report.build(self.session, jobs=jobs)
+            tables.append(self._results(report.result_table))
+        self.assertTrue(tables[0])
+        self.assertEqual(tables[0], tables[1])
+
+    def test_daily_report(self):
+        tables = []
+        for jobs in (1, 2):
+            # Compute the results rather than reading the stored ones.
+            self.session.query(self.ts.DailyReportResult).delete()
+            report = DailyReport(self.ts, 2024, 6, 3,
+                                 num_prior_days_to_include=3)
+            report.build(self.session, jobs=jobs)
+            tables.append((
+                [(test.name, [(machine.name, [(r.cr.current, r.cr.previous)
+                                              if r else None
+                                              for r in day_results])
+                              for machine, day_results in visible_results])
+                 for field, field_results in report.result_table
+                 for test, visible_results in field_results],
+                [(machine.name, nr_tests)
+                 for machine, nr_tests in report.nr_tests_table]))
+        self.assertTrue(tables[0][0])
+        self.assertEqual(tables[0], tables[1])
+        self.session.rollback()
+
+
+if __name__ == '__main__':
+    unittest.main(argv=[sys.argv[0], ])
@@ -0,0 +1,140 @@
+# Check that the comparisons shown by default on the run pages are stored when
+# the runs are imported, and give the same report as comparing the samples.
+#
+# RUN: rm -rf %t.instance
+# RUN: %{utils}/with_postgres.sh %t.pg.log \
+# RUN:     %{utils}/with_temporary_instance.py %t.instance \
+# RUN:         -- python %s %t.instance
+
+import datetime
+import json
+import sys
+import unittest
+
+import lnt.server.instance
+import lnt.util.stats
+from lnt.server.db.fieldchange import post_submit_tasks
+from lnt.server.reporting.runs import generate_run_data, \
+    store_run_comparisons
+
+
+class RunComparisonsTest(unittest.TestCase):
+    def setUp(self):
+        instance_path = sys.argv[1]
+        instance = lnt.server.instance.Instance.frompath(instance_path)
+        self.db = instance.get_database('default')
+        self.session = self.db.make_session()
+        self.ts = self.db.testsuite['nts']
+
+    def tearDown(self):
+        self.session.close()
+
+    def _import(self, order, tests, merge_run='reject', machine='rc-machine',
+                store=True):
+        start_time = datetime.datetime(2024, 7, 1, 10)
+        data = {
+            'format_version': '2',
+            'machine': {'name': machine},
+            'run': {
+                'start_time': str(start_time),
+                'end_time': str(start_time),
+                'llvm_project_revision': order,
+            },
+            'tests': [dict(name=name, **values)
+                      for name, values in sorted(tests.items())],
+        }
+        run = self.ts.importDataFromDict(self.session, data, config=None,
+                                         select_machine='match',
+                                         merge_run=merge_run)
+        if store:
+            store_run_comparisons(self.session, self.ts, run)
+        self.session.commit()
+        return run
+
+    def _stored(self, run):
+        return sorted((compare_to_id for compare_to_id, in
+                       self.session.query(self.ts.RunComparison.compare_to_id)
+                       .filter(self.ts.RunComparison.run_id == run.id)),
+                      key=lambda i: (i is not None, i))
+
+    def _report(self, run, **kwargs):
+        data = generate_run_data(self.session, run, baseurl='/', **kwargs)
+        results = [(test_name, field.name, cr.previous, cr.current,
+                    cr.get_test_status(), cr.get_value_status())
+                   for (test_name, field), cr in
+                   sorted(data['run_to_run_info'].items(),
+                          key=lambda item: (item[0][0], item[0][1].name))]
+        return results, data['sri']
+
+    def test_run_comparisons(self):
+        run_1 = self._import('1', {'rc/t1': {'execution_time': 1.0},
+                                   'rc/t2': {'execution_time': 2.0}})
+        run_3 = self._import('3', {'rc/t1': {'execution_time': 2.0},
+                                   'rc/t3': {'execution_time': 3.0,
+                                             'execution_status': 1}})
+        # The first run is the baseline of the machine.
+        self.assertEqual(self._stored(run_1), [None, run_1.id])
+        self.assertEqual(self._stored(run_3), [run_1.id])
+
+        # The report of the stored comparison does not load any sample, and
+        # is the same as the one comparing the samples.
+        stored, sri = self._report(run_3, compare_to=run_1)
+        self.assertEqual(sri.loaded_run_ids, set())
+        self.assertEqual([r[:4] for r in stored
+                          if r[1] == 'execution_time'],
+                         [('rc/t1', 'execution_time', 1.0, 2.0),
+                          ('rc/t2', 'execution_time', None, None),
+                          ('rc/t3', 'execution_time', None, 3.0)])
+        self.session.query(self.ts.RunComparison).delete()
+        computed, sri = self._report(run_3, compare_to=run_1)
+        self.assertEqual(sri.loaded_run_ids, set([run_1.id, run_3.id]))
+        self.assertEqual(stored, computed)
+        self.session.rollback()
+
+        # Only the aggregated values are stored, not the samples.
+        data = self.session.query(self.ts.RunComparison.data) \
+            .filter(self.ts.RunComparison.run_id == run_3.id).scalar()
+        for results in json.loads(data.decode('utf-8'))['fields'].values():
+            for result in results.values():
+                self.assertFalse(any(isinstance(value, list)
+                                     for value in result))
+
+        # Other aggregation functions compare the samples.
+        _, sri = self._report(run_3, compare_to=run_1,
+                              aggregation_fn=lnt.util.stats.median)
+        self.assertEqual(sri.loaded_run_ids, set([run_1.id, run_3.id]))
+
+        # A run imported in between is compared to by the next run.
+        run_2 = self._import('2', {'rc/t1': {'execution_time': 1.5}})
+        self.assertEqual(self._stored(run_2), [run_1.id])
+        self.assertEqual(self._stored(run_3), [run_1.id, run_2.id])
+
+        # Replacing a run, which keeps its ID, removes the comparisons to it,
+        # and stores the ones of the new run.
+        run_2 = self._import('2', {'rc/t1': {'execution_time': 1.25}},
+                             merge_run='replace')
+        self.assertEqual(self._stored(run_2), [run_1.id])
+        self.assertEqual(self._stored(run_3), [run_1.id, run_2.id])
+        stored, _ = self._report(run_3, compare_to=run_2)
+        self.assertIn(('rc/t1', 'execution_time', 1.25, 2.0),
+                      [r[:4] for r in stored])
+
+    def test_post_submit_tasks(self):
+        # A post submission job stores the comparisons of all the runs of its
+        # machine and order, as several submissions may be coalesced into it.
+        run_1 = self._import('1', {'rc/t1': {'execution_time': 1.0}},
+                             machine='rc-post-submit', store=False)
+        run_2 = self._import('2', {'rc/t1': {'execution_time': 2.0}},
+                             machine='rc-post-submit', store=False)
+        run_3 = self._import('2', {'rc/t1': {'execution_time': 3.0}},
+                             machine='rc-post-submit', store=False,
+                             merge_run='append')
+        self.assertEqual(self._stored(run_2), [])
+        post_submit_tasks(self.session, self.ts, run_3.id)
+        self.assertEqual(self._stored(run_1), [])
+        self.assertEqual(self._stored(run_2), [run_1.id])
+        self.assertEqual(self._stored(run_3), [run_1.id])
+
+
+if __name__ == '__main__':
+    unittest.main(argv=[sys.argv[0], ])
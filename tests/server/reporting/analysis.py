@@ -1,9 +1,12 @@
 # Check that analysis produces correct results
 #
 # RUN: python %s
+import collections
 import unittest
 
 from lnt.server.reporting.analysis import ComparisonResult, REGRESSED, IMPROVED
+from lnt.server.reporting.analysis import StoredComparisonResult
+from lnt.server.reporting.analysis import encode_stored_comparison_result
 from lnt.server.reporting.analysis import UNCHANGED_PASS, UNCHANGED_FAIL
 from lnt.server.reporting.analysis import absmin_diff
 from lnt.util.stats import median
@@ -342,6 +345,27 @@ class ComparisonResultTest(unittest.TestCase):
         self.assertTrue(disabled.is_result_interesting())
 
 
+class StoredComparisonResultTester(unittest.TestCase):
+
+    def test_stored(self):
+        """Stored results have the statuses of the default comparison."""
+        Field = collections.namedtuple('Field',
+                                       'bigger_is_better ignore_same_hash')
+        cr = ComparisonResult(min, False, False, [10.], [5.], None, None)
+        stored = StoredComparisonResult(
+            Field(False, False), encode_stored_comparison_result(cr))
+        self.assertEqual(stored.current, 10.)
+        self.assertEqual(stored.previous, 5.)
+        self.assertEqual(stored.get_value_status(), REGRESSED)
+        self.assertEqual(stored.get_value_status(ignore_small=False),
+                         REGRESSED)
+        self.assertTrue(stored.is_result_interesting())
+        with self.assertRaises(ValueError):
+            stored.get_value_status(confidence_interval=1.96)
+        with self.assertRaises(ValueError):
+            stored.get_value_status(value_precision=0.01)
+
+
 class AbsMinTester(unittest.TestCase):
 
     def test_absmin(self):
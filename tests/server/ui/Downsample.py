@@ -0,0 +1,45 @@
+# RUN: python %s
+
+import random
+import unittest
+
+from lnt.server.ui.downsample import lttb_indices
+
+
+class DownsampleTest(unittest.TestCase):
+    def test_lttb_small(self):
+        self.assertEqual(lttb_indices([], 10), [])
+        self.assertEqual(lttb_indices([3, 1, 2], 10), [0, 1, 2])
+        self.assertEqual(lttb_indices([3, 1, 2], None), [0, 1, 2])
+        self.assertEqual(lttb_indices([3, 1, 2, 5], 2), [0, 3])
+        self.assertEqual(lttb_indices([3, 1, 2, 5], 1), [0])
+        self.assertEqual(lttb_indices([3, 1, 2, 5], 1, keep=[2]), [0, 2])
+
+    def test_lttb_spike(self):
+        values = [0] * 100
+        values[37] = 10
+        self.assertEqual(lttb_indices(values, 3), [0, 37, 99])
+        # The spike is found with the X coordinates as well.
+        xs = [i * 2.5 for i in range(100)]
+        self.assertEqual(lttb_indices(values, 3, xs), [0, 37, 99])
+
+    def test_lttb_random(self):
+        rng = random.Random(42)
+        values = [rng.random() for _ in range(1000)]
+        indices = lttb_indices(values, 100)
+        self.assertEqual(len(indices), 100)
+        self.assertEqual(indices, sorted(set(indices)))
+        self.assertEqual(indices[0], 0)
+        self.assertEqual(indices[-1], 999)
+
+        # The points to keep are kept, within max_points.
+        keep = [5, 6, 7, 500]
+        indices = lttb_indices(values, 100, keep=keep)
+        self.assertLessEqual(len(indices), 100)
+        self.assertEqual(indices, sorted(set(indices)))
+        for i in keep:
+            self.assertIn(i, indices)
+
+
+if __name__ == '__main__':
+    unittest.main()
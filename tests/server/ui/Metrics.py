@@ -0,0 +1,50 @@
+# Check the registry of the metrics shown by /metrics.
+#
+# RUN: python %s
+
+import sys
+import unittest
+
+from lnt.util.metrics import Registry
+
+
+class MetricsTest(unittest.TestCase):
+    def test_counter(self):
+        registry = Registry()
+        counter = registry.counter('lnt_things_total', "Things.", ['kind'])
+        self.assertIs(registry.counter('lnt_things_total', "Things.",
+                                       ['kind']), counter)
+        counter.inc(kind='a')
+        counter.inc(2, kind='a "quoted"\n')
+        self.assertEqual(registry.render(),
+                         '# HELP lnt_things_total Things.\n'
+                         '# TYPE lnt_things_total counter\n'
+                         'lnt_things_total{kind="a"} 1\n'
+                         'lnt_things_total{kind="a \\"quoted\\"\\n"} 2\n')
+        self.assertRaises(ValueError, counter.inc, other='a')
+        self.assertRaises(ValueError, registry.gauge, 'lnt_things_total',
+                          "Things.")
+
+    def test_histogram(self):
+        registry = Registry()
+        histogram = registry.histogram('lnt_seconds', "Durations.",
+                                       buckets=[1.0, 0.5])
+        for value in (0.25, 0.5, 0.75, 2.0):
+            histogram.observe(value)
+        self.assertEqual(registry.render().splitlines()[2:],
+                         ['lnt_seconds_bucket{le="0.5"} 2',
+                          'lnt_seconds_bucket{le="1.0"} 3',
+                          'lnt_seconds_bucket{le="+Inf"} 4',
+                          'lnt_seconds_sum 3.5',
+                          'lnt_seconds_count 4'])
+
+    def test_gauge(self):
+        registry = Registry()
+        gauge = registry.gauge('lnt_connections', "Connections.", ['db'])
+        gauge.set(3, db='default')
+        gauge.set(1, db='default')
+        self.assertIn('lnt_connections{db="default"} 1\n', registry.render())
+
+
+if __name__ == '__main__':
+    unittest.main(argv=sys.argv[:1])
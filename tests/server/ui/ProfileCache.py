@@ -0,0 +1,120 @@
+# Check the cache of decoded profiles.
+#
+# RUN: rm -rf %t.dir && mkdir -p %t.dir
+# RUN: python %s %t.dir
+
+import copy
+import os
+import sys
+import threading
+import unittest
+
+from lnt.server.ui.profile_cache import ProfileCache
+from lnt.testing.profile.profilev1impl import ProfileV1
+from lnt.testing.profile.profilev2impl import ProfileV2
+
+DATA = {
+    'counters': {'cycles': 12345.0, 'branch-misses': 200.0},
+    'disassembly-format': 'raw',
+    'functions': {
+        'fn1': {
+            'counters': {'cycles': 45.0, 'branch-misses': 10.0},
+            'data': [
+                ({'branch-misses': 0.0, 'cycles': 0.0}, 0x100000,
+                 'add r0, r0, r0'),
+                ({'branch-misses': 0.0, 'cycles': 100.0}, 0x100004,
+                 'sub r1, r0, r0'),
+            ]
+        }
+    }
+}
+
+
+class ProfileCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = sys.argv[1]
+
+    def _write(self, name, data=DATA):
+        path = os.path.join(self.dir, name)
+        ProfileV2.upgrade(ProfileV1(copy.deepcopy(data))).serialize(path)
+        return path
+
+    def test_hits(self):
+        path = self._write('hits.lntprof')
+        cache = ProfileCache(1 << 20)
+        p = cache.get_profile(path)
+        self.assertEqual(p.getTopLevelCounters(), DATA['counters'])
+        self.assertIs(cache.get_profile(path), p)
+        # Only the sections read so far are counted.
+        loaded_size = p.getDecodedSize()
+        self.assertEqual(cache.get_stats()['size'], loaded_size)
+
+        code = cache.get_code_for_function(path, 'fn1')
+        self.assertEqual(code, DATA['functions']['fn1']['data'])
+        self.assertIs(cache.get_code_for_function(path, 'fn1'), code)
+
+        stats = cache.get_stats()
+        # The code listing miss also looks up the profile.
+        self.assertEqual((stats['hits'], stats['misses']), (3, 2))
+        self.assertEqual(stats['entries'], 2)
+        # The profile grew by the sections holding the code.
+        self.assertGreater(p.getDecodedSize(), loaded_size)
+        self.assertEqual(stats['size'],
+                         p.getDecodedSize() + sum(200 + len(text)
+                                                  for _, _, text in code))
+
+    def test_modified(self):
+        path = self._write('modified.lntprof')
+        cache = ProfileCache(1 << 20)
+        p = cache.get_profile(path)
+        data = copy.deepcopy(DATA)
+        data['counters']['cycles'] = 1.0
+        self._write('modified.lntprof', data)
+        os.utime(path, ns=(0, os.stat(path).st_mtime_ns + 1))
+        self.assertIsNot(cache.get_profile(path), p)
+        self.assertEqual(cache.get_profile(path).getTopLevelCounters(),
+                         data['counters'])
+
+    def test_eviction(self):
+        paths = [self._write('evict%d.lntprof' % i) for i in range(3)]
+        size = ProfileCache(1 << 20).get_profile(paths[0]).getDecodedSize()
+        cache = ProfileCache(2 * size)
+        profiles = [cache.get_profile(path) for path in paths]
+        self.assertEqual(cache.get_stats()['entries'], 2)
+        self.assertIs(cache.get_profile(paths[2]), profiles[2])
+        # Evicted profiles release their file.
+        self.assertIsNone(profiles[0].impl.mapping)
+        self.assertIsNotNone(profiles[2].impl.mapping)
+        self.assertIsNot(cache.get_profile(paths[0]), profiles[0])
+
+        cache = ProfileCache(0)
+        self.assertIsNot(cache.get_profile(paths[0]),
+                         cache.get_profile(paths[0]))
+
+    def test_closed(self):
+        # The code of a profile evicted while it is looked up is still read.
+        path = self._write('closed.lntprof')
+        cache = ProfileCache(1 << 20)
+        cache.get_profile(path)
+        cached = cache._get_profile(path, os.stat(path))
+        cached.close()
+        self.assertEqual(cache.get_code_for_function(path, 'fn1'),
+                         DATA['functions']['fn1']['data'])
+
+    def test_threads(self):
+        path = self._write('threads.lntprof')
+        cache = ProfileCache(1 << 20)
+        results = []
+
+        def run():
+            results.append(cache.get_code_for_function(path, 'fn1'))
+        threads = [threading.Thread(target=run) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, [DATA['functions']['fn1']['data']] * 8)
+
+
+if __name__ == '__main__':
+    unittest.main(argv=sys.argv[:1])
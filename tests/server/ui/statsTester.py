@@ -1,5 +1,6 @@
 # RUN: python %s
 
+import random
 import unittest
 
 import lnt.util.stats as stats
@@ -34,6 +35,55 @@ class TestLNTStatsTester(unittest.TestCase):
         self.assertEqual(stats.median([3, 2, 1]), 2)
         self.assertEqual(stats.median([1, 1, 1]), 1)
 
+    def test_moving_means_and_medians(self):
+        rng = random.Random(42)
+        for n in (0, 1, 2, 5, 50, 500):
+            values = [rng.choice([1.0, 2.0, 3.0, rng.random()])
+                      for _ in range(n)]
+            for window in (0, 1, 3, 10, 100):
+                slices = [values[max(0, i - window):min(n, i + window)]
+                          for i in range(n)]
+                means = stats.moving_means(values, window)
+                self.assertEqual(len(means), n)
+                for mean, window_values in zip(means, slices):
+                    expected = stats.mean(window_values)
+                    if expected is None:
+                        self.assertIsNone(mean)
+                    else:
+                        self.assertAlmostEqual(mean, expected)
+                self.assertEqual(stats.moving_medians(values, window),
+                                 [stats.median(s) for s in slices])
+
+    def test_mannwhitneyu_small(self):
+        def pairwise_u(x, y):
+            u = 0.
+            for xe in x:
+                for ye in y:
+                    if xe < ye:
+                        u += 1
+                    elif xe == ye:
+                        u += .5
+            return u
+
+        def reference(a, b, sigLevel):
+            flip = len(a) > len(b)
+            Ux = pairwise_u(b, a) if flip else pairwise_u(a, b)
+            Uy = len(a) * len(b) - Ux
+            Ua, Ub = (Uy, Ux) if flip else (Ux, Uy)
+            table = stats.SIGN_TABLES[sigLevel]
+            return abs(Ua - Ub) <= table[len(a) - 1][len(b) - 1]
+
+        rng = random.Random(42)
+        for _ in range(2000):
+            # Draw from few distinct values to get plenty of ties.
+            a = [rng.choice([1.0, 1.5, 2.0, 2.5, 3.0])
+                 for _ in range(rng.randint(1, 20))]
+            b = [rng.choice([1.0, 1.5, 2.0, 2.5, 3.0]) + rng.choice([0, 1])
+                 for _ in range(rng.randint(1, 20))]
+            for sigLevel in (.05, .01):
+                self.assertEqual(stats.mannwhitneyu_small(a, b, sigLevel),
+                                 reference(a, b, sigLevel), (a, b))
+
 
 if __name__ == '__main__':
     unittest.main()
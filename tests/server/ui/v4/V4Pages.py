@@ -486,6 +486,17 @@ def main():
     check_code(client, f'/v4/nts/graph?plot.0={m1_id}.{fv_id}.9999',
                expected_code=HTTP_NOT_FOUND)
     check_json(client, f'/v4/nts/graph?plot.9999={m1_id}.{fv_id}.2&json=True')
+    # Check that the lines and their trends are downsampled together.
+    graph_url = (f'/v4/nts/graph?plot.0={m1_id}.{fv_id}.2&json=True'
+                 '&show_moving_average=yes&show_moving_median=yes'
+                 '&show_cumulative_minimum=yes&moving_window_size=1')
+    full = check_json(client, graph_url)
+    downsampled = check_json(client, graph_url + '&max_points=2')
+    assert len(full['data']) == len(downsampled['data'])
+    for full_trace, trace in zip(full['data'], downsampled['data']):
+        assert len(trace['x']) == min(len(full_trace['x']), 2)
+        for x, y in zip(trace['x'], trace['y']):
+            assert y == full_trace['y'][full_trace['x'].index(x)]
     # Get the mean graph page.
     check_html(client, f'/v4/nts/graph?mean={m1_id}.2')
     # Don't crash when requesting non-existing data
@@ -760,6 +771,11 @@ def main():
     check_html(client, '/rules')
     resp = check_code(client, '/__health')
     assert resp.get_data(as_text=True) == "Ok"
+    resp = check_code(client, '/metrics')
+    assert 'lnt_db_pool_size{database="default"}' in \
+        resp.get_data(as_text=True)
+    assert 'lnt_http_request_duration_seconds_count{endpoint="lnt.health",' \
+        'method="GET",status="200"}' in resp.get_data(as_text=True)
     resp = check_code(client, '/ping')
     assert resp.get_data(as_text=True) == "pong"
 
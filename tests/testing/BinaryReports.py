@@ -0,0 +1,103 @@
+# Check that reports stored in the binary format read back unchanged.
+#
+# RUN: rm -rf %t.dir && mkdir -p %t.dir
+# RUN: python %s %t.dir
+
+import io
+import os
+import sys
+import unittest
+
+import lnt.formats
+import lnt.formats.BinaryFormat as BinaryFormat
+
+
+REPORT = {
+    'format_version': '2',
+    'machine': {'name': 'm', 'os': 'linux é'},
+    'run': {'start_time': '2024-01-01 10:00:00',
+            'llvm_project_revision': '1234'},
+    'tests': [
+        {'name': 'a', 'execution_time': [1.5, 2.5, 3.0],
+         'compile_time': 0.25, 'hash': 'abc'},
+        {'name': 'b', 'execution_time': 4.0, 'code_size': [100, 200]},
+        {'name': 'c'},
+        {'name': 'd', 'execution_time': 1, 'hash': 'déf',
+         'execution_status': None, 'flag': True},
+        {'name': 'e', 'code_size': 1 << 40, 'mixed': [1, 'x']},
+    ],
+}
+
+
+class BinaryFormatTest(unittest.TestCase):
+    def test_roundtrip(self):
+        compressions = [BinaryFormat.COMPRESSION_NONE,
+                        BinaryFormat.COMPRESSION_ZLIB]
+        if BinaryFormat._zstd() is not None:
+            compressions.append(BinaryFormat.COMPRESSION_ZSTD)
+        for compression in compressions:
+            data = BinaryFormat.encode(REPORT, compression)
+            self.assertEqual(BinaryFormat.decode(data), REPORT)
+
+            report = BinaryFormat.decode(data, stream=True)
+            self.assertEqual(len(report['tests']), len(REPORT['tests']))
+            report['tests'] = list(report['tests'])
+            self.assertEqual(report, REPORT)
+
+    def test_read_any(self):
+        path = os.path.join(sys.argv[1], 'report.lntb')
+        with open(path, 'wb') as fp:
+            lnt.formats.binary['write'](REPORT, fp)
+        self.assertEqual(lnt.formats.guess_format(path), lnt.formats.binary)
+        self.assertEqual(lnt.formats.read_any(path, '<auto>'), REPORT)
+        with open(path, 'rb') as fp:
+            self.assertEqual(lnt.formats.read_any(fp, '<auto>'), REPORT)
+        report = lnt.formats.read_any(path, '<auto>', stream=True)
+        self.assertEqual(list(report['tests']), REPORT['tests'])
+        self.assertEqual(list(report['tests']), REPORT['tests'])
+
+    def test_not_a_report(self):
+        data = BinaryFormat.encode({'a': 1})
+        self.assertEqual(BinaryFormat.decode(data), {'a': 1})
+
+    def test_upgrade(self):
+        report = {
+            'Machine': {'Name': 'm', 'Info': {}},
+            'Run': {'Start Time': '2024-01-01 10:00:00',
+                    'End Time': '2024-01-01 10:01:00',
+                    'Info': {'run_order': '1234', 'tag': 'nts'}},
+            'Tests': [{'Name': 'nts.a.exec', 'Info': {}, 'Data': [1.0, 2.0]}],
+        }
+        fp = io.BytesIO()
+        lnt.formats.binary['write'](report, fp)
+        data = BinaryFormat.decode(fp.getvalue())
+        self.assertEqual(data['format_version'], '2')
+        self.assertEqual(data['tests'],
+                         [{'name': 'a', 'execution_time': [1.0, 2.0]}])
+
+    def test_invalid(self):
+        data = BinaryFormat.encode(REPORT, BinaryFormat.COMPRESSION_NONE)
+        self.assertRaises(ValueError, BinaryFormat.decode, data[:-1])
+        self.assertRaises(ValueError, BinaryFormat.decode, data + b'\0')
+        self.assertRaises(ValueError, BinaryFormat.decode, b'LNTB\x02\x00')
+        self.assertRaises(ValueError, BinaryFormat.decode, b'{"a": 1}')
+        data = BinaryFormat.encode(REPORT, BinaryFormat.COMPRESSION_ZLIB)
+        self.assertRaises(ValueError, BinaryFormat.decode, data[:-4])
+
+    def test_max_size(self):
+        # A small payload expanding past the limit is rejected.
+        report = {'a': 'x' * 100000}
+        compressions = [BinaryFormat.COMPRESSION_ZLIB]
+        if BinaryFormat._zstd() is not None:
+            compressions.append(BinaryFormat.COMPRESSION_ZSTD)
+        for compression in compressions:
+            data = BinaryFormat.encode(report, compression)
+            self.assertLess(len(data), 1000)
+            with self.assertRaisesRegex(ValueError, 'larger than'):
+                BinaryFormat.decode(data, max_size=10000)
+            self.assertEqual(BinaryFormat.decode(data, max_size=200000),
+                             report)
+
+
+if __name__ == '__main__':
+    unittest.main(argv=sys.argv[:1])
@@ -0,0 +1,130 @@
+# Check the shared text pools of profiles.
+#
+# RUN: rm -rf %t.dir && mkdir -p %t.dir
+# RUN: python %s %t.dir
+
+import copy
+import os
+import shutil
+import sys
+import unittest
+
+import lnt.testing.profile.pool as pool
+from lnt.testing.profile.profile import Profile
+from lnt.testing.profile.profilev1impl import ProfileV1
+from lnt.testing.profile.profilev2impl import ProfileV2
+from lnt.testing.profile.profilev3impl import ProfileV3
+
+DATA = {
+    'counters': {'cycles': 12345.0, 'branch-misses': 200.0},
+    'disassembly-format': 'raw',
+    'functions': {
+        'fn1': {
+            'counters': {'cycles': 45.0, 'branch-misses': 10.0},
+            'data': [
+                ({'branch-misses': 0.0, 'cycles': 0.0}, 0x100000,
+                 'add r0, r0, r0'),
+                ({'branch-misses': 0.0, 'cycles': 100.0}, 0x100004,
+                 'sub r1, r0, r0'),
+            ]
+        }
+    }
+}
+
+
+def make_profile(data=DATA):
+    return Profile(ProfileV2.upgrade(ProfileV1(copy.deepcopy(data))))
+
+
+class ProfilePoolTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = os.path.join(sys.argv[1], self.id())
+        shutil.rmtree(self.dir, ignore_errors=True)
+        os.makedirs(self.dir)
+        self.store = pool.PoolStore(self.dir)
+
+    def pools(self):
+        return sorted(name for name in os.listdir(self.store.pool_dir)
+                      if name.endswith(pool.POOL_SUFFIX))
+
+    def check_profile(self, path):
+        p = Profile.fromFile(os.path.join(self.dir, path))
+        self.assertEqual(p.getTopLevelCounters(), DATA['counters'])
+        self.assertEqual(list(p.getCodeForFunction('fn1')),
+                         DATA['functions']['fn1']['data'])
+        return p
+
+    def test_save(self):
+        paths = [make_profile().save(profileDir=self.dir),
+                 Profile.saveFromRendered(make_profile().render(),
+                                          profileDir=self.dir)]
+        self.assertEqual(len(self.pools()), 1)
+        pool_fname = pool.POOL_DIR + '/' + self.pools()[0]
+        self.assertEqual(self.store.getRefcount(pool_fname), 2)
+
+        for path in paths:
+            with open(os.path.join(self.dir, path), 'rb') as f:
+                self.assertEqual(pool.getPoolReference(f.read()),
+                                 pool_fname)
+            p = self.check_profile(path)
+            # Rendered profiles hold their text pool.
+            rendered = Profile.fromRendered(p.render())
+            self.assertEqual(list(rendered.getCodeForFunction('fn1')),
+                             DATA['functions']['fn1']['data'])
+
+        other = copy.deepcopy(DATA)
+        other['functions']['fn1']['data'][0] = \
+            ({'branch-misses': 0.0, 'cycles': 0.0}, 0x100000, 'nop')
+        make_profile(other).save(profileDir=self.dir)
+        self.assertEqual(len(self.pools()), 2)
+
+    def test_repack(self):
+        for i in range(3):
+            make_profile().save(filename=os.path.join(self.dir,
+                                                      '%d.lntprof' % i))
+        v1 = Profile(ProfileV1(copy.deepcopy(DATA)))
+        v1.save(filename=os.path.join(self.dir, 'v1.lntprof'))
+        mtime = os.stat(os.path.join(self.dir, '0.lntprof')).st_mtime_ns
+
+        self.assertEqual(pool.repack(self.dir), (3, 0))
+        self.assertEqual(len(self.pools()), 1)
+        pool_fname = pool.POOL_DIR + '/' + self.pools()[0]
+        self.assertEqual(self.store.getRefcount(pool_fname), 3)
+        self.assertEqual(os.stat(os.path.join(self.dir,
+                                              '0.lntprof')).st_mtime_ns,
+                         mtime)
+        for i in range(3):
+            self.check_profile('%d.lntprof' % i)
+        self.assertEqual(
+            Profile.fromFile(os.path.join(self.dir, 'v1.lntprof'))
+            .getVersion(), 1)
+
+        self.assertEqual(pool.repack(self.dir), (0, 0))
+        os.remove(os.path.join(self.dir, '0.lntprof'))
+        os.remove(os.path.join(self.dir, '1.lntprof'))
+        # Make the reference count look older than the repacking.
+        refs_path = self.store._paths(pool_fname)[1]
+        os.utime(refs_path, (0, 0))
+        self.assertEqual(pool.repack(self.dir), (0, 0))
+        self.assertEqual(self.store.getRefcount(pool_fname), 1)
+        os.remove(os.path.join(self.dir, '2.lntprof'))
+        os.utime(refs_path, (0, 0))
+        self.assertEqual(pool.repack(self.dir), (0, 1))
+        self.assertEqual(self.pools(), [])
+
+    def test_repack_v3(self):
+        path = os.path.join(self.dir, 'v3.lntprof')
+        Profile(ProfileV3.upgrade(make_profile().impl)).save(filename=path)
+        with open(path, 'rb') as f:
+            self.assertIsNone(pool.getPoolReference(f.read()))
+
+        self.assertEqual(pool.repack(self.dir), (1, 0))
+        self.assertEqual(len(self.pools()), 1)
+        with open(path, 'rb') as f:
+            self.assertEqual(pool.getPoolReference(f.read()),
+                             pool.POOL_DIR + '/' + self.pools()[0])
+        self.assertEqual(self.check_profile('v3.lntprof').getVersion(), 3)
+
+
+if __name__ == '__main__':
+    unittest.main(argv=sys.argv[:1])
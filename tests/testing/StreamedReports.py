@@ -0,0 +1,75 @@
+# Check that reports read with streaming decode like json.load.
+#
+# RUN: rm -rf %t.dir && mkdir -p %t.dir
+# RUN: python %s %t.dir
+
+import json
+import os
+import sys
+import unittest
+
+import lnt.formats
+import lnt.formats.JSONFormat as JSONFormat
+
+
+class StreamTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = sys.argv[1]
+
+    def _write(self, name, text):
+        path = os.path.join(self.dir, name)
+        with open(path, 'w') as fp:
+            fp.write(text)
+        return path
+
+    def _check(self, path):
+        expected = lnt.formats.read_any(path, '<auto>')
+        data = lnt.formats.read_any(path, '<auto>', stream=True)
+        for key in JSONFormat._STREAMED_KEYS:
+            if key in data:
+                self.assertEqual(len(data[key]), len(expected[key]))
+                data[key] = list(data[key])
+        self.assertEqual(data, expected)
+
+    def test_stream(self):
+        report = {
+            'format_version': '2',
+            'machine': {'name': 'm', 'os': 'linux é'},
+            'run': {'start_time': '2024-01-01 10:00:00',
+                    'llvm_project_revision': '1234'},
+            'tests': [{'name': 't/%d' % i,
+                       'execution_time': [1.5e-3 * i, -i, 12345678901234],
+                       'hash': 'x' * (i * 37),
+                       'ok': i % 2 == 0, 'none': None}
+                      for i in range(50)],
+            'extra': [1, [2, {}], []],
+        }
+        compact = self._write('compact.json', json.dumps(report))
+        indented = self._write('indented.json',
+                               json.dumps(report, indent=4, sort_keys=True))
+        empty = self._write('empty.json', '{ "tests" : [ ], "Tests": [] }')
+
+        # Use tiny chunks, so values are cut everywhere.
+        for chunk_size in (1, 3, 7, 64, JSONFormat._CHUNK_SIZE):
+            JSONFormat._CHUNK_SIZE = chunk_size
+            for path in (compact, indented, empty):
+                self._check(path)
+
+    def test_invalid(self):
+        for text in ('{"tests": [1, 2', '{"tests": [1 2]}', '{"a": 1} {}',
+                     '{"a" 1}', '{1: 2}', '{"tests": [tru]}'):
+            path = self._write('invalid.json', text)
+            with self.assertRaises(ValueError):
+                lnt.formats.read_any(path, 'json', stream=True)
+
+    def test_guess_format(self):
+        path = self._write('report.json', '\n  {"a": 1}')
+        self.assertEqual(lnt.formats.guess_format(path)['name'], 'json')
+        path = self._write('report.plist', '<?xml version="1.0"?>\n<plist/>')
+        self.assertEqual(lnt.formats.guess_format(path)['name'], 'plist')
+        path = self._write('report.txt', 'NOT JSON {}')
+        self.assertIsNone(lnt.formats.guess_format(path))
+
+
+if __name__ == '__main__':
+    unittest.main(argv=[sys.argv[0], ])
@@ -45,6 +45,32 @@ class ProfileV2Test(unittest.TestCase):
         l2 = self.test_data['functions']['fn1']['data']
         self.assertEqual(l1, l2)
 
+    def test_lazy(self):
+        p = ProfileV2.upgrade(ProfileV1(copy.deepcopy(self.test_data)))
+        with tempfile.NamedTemporaryFile() as f:
+            p.serialize(f.name)
+            with open(f.name, 'rb') as fobj:
+                p2 = ProfileV2.deserialize(fobj)
+
+        # The index is read without decompressing the other sections.
+        self.assertEqual(p2.getFunctions(), p.getFunctions())
+        self.assertEqual(p2.getTopLevelCounters(),
+                         self.test_data['counters'])
+        for section in (p2.lc, p2.la, p2.lt, p2.tp):
+            self.assertIsNotNone(section.buf)
+        self.assertIsNotNone(p2.mapping)
+
+        l1 = list(p2.getCodeForFunction('fn1'))
+        l2 = self.test_data['functions']['fn1']['data']
+        self.assertEqual(l1, l2)
+        for section in (p2.lc, p2.la, p2.lt, p2.tp):
+            self.assertIsNone(section.buf)
+        # The file is released once all the sections are loaded.
+        self.assertIsNone(p2.mapping)
+
+        p3 = ProfileV2.deserialize(io.BytesIO(p2.serialize()))
+        self.assertEqual(list(p3.getCodeForFunction('fn1')), l2)
+
     def test_getFunctions(self):
         p = ProfileV2.upgrade(ProfileV1(copy.deepcopy(self.test_data)))
         self.assertEqual(p.getFunctions(),
@@ -0,0 +1,103 @@
+# RUN: python %s
+
+import copy
+import io
+import sys
+import tempfile
+import unittest
+
+from lnt.testing.profile import codec
+from lnt.testing.profile.profile import Profile
+from lnt.testing.profile.profilev1impl import ProfileV1
+from lnt.testing.profile.profilev2impl import ProfileV2
+from lnt.testing.profile.profilev3impl import ProfileV3
+
+
+class ProfileV3Test(unittest.TestCase):
+    def setUp(self):
+        self.test_data = {
+            'counters': {'cycles': 12345.0, 'branch-misses': 200.0},
+            'disassembly-format': 'raw',
+            'functions': {
+                'fn1': {
+                    'counters': {'cycles': 45.0, 'branch-misses': 10.0},
+                    'data': [
+                        ({'branch-misses': 0.0, 'cycles': 0.0}, 0x100000,
+                         'add r0, r0, r0'),
+                        ({'branch-misses': 0.0, 'cycles': 100.0}, 0x100004,
+                         'sub r1, r0, r0')
+                    ]
+                }
+            }
+        }
+
+    def v2(self):
+        return ProfileV2.upgrade(ProfileV1(copy.deepcopy(self.test_data)))
+
+    def test_codecs(self):
+        for c in codec.availableCodecs():
+            p = ProfileV3.upgrade(self.v2(), c)
+            with tempfile.NamedTemporaryFile() as f:
+                p.serialize(f.name)
+                self.assertTrue(ProfileV3.checkFile(f.name))
+                self.assertFalse(ProfileV2.checkFile(f.name))
+                with open(f.name, 'rb') as fobj:
+                    p2 = ProfileV3.deserialize(fobj)
+                self.assertIs(p2.codec, c)
+                self.assertIsNotNone(p2.lc.buf)
+                self.assertEqual(list(p2.getCodeForFunction('fn1')),
+                                 self.test_data['functions']['fn1']['data'])
+                self.assertEqual(p2.getTopLevelCounters(),
+                                 self.test_data['counters'])
+
+    def test_upgrade(self):
+        # Upgrade a profile read from a file, whose sections are compressed
+        # with BZ2.
+        v2 = ProfileV2.deserialize(io.BytesIO(self.v2().serialize()))
+        p = Profile(v2).upgrade()
+        self.assertEqual(p.getVersion(), 3)
+        self.assertIs(p.impl.codec, codec.defaultCodec())
+
+        p.impl.codec = codec.ZLIB
+        p2 = Profile.fromRendered(p.render())
+        self.assertEqual(p2.getVersion(), 3)
+        self.assertIs(p2.impl.codec, codec.ZLIB)
+        self.assertEqual(list(p2.getCodeForFunction('fn1')),
+                         self.test_data['functions']['fn1']['data'])
+
+        # Rewrite it with another codec.
+        p2.impl.codec = codec.BZ2
+        p3 = ProfileV3.deserialize(io.BytesIO(p2.impl.serialize()))
+        self.assertIs(p3.codec, codec.BZ2)
+        self.assertEqual(list(p3.getCodeForFunction('fn1')),
+                         self.test_data['functions']['fn1']['data'])
+
+    def test_arrays(self):
+        data = copy.deepcopy(self.test_data)
+        data['functions']['fn2'] = {
+            'counters': {},
+            'data': [({}, 0x200000, 'nop'), ({}, 0x1ffff0, 'ret')],
+        }
+        p = ProfileV3.upgrade(ProfileV2.upgrade(ProfileV1(data)))
+        # The code of an upgraded profile can be read before it is written.
+        self.assertEqual(list(p.getCodeForFunction('fn2')),
+                         data['functions']['fn2']['data'])
+
+        p2 = ProfileV3.deserialize(io.BytesIO(p.serialize()))
+        # Unlike in version 2, addresses can go backwards.
+        self.assertEqual(list(p2.getCodeForFunction('fn2')),
+                         data['functions']['fn2']['data'])
+        self.assertEqual(list(p2.getCodeForFunction('fn1')),
+                         data['functions']['fn1']['data'])
+        self.assertEqual(len(p2.lc.data), 2 * 2 * 4)
+        self.assertEqual(len(p2.la.data), 4 * 8)
+
+    def test_getCodec(self):
+        self.assertIs(codec.getCodec('zlib'), codec.ZLIB)
+        self.assertIs(codec.getCodec(0), codec.BZ2)
+        self.assertRaises(ValueError, codec.getCodec, 'gzip')
+        self.assertIn(codec.ZLIB, codec.availableCodecs())
+
+
+if __name__ == '__main__':
+    unittest.main(argv=[sys.argv[0], ])
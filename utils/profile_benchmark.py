@@ -0,0 +1,160 @@
+#!/usr/bin/env python
+"""
+Measure how long it takes to read a ProfileV2 file to answer the queries of
+the profile viewer: the list of functions, the top level counters, and the
+code of a function.
+
+The profile is either given on the command line or generated, with as many
+functions and instructions per function as asked for. Each query is timed with
+the sections read lazily (the default), and with every section decompressed
+up front as the reader used to do.
+
+  python utils/profile_benchmark.py --functions 2000 --instructions 500
+
+With --codecs, the profile is instead written as a ProfileV3 with each of the
+available codecs, and the size and decompression throughput of its sections
+are reported for each. Profiles imported from perf data are the most
+representative input:
+
+  lnt profile upgrade perf.data /tmp/perf.lntprof
+  python utils/profile_benchmark.py --codecs /tmp/perf.lntprof
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+from lnt.testing.profile import codec
+from lnt.testing.profile.profile import Profile
+from lnt.testing.profile.profilev1impl import ProfileV1
+from lnt.testing.profile.profilev2impl import ProfileV2, readIndex
+
+
+def generate(path, num_functions, num_instructions, seed=0):
+    rng = random.Random(seed)
+    counters = ['cycles', 'branch-misses', 'cache-misses']
+    mnemonics = ['add', 'sub', 'mul', 'ldr', 'str', 'b', 'cmp', 'mov']
+    functions = {}
+    address = 0x400000
+    for i in range(num_functions):
+        data = []
+        for j in range(num_instructions):
+            data.append(({c: float(rng.randint(0, 100)) for c in counters},
+                         address,
+                         '%s r%d, r%d, r%d' % (rng.choice(mnemonics),
+                                               rng.randint(0, 15),
+                                               rng.randint(0, 15),
+                                               rng.randint(0, 15))))
+            address += 4
+        functions['function_%d' % i] = {
+            'counters': {c: float(rng.randint(0, 100)) for c in counters},
+            'data': data,
+        }
+    v1 = ProfileV1({
+        'counters': {c: float(rng.randint(0, 1 << 30)) for c in counters},
+        'disassembly-format': 'raw',
+        'functions': functions,
+    })
+    ProfileV2.upgrade(v1).serialize(path)
+
+
+def read(path, eager):
+    p = Profile.fromFile(path).impl
+    if eager:
+        for section in p.sections:
+            section.load()
+    return p
+
+
+QUERIES = [
+    ('getFunctions', lambda p: p.getFunctions()),
+    ('getTopLevelCounters', lambda p: p.getTopLevelCounters()),
+    ('getCodeForFunction',
+     lambda p: list(p.getCodeForFunction(sorted(p.getFunctions())[0]))),
+]
+
+
+def bench(path, eager, query, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        query(read(path, eager))
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+# The sections of a profile which are compressed (see readIndex).
+COMPRESSED_SECTIONS = [3, 4, 5, 6]
+
+
+def bench_codecs(path, repeat):
+    profile = Profile.fromFile(path).upgrade().impl
+    print("%-6s %10s %14s %14s" %
+          ('codec', 'size', 'decode (MB/s)', 'getCode (s)'))
+    for c in codec.availableCodecs():
+        profile.codec = c
+        data = profile.serialize()
+        index, start = readIndex(data)
+        compressed = []
+        for i in COMPRESSED_SECTIONS:
+            offset, size, _ = index[i]
+            compressed.append(data[start + offset:start + offset + size])
+        size = sum(len(c.decompress(section)) for section in compressed)
+        best = None
+        for _ in range(repeat):
+            begin = time.perf_counter()
+            for section in compressed:
+                c.decompress(section)
+            elapsed = time.perf_counter() - begin
+            best = elapsed if best is None else min(best, elapsed)
+
+        fd, tmp_path = tempfile.mkstemp(suffix='.lntprof')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            query = bench(tmp_path, False, QUERIES[2][1], repeat)
+        finally:
+            os.remove(tmp_path)
+        print("%-6s %10d %14.1f %14.4f" %
+              (c.name, len(data), size / best / 1e6, query))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('profile', nargs='?',
+                        help="a .lntprof file (generated if not given)")
+    parser.add_argument('--functions', type=int, default=1000)
+    parser.add_argument('--instructions', type=int, default=200)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--codecs', action='store_true',
+                        help="compare the codecs of ProfileV3")
+    args = parser.parse_args()
+
+    path = args.profile
+    if path is None:
+        fd, path = tempfile.mkstemp(suffix='.lntprof')
+        os.close(fd)
+        generate(path, args.functions, args.instructions)
+    try:
+        print("%s: %d bytes" % (path, os.path.getsize(path)))
+        if args.codecs:
+            bench_codecs(path, args.repeat)
+            return
+        print("%-20s %10s %10s %8s" % ('query', 'eager (s)', 'lazy (s)',
+                                       'speedup'))
+        for name, query in QUERIES:
+            eager = bench(path, True, query, args.repeat)
+            lazy = bench(path, False, query, args.repeat)
+            print("%-20s %10.4f %10.4f %7.1fx" %
+                  (name, eager, lazy, eager / lazy))
+    finally:
+        if args.profile is None:
+            os.remove(path)
+
+
+if __name__ == '__main__':
+    sys.exit(main())